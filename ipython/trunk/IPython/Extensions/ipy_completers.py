@@ -11,7 +11,7 @@ ip.set_hook('complete_command', svn_completer, str_key = 'svn')
 import IPython.ipapi
 import glob,os,shlex,sys
 import inspect
-from time import time
+import threading
 ip = IPython.ipapi.get()
 
 try:
@@ -19,8 +19,7 @@ try:
 except:
     from sets import Set as set
 
-TIMEOUT_STORAGE = 3 #Time in seconds after which the rootmodules will be stored
-TIMEOUT_GIVEUP = 20 #Time in seconds after which we give up
+TIMEOUT_STORAGE = 3 #Time in seconds to wait for the first index of the rootmodules
 
 def quick_completer(cmd, completions):
     """ Easily create a trivial completer for a command.
@@ -44,58 +43,131 @@ def quick_completer(cmd, completions):
     
     ip.set_hook('complete_command',do_complete, str_key = cmd)
     
+class ModuleIndex(object):
+    """ The modules found in the folders of the pythonpath, kept in ip.db
+
+    The index maps each folder to its modification time when it was last
+    listed, the names of the modules in it and which of them are packages.
+    A folder is only listed again once its modification time changes, and
+    refresh() does that in a thread, so that completion rarely waits for a
+    slow filesystem.  The folders of packages are indexed too, so that
+    submodules are completed without importing anything.
+    """
+    
+    def __init__(self, db, key = 'moduleindex'):
+        self.db = db
+        self.key = key
+        self.folders = {}
+        # Whether some folders were listed since the index was stored
+        self.dirty = False
+        self.thread = None
+    
+    def sync(self):
+        """ Pick up the index as stored by %rehashx or other sessions """
+        if self.thread is not None and self.thread.isAlive():
+            return
+        stored = self.db.get(self.key, None)
+        if stored is not self.folders:
+            self.folders = stored or {}
+    
+    def scan(self, folder):
+        """ Return the index entry of folder, listing it if it is stale """
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            mtime = None
+        entry = self.folders.get(folder)
+        if entry is not None and entry[0] == mtime:
+            return entry
+        modules = set()
+        packages = []
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            names = []
+        for name in names:
+            base, ext = os.path.splitext(name)
+            if ext in ('.py','.so','.pyc','.pyo'):
+                modules.add(base)
+            elif not ext and os.path.isfile(
+                os.path.join(folder, name, '__init__.py')):
+                modules.add(name)
+                packages.append(name)
+        modules.discard('__init__')
+        entry = (mtime, list(modules), packages)
+        self.folders[folder] = entry
+        self.dirty = True
+        return entry
+    
+    def refresh(self, folders):
+        """ Bring the entries of folders up to date in a thread """
+        if self.thread is not None and self.thread.isAlive():
+            return
+        def update():
+            for folder in folders:
+                self.scan(folder)
+            if self.dirty:
+                self.dirty = False
+                self.db[self.key] = self.folders
+        self.thread = threading.Thread(target = update)
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def modules(self, folder):
+        """ The names of the modules in folder """
+        return list(self.scan(folder)[1])
+    
+    def submodules(self, package):
+        """ The names of the modules in a dotted package, or [] """
+        names = package.split('.')
+        for path in pathFolders():
+            folder = path
+            for name in names:
+                if name not in self.scan(folder)[2]:
+                    break
+                folder = os.path.join(folder, name)
+            else:
+                return self.modules(folder)
+        return []
+
+module_index = ModuleIndex(ip.db)
+
+def pathFolders():
+    """ The folders of the pythonpath, as absolute paths """
+    return [os.path.abspath(p) for p in sys.path]
+
 def getRootModules():
     """
     Returns a list containing the names of all the modules available in the
     folders of the pythonpath.
+
+    The names come from module_index, which brings itself up to date in the
+    background.  Only the folders that were never indexed are waited for,
+    and not for more than TIMEOUT_STORAGE seconds.
     """
-    modules = []
-    if ip.db.has_key('rootmodules'):
-        return ip.db['rootmodules']
-    t = time()
-    store = False
-    for path in sys.path:
-        modules += moduleList(path)        
-        if time() - t >= TIMEOUT_STORAGE and not store:
-            store = True
-            print "\nCaching the list of root modules, please wait!" 
+    folders = pathFolders()
+    module_index.sync()
+    module_index.refresh(folders)
+    known = [f for f in folders if f in module_index.folders]
+    if len(known) < len(folders):
+        module_index.thread.join(TIMEOUT_STORAGE)
+        if module_index.thread.isAlive():
+            print "\nIndexing the root modules in the background, please wait!"
             print "(This will only be done once - type '%rehashx' to " + \
-            "reset cache!)"
-            print
-        if time() - t > TIMEOUT_GIVEUP:
-            print "This is taking too long, we give up."
+            "reset the index!)"
             print
-            ip.db['rootmodules'] = []
-            return []
-    
-    modules += sys.builtin_module_names
-      
-    modules = list(set(modules))
-    if '__init__' in modules:
-        modules.remove('__init__')
-    modules = list(set(modules))
-    if store:
-        ip.db['rootmodules'] = modules
-    return modules
+        known = [f for f in folders if f in module_index.folders]
+    modules = set(sys.builtin_module_names)
+    for folder in known:
+        modules.update(module_index.folders[folder][1])
+    return list(modules)
 
 def moduleList(path):
     """
     Return the list containing the names of the modules available in the given
     folder.
     """
-
-    if os.path.isdir(path):
-        folder_list = os.listdir(path)
-    else:
-        folder_list = []
-    #folder_list = glob.glob(os.path.join(path,'*'))
-    folder_list = [p for p in folder_list  \
-       if os.path.exists(os.path.join(path, p,'__init__.py'))\
-           or p[-3:] in ('.py','.so')\
-           or p[-4:] in ('.pyc','.pyo')]
-
-    folder_list = [os.path.basename(p).split('.')[0] for p in folder_list]
-    return folder_list
+    return module_index.modules(os.path.abspath(path))
 
 def moduleCompletion(line):
     """
@@ -103,26 +175,22 @@ def moduleCompletion(line):
     The line looks like this :
     'import xml.d'
     'from xml.dom import'
+
+    Submodules come from module_index, modules are never imported.  Their
+    attributes are only completed if they are imported already.
     """
-    def tryImport(mod, only_modules=False):
-        def isImportable(module, attr):
-            if only_modules:
-                return inspect.ismodule(getattr(module, attr))
-            else:
-                return not(attr[:2] == '__' and attr[-2:] == '__')
-        try:
-            m = __import__(mod)
-        except:
-            return []
-        mods = mod.split('.')
-        for module in mods[1:]:
-            m = getattr(m,module)
-        if (not hasattr(m, '__file__')) or (not only_modules) or\
-           (hasattr(m, '__file__') and '__init__' in m.__file__):
-            completion_list = [attr for attr in dir(m) if isImportable(m, attr)]
-        completion_list.extend(getattr(m,'__all__',[]))
-        if hasattr(m, '__file__') and '__init__' in m.__file__:
-            completion_list.extend(moduleList(os.path.dirname(m.__file__)))
+    def moduleNames(mod, only_modules=False):
+        completion_list = module_index.submodules(mod)
+        m = sys.modules.get(mod)
+        if m is not None:
+            for attr in dir(m):
+                if only_modules:
+                    if inspect.ismodule(getattr(m, attr, None)):
+                        completion_list.append(attr)
+                elif not(attr[:2] == '__' and attr[-2:] == '__'):
+                    completion_list.append(attr)
+            if not only_modules:
+                completion_list.extend(getattr(m,'__all__',[]))
         completion_list = list(set(completion_list))
         if '__init__' in completion_list:
             completion_list.remove('__init__')
@@ -137,12 +205,12 @@ def moduleCompletion(line):
         mod = words[1].split('.')
         if len(mod) < 2:
             return getRootModules()
-        completion_list = tryImport('.'.join(mod[:-1]), True)
+        completion_list = moduleNames('.'.join(mod[:-1]), True)
         completion_list = ['.'.join(mod[:-1] + [el]) for el in completion_list]
         return completion_list
     if len(words) >= 3 and words[0] == 'from':
         mod = words[1]
-        return tryImport(mod)
+        return moduleNames(mod)
 
 def vcs_completer(commands, event):
     """ utility to make writing typical version control app completers easier
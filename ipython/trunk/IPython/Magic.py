@@ -2564,7 +2564,7 @@ Defaulting color scheme to 'NoColor'"""
         '|'-separated string of extensions, stored in the IPython config
         variable win_exec_ext.  This defaults to 'exe|com|bat'.
         
-        This function also resets the root module cache of module completer,
+        This function also resets the module index of module completer,
         used on slow filesystems.
         """
         
@@ -2572,7 +2572,7 @@ Defaulting color scheme to 'NoColor'"""
         ip = self.api
 
         # for the benefit of module completer in ipy_completers.py
-        del ip.db['rootmodules']
+        del ip.db['moduleindex']
         
         path = [os.path.abspath(os.path.expanduser(p)) for p in 
             os.environ.get('PATH','').split(os.pathsep)]
@@ -65,6 +65,7 @@ used, and this module (and the readline module) are silently inactive.
 
 import __builtin__
 import __main__
+import bisect
 import glob
 import keyword
 import os
@@ -86,7 +87,86 @@ except NameError:
 
 from IPython.genutils import debugx, dir2
 
-__all__ = ['Completer','IPCompleter']
+__all__ = ['Completer','IPCompleter','PrefixIndex']
+
+class PrefixIndex:
+    """A sorted index of names, to find those that start with a prefix.
+
+    sync() brings the index up to date with a collection of names (like the
+    keys of a namespace), inserting and removing only the names that
+    changed since the last sync, and matches() finds the names starting
+    with a prefix by bisection instead of looking at every name.
+    """
+
+    def __init__(self,names=()):
+        self.names = set()
+        self.sorted = []
+        self.source = None
+        self.length = 0
+        self.version = None
+        self.sync(names)
+
+    def sync(self,names,version=None,known=()):
+        """Make the index hold the string names in names.
+
+        Finding what changed takes a pass over names.  That is skipped if
+        a version is given, names is the same object as at the last sync,
+        with the same length, and version is the same too.  So the version
+        must change whenever names may have.
+
+        known holds names that whoever keeps names may have added since the
+        last sync (like the shell's _i<n> and _<n> caches).  If names is the
+        same object as at the last sync and its length changed only by the
+        known names that are new, they are added and the pass is skipped
+        too.  A name added together with another one removed is then only
+        seen at the next full pass.
+        """
+        if (version is not None and version == self.version and
+            names is self.source and len(names) == self.length):
+            return
+        if known and names is self.source:
+            new = [name for name in set(known)
+                   if name in names and name not in self.names]
+            if len(names) == self.length + len(new):
+                self.length = len(names)
+                self.version = version
+                self.update(new,[])
+                return
+        self.source = names
+        self.length = len(names)
+        self.version = version
+        names = set(names)
+        if names == self.names:
+            return
+        new = names - self.names
+        gone = self.names - names
+        self.update(new,gone)
+
+    def update(self,new,gone):
+        """Add the names in new to the index, and remove those in gone."""
+        self.names.update(new)
+        self.names.difference_update(gone)
+        added = [name for name in new if type(name) is str]
+        removed = [name for name in gone if type(name) is str]
+        if len(added) + len(removed) > len(self.sorted)/8:
+            # Cheaper to sort everything again
+            self.sorted = [name for name in self.names if type(name) is str]
+            self.sorted.sort()
+        else:
+            for name in removed:
+                del self.sorted[bisect.bisect_left(self.sorted,name)]
+            for name in added:
+                bisect.insort(self.sorted,name)
+
+    def matches(self,prefix):
+        """Return the names that start with prefix, in sorted order."""
+        names = self.sorted
+        i = bisect.bisect_left(names,prefix)
+        j = i
+        end = len(names)
+        while j < end and names[j].startswith(prefix):
+            j += 1
+        return names[i:j]
 
 class Completer:
     def __init__(self,namespace=None,global_namespace=None):
@@ -130,6 +210,13 @@ class Completer:
         else:
             self.global_namespace = global_namespace
 
+        # Prefix indexes of the names seen by global_matches, kept in sync
+        # with the namespaces when completing
+        self.keyword_index = PrefixIndex(keyword.kwlist)
+        self.builtin_index = PrefixIndex()
+        self.namespace_index = PrefixIndex()
+        self.global_namespace_index = PrefixIndex()
+
     def complete(self, text, state):
         """Return the next possible completion for 'text'.
 
@@ -157,18 +244,36 @@ class Completer:
         defined in self.namespace or self.global_namespace that match.
 
         """
+        version = self.namespace_version()
+        self.builtin_index.sync(__builtin__.__dict__,version)
+        self.namespace_index.sync(self.namespace,version,
+                                  self.namespace_known())
+        self.global_namespace_index.sync(self.global_namespace,version)
         matches = []
-        match_append = matches.append
-        n = len(text)
-        for lst in [keyword.kwlist,
-                    __builtin__.__dict__.keys(),
-                    self.namespace.keys(),
-                    self.global_namespace.keys()]:
-            for word in lst:
-                if word[:n] == text and word != "__builtins__":
-                    match_append(word)
+        for index in [self.keyword_index,
+                      self.builtin_index,
+                      self.namespace_index,
+                      self.global_namespace_index]:
+            matches.extend(index.matches(text))
+        if "__builtins__".startswith(text):
+            matches = [word for word in matches if word != "__builtins__"]
         return matches
 
+    def namespace_version(self):
+        """Return something that changes whenever the namespaces may have.
+
+        None means that they must be checked for changes on every call.
+        """
+        return None
+
+    def namespace_known(self):
+        """Return the names that may have been added to the namespace since
+        the last call, by something other than user code.
+
+        See PrefixIndex.sync.
+        """
+        return ()
+
     def attr_matches(self, text):
         """Compute matches when text contains a dot.
 
@@ -240,6 +345,7 @@ class IPCompleter(Completer):
         to complete. """
 
         Completer.__init__(self,namespace,global_namespace)
+        self.shell = shell
         self.magic_prefix = shell.name+'.magic_'
         self.magic_escape = shell.ESC_MAGIC
         self.readline = readline
@@ -253,6 +359,9 @@ class IPCompleter(Completer):
         if alias_table is None:
             alias_table = {}
         self.alias_table = alias_table
+        self.alias_index = PrefixIndex()
+        # The prompt count when namespace_known was last called
+        self.known_count = 0
         # Regexp to split filenames with spaces in them
         self.space_name_re = re.compile(r'([^\\] )')
         # Hold a local ref. to glob.glob for speed
@@ -413,11 +522,24 @@ class IPCompleter(Completer):
         if ' ' in self.lbuf.lstrip() and not self.lbuf.lstrip().startswith('sudo'):
             return []
         text = os.path.expanduser(text)
-        aliases =  self.alias_table.keys()
-        if text == "":
-            return aliases
-        else:
-            return [alias for alias in aliases if alias.startswith(text)]
+        self.alias_index.sync(self.alias_table,self.namespace_version())
+        return self.alias_index.matches(text)
+
+    def namespace_version(self):
+        """The shell's ns_version, which changes when code may have run."""
+        return self.shell.ns_version
+
+    def namespace_known(self):
+        """The names the shell's input and output caches set since the
+        last call: _, __, ___, _i, _ii, _iii and _<n>, _i<n> for the new
+        prompt numbers."""
+        last = self.known_count
+        self.known_count = count = self.shell.outputcache.prompt_count
+        known = ['_','__','___','_i','_ii','_iii']
+        for n in range(last,count+1):
+            known.append('_%d' % n)
+            known.append('_i%d' % n)
+        return known
 
     def python_matches(self,text):
         """Match attributes or global python names"""
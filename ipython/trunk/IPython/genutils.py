@@ -1995,6 +1995,44 @@ def popkey(dct,key,default=NotGiven):
         del dct[key]
         return val
 
+#----------------------------------------------------------------------------
+class LRUCache:
+    """A dict-like cache holding at most size items.
+
+    When a new item doesn't fit, the least recently used half of the items
+    is dropped at once, so that finding them is only paid for once every
+    size/2 new items.
+    """
+
+    def __init__(self,size):
+        self.size = size
+        self.data = {}
+        self.tick = 0
+
+    def __getitem__(self,key):
+        item = self.data[key]
+        self.tick += 1
+        item[1] = self.tick
+        return item[0]
+
+    def __setitem__(self,key,value):
+        if key not in self.data and len(self.data) >= self.size:
+            ticks = [(item[1],key_old) for key_old,item in self.data.items()]
+            ticks.sort()
+            for tick,key_old in ticks[:len(ticks)-self.size/2]:
+                del self.data[key_old]
+        self.tick += 1
+        self.data[key] = [value,self.tick]
+
+    def __contains__(self,key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
 def wrap_deprecated(func, suggest = '<nothing>'):
     def newFunc(*args, **kwargs):
         warnings.warn("Call to deprecated function %s, use %s instead" % 
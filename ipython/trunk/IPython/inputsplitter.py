@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Tell when a block of input lines may be complete, without compiling it.
+
+InteractiveShell.push used to compile the whole input buffer after every
+line, to learn from codeop whether the block was complete.  Pasting or
+running a block of n lines therefore compiled n ever longer sources.  The
+InputSplitter here follows the lines as they are pushed instead, carrying
+the state of the tokenizer from one line to the next (open brackets, open
+strings and backslash continuations), so that the shell only compiles once
+the block can be complete.
+"""
+__docformat__ = "restructuredtext en"
+
+import re
+
+# The characters that change the state outside of a string
+_special_re = re.compile(r'[#\'"()\[\]{}\\]')
+
+# The characters that can end a string, for each kind of quote
+_string_end_re = {
+    "'": re.compile(r"[\\']"),
+    '"': re.compile(r'[\\"]'),
+    "'''": re.compile(r"\\|'''"),
+    '"""': re.compile(r'\\|"""'),
+    }
+
+class InputSplitter(object):
+    """Follow the lines of a block of input as they are pushed.
+
+    push() scans each new line and says whether the source pushed since the
+    last reset() may be complete.  When it says no, compiling the source is
+    sure to find it incomplete (or to find a syntax error that compiling the
+    rest of the block will report anyway), so the shell can wait for more
+    lines.  When it says yes, only compiling tells.
+
+    A block stays incomplete while:
+
+    - a bracket, a string or a backslash continuation is open, or
+
+    - it is a compound statement (the shell calls block_open() when codeop
+      says so) and the new logical line is indented, since only a line that
+      is blank or not indented can end it.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the lines pushed so far, for a new block."""
+        # The depth of the open brackets
+        self.depth = 0
+        # The quote of the open string, or None
+        self.quote = None
+        # Whether the last line ended with a backslash continuation
+        self.continued = False
+        # Whether codeop found the block to be an unfinished compound
+        # statement
+        self.in_block = False
+        # Whether the current logical line starts with some indentation
+        self.indented = False
+
+    def is_open(self):
+        """Return whether a bracket, a string or a continuation is open."""
+        return bool(self.depth or self.quote or self.continued)
+
+    def block_open(self):
+        """Note that compiling the block found it incomplete."""
+        if not self.is_open():
+            self.in_block = True
+
+    def push(self, line):
+        """Scan a line, return whether the block may now be complete.
+
+        The line may have internal newlines, in which case it is scanned
+        line by line and the block may always be complete.  So may it if
+        the line has a carriage return, which the compiler also takes as
+        the end of a line.
+        """
+        sublines = line.split('\n')
+        for subline in sublines:
+            self._scan(subline)
+        if self.depth < 0:
+            # Unbalanced brackets, let the compiler complain
+            return True
+        if self.is_open():
+            return False
+        if len(sublines) > 1 or '\r' in line:
+            return True
+        return not (self.in_block and self.indented and line.strip())
+
+    def _scan(self, line):
+        if not self.is_open():
+            # A new logical line
+            self.indented = line[:1] in (' ', '\t')
+        self.continued = False
+        pos, end = 0, len(line)
+        while pos < end:
+            if self.quote is None:
+                m = _special_re.search(line, pos)
+                if m is None:
+                    break
+                c = m.group()
+                pos = m.end()
+                if c == '#':
+                    return
+                elif c in '([{':
+                    self.depth += 1
+                elif c in ')]}':
+                    self.depth -= 1
+                elif c == '\\':
+                    self.continued = pos == end
+                elif line.startswith(c*3, pos-1):
+                    self.quote = c*3
+                    pos += 2
+                else:
+                    self.quote = c
+            else:
+                m = _string_end_re[self.quote].search(line, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    if pos == end:
+                        # The string goes on on the next line
+                        return
+                    pos += 1
+                else:
+                    self.quote = None
+        if self.quote is not None and len(self.quote) == 1:
+            # A single quoted string only goes on after a backslash, this
+            # one is unterminated and the compiler will say so.
+            self.quote = None
@@ -73,6 +73,7 @@ from IPython.background_jobs import BackgroundJobManager
 from IPython.usage import cmd_line_usage,interactive_usage
 from IPython.genutils import *
 from IPython.strdispatch import StrDispatch
+from IPython.inputsplitter import InputSplitter
 import IPython.ipapi
 import IPython.history
 import IPython.prefilter as prefilter
@@ -239,6 +240,18 @@ class InteractiveShell(object,Magic):
         # User input buffer
         self.buffer = []
 
+        # Tells push when the buffer is worth compiling
+        self.input_splitter = InputSplitter()
+
+        # Changes whenever user code may have changed the namespaces or the
+        # alias table: after code runs and before a line is read.  The
+        # completer only looks for changes in them when it does.
+        self.ns_version = 0
+
+        # What prefilter.classifyPlain() said about recent lines, so that
+        # _prefilter can send plain python straight to handle_normal
+        self.prefilter_cache = LRUCache(10000)
+
         # Default name given in compilation of code
         self.filename = '<ipython console>'
 
@@ -2066,6 +2079,7 @@ want to merge them back into the new files.""" % locals()
             finally:
                 # Reset our crash handler in place
                 sys.excepthook = old_excepthook
+                self.ns_version += 1
         except SystemExit:
             self.resetbuffer()
             self.showtraceback()
@@ -2096,6 +2110,11 @@ want to merge them back into the new files.""" % locals()
         is left as it was after the line was appended.  The return
         value is 1 if more input is required, 0 if the line was dealt
         with in some way (this is the same as runsource()).
+
+        runsource() is not called while self.input_splitter knows that the
+        buffer is incomplete, so that a block of n lines is not compiled n
+        times.  A syntax error inside such a block is reported when the
+        block ends.
         """
 
         # autoindent management should be done here, and not in the
@@ -2106,9 +2125,15 @@ want to merge them back into the new files.""" % locals()
         #print 'push line: <%s>' % line  # dbg
         for subline in line.splitlines():
             self.autoindent_update(subline)
+        if not self.buffer:
+            self.input_splitter.reset()
         self.buffer.append(line)
+        if not self.input_splitter.push(line):
+            return True
         more = self.runsource('\n'.join(self.buffer), self.filename)
-        if not more:
+        if more:
+            self.input_splitter.block_open()
+        else:
             self.resetbuffer()
         return more
 
@@ -2119,6 +2144,7 @@ want to merge them back into the new files.""" % locals()
     def resetbuffer(self):
         """Reset the input buffer."""
         self.buffer[:] = []
+        self.input_splitter.reset()
         
     def raw_input(self,prompt='',continue_prompt=False):
         """Write a prompt and read a line.
@@ -2138,6 +2164,7 @@ want to merge them back into the new files.""" % locals()
         # We must ensure that our completer is back in place.
         if self.has_readline:
             self.set_completer()
+        self.ns_version += 1
         
         try:
             line = raw_input_original(prompt).decode(self.stdin_encoding)
@@ -2217,10 +2244,23 @@ want to merge them back into the new files.""" % locals()
 
             # Only return if the accumulated input buffer was just whitespace!
             if ''.join(self.buffer).isspace():
-                self.buffer[:] = []
+                self.resetbuffer()
             return ''
         
-        line_info = prefilter.LineInfo(line, continue_prompt)
+        # The split of the line and what classifyPlain() said about it only
+        # depend on the line and on these flags
+        rc = self.rc
+        key = (line,continue_prompt,rc.automagic,rc.autocall,
+               rc.multi_line_specials)
+        try:
+            split,plain = self.prefilter_cache[key]
+        except KeyError:
+            line_info = prefilter.LineInfo(line, continue_prompt)
+            plain = prefilter.classifyPlain(line_info, self)
+            self.prefilter_cache[key] = ((line_info.pre,line_info.iFun,
+                                          line_info.theRest),plain)
+        else:
+            line_info = prefilter.LineInfo(line, continue_prompt, split)
         
         # the input history needs to track even empty lines
         stripped = line.strip()
@@ -2244,6 +2284,9 @@ want to merge them back into the new files.""" % locals()
                                                          continue_prompt))
             
         #print 'pre <%s> iFun <%s> rest <%s>' % (pre,iFun,theRest)  # dbg
+
+        if plain is not None and prefilter.isPlain(line_info, self, plain):
+            return self.handle_normal(line_info)
         
         return prefilter.prefilter(line_info, self)
 
@@ -41,11 +41,16 @@ class LineInfo(object):
     
     theRest
       Everything else on the line.
+
+    If the result of splitUserInput(line) is already known, it can be given
+    as split.
     """
-    def __init__(self, line, continue_prompt):
+    def __init__(self, line, continue_prompt, split=None):
         self.line            = line
         self.continue_prompt = continue_prompt
-        self.pre, self.iFun, self.theRest = splitUserInput(line)
+        if split is None:
+            split = splitUserInput(line)
+        self.pre, self.iFun, self.theRest = split
 
         self.preChar       = self.pre.strip()
         if self.preChar:
@@ -308,6 +313,69 @@ re_exclude_auto = re.compile(r'^[,&^\|\*/\+-]'
 # nasty enough that I shouldn't change it until I can test it _well_.
 #self.re_fun_name = re.compile (r'[a-zA-Z_]([a-zA-Z0-9_.\[\]]*) ?$')
 
+# Fast path for plain python lines
+#
+# Most lines, like those of a script replayed by runlines or %run -i, are
+# plain python that prefilter() hands to handle_normal after every check
+# has looked at them.  classifyPlain() does the part of that work which only
+# depends on the text of the line and on a few flags, so the shell can cache
+# its result by line, and isPlain() does the rest with a few lookups.
+
+def classifyPlain(l_info,ip):
+    """Tell whether prefilter() may send a line to handle_normal, judging
+    only by its text and by ip.rc's automagic, autocall and
+    multi_line_specials flags.
+
+    Return None if some check may pick another handler, whatever the
+    namespaces hold.  Otherwise return the (assign,magic,autocall) flags
+    that isPlain() needs: whether checkAssignment takes the line, and
+    whether checkAutomagic and checkAutocall still apply to it."""
+    line = l_info.line
+    iFun = l_info.iFun
+    theRest = l_info.theRest
+    if l_info.preChar \
+           or line[-1] == ip.ESC_HELP \
+           or line.endswith('# PYTHON-MODE') \
+           or line.lstrip().startswith(ip.ESC_SHELL) \
+           or (l_info.continue_prompt and ip.rc.multi_line_specials
+               and iFun.startswith(ip.ESC_MAGIC)):
+        return None
+    if theRest and theRest[0] in '=,':
+        return (True,False,False)
+    magic = bool(ip.rc.automagic) and \
+            (not l_info.continue_prompt or bool(ip.rc.multi_line_specials))
+    autocall = bool(ip.rc.autocall) \
+               and not (theRest and theRest[0] in '!=()<>,+*/%^&|') \
+               and not re_exclude_auto.match(theRest) \
+               and re_fun_name.match(iFun) is not None
+    return (False,magic,autocall)
+
+def isPlain(l_info,ip,plain):
+    """Return whether prefilter() would send a line to handle_normal.
+
+    plain is what classifyPlain() returned for the line.  Only names are
+    looked up, no attributes, so unlike ofind() this can't change any
+    state."""
+    assign,magic,autocall = plain
+    iFun = l_info.iFun
+    if isinstance(ip.user_ns.get(iFun), IPython.ipapi.IPyAutocall):
+        return False
+    if assign:
+        return True
+    # An automagic or an alias, or the magic ofind() would find
+    if (magic or autocall) and hasattr(ip,'magic_'+iFun):
+        return False
+    if iFun in ip.alias_table:
+        return False
+    if autocall:
+        # Nothing for ofind() to find means nothing to call
+        head = iFun.split('.',1)[0]
+        return not (head in ip.user_ns \
+                    or head in ip.internal_ns \
+                    or head in ip.ns_table['builtin'] \
+                    or head in ip.alias_table)
+    return True
+
 # Handler Check Utilities
 def isShadowed(identifier,ip):
     """Is the given identifier defined in one of the namespaces which shadow
@@ -8,6 +8,8 @@ class StrDispatch(object):
     def __init__(self):
         self.strs = {}
         self.regexs = {}
+        # Built by _regex_index() when dispatch() needs it
+        self.regex_index = None
     def add_s(self, s, obj, priority= 0 ):
         """ Adds a target 'string' for dispatching """
         
@@ -21,19 +23,65 @@ class StrDispatch(object):
         chain = self.regexs.get(regex, CommandChainDispatcher())
         chain.add(obj,priority)
         self.regexs[regex] = chain
+        self.regex_index = None
+
+    def _regex_index(self):
+        """ Return the regexps in self.regexs, ready to be matched at once
+
+        The result is a list of (match, chains) pairs.  self.regexs stays
+        keyed by the regexps as they were added, only the index holds them
+        compiled.  The regexps that have no groups or flags of their own are
+        each wrapped in a capturing lookahead and joined into one regexp,
+        which matches wherever the joined ones do, telling which of them did
+        by its groups.  For those,
+        chains lists the chain of each group, for the others it is the
+        chain of the regexp.  The pairs keep the order of self.regexs.
+        """
+        index = []
+        joined = []
+        for regex, chain in self.regexs.items():
+            regex = re.compile(regex)
+            if regex.groups or regex.flags or len(joined) == 99:
+                self._join_regexs(joined, index)
+                joined = []
+            if regex.groups or regex.flags:
+                index.append((regex.match, chain))
+            else:
+                joined.append((regex, chain))
+        self._join_regexs(joined, index)
+        return index
+
+    def _join_regexs(self, joined, index):
+        if not joined:
+            return
+        pattern = ''.join(['(?=(%s))?' % regex.pattern
+                           for regex, chain in joined])
+        try:
+            match = re.compile(pattern).match
+        except re.error:
+            for regex, chain in joined:
+                index.append((regex.match, chain))
+        else:
+            index.append((match, [chain for regex, chain in joined]))
 
     def dispatch(self, key):
         """ Get a seq of Commandchain objects that match key """
         if key in self.strs:
             yield self.strs[key]
         
-        for r, obj in self.regexs.items():
-            if re.match(r, key):
-                yield obj
-            else: 
-                #print "nomatch",key
-                pass
-            
+        if self.regex_index is None:
+            self.regex_index = self._regex_index()
+        for match, chains in self.regex_index:
+            m = match(key)
+            if m is None:
+                continue
+            if isinstance(chains, CommandChainDispatcher):
+                yield chains
+            else:
+                for group, chain in enumerate(chains):
+                    if m.group(group+1) is not None:
+                        yield chain
+
 
     def __repr__(self):
         return "<Strdispatch %s, %s>" % (self.strs, self.regexs)
@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+import sys, unittest
+sys.path.append ('..')
+
+from IPython.inputsplitter import InputSplitter
+
+def push_all(splitter, lines):
+    """Push lines, return what push said about each of them."""
+    return [splitter.push(line) for line in lines]
+
+class Tests (unittest.TestCase):
+    def setUp(self):
+        self.splitter=InputSplitter()
+
+    def test_simple(self):
+        self.assertEqual(push_all(self.splitter,["a = 1"]),[True])
+        self.splitter.reset()
+        self.assertEqual(push_all(self.splitter,[""]),[True])
+
+    def test_brackets(self):
+        tests=[
+         (["x = (1,", "2)"],                [False,True]),
+         (["x = [1, {2:", "3}, (4,", "5)]"], [False,False,True]),
+         (["x = (1, # )", "2)"],            [False,True]),
+         (["x = ')'+(", "'('", ")"],        [False,False,True]),
+         (["x = 1)"],                       [True]),
+        ]
+        for lines,res in tests:
+            self.splitter.reset()
+            self.assertEqual(push_all(self.splitter,lines),res)
+
+    def test_strings(self):
+        tests=[
+         (['x = """a', 'b', 'c"""'],        [False,False,True]),
+         (["x = '''a", '"""', "'''"],       [False,False,True]),
+         (['x = """a\\"""', '"""'],         [False,True]),
+         (["x = 'a\\", "b'"],               [False,True]),
+         (["x = 'a"],                       [True]),
+         (['x = "#" + (', '1)'],            [False,True]),
+        ]
+        for lines,res in tests:
+            self.splitter.reset()
+            self.assertEqual(push_all(self.splitter,lines),res)
+
+    def test_continuation(self):
+        self.assertEqual(push_all(self.splitter,["x = 1 + \\", "2"]),
+                         [False,True])
+        self.splitter.reset()
+        self.assertEqual(push_all(self.splitter,["x = 1 # \\"]),[True])
+
+    def test_block(self):
+        s=self.splitter
+        self.assertEqual(s.push("def f(x):"),True)
+        s.block_open()
+        self.assertEqual(push_all(s,["    y = (x,", "x)", "    # c"]),
+                         [False,False,False])
+        self.assertEqual(push_all(s,["    ", "else:", ""]),[True,True,True])
+
+    def test_newlines(self):
+        s=self.splitter
+        s.push("if 1:")
+        s.block_open()
+        self.assertEqual(s.push("  a = 1\n  b = (2,"),False)
+        self.assertEqual(s.push("  3)\n"),True)
+        self.assertEqual(s.push("  c = 4\r"),True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+import os, shutil, sys, tempfile, unittest
+sys.path.append ('..')
+sys.path.append ('../IPython/Extensions')
+
+from StringIO import StringIO
+import IPython.Shell
+
+# ipy_completers needs a running IPython, which replaces __main__
+old_stdout, old_main = sys.stdout, sys.modules['__main__']
+sys.stdout = StringIO()
+IPython.Shell.IPShell(argv=[])
+sys.stdout, sys.modules['__main__'] = old_stdout, old_main
+
+from ipy_completers import ModuleIndex
+
+class Tests (unittest.TestCase):
+    def setUp(self):
+        self.folder=tempfile.mkdtemp()
+        self.touch('mod_a.py')
+        self.touch('mod_b.pyc')
+        self.touch('notes.txt')
+        self.touch('pkg','__init__.py')
+        self.touch('pkg','sub','__init__.py')
+        self.touch('pkg','sub','leaf.py')
+        os.mkdir(os.path.join(self.folder,'nopkg'))
+        sys.path.append(self.folder)
+        self.db={}
+        self.index=ModuleIndex(self.db)
+
+    def tearDown(self):
+        sys.path.remove(self.folder)
+        shutil.rmtree(self.folder)
+
+    def touch(self,*names):
+        name=os.path.join(self.folder,*names)
+        if not os.path.isdir(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+        open(name,'w').close()
+
+    def test_modules(self):
+        mods=self.index.modules(self.folder)
+        mods.sort()
+        self.assertEqual(mods,['mod_a','mod_b','pkg'])
+
+    def test_refresh(self):
+        self.index.refresh([self.folder])
+        self.index.thread.join()
+        self.assert_(self.db['moduleindex'] is self.index.folders)
+        mtime,mods,packages=self.db['moduleindex'][self.folder]
+        self.assertEqual(packages,['pkg'])
+
+    def test_stale(self):
+        self.index.modules(self.folder)
+        entry=self.index.folders[self.folder]
+        self.assert_(self.index.scan(self.folder) is entry)
+        self.index.folders[self.folder]=(entry[0]-1,)+entry[1:]
+        self.touch('mod_c.py')
+        self.assert_('mod_c' in self.index.modules(self.folder))
+
+    def test_submodules(self):
+        self.assertEqual(self.index.submodules('pkg'),['sub'])
+        self.assertEqual(self.index.submodules('pkg.sub'),['leaf'])
+        self.assertEqual(self.index.submodules('mod_a'),[])
+        self.assert_('pkg' not in sys.modules)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -421,6 +421,29 @@ for b in bin_ops:
 run_handler_tests(bin_tests)
 
 
+# Cached prefilter decisions
+# ==========================
+
+# The shell caches what the text of a line says about it, the same line must
+# still follow the namespaces, the alias table and the options
+ip.options.autocall = 1
+run_one_test('cached_name arg', handle_normal)
+run_one_test('cached_name arg', handle_normal)
+ip.user_ns['cached_name'] = len
+run_one_test('cached_name arg', handle_auto)
+ip.options.autocall = 0
+run_one_test('cached_name arg', handle_normal)
+ip.options.autocall = 1
+ip.user_ns['cached_name'] = IPython.ipapi.IPyAutocall()
+run_one_test('cached_name = arg', handle_auto)
+del ip.user_ns['cached_name']
+run_one_test('cached_name = arg', handle_normal)
+ip.IP.alias_table['cached_name'] = 'alias_result'
+run_one_test('cached_name arg', handle_alias)
+del ip.IP.alias_table['cached_name']
+run_one_test('cached_name arg', handle_normal)
+
+
 # Possibly add tests for namespace shadowing (really ofind's business?).
 #
 # user > ipython internal > python builtin > alias > magic
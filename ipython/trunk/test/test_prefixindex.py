@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+import sys, unittest
+sys.path.append ('..')
+
+from IPython.completer import PrefixIndex
+
+class Tests (unittest.TestCase):
+    def setUp(self):
+        self.ns={'abc':1,'abd':2,'b':3,'ab':4,1:5}
+        self.index=PrefixIndex(self.ns)
+
+    def test_matches(self):
+        self.assertEqual(self.index.matches('ab'),['ab','abc','abd'])
+        self.assertEqual(self.index.matches('abc'),['abc'])
+        self.assertEqual(self.index.matches('c'),[])
+        self.assertEqual(self.index.matches(''),['ab','abc','abd','b'])
+
+    def test_sync(self):
+        del self.ns['abc']
+        self.ns['abe']=6
+        self.index.sync(self.ns)
+        self.assertEqual(self.index.matches('ab'),['ab','abd','abe'])
+
+    def test_version(self):
+        self.index.sync(self.ns,1)
+        self.ns['abe']=6
+        del self.ns['b']
+        # Same object, same length, same version: taken as unchanged
+        self.index.sync(self.ns,1)
+        self.assertEqual(self.index.matches('abe'),[])
+        self.index.sync(self.ns,2)
+        self.assertEqual(self.index.matches('abe'),['abe'])
+        self.assertEqual(self.index.matches('b'),[])
+
+    def test_known(self):
+        self.index.sync(self.ns,1)
+        self.ns['_i1']=7
+        self.ns['abe']=8
+        # The length changed by more than the known names
+        self.index.sync(self.ns,2,['_i1','_1'])
+        self.assertEqual(self.index.matches('_'),['_i1'])
+        self.assertEqual(self.index.matches('abe'),['abe'])
+        self.ns['_1']=9
+        self.ns['_i2']=10
+        self.index.sync(self.ns,3,['_1','_i1','_2','_i2'])
+        self.assertEqual(self.index.matches('_'),['_1','_i1','_i2'])
+        # Only the known names are looked at
+        self.ns['c']=11
+        del self.ns['b']
+        self.index.sync(self.ns,4,['_i1'])
+        self.assertEqual(self.index.matches('c'),[])
+        self.index.sync(self.ns,5)
+        self.assertEqual(self.index.matches('c'),['c'])
+        self.assertEqual(self.index.matches('b'),[])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+import re, sys, unittest
+sys.path.append ('..')
+
+from IPython.strdispatch import StrDispatch
+
+class Tests (unittest.TestCase):
+    def setUp(self):
+        self.d=StrDispatch()
+
+    def old_dispatch(self,key):
+        """What dispatch() did before the regexps were joined."""
+        res=[]
+        if key in self.d.strs:
+            res.append(self.d.strs[key])
+        for r,obj in self.d.regexs.items():
+            if re.match(r,key):
+                res.append(obj)
+        return res
+
+    def test_priority(self):
+        self.d.add_s('hei',34,priority=4)
+        self.d.add_s('hei',123,priority=2)
+        self.d.add_re('h.i',686)
+        self.assertEqual(list(self.d.flat_matches('hei')),[123,34,686])
+
+    def test_regexs(self):
+        keys=['apt-get install','svn up','hei','HEI','xy','','zzz']
+        for i,regex in enumerate(['.*apt-get','.*','h.i',r'(?i)hei','(x)y',
+                                  'svn\\b','^$',re.compile('z+')]):
+            self.d.add_re(regex,i)
+            for key in keys:
+                self.assertEqual(list(self.d.dispatch(key)),
+                                 self.old_dispatch(key))
+
+    def test_many(self):
+        for i in range(250):
+            self.d.add_re('.*cmd%d$' % i,i)
+        self.assertEqual(list(self.d.flat_matches('run cmd120')),[120])
+        self.assertEqual(list(self.d.dispatch('cmd7')),
+                         self.old_dispatch('cmd7'))
+
+    def test_same_regex(self):
+        self.d.add_re('foo.*','A',1)
+        re.purge()
+        self.d.add_re('foo.*','B',5)
+        self.assertEqual(self.d.regexs.keys(),['foo.*'])
+        self.assertEqual(list(self.d.flat_matches('foobar')),['A','B'])
+        self.assertEqual(list(self.d.dispatch('foobar')),
+                         self.old_dispatch('foobar'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Time how long IPython takes to answer a TAB, for a few kinds of completion.
+
+The shell gets a user namespace of n names and an alias table of a
+executables, as %rehashx would make it, and each case is timed on calls to
+IPCompleter.complete as readline makes them::
+
+    python completion_profiler.py -n 100000 -a 5000
+
+The cases are:
+
+- global: a name from the user namespace
+- rerun: the same, the first time after some code ran
+- input: the same, the first time after an input whose result was shown,
+  which adds _i<n> and _<n> to the user namespace
+- changed: the same, the first time after some code added a name
+- alias: an alias, as the first word of the line
+- attr: an attribute of a module
+- none: a prefix that matches nothing
+"""
+import sys
+from optparse import OptionParser
+from StringIO import StringIO
+
+sys.path.insert(0, '..')
+
+import IPython.Shell
+from IPython.genutils import Term, time
+
+def complete(completer, line):
+    """Return all the completions of the last word of line."""
+    completer.get_endidx = lambda: len(line)
+    text = line.split()[-1]
+    matches = []
+    state = 0
+    while True:
+        match = completer.complete(text, state, line_buffer=line)
+        if match is None:
+            return matches
+        matches.append(match)
+        state += 1
+
+def time_completion(ip, line, repeat, setup=None):
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start = time.time()
+        n = len(complete(ip.Completer, line))
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, n
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(names=100000)
+    parser.set_defaults(aliases=5000)
+    parser.set_defaults(repeat=20)
+
+    parser.add_option("-n", type='int', dest='names',
+        help='the number of names in the user namespace')
+    parser.add_option("-a", type='int', dest='aliases',
+        help='the number of aliases')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times to time each case')
+
+    (opts, args) = parser.parse_args()
+
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        ip = IPython.Shell.IPShell(argv=[]).IP
+    finally:
+        sys.stdout = stdout
+    for i in range(opts.names):
+        ip.user_ns['name%06d' % i] = i
+    for i in range(opts.aliases):
+        ip.alias_table['exe%05d' % i] = (0, 'exe%05d' % i)
+    ip.user_ns['os'] = __import__('os')
+
+    def rerun(i):
+        ip.runlines('name00000 = %d' % i)
+
+    def input(i):
+        cout = Term.cout
+        Term.cout = StringIO()
+        try:
+            ip.push(ip.prefilter('name00000', False))
+        finally:
+            Term.cout = cout
+
+    def change(i):
+        ip.runlines('name_new%d = %d' % (i, i))
+
+    cases = [
+        ('global', 'x = name00012', None),
+        ('rerun', 'x = name00012', rerun),
+        ('input', 'x = name00012', input),
+        ('changed', 'x = name00012', change),
+        ('alias', 'exe0012', None),
+        ('attr', 'os.pa', None),
+        ('none', 'x = zzz', None),
+        ]
+    print "%i names, %i aliases" % (opts.names, opts.aliases)
+    print "%8s %10s %8s" % ('case', 'time (ms)', 'matches')
+    for name, line, setup in cases:
+        t, n = time_completion(ip, line, opts.repeat, setup)
+        print "%8s %10.3f %8i" % (name, 1000*t, n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Time how long IPython takes to run pasted blocks of growing size.
+
+Each block is run with runlines, which pushes it line by line as a paste
+would be.  The blocks are a function whose body has n lines and a dict
+literal of n lines.  With -o the shell compiles the whole buffer after
+every line, as it did before InteractiveShell.input_splitter::
+
+    python paste_profiler.py -n 500,1000,2000,4000
+    python paste_profiler.py -n 500,1000,2000,4000 -o
+"""
+import sys
+from optparse import OptionParser
+from StringIO import StringIO
+
+sys.path.insert(0, '..')
+
+import IPython.Shell
+from IPython.genutils import time
+
+class CompileEveryLine(object):
+    """An input splitter that always lets the shell compile."""
+    def reset(self):
+        pass
+    def block_open(self):
+        pass
+    def push(self, line):
+        return True
+
+def function_block(n):
+    lines = ['def f(x):']
+    for i in range(n):
+        lines.append('    x = x + %d' % i)
+    lines.append('    return x')
+    return '\n'.join(lines) + '\n'
+
+def dict_block(n):
+    lines = ['d = {']
+    for i in range(n):
+        lines.append('    %d: "%d",' % (i, i))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+def time_paste(ip, block, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        ip.runlines(block)
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(sizes='250,500,1000,2000,3000')
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(old=False)
+
+    parser.add_option("-n", type='string', dest='sizes',
+        help='the comma separated numbers of lines in the blocks')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times to run each block')
+    parser.add_option("-o", action='store_true', dest='old',
+        help='compile the buffer after every line')
+
+    (opts, args) = parser.parse_args()
+    sizes = [int(n) for n in opts.sizes.split(',')]
+
+    # Keep the shell quiet while it starts and runs the blocks
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        ip = IPython.Shell.IPShell(argv=[]).IP
+        if opts.old:
+            ip.input_splitter = CompileEveryLine()
+        times = []
+        for n in sizes:
+            times.append((n, time_paste(ip, function_block(n), opts.repeat),
+                time_paste(ip, dict_block(n), opts.repeat)))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    print "%8s %12s %12s" % ('lines', 'function (s)', 'dict (s)')
+    for n, tf, td in times:
+        print "%8i %12.3f %12.3f" % (n, tf, td)
+
+
+if __name__ == '__main__':
+    main()
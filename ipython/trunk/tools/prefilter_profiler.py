@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Time how long IPython takes to prefilter and run plain python lines.
+
+A script of n lines is prefiltered line by line, and run with runlines as
+%run -i or a paste would.  The first pass fills the shell's prefilter
+cache, the second one finds the lines in it, and the best of a few runs is
+shown.  With -o every line goes
+through all the checks of prefilter.prefilter, as it did before
+InteractiveShell.prefilter_cache::
+
+    python prefilter_profiler.py -n 3000
+    python prefilter_profiler.py -n 3000 -o
+"""
+import sys
+from optparse import OptionParser
+from StringIO import StringIO
+
+sys.path.insert(0, '..')
+
+import IPython.Shell
+from IPython import prefilter
+from IPython.genutils import time
+
+class CheckEveryLine(object):
+    """A prefilter cache that has every line, all to be checked in full."""
+    def __getitem__(self, key):
+        return prefilter.splitUserInput(key[0]), None
+
+def script(n):
+    lines = ['def f(x):',
+             '    if x > 2:',
+             '        return sum([i for i in range(x)])',
+             '    return x',
+             '',
+             'results = []',
+             'total = 0']
+    for i in range(n/3):
+        lines.append('a%d = f(%d)' % (i, i % 5))
+        lines.append('results.append(a%d)' % i)
+        lines.append('total += len(results) + a%d' % i)
+    return lines
+
+def time_prefilter(ip, lines):
+    start = time.time()
+    for line in lines:
+        ip.prefilter(line, 0)
+    return time.time()-start
+
+def time_runlines(ip, lines):
+    source = '\n'.join(lines)
+    start = time.time()
+    ip.runlines(source)
+    return time.time()-start
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(lines=3000)
+    parser.set_defaults(repeat=5)
+    parser.set_defaults(old=False)
+
+    parser.add_option("-n", type='int', dest='lines',
+        help='the number of lines in the script')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times to time each case')
+    parser.add_option("-o", action='store_true', dest='old',
+        help='check every line in full')
+
+    (opts, args) = parser.parse_args()
+    lines = script(opts.lines)
+
+    # Keep the shell quiet while it starts and runs the script
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        ip = IPython.Shell.IPShell(argv=[]).IP
+        if opts.old:
+            ip.prefilter_cache = CheckEveryLine()
+        # Define the names the script uses first
+        ip.runlines('\n'.join(lines))
+        times = []
+        for name, timer in [('prefilter', time_prefilter),
+                            ('runlines', time_runlines)]:
+            best = []
+            for i in range(opts.repeat):
+                if not opts.old:
+                    ip.prefilter_cache.clear()
+                best.append((timer(ip, lines), timer(ip, lines)))
+            times.append((name, min([first for first, again in best]),
+                          min([again for first, again in best])))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    print "%i lines" % len(lines)
+    print "%10s %10s %10s" % ('', 'first (s)', 'again (s)')
+    for name, first, again in times:
+        print "%10s %10.3f %10.3f" % (name, first, again)
+
+
+if __name__ == '__main__':
+    main()
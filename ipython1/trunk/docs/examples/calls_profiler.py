@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Measure how many small calls per second a MultiEngineClient can make.
+
+Each call in this script does almost no work on the engines, so its rate
+is set by the round trips between the client and the controller.  The
+script times execute and pull made one at a time with block=True, made
+with block=False and collected with barrier, and made inside a batch,
+which sends all of them in a single request.  To run the script there must
+first be an IPython controller and engines running::
+
+    ipcluster -n 4
+
+and then::
+
+    python calls_profiler.py -n 200
+
+Blocking calls reuse a single persistent connection, so their rate is
+limited by latency alone.  Batched calls should be faster by a large
+factor because they pay for one round trip instead of one per call.
+"""
+from __future__ import with_statement
+import sys
+from optparse import OptionParser
+
+from IPython.genutils import time
+from ipython1.kernel import client
+
+def blockingCalls(rc, n):
+    for i in range(n):
+        rc.execute('a = %i' % i, block=True)
+        rc.pull('a', block=True)
+
+def nonblockingCalls(rc, n):
+    pending = []
+    for i in range(n):
+        pending.append(rc.execute('a = %i' % i, block=False))
+        pending.append(rc.pull('a', block=False))
+    rc.barrier(pending)
+
+def batchedCalls(rc, n):
+    pending = []
+    with rc.batch():
+        for i in range(n):
+            pending.append(rc.execute('a = %i' % i))
+            pending.append(rc.pull('a'))
+    rc.barrier(pending)
+
+def callRate(f, rc, n, repeat):
+    """Return the best number of calls per second made by f."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        f(rc, n)
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return 2*n/best
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(ncalls=100)
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(targets=0)
+    parser.set_defaults(controller='localhost')
+    parser.set_defaults(meport=10105)
+
+    parser.add_option("-n", type='int', dest='ncalls',
+        help='the number of execute/pull pairs to make')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times each measurement is repeated')
+    parser.add_option("-t", type='int', dest='targets',
+        help='the engine the calls are made on')
+    parser.add_option("-c", type='string', dest='controller',
+        help='the address of the controller')
+    parser.add_option("-p", type='int', dest='meport',
+        help="the port on which the controller listens for the MultiEngine/RemoteController client")
+
+    (opts, args) = parser.parse_args()
+
+    rc = client.MultiEngineClient((opts.controller, opts.meport))
+    rc.targets = opts.targets
+
+    print "%i small calls on engine %i" % (2*opts.ncalls, opts.targets)
+    for name, f in [('blocking', blockingCalls),
+        ('non-blocking', nonblockingCalls), ('batched', batchedCalls)]:
+        rate = callRate(f, rc, opts.ncalls, opts.repeat)
+        print "%15s: %10.0f calls/second" % (name, rate)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Compare the time to push an object with fan-out and tree broadcasts.
+
+With method='fanout' the controller sends a copy of the pickled namespace
+to every engine.  With method='tree' it sends one copy and the engines
+forward it to each other along a binomial tree.  This script pushes an
+object of a given size to 1, 2, 4, ... engines with both methods and
+prints the best time of several repeats.  To run the script there must
+first be an IPython controller and engines running::
+
+    ipcluster -n 16
+
+A good test to run with 16 engines is::
+
+    python push_profiler.py -s 10 -r 3
+
+The engines forward each chunk of the object as soon as it arrives, so a
+tree push takes about as long as sending the object once, plus a small delay
+for each level of the tree.  It should win once the push is limited by the
+controller's network connection, that is for large objects and many engines
+on several hosts.  Each engine holds the chunks of the pickle and the
+unpickled object, but never a second, joined copy of the pickle.
+"""
+import sys
+from optparse import OptionParser
+
+from IPython.genutils import time
+from ipython1.kernel import client
+
+def timePush(rc, ns, targets, method, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        rc.push(ns, targets=targets, method=method)
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(size=1.0)
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(controller='localhost')
+    parser.set_defaults(meport=10105)
+
+    parser.add_option("-s", type='float', dest='size',
+        help='the size of the pushed object in MB')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times each push is repeated')
+    parser.add_option("-c", type='string', dest='controller',
+        help='the address of the controller')
+    parser.add_option("-p", type='int', dest='meport',
+        help="the port on which the controller listens for the MultiEngine/RemoteController client")
+
+    (opts, args) = parser.parse_args()
+
+    rc = client.MultiEngineClient((opts.controller, opts.meport))
+    rc.block = True
+    ids = rc.get_ids()
+    ids.sort()
+
+    ns = dict(a='x'*int(opts.size*1024*1024))
+
+    print "pushing %.1f MB, best of %i" % (opts.size, opts.repeat)
+    print "%8s %12s %12s %8s" % ('engines', 'fanout (s)', 'tree (s)', 'speedup')
+    n = 1
+    while True:
+        targets = ids[:n]
+        fanout = timePush(rc, ns, targets, 'fanout', opts.repeat)
+        tree = timePush(rc, ns, targets, 'tree', opts.repeat)
+        print "%8i %12.3f %12.3f %8.2f" % (len(targets), fanout, tree, fanout/tree)
+        sys.stdout.flush()
+        if n >= len(ids):
+            break
+        n = min(2*n, len(ids))
+    rc.reset()
+
+
+if __name__ == '__main__':
+    main()
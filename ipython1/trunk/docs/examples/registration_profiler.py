@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Time how fast a controller registers a storm of engines.
+
+This script starts a controller with the MultiEngine and TaskController
+interfaces in this process, connects a number of engines to it over PB
+all at once and reports how long it took until the last one was
+registered.  It then times how long the MultiEngine takes to resolve a
+list of all the engine ids and a named group of them, which is what every
+call on those targets does.  No controller or engines need to be running::
+
+    python registration_profiler.py -n 2000
+
+The engines share a single EngineService, so the time is spent on the
+connections and in the controller rather than in starting interpreters.
+Every engine is a connection with two ends in this process, so it needs
+about 2n file descriptors (see ulimit -n) and, past a few hundred engines,
+a reactor that is not limited by select.
+"""
+import sys
+from optparse import OptionParser
+
+try:
+    # select cannot watch more than about 1024 connections
+    from twisted.internet import pollreactor
+    pollreactor.install()
+except ImportError:
+    pass
+from twisted.internet import reactor
+from twisted.python import log
+
+from IPython.genutils import time
+from ipython1.kernel import controllerservice, engineservice, enginepb
+from ipython1.kernel import multiengine, task
+
+def registerEngines(n, repeat):
+    """Connect n engines to a new controller and time their registration.
+
+    The targets are resolved once all of them are registered, as the
+    engines are disconnected when the reactor stops.
+    """
+    controller = controllerservice.ControllerService()
+    controller.startService()
+    me = multiengine.IMultiEngine(controller)
+    tc = task.ITaskController(controller)
+    factory = enginepb.IPBEngineServerFactory(controller)
+    port = reactor.listenTCP(0, factory, backlog=n, interface='127.0.0.1')
+    addr = ('127.0.0.1', port.getHost().port)
+    service = engineservice.EngineService()
+    service.startService()
+    times = {}
+    def done():
+        times['registered'] = time.time()
+        ids = controller.engines.keys()
+        ids.sort()
+        me.set_group('storm', ids)
+        times['list'] = timeTargets(me, ids, repeat)
+        times['group'] = timeTargets(me, 'storm', repeat)
+        times['engines'] = len(ids)
+        reactor.callLater(0, reactor.stop)
+    controller.on_n_engines_registered_do(n, done)
+    def connect():
+        times['start'] = time.time()
+        for i in range(n):
+            reactor.connectTCP(addr[0], addr[1],
+                enginepb.PBEngineClientFactory(service))
+        times['connected'] = time.time()
+    reactor.callWhenRunning(connect)
+    reactor.run()
+    return times
+
+def timeTargets(me, targets, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        me.engineList(targets)
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(engines=2000)
+    parser.set_defaults(repeat=10)
+    parser.set_defaults(log=False)
+
+    parser.add_option("-n", type='int', dest='engines',
+        help='the number of engines to connect')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times to resolve the targets')
+    parser.add_option("-l", action='store_true', dest='log',
+        help='log to stdout')
+
+    (opts, args) = parser.parse_args()
+    if opts.log:
+        log.startLogging(sys.stdout)
+
+    times = registerEngines(opts.engines, opts.repeat)
+    print "%i engines connected in %.3f s, registered in %.3f s" % \
+        (times['engines'], times['connected']-times['start'],
+        times['registered']-times['start'])
+    print "resolving %i targets: list %.2f ms, group %.2f ms" % \
+        (times['engines'], 1000*times['list'], 1000*times['group'])
+
+
+if __name__ == '__main__':
+    main()
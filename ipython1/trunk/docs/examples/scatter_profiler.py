@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Time how long the scatter/gather maps take to split and join sequences.
+
+This script partitions a list (and a numpy array, if numpy is installed)
+for 1, 2, 4, ... 512 engines with each map style, joins the partitions
+back together and prints the best time of several repeats.  It only
+measures the local work done by scatter and gather, so no controller or
+engines are needed to run it::
+
+    python scatter_profiler.py -n 100000 -r 5
+
+For a fixed length the times should change little with the number of
+engines.  Basic, round robin and weighted partitions of an array are views,
+so splitting an array should take almost no time with those styles.
+"""
+import sys
+from optparse import OptionParser
+
+from IPython.genutils import time
+from ipython1.kernel import map as Map
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def timeMap(mapObject, seq, q, repeat):
+    """Return the best times to partition seq q ways and to join it."""
+    bestSplit = bestJoin = None
+    for i in range(repeat):
+        start = time.time()
+        partitions = mapObject.getPartitions(seq, q)
+        split = time.time()-start
+        start = time.time()
+        mapObject.joinPartitions(partitions)
+        join = time.time()-start
+        if bestSplit is None or split < bestSplit:
+            bestSplit = split
+        if bestJoin is None or join < bestJoin:
+            bestJoin = join
+    return bestSplit, bestJoin
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(length=100000)
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(maxengines=512)
+
+    parser.add_option("-n", type='int', dest='length',
+        help='the length of the scattered sequence')
+    parser.add_option("-r", type='int', dest='repeat',
+        help='the number of times each measurement is repeated')
+    parser.add_option("-e", type='int', dest='maxengines',
+        help='the largest number of engines to test')
+
+    (opts, args) = parser.parse_args()
+
+    seqs = [('list', range(opts.length))]
+    if numpy is not None:
+        seqs.append(('array', numpy.arange(opts.length)))
+    styles = ['basic', 'roundrobin', 'blockcyclic', 'weighted']
+    for name, seq in seqs:
+        print "split/join times (ms) for a %s of length %i, best of %i" % \
+            (name, opts.length, opts.repeat)
+        print "%8s" % 'engines' + ''.join(["%20s" % s for s in styles])
+        q = 1
+        while q <= opts.maxengines:
+            times = []
+            for style in styles:
+                if style == 'weighted':
+                    mapObject = Map.WeightedMap([1+i%4 for i in range(q)])
+                elif style == 'blockcyclic':
+                    mapObject = Map.BlockCyclicMap(16)
+                else:
+                    mapObject = Map.getMap(style)
+                times.append(timeMap(mapObject, seq, q, opts.repeat))
+            print "%8i" % q + ''.join(["%10.2f/%-9.2f" % (1000*s, 1000*j) 
+                for s, j in times])
+            sys.stdout.flush()
+            q *= 2
+        print
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Test how fast the task schedulers dispatch tasks as the queue grows.
+
+This script fills a scheduler with a number of tasks, a fraction of which
+have a dependency that only some workers meet, and then measures how many
+tasks per second the scheduler hands out to a set of workers.  Workers are
+returned to the scheduler as soon as they get a task, like a
+TaskController with very short tasks would.  No controller or engines are
+needed to run it::
+
+    python scheduler_profiler.py -w 200 -d 0.1
+
+The IndexedScheduler should dispatch at a roughly constant rate and the
+PriorityScheduler at a rate that only falls off as log(n), while the rate
+of the FIFOScheduler drops as the queue gets deeper.
+"""
+import random, sys
+from optparse import OptionParser
+
+from IPython.genutils import time
+from ipython1.kernel import task
+from ipython1.kernel.engineservice import StrictDict
+
+class Worker(object):
+
+    def __init__(self, workerid, properties):
+        self.workerid = workerid
+        self.properties = StrictDict(properties)
+
+def hasGPU(properties):
+    return properties.get('gpu', False)
+
+def dispatchRate(SchedulerClass, ntasks, nworkers, fraction, maxTime):
+    """Return the number of tasks per second dispatched by a scheduler."""
+    scheduler = SchedulerClass()
+    for i in range(ntasks):
+        if random.random() < fraction:
+            t = task.Task('pass', depend=hasGPU)
+        else:
+            t = task.Task('pass')
+        t.taskid = i
+        scheduler.add_task(t)
+    for i in range(nworkers):
+        scheduler.add_worker(Worker(i, {'gpu':i%10 == 0}))
+    dispatched = 0
+    start = time.time()
+    while time.time()-start < maxTime:
+        worker, t = scheduler.schedule()
+        if worker is None:
+            break
+        dispatched += 1
+        scheduler.add_worker(worker)
+    return dispatched/(time.time()-start)
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(workers=200)
+    parser.set_defaults(fraction=0.1)
+    parser.set_defaults(maxdepth=50000)
+    parser.set_defaults(time=2.0)
+
+    parser.add_option("-w", type='int', dest='workers',
+        help='the number of workers')
+    parser.add_option("-d", type='float', dest='fraction',
+        help='the fraction of tasks with a dependency')
+    parser.add_option("-n", type='int', dest='maxdepth',
+        help='the largest number of queued tasks to test')
+    parser.add_option("-t", type='float', dest='time',
+        help='the maximum time in seconds to spend on each measurement')
+
+    (opts, args) = parser.parse_args()
+
+    schedulers = [task.FIFOScheduler, task.IndexedScheduler,
+        task.PriorityScheduler]
+    print "tasks/second dispatched to %i workers, %i%% with a dependency" % \
+        (opts.workers, 100*opts.fraction)
+    print "%10s" % 'queued' + ''.join(["%20s" % s.__name__ for s in schedulers])
+    depth = 100
+    while depth <= opts.maxdepth:
+        rates = [dispatchRate(s, depth, opts.workers, opts.fraction, opts.time)
+            for s in schedulers]
+        print "%10i" % depth + ''.join(["%20.0f" % r for r in rates])
+        sys.stdout.flush()
+        depth *= 10
+        if depth > opts.maxdepth and depth/10 < opts.maxdepth:
+            depth = opts.maxdepth
+
+
+if __name__ == '__main__':
+    main()
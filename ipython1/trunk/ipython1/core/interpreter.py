@@ -346,6 +346,10 @@ class Interpreter(object):
                 return None
             else:
                 self.execute_block(code)
+                # An interrupted command should not go on with the next block
+                if self.traceback_trap.args and \
+                   self.traceback_trap.args[0] is KeyboardInterrupt:
+                    return None
 
     def execute_block(self,code):
         """Execute a single block of code in the user namespace.
@@ -20,8 +20,10 @@ defaultKernelConfig = ConfigObj()
 
 enginePort = 10201
 xmlrpcMEPort = 10105
+framedMEPort = 10106
 pbTCPort = 10114
 xmlrpcTCPort = 10113
+framedTCPort = 10115
 httpMEPort = 8000
 httpNBPort = 8008
     
@@ -29,9 +31,16 @@ httpNBPort = 8008
 # Engine Configuration
 #-------------------------------------------------------------------------------
 
+# Compress the objects of push_serialized and pull_serialized that are at
+# least threshold bytes, see ipython1.kernel.newserialized.compress.  The
+# controller compresses what it pushes and the engines what they send back.
+# Plain push and pull are never compressed.
+compressionConfig = {'enabled': False, 'threshold': 1024*1024, 'codec': 'zlib'}
+
 engineConfig = {
     'connectToControllerOn': {'ip': '127.0.0.1', 'port': enginePort},
-    'engineClientProtocolInterface': 'ipython1.kernel.enginepb.PBEngineClientFactory'
+    'engineClientProtocolInterface': 'ipython1.kernel.enginepb.PBEngineClientFactory',
+    'compression': dict(compressionConfig)
 }
 
 #-------------------------------------------------------------------------------
@@ -63,8 +72,15 @@ xmlrpcME = {
     'port': xmlrpcMEPort
 }
             
+framedME = {
+    'interface': 'ipython1.kernel.multiengineframed.IFramedMultiEngineFactory', 
+    'ip': '', 
+    'port': framedMEPort
+}
+            
 networkInterfacesME = {
-    'xmlrpc':xmlrpcME
+    'xmlrpc':xmlrpcME,
+    'framed':framedME
 }
 
 xmlrpcTC = {
@@ -79,8 +95,15 @@ pbTC = {
     'port': pbTCPort
 }
 
+framedTC = {
+    'interface': 'ipython1.kernel.taskframed.IFramedTaskControllerFactory',
+    'ip':'',
+    'port': framedTCPort
+}
+
 networkInterfacesTC = {
-    'xmlrpc':xmlrpcTC
+    'xmlrpc':xmlrpcTC,
+    'framed':framedTC
 }
 
 controllerConfig = {
@@ -98,7 +121,11 @@ controllerConfig = {
             'default': 'xmlrpc'
         }
     },
-    'controllerImportStatement': ''
+    'controllerImportStatement': '',
+    # Ping the engines every period seconds (0 for never) and quarantine or
+    # unregister those that don't answer within timeout seconds.
+    'heartbeat': {'period': 0.0, 'timeout': 10.0, 'action': 'quarantine'},
+    'compression': dict(compressionConfig)
 }    
 
 #-------------------------------------------------------------------------------
@@ -37,9 +37,10 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 import os, sys
+from heapq import heappush, heappop
 
 from twisted.application import service
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
 from twisted.python import log, components
 from zope.interface import Interface, implements, Attribute
 import zope.interface as zi
@@ -47,10 +48,11 @@ import zope.interface as zi
 from ipython1.kernel.engineservice import \
     IEngineCore, \
     IEngineSerialized, \
-    IEngineQueued
+    IEngineQueued, \
+    IEngineHeartbeat
     
 from ipython1.config import cutils
-from ipython1.kernel import codeutil
+from ipython1.kernel import codeutil, error
 
 #-------------------------------------------------------------------------------
 # Interfaces for the Controller
@@ -120,6 +122,27 @@ class IControllerCore(Interface):
         
     def on_n_engines_registered_do(n, f, *arg, **kwargs):
         """Call f(*args, **kwargs) the first time the nth engine registers."""
+    
+    def on_stop_service_do(f, *args, **kwargs):
+        """Call f(*args, **kwargs) when the controller is stopped."""
+    
+    def get_liveness():
+        """Return the heartbeat statistics of the engines.
+        
+        :Returns: A list with a dict for each registered or quarantined
+            engine, sorted by id.  The keys are:
+            
+            * id
+            * state: 'alive', 'late' (a ping is overdue but the timeout 
+              has not passed), 'busy' (a ping is overdue but the engine is
+              running a command, so it isn't timed out) or 'quarantined'
+            * latency, averageLatency, maxLatency: the last, moving average
+              and largest round trip time of a ping in seconds, or None if
+              no ping has been answered yet
+            * pings: the number of pings answered
+            * missed: the number of heartbeats since the last answer
+            * silence: the time in seconds since the engine last answered
+        """
                     
 class IControllerBase(IControllerCore):
     """The basic controller interface."""
@@ -130,6 +153,98 @@ class IControllerBase(IControllerCore):
 # Implementation of the ControllerService
 #-------------------------------------------------------------------------------
 
+class EngineIDs(object):
+    """The engine ids that are free to be given to new engines.
+    
+    The lowest free id is handed out first.  Ids that have never been used
+    are not stored, so the number of engines can be large or unlimited, 
+    and taking or releasing an id costs O(log n) at most.  ``id in ids``
+    tells whether id is free.
+    """
+    
+    def __init__(self, maxID=None):
+        self.maxID = maxID
+        self._next = 0          # no id from here up has been handed out...
+        self._taken = set()     # ...except these, which were asked for
+        self._free = []         # a heap of released ids below _next
+        self._freeSet = set()   # the ids that are really free in _free
+    
+    def __contains__(self, id):
+        if not isinstance(id, int) or id < 0:
+            return False
+        if self.maxID is not None and id > self.maxID:
+            return False
+        if id < self._next:
+            return id in self._freeSet
+        return id not in self._taken
+    
+    def take(self, id=None):
+        """Take id if it is free, or else the lowest free id."""
+        if id is not None and id in self:
+            if id < self._next:
+                # The heap entry is skipped when it comes to the top.
+                self._freeSet.remove(id)
+            else:
+                self._taken.add(id)
+            return id
+        while self._free:
+            id = heappop(self._free)
+            if id in self._freeSet:
+                self._freeSet.remove(id)
+                return id
+        while self._next in self._taken:
+            self._taken.remove(self._next)
+            self._next += 1
+        id = self._next
+        if self.maxID is not None and id > self.maxID:
+            raise IndexError("all %i engine ids are in use" % (self.maxID+1))
+        self._next += 1
+        return id
+    
+    def release(self, id):
+        """Make id free again."""
+        if id >= self._next:
+            self._taken.discard(id)
+        elif id not in self._freeSet:
+            self._freeSet.add(id)
+            heappush(self._free, id)
+
+
+class EngineLiveness(object):
+    """The heartbeat record of an engine."""
+    
+    def __init__(self, now):
+        self.state = 'alive'
+        self.lastSeen = now
+        self.lastBusy = None
+        self.pingSent = None
+        self.latency = None
+        self.averageLatency = None
+        self.maxLatency = None
+        self.pings = 0
+        self.missed = 0
+    
+    def answered(self, now):
+        """Record the answer to the outstanding ping."""
+        latency = now - self.pingSent
+        self.latency = latency
+        if self.averageLatency is None:
+            self.averageLatency = latency
+        else:
+            self.averageLatency = 0.8*self.averageLatency + 0.2*latency
+        if self.maxLatency is None or latency > self.maxLatency:
+            self.maxLatency = latency
+        self.lastSeen = now
+        self.pingSent = None
+        self.pings += 1
+        self.missed = 0
+    
+    def stats(self, id, now):
+        return dict(id=id, state=self.state, latency=self.latency,
+            averageLatency=self.averageLatency, maxLatency=self.maxLatency,
+            pings=self.pings, missed=self.missed, silence=now-self.lastSeen)
+
+
 class ControllerService(object, service.Service):
     """A basic Controller represented as a Twisted Service.
     
@@ -140,13 +255,72 @@ class ControllerService(object, service.Service):
     # I also pick up the IService interface by inheritance from service.Service
     implements(IControllerBase)
     
-    def __init__(self, maxEngines=255, saveIDs=False):
+    def __init__(self, maxEngines=None, saveIDs=False, heartbeatPeriod=None,
+        heartbeatTimeout=10.0, heartbeatAction='quarantine', clock=reactor):
+        """Create a ControllerService.
+        
+        :Parameters:
+            maxEngines : int
+                The largest number of engines, or None for no limit.  The
+                engines get ids 0 to maxEngines-1.
+            saveIDs : bool
+                Don't reuse the ids of engines that unregister.
+            heartbeatPeriod : float
+                Ping the engines every heartbeatPeriod seconds.  None or 0
+                turns the heartbeat off.
+            heartbeatTimeout : float
+                How long an engine can go without answering a ping before 
+                it is considered unresponsive.
+            heartbeatAction : str
+                What to do with an unresponsive engine.  With 'quarantine' 
+                it is taken out of service, but keeps its id and is put 
+                back when it answers again.  With 'unregister' it is 
+                unregistered and disconnected.
+            clock
+                Something with callLater and seconds methods, the reactor
+                by default.
+        """
+        assert heartbeatAction in ('quarantine', 'unregister'), \
+            "heartbeatAction must be 'quarantine' or 'unregister'"
         self.saveIDs = saveIDs
         self.engines = {}
-        self.availableIDs = range(maxEngines,-1,-1)   # [255,...,0]
+        if maxEngines is None:
+            self.availableIDs = EngineIDs()
+        else:
+            self.availableIDs = EngineIDs(maxEngines-1)
+        self._engineInfoFile = None
         self._onRegister = []
         self._onUnregister = []
         self._onNRegistered = []
+        self._onStop = []
+        self.heartbeatPeriod = heartbeatPeriod
+        self.heartbeatTimeout = heartbeatTimeout
+        self.heartbeatAction = heartbeatAction
+        self.clock = clock
+        self.liveness = {}      # {id: EngineLiveness}
+        self.quarantined = {}   # {id: remoteEngine}
+        self._heartbeat = None
+    
+    def startService(self):
+        service.Service.startService(self)
+        if self.heartbeatPeriod:
+            self._heartbeat = task.LoopingCall(self.beat)
+            self._heartbeat.clock = self.clock
+            self._heartbeat.start(self.heartbeatPeriod, now=False)
+    
+    def stopService(self):
+        if self._heartbeat is not None and self._heartbeat.running:
+            self._heartbeat.stop()
+        self._heartbeat = None
+        if self._engineInfoFile is not None:
+            self._engineInfoFile.close()
+            self._engineInfoFile = None
+        for f, args, kwargs in self._onStop:
+            try:
+                f(*args, **kwargs)
+            except:
+                log.err()
+        return service.Service.stopService(self)
     
     #---------------------------------------------------------------------------
     # Methods used to save the engine info to a log file
@@ -197,11 +371,13 @@ class ControllerService(object, service.Service):
         If any of the entries are not known, they are replaced by -99.
         """
         
-        fname = self._getEngineInfoLogFile()
-        f = open(fname, 'a')
+        # The file is kept open, as thousands of engines can register at once.
+        if self._engineInfoFile is None:
+            fname = self._getEngineInfoLogFile()
+            self._engineInfoFile = open(fname, 'a')
         s = self._buildEngineInfoString(id,ip,port,pid)
-        f.write(s + '\n')
-        f.close()
+        self._engineInfoFile.write(s + '\n')
+        self._engineInfoFile.flush()
     
     #---------------------------------------------------------------------------
     # IControllerCore methods
@@ -227,18 +403,11 @@ class ControllerService(object, service.Service):
         assert isinstance(pid, int) or pid is None, \
             "pid to register_engine must be an integer or None"
             
-        desiredID = id
-        if desiredID in self.engines.keys():
-            desiredID = None
-            
-        if desiredID in self.availableIDs:
-            getID = desiredID
-            self.availableIDs.remove(desiredID)
-        else:
-            getID = self.availableIDs.pop()
+        getID = self.availableIDs.take(id)
         remoteEngine.id = getID
         remoteEngine.service = self
         self.engines[getID] = remoteEngine
+        self.liveness[getID] = EngineLiveness(self.clock.seconds())
 
         # Log the Engine Information for monitoring purposes
         self._logEngineInfoToFile(getID, ip, port, pid)
@@ -246,19 +415,11 @@ class ControllerService(object, service.Service):
         msg = "registered engine: %i" %getID
         log.msg(msg)
         
-        for i in range(len(self._onRegister)):
-            (f,args,kwargs,ifid) = self._onRegister[i]
-            try:
-                if ifid:
-                    f(getID, *args, **kwargs)
-                else:
-                    f(*args, **kwargs)
-            except:
-                self._onRegister.pop(i)
+        self._notifyRegister(getID)
         
         # Call functions when the nth engine is registered and them remove them
         for i, (n, f, args, kwargs) in enumerate(self._onNRegistered):
-            if len(self.engines.keys()) == n:
+            if len(self.engines) == n:
                 try:
                     try:
                         f(*args, **kwargs)
@@ -277,27 +438,48 @@ class ControllerService(object, service.Service):
         
         msg = "unregistered engine %i" %id
         log.msg(msg)
+        if id in self.quarantined:
+            # Its unregister callbacks were called when it was quarantined.
+            del self.quarantined[id]
+            self.liveness.pop(id, None)
+            self._releaseID(id)
+            return
         try:
             del self.engines[id]
         except KeyError:
             log.msg("engine %i was not registered" % id)
         else:
-            if not self.saveIDs:
-                self.availableIDs.append(id)
-                # Sort to assign lower ids first
-                self.availableIDs.sort(reverse=True) 
-            else:
-                log.msg("preserving id %i" %id)
-            
-            for i in range(len(self._onUnregister)):
-                (f,args,kwargs,ifid) = self._onUnregister[i]
-                try:
-                    if ifid:
-                        f(id, *args, **kwargs)
-                    else:
-                        f(*args, **kwargs)
-                except:
-                    self._onUnregister.pop(i)
+            self.liveness.pop(id, None)
+            self._releaseID(id)
+            self._notifyUnregister(id)
+    
+    def _releaseID(self, id):
+        if not self.saveIDs:
+            self.availableIDs.release(id)
+        else:
+            log.msg("preserving id %i" %id)
+    
+    def _notifyRegister(self, id):
+        for i in range(len(self._onRegister)):
+            (f,args,kwargs,ifid) = self._onRegister[i]
+            try:
+                if ifid:
+                    f(id, *args, **kwargs)
+                else:
+                    f(*args, **kwargs)
+            except:
+                self._onRegister.pop(i)
+    
+    def _notifyUnregister(self, id):
+        for i in range(len(self._onUnregister)):
+            (f,args,kwargs,ifid) = self._onUnregister[i]
+            try:
+                if ifid:
+                    f(id, *args, **kwargs)
+                else:
+                    f(*args, **kwargs)
+            except:
+                self._onUnregister.pop(i)
     
     def on_register_engine_do(self, f, includeID, *args, **kwargs):
         assert callable(f), "f must be callable"
@@ -322,10 +504,93 @@ class ControllerService(object, service.Service):
                 return
 
     def on_n_engines_registered_do(self, n, f, *args, **kwargs):
-        if len(self.engines.keys()) >= n:
+        if len(self.engines) >= n:
             f(*args, **kwargs)
         else:
             self._onNRegistered.append((n,f,args,kwargs))
+    
+    def on_stop_service_do(self, f, *args, **kwargs):
+        assert callable(f), "f must be callable"
+        self._onStop.append((f,args,kwargs))
+    
+    def get_liveness(self):
+        now = self.clock.seconds()
+        ids = self.liveness.keys()
+        ids.sort()
+        return [self.liveness[id].stats(id, now) for id in ids]
+    
+    #---------------------------------------------------------------------------
+    # The heartbeat
+    #---------------------------------------------------------------------------
+    
+    def beat(self):
+        """Ping the engines and deal with those that don't answer.
+        
+        An engine only has one ping outstanding at a time.  If it hasn't
+        answered for heartbeatTimeout seconds, it is quarantined or 
+        unregistered, see `__init__`.
+        
+        An `EngineService` runs user code in the reactor thread, so it can't
+        answer pings during a long command.  Engines are therefore not timed
+        out while they run a command, only when they are idle or once the
+        command has been interrupted.
+        """
+        now = self.clock.seconds()
+        engines = self.engines.items() + self.quarantined.items()
+        for id, remoteEngine in engines:
+            lv = self.liveness.get(id)
+            if lv is None or not IEngineHeartbeat.providedBy(remoteEngine):
+                continue
+            if lv.pingSent is None:
+                lv.pingSent = now
+                d = remoteEngine.ping()
+                # Any answer, even an error, means the engine is responsive.
+                d.addBoth(self._pingAnswered, id, lv)
+                continue
+            lv.missed += 1
+            if lv.state == 'quarantined':
+                continue
+            if hasattr(remoteEngine, 'command_in_flight') and \
+                remoteEngine.command_in_flight():
+                lv.lastBusy = now
+                lv.state = 'busy'
+                continue
+            if now - max(lv.lastSeen, lv.lastBusy) > self.heartbeatTimeout:
+                self._engineTimedOut(id, now - lv.lastSeen)
+            else:
+                lv.state = 'late'
+    
+    def _pingAnswered(self, _, id, lv):
+        # lv is checked because the id may have been given to a new engine.
+        if self.liveness.get(id) is not lv:
+            return
+        lv.answered(self.clock.seconds())
+        if lv.state == 'quarantined':
+            self._readmitEngine(id)
+        lv.state = 'alive'
+    
+    def _engineTimedOut(self, id, silence):
+        remoteEngine = self.engines[id]
+        msg = "engine %i has not answered for %.1f seconds" % (id, silence)
+        if self.heartbeatAction == 'unregister':
+            log.msg(msg + ", unregistering it")
+            self.unregister_engine(id)
+            remoteEngine.disconnect()
+        else:
+            log.msg(msg + ", quarantining it")
+            del self.engines[id]
+            self.quarantined[id] = remoteEngine
+            self.liveness[id].state = 'quarantined'
+            self._notifyUnregister(id)
+        # This comes after the unregister callbacks so that a TaskController
+        # requeues the engine's tasks instead of seeing them fail.
+        if hasattr(remoteEngine, 'abandon_commands'):
+            remoteEngine.abandon_commands(error.EngineUnresponsive(msg))
+    
+    def _readmitEngine(self, id):
+        log.msg("engine %i is answering again, readmitting it" % id)
+        self.engines[id] = self.quarantined.pop(id)
+        self._notifyRegister(id)
             
 
 #-------------------------------------------------------------------------------
@@ -372,3 +637,9 @@ class ControllerAdapterBase(object):
 
     def on_n_engines_registered_do(self, n, f, *args, **kwargs):
         return self.controller.on_n_engines_registered_do(n, f, *args, **kwargs)
+    
+    def on_stop_service_do(self, f, *args, **kwargs):
+        return self.controller.on_stop_service_do(f, *args, **kwargs)
+    
+    def get_liveness(self):
+        return self.controller.get_liveness()
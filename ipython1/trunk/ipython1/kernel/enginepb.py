@@ -34,6 +34,7 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 import os, time
+from array import array
 import cPickle as pickle
 
 from twisted.python import components, log, failure
@@ -42,14 +43,18 @@ from twisted.spread import pb
 from twisted.internet import defer, reactor, threads
 from twisted.internet.interfaces import IProtocolFactory
 from zope.interface import Interface, implements, Attribute
-from twisted.spread.util import Pager, StringPager, CallbackPageCollector
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from twisted.internet.base import DelayedCall
 DelayedCall.debug = True
 
 from ipython1.kernel import pbconfig
-from ipython1.kernel.pbutil import packageFailure, unpackageFailure, checkMessageSize
-from ipython1.kernel.pbconfig import CHUNK_SIZE
+from ipython1.kernel.pbutil import packageFailure, unpackageFailure, \
+    checkMessageSize, pickleNamespace
 from ipython1.kernel.util import printer
 from ipython1.kernel.twistedutil import gatherBoth
 from ipython1.kernel import newserialized
@@ -59,6 +64,11 @@ from ipython1.kernel.controllerservice import IControllerBase
 from ipython1.kernel.engineservice import \
     IEngineBase, \
     IEngineQueued, \
+    IEngineRelay, \
+    IEngineTasks, \
+    IEngineHeartbeat, \
+    IEngineInterruptible, \
+    IEngineQueries, \
     EngineService, \
     StrictDict
 from ipython1.kernel.pickleutil import \
@@ -73,81 +83,489 @@ from ipython1.kernel.pickleutil import \
 #-------------------------------------------------------------------------------
 # Classes to enable paging of large objects
 #-------------------------------------------------------------------------------
-  
-# NOTE:  The paging versions of push/pull/etc are not being used as there is 
-# a problem with the way that deferreds are created but not handled in the 
-# internals of pb.brokers (BG 1/15/07).
-  
-class SerializedPager(StringPager):
-    
-    def __init__(self, collector, serial, chunkSize=8192, callback=None, *args, **kw):
-        
-        # Save the pickled metadata to self._firstPage and pass the
-        # data to StringPager.__init__
-        assert newserialized.ISerialized.providedBy(serial)
-        self._atFirstPage = True
-        md = serial.getMetadata()
-        md['type'] = serial.getTypeDescriptor()
-        self._firstPage = pickle.dumps(md, 2)
-        data = serial.getData()
-        
-        StringPager.__init__(self, collector, data, chunkSize, callback, *args, **kw)
 
-    def nextPage(self):
-        if self._atFirstPage:
-            self._atFirstPage = False
-            return self._firstPage
-        else:
-            return StringPager.nextPage(self)
+# Serialized objects larger than pbconfig.PAGING_THRESHOLD are not pickled
+# into a single PB message.  Instead their frames are streamed to a
+# SerializedCollector on the other side in chunks of at most 
+# pbconfig.CHUNK_SIZE bytes.  At most pbconfig.PAGING_WINDOW chunks are in 
+# flight at any time: the next chunk is only sent when the other side has 
+# acknowledged an earlier one.  This bounds both the size of individual PB 
+# messages and the amount of data buffered in the transport.
+
+def _frames(serial):
+    """Return the data of a Serialized as a list of frames."""
+    data = serial.getData()
+    if isinstance(data, list):
+        return data
+    return [data]
 
+def serializedSize(serial):
+    """The number of bytes in the frames of a Serialized."""
+    return sum([len(f) for f in _frames(serial)])
 
 
-class DeferredCollector(pb.Referenceable):
+class SerializedPager(object):
+    """Stream a Serialized object to a remote SerializedCollector.
     
-    def __init__(self):
-        self.pages = []
+    The data is sent as a header, a sequence of chunks, and a final 
+    ``endSerialized`` message.  Each chunk is a ``str`` of at most 
+    ``chunkSize`` bytes sliced out of the frames using ``buffer``, so
+    only the chunks themselves are ever copied.
+    """
+    
+    def __init__(self, collector, name, serial, chunkSize=None, window=None):
+        assert newserialized.ISerialized.providedBy(serial)
+        self.collector = collector
+        self.name = name
+        self.serial = serial
+        self.chunkSize = chunkSize or pbconfig.CHUNK_SIZE
+        self.window = window or pbconfig.PAGING_WINDOW
+        self.frames = _frames(serial)
+        self._chunks = self._iterChunks()
+        self._inFlight = 0
+        self._exhausted = False
+        self._failed = False
         self._deferred = defer.Deferred()
-        
-    def remote_gotPage(self, page):
-        self.pages.append(page)
-
-    def remote_endedPaging(self):
-        #self.pagesReceived()
-        # The pagesReceived method triggers the actual object to be returned to the
-        # requester.  This callLater is needed to ensure that other Deferreds are
-        # first closed up.  This is related to the internal problems in PBs paging
-        # machinery  (BG 1/15/07).
-        reactor.callLater(0.1, self.pagesReceived)       
-        
-    def getDeferredToCollected(self):
+    
+    def _iterChunks(self):
+        for i, frame in enumerate(self.frames):
+            for offset in xrange(0, len(frame), self.chunkSize):
+                yield i, offset, str(buffer(frame, offset, self.chunkSize))
+    
+    def start(self):
+        """Start sending and return a Deferred that fires when all is sent."""
+        header = pickle.dumps((self.serial.getTypeDescriptor(),
+            self.serial.getMetadata(), 
+            [len(f) for f in self.frames]), 2)
+        d = self.collector.callRemote('beginSerialized', self.name, header)
+        d.addCallbacks(self._fillWindow, self._fail)
         return self._deferred
         
-    def pagesReceived(self):
-        """Do something with self.pages, and call self._deferred.call[err]back."""
-        raise NotImplementedError("You must implement handlePages")
+    def _fillWindow(self, _=None):
+        while not self._failed and not self._exhausted and \
+            self._inFlight < self.window:
+            try:
+                frameIndex, offset, chunk = self._chunks.next()
+            except StopIteration:
+                self._exhausted = True
+            else:
+                self._inFlight += 1
+                d = self.collector.callRemote('gotChunk', self.name, 
+                    frameIndex, offset, chunk)
+                d.addCallbacks(self._chunkReceived, self._fail)
+        if self._exhausted and self._inFlight == 0 and not self._failed:
+            d = self.collector.callRemote('endSerialized', self.name)
+            d.addCallbacks(self._deferred.callback, self._fail)
+    
+    def _chunkReceived(self, _):
+        self._inFlight -= 1
+        self._fillWindow()
+    
+    def _fail(self, reason):
+        if not self._failed:
+            self._failed = True
+            self._deferred.errback(reason)
 
 
-class SerializedCollector(DeferredCollector):
+def pageSerialized(collector, serials):
+    """Stream a dict of name, Serialized pairs to a collector one by one.
+    
+    Returns a Deferred that fires when the collector has all of them.
+    """
+    d = defer.succeed(None)
+    for name, serial in serials.iteritems():
+        d.addCallback(lambda _, name=name, serial=serial: 
+            SerializedPager(collector, name, serial).start())
+    return d
+
+
+class SerializedCollector(pb.Referenceable):
+    """Reassemble Serialized objects sent by a SerializedPager.
+    
+    The frames are preallocated from the sizes in the header and the
+    chunks are written into them in place, so the data is held in memory
+    only once, and chunks can arrive in any order.  With numpy the frames are
+    exposed as writable buffers which lets `newserialized` build arrays on 
+    top of them without a further copy.  Without numpy they are 
+    ``array('c')`` objects that are turned into a ``str`` at the end.
+    """
     
     def __init__(self):
-        DeferredCollector.__init__(self)
+        self._frames = {}
+        self._headers = {}
+        self.serials = {}
+    
+    def remote_beginSerialized(self, name, header):
+        typeDescriptor, metadata, sizes = pickle.loads(header)
+        self._headers[name] = (typeDescriptor, metadata)
+        self._frames[name] = [_allocateFrame(size) for size in sizes]
+    
+    def remote_gotChunk(self, name, frameIndex, offset, chunk):
+        frame = self._frames[name][frameIndex]
+        if isinstance(frame, array):
+            frame[offset:offset+len(chunk)] = array('c', chunk)
+        else:
+            frame[offset:offset+len(chunk)] = numpy.frombuffer(chunk, 
+                dtype=numpy.uint8)
+    
+    def remote_endSerialized(self, name):
+        typeDescriptor, metadata = self._headers.pop(name)
+        frames = [_finishFrame(f) for f in self._frames.pop(name)]
+        if typeDescriptor != 'container':
+            frames = frames[0]
+        # Nothing else uses the frames, so arrays can be built on top of them
+        self.serials[name] = newserialized.Serialized(frames, typeDescriptor,
+            metadata, owned=True)
+    
+    def getSerialized(self, name):
+        return self.serials.pop(name)
 
-    def pagesReceived(self):
-        metadataString = self.pages[0]
-        dataString = ''.join(self.pages[1:])
-        try:
-            metadata = pickle.loads(metadataString)
-        except:
-            self._deferred.errback(failure.Failure())
+
+def _allocateFrame(size):
+    """Allocate a frame of size bytes that chunks can be written into."""
+    if numpy is not None:
+        return numpy.empty(size, dtype=numpy.uint8)
+    else:
+        return array('c', '\0')*size
+
+def _finishFrame(frame):
+    if isinstance(frame, array):
+        return frame.tostring()
+    else:
+        return numpy.getbuffer(frame)
+
+
+class EngineSerializedCollector(SerializedCollector):
+    """A SerializedCollector that pushes what it collected into an engine."""
+    
+    def __init__(self, service):
+        SerializedCollector.__init__(self)
+        self.service = service
+    
+    def remote_push_serialized(self):
+        namespace, self.serials = self.serials, {}
+        return self.service.push_serialized(namespace).addErrback(packageFailure)
+
+
+class PagedSerialized(object):
+    """Stand in for Serialized objects that were paged to a collector.
+    
+    This is what ``remote_pull_serialized`` returns in place of the objects
+    when they have been sent to the collector passed to it.
+    """
+    
+    def __init__(self, names, isSequence):
+        self.names = names
+        self.isSequence = isSequence
+    
+    def collect(self, collector):
+        serials = [collector.getSerialized(n) for n in self.names]
+        if self.isSequence:
+            return serials
+        return serials[0]
+
+    
+#-------------------------------------------------------------------------------
+# Relaying pushed namespaces between engines
+#-------------------------------------------------------------------------------
+
+def planIDs(plan):
+    """Return the ids of all engines in a relay plan."""
+    ids = []
+    for id, host, port, subplan in plan:
+        ids.append(id)
+        ids.extend(planIDs(subplan))
+    return ids
+
+
+class ChunkReader(object):
+    """A file like object reading a string that is split into chunks.
+    
+    cPickle can load a relayed namespace from this, so the chunks are never 
+    joined into a second copy of the whole package.
+    """
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.index = 0
+        self.offset = 0
+    
+    def read(self, n=-1):
+        pieces = []
+        while self.index < len(self.chunks) and n != 0:
+            chunk = self.chunks[self.index]
+            if n < 0:
+                end = len(chunk)
+            else:
+                end = min(len(chunk), self.offset + n)
+                n -= end - self.offset
+            pieces.append(chunk[self.offset:end])
+            self._advance(chunk, end)
+        return ''.join(pieces)
+    
+    def readline(self):
+        pieces = []
+        while self.index < len(self.chunks):
+            chunk = self.chunks[self.index]
+            end = chunk.find('\n', self.offset) + 1 or len(chunk)
+            pieces.append(chunk[self.offset:end])
+            self._advance(chunk, end)
+            if pieces[-1].endswith('\n'):
+                break
+        return ''.join(pieces)
+    
+    def _advance(self, chunk, end):
+        if end == len(chunk):
+            self.index += 1
+            self.offset = 0
         else:
-            typeDescriptor = metadata.pop('type')
-            serial = newserialized.Serialized(dataString, typeDescriptor, metadata)
-            self._deferred.callback(serial)
+            self.offset = end
 
-class CollectorCollision(Exception):
-    pass
+
+def loadChunks(chunks):
+    """Unpickle a string that is split into a list of chunks."""
+    return pickle.Unpickler(ChunkReader(chunks)).load()
+
+
+class PackageRelayer(object):
+    """Stream a pickled namespace to the EngineRelay of an engine.
+    
+    The package is sent as a ``begin_relay`` message with the relay plan, 
+    a sequence of chunks of at most ``chunkSize`` bytes, and an 
+    ``end_relay`` message that returns the ids of the engines that could 
+    not be reached.  As with SerializedPager at most ``window`` chunks are 
+    in flight.  Engines only acknowledge a chunk once the engines they
+    forward it to have, so this also bounds the data buffered in the tree.
+    """
+    
+    def __init__(self, reference, token, package, plan, chunkSize=None,
+        window=None):
+        self.reference = reference
+        self.token = token
+        self.package = package
+        self.plan = plan
+        self.chunkSize = chunkSize or pbconfig.CHUNK_SIZE
+        self.window = window or pbconfig.PAGING_WINDOW
+        self._chunks = self._iterChunks()
+        self._inFlight = 0
+        self._exhausted = False
+        self._failed = False
+        self._deferred = defer.Deferred()
+    
+    def _iterChunks(self):
+        for offset in xrange(0, len(self.package), self.chunkSize):
+            yield self.package[offset:offset+self.chunkSize]
+    
+    def start(self):
+        """Start sending and return a Deferred to the unreachable ids."""
+        d = self.reference.callRemote('begin_relay', self.token, self.plan)
+        d.addCallbacks(self._fillWindow, self._fail)
+        return self._deferred
+    
+    def _fillWindow(self, _=None):
+        while not self._failed and not self._exhausted and \
+            self._inFlight < self.window:
+            try:
+                chunk = self._chunks.next()
+            except StopIteration:
+                self._exhausted = True
+            else:
+                self._inFlight += 1
+                d = self.reference.callRemote('relay_chunk', self.token, chunk)
+                d.addCallbacks(self._chunkReceived, self._fail)
+        if self._exhausted and self._inFlight == 0 and not self._failed:
+            d = self.reference.callRemote('end_relay', self.token)
+            d.addCallbacks(self._deferred.callback, self._fail)
+    
+    def _chunkReceived(self, _):
+        self._inFlight -= 1
+        self._fillWindow()
+    
+    def _fail(self, reason):
+        if not self._failed:
+            self._failed = True
+            self._deferred.errback(reason)
+
+
+class RelayChild(object):
+    """Forward the chunks of a relayed namespace to one engine in a plan.
+    
+    Calls made before the connection to the engine is up are queued and
+    sent in order once it is.  After a call fails the engine and the ones
+    it forwards to are reported as unreachable, and later calls are dropped.
+    """
     
+    def __init__(self, relay, token, child):
+        self.relay = relay
+        self.token = token
+        self.child = child
+        id, host, port, self.subplan = child
+        self.peer = None
+        self.failed = False
+        self.queued = []
+        d = relay.connect(host, port)
+        d.addCallbacks(self._connected, self._fail)
+    
+    def _connected(self, peer):
+        self.peer = peer
+        self.call('begin_relay', self.subplan)
+        queued, self.queued = self.queued, []
+        for args, d in queued:
+            self.call(*args).chainDeferred(d)
+    
+    def call(self, methodName, *args):
+        """Call methodName on the engine with the token and args."""
+        if self.failed:
+            return defer.succeed(None)
+        if self.peer is None:
+            d = defer.Deferred()
+            self.queued.append(((methodName,) + args, d))
+            return d
+        try:
+            d = self.peer.callRemote(methodName, self.token, *args)
+        except pb.DeadReferenceError:
+            d = defer.fail()
+        return d.addErrback(self._fail)
+    
+    def end(self):
+        """Finish forwarding and return a deferred to the unreachable ids."""
+        d = self.call('end_relay')
+        d.addCallback(lambda failedIDs: 
+            self.failed and planIDs([self.child]) or failedIDs)
+        return d
     
+    def _fail(self, reason):
+        if not self.failed:
+            self.failed = True
+            id, host, port, subplan = self.child
+            log.msg("Relaying to engine %r failed: %s" % 
+                (id, reason.getErrorMessage()))
+            self.relay.forget(host, port)
+        queued, self.queued = self.queued, []
+        for args, d in queued:
+            d.callback(None)
+
+
+class EngineRelay(pb.Root):
+    """Receive pickled namespaces from other engines and forward them on.
+    
+    This is what other engines connect to when a namespace is broadcast
+    along a tree of engines.  The chunks of a namespace are forwarded to 
+    the next engines in the plan as they arrive, so the levels of the tree
+    transfer it at the same time.  Relayed namespaces are only stored here, 
+    under a token chosen by the controller, until the controller asks for 
+    them to be pushed with ``push_relayed``.  They are never unpickled here.
+    
+    Only listens on interface, which should be the one the engine reaches
+    the controller on, and only accepts the tokens the controller said to
+    expect.
+    """
+    
+    def __init__(self, interface=''):
+        self.interface = interface
+        self.expected = set()
+        self.relaying = {}
+        self.inbox = {}
+        self.waiting = {}
+        self.peers = {}
+        self.port = None
+    
+    def listen(self):
+        """Start listening for other engines if needed and return the port."""
+        if self.port is None:
+            self.port = reactor.listenTCP(0, pb.PBServerFactory(self),
+                interface=self.interface)
+        return self.port.getHost().port
+    
+    def close(self):
+        """Stop listening and drop the connections to other engines."""
+        for factory in self.peers.values():
+            factory.disconnect()
+        self.peers = {}
+        if self.port is not None:
+            port, self.port = self.port, None
+            return port.stopListening()
+    
+    def connect(self, host, port):
+        """Return a deferred to the EngineRelay of the engine at host, port."""
+        factory = self.peers.get((host, port))
+        if factory is None:
+            factory = pb.PBClientFactory()
+            reactor.connectTCP(host, port, factory)
+            self.peers[(host, port)] = factory
+        return factory.getRootObject()
+    
+    def forget(self, host, port):
+        """Connect to the engine at host, port again next time."""
+        self.peers.pop((host, port), None)
+    
+    def expect(self, token):
+        """Accept a namespace relayed under token."""
+        self.expected.add(token)
+    
+    def remote_begin_relay(self, token, plan):
+        """Start receiving chunks under token and forwarding them along plan.
+        
+        A namespace that is relayed again under the same token, because an
+        engine on the way failed, replaces any chunks received before.
+        """
+        if token not in self.expected:
+            return defer.fail(ProtocolError("unexpected relay token %r" % token))
+        children = [RelayChild(self, token, child) for child in plan]
+        self.relaying[token] = ([], children)
+    
+    def remote_relay_chunk(self, token, chunk):
+        """Store and forward a chunk, return a deferred for when it is sent."""
+        if not self.relaying.has_key(token):
+            return defer.fail(ProtocolError("no relay begun for token %r" % token))
+        chunks, children = self.relaying[token]
+        chunks.append(chunk)
+        d = gatherBoth([c.call('relay_chunk', chunk) for c in children],
+            consumeErrors=1, logErrors=0)
+        return d.addCallback(lambda _: None)
+    
+    def remote_end_relay(self, token):
+        """Store the chunks and return a deferred to the unreachable ids."""
+        if not self.relaying.has_key(token):
+            return defer.fail(ProtocolError("no relay begun for token %r" % token))
+        chunks, children = self.relaying.pop(token)
+        self.deliver(token, chunks)
+        d = gatherBoth([c.end() for c in children], 
+            consumeErrors=1, logErrors=0)
+        d.addCallback(lambda failedIDs: sum(failedIDs, []))
+        return d
+    
+    def deliver(self, token, chunks):
+        d = self.waiting.pop(token, None)
+        if d is not None:
+            self.expected.discard(token)
+            d.callback(chunks)
+        elif not self.inbox.has_key(token):
+            self.inbox[token] = chunks
+    
+    def receive(self, token):
+        """Return a deferred to the chunks of the package relayed under token."""
+        if self.inbox.has_key(token):
+            self.expected.discard(token)
+            return defer.succeed(self.inbox.pop(token))
+        if token not in self.expected:
+            return defer.fail(ProtocolError("the namespace relayed under "
+                "%r was discarded" % token))
+        d = defer.Deferred()
+        self.waiting[token] = d
+        return d
+    
+    def discard(self, token):
+        """Forget token and fail any push_relayed waiting for it."""
+        self.expected.discard(token)
+        self.relaying.pop(token, None)
+        self.inbox.pop(token, None)
+        d = self.waiting.pop(token, None)
+        if d is not None:
+            d.errback(ProtocolError("the namespace relayed under %r was "
+                "discarded" % token))
+
+
 #-------------------------------------------------------------------------------
 # The client (Engine) side of things
 #-------------------------------------------------------------------------------
@@ -183,6 +601,10 @@ class PBEngineClientFactory(pb.PBClientFactory, object):
         """callback for pb.PBClientFactory.getRootObject"""
         
         self.rootObject = obj
+        # Other engines can relay to us on the interface we reach the
+        # controller on.
+        self.engineReference.relay.interface = \
+            obj.broker.transport.getHost().host
         # Now register myself with the controller
         desiredID = self.service.id
         d = self.rootObject.callRemote('register_engine', self.engineReference, 
@@ -229,7 +651,7 @@ class PBEngineReferenceFromService(pb.Referenceable, object):
         assert IEngineBase.providedBy(service), \
             "IEngineBase is not provided by" + repr(service)
         self.service = service
-        self.collectors = {}
+        self.relay = EngineRelay()
     
     def remote_getID(self):
         return self.service.id
@@ -273,42 +695,114 @@ class PBEngineReferenceFromService(pb.Referenceable, object):
             return self.service.push(namespace).addErrback(packageFailure)
     
     #---------------------------------------------------------------------------
-    # Paging version of push
+    # Paging version of push_serialized
     #---------------------------------------------------------------------------
     
-    # NOTE:  These are not being used right now due to problems with PBs 
-    # paging handling  (BG 1/15/07).
+    def remote_get_collector(self):
+        """Return a collector that large Serialized objects can be paged to.
+        
+        Once all objects have been sent, calling ``push_serialized`` on the
+        collector pushes them into the users namespace.
+        """
+        return EngineSerializedCollector(self.service)
+    
+    #---------------------------------------------------------------------------
+    # Relayed version of push
+    #---------------------------------------------------------------------------
     
-    def remote_getCollectorForKey(self, key):
-        #log.msg("Creating a collector for key" + key)
-        if self.collectors.has_key(key):
-            return packageFailure(defer.fail(failure.Failure( \
-                CollectorCollision("Collector for key %s already exists" % key))))
-        coll = SerializedCollector()
-        self.collectors[key] = coll
-        return coll
+    def remote_get_relay_port(self):
+        """Return the port other engines can relay namespaces to."""
+        return self.relay.listen()
     
-    def removeCollector(self, key):
-        if self.collectors.has_key(key):
-            self.collectors.pop(key)
+    def remote_expect_relayed(self, token):
+        self.relay.expect(token)
     
-    def remote_finishPushPaging(self, key):
-        #log.msg("finishPushPaging for key: " + key)
-        coll = self.collectors.get(key, None)
-        if coll is None:
-            return 'no collector for key'
+    def remote_begin_relay(self, token, plan):
+        return self.relay.remote_begin_relay(token, plan)
+    
+    def remote_relay_chunk(self, token, chunk):
+        return self.relay.remote_relay_chunk(token, chunk)
+    
+    def remote_end_relay(self, token):
+        return self.relay.remote_end_relay(token)
+    
+    def remote_push_relayed(self, token):
+        """Push the pickled namespace relayed under token when it arrives."""
+        d = self.relay.receive(token)
+        d.addCallbacks(self._pushChunks, packageFailure)
+        return d
+    
+    def _pushChunks(self, chunks):
+        try:
+            namespace = loadChunks(chunks)
+        except:
+            return defer.fail(failure.Failure()).addErrback(packageFailure)
         else:
-            d = coll.getDeferredToCollected()
-            d.addCallback(self.handlePagedPush, key)
-            return d
+            return self.service.push(namespace).addErrback(packageFailure)
+    
+    def remote_discard_relayed(self, token):
+        self.relay.discard(token)
+    
+    #---------------------------------------------------------------------------
+    # Heartbeat
+    #---------------------------------------------------------------------------
+    
+    def remote_ping(self):
+        """Answer the controller's heartbeat."""
+        return None
+
+    #---------------------------------------------------------------------------
+    # Interrupt
+    #---------------------------------------------------------------------------
+    
+    def remote_interrupt(self):
+        """Interrupt the running command, if the engine can.
+        
+        Returns a deferred to True if a command was interrupted.
+        """
+        if not IEngineInterruptible.providedBy(self.service):
+            return False
+        return self.service.interrupt().addErrback(packageFailure)
+    
+    #---------------------------------------------------------------------------
+    # run_tasks
+    #---------------------------------------------------------------------------
     
-    def handlePagedPush(self, serial, key):
-        log.msg("I got a serial! " + repr(serial) + key)
-        d = self.service.push_serialized({key:serial})           
+    def remote_run_tasks(self, pTasks):
+        """Run a pickled list of task dicts.
+        
+        Returns a deferred to a list of pickled results, one for each task.
+        A task whose result can't be pickled or is too big gets a pickled
+        Failure, without affecting the other tasks.
+        """
+        try:
+            tasks = pickle.loads(pTasks)
+        except:
+            return defer.fail(failure.Failure()).addErrback(packageFailure)
+        d = self.service.run_tasks(tasks)
+        d.addCallback(self._packageResults)
+        d.addErrback(packageFailure)
+        d.addCallback(self._checkProperties)
         d.addErrback(packageFailure)
-        self.removeCollector(key)
         return d
     
+    def _packageResults(self, results):
+        packages = []
+        for r in results:
+            if isinstance(r, failure.Failure):
+                packages.append(packageFailure(r))
+                continue
+            try:
+                package = pickle.dumps(r, 2)
+            except:
+                package = failure.Failure()
+            else:
+                package = checkMessageSize(package, 'task result')
+            if isinstance(package, failure.Failure):
+                package = packageFailure(package)
+            packages.append(package)
+        return packages
+    
     #---------------------------------------------------------------------------
     # pull
     #---------------------------------------------------------------------------     
@@ -325,17 +819,6 @@ class PBEngineReferenceFromService(pb.Referenceable, object):
         d.addErrback(packageFailure)
         return d
     
-    # NOTE:  The paging version of pull is not being used right now  (BG 1/15/07).
-    
-    def remote_pullPaging(self, key, collector):
-        d = self.service.pull(key)
-        d.addCallback(newserialized.serialize)
-        d.addCallbacks(self._startPaging, packageFailure, callbackArgs=(collector,))
-        return d
-    
-    def _startPaging(self, serial, collector):
-        pager = SerializedPager(collector, serial, chunkSize=CHUNK_SIZE)
-
     #---------------------------------------------------------------------------
     # push/pullFuction
     #---------------------------------------------------------------------------
@@ -407,17 +890,35 @@ class PBEngineReferenceFromService(pb.Referenceable, object):
             d = self.service.push_serialized(namespace)
             return d.addErrback(packageFailure)
     
-    def remote_pull_serialized(self, keys):
+    def remote_pull_serialized(self, keys, collector=None):
         """Pull objects from users namespace by key as Serialized.
         
-        Returns a deferred to a pickled dict of key, Serialized pairs.
+        Returns a deferred to a pickled Serialized or list of Serialized.
+        
+        If a collector is given and the objects are larger than 
+        pbconfig.PAGING_THRESHOLD, they are paged to the collector and a
+        pickled PagedSerialized is returned instead.
         """
         d = self.service.pull_serialized(keys)
-        d.addCallback(pickle.dumps, 2)
+        d.addCallback(self._packageSerialized, collector)
         d.addCallback(checkMessageSize, repr(keys))
         d.addErrback(packageFailure)
         return d
     
+    def _packageSerialized(self, result, collector):
+        isSequence = isinstance(result, (list, tuple))
+        if isSequence:
+            serials = list(result)
+        else:
+            serials = [result]
+        size = sum([serializedSize(s) for s in serials])
+        if collector is None or size <= pbconfig.PAGING_THRESHOLD:
+            return pickle.dumps(result, 2)
+        names = range(len(serials))
+        d = pageSerialized(collector, dict(zip(names, serials)))
+        d.addCallback(lambda _: pickle.dumps(PagedSerialized(names, isSequence), 2))
+        return d
+    
     #---------------------------------------------------------------------------
     # Properties interface
     #---------------------------------------------------------------------------
@@ -483,12 +984,14 @@ class EngineFromReference(object):
     and the controller needs to adapt it to IEngineBase.
     """
     
-    implements(IEngineBase)
+    implements(IEngineBase, IEngineRelay, IEngineTasks, IEngineHeartbeat,
+        IEngineInterruptible, IEngineQueries)
     
     def __init__(self, reference):
         self.reference = reference
         self._id = None
         self._properties = StrictDict()
+        self._relayAddress = None
         self.currentCommand = None
     
     def callRemote(self, *args, **kwargs):
@@ -558,7 +1061,7 @@ class EngineFromReference(object):
     
     def pushOld(self, namespace):
         try:
-            package = pickle.dumps(namespace, 2)
+            package = pickleNamespace(namespace)
         except:
             return defer.fail(failure.Failure())
         else:
@@ -569,39 +1072,84 @@ class EngineFromReference(object):
                 d = self.callRemote('push', package)
                 return d.addCallback(self.checkReturnForFailure)
     
-    # Paging version
+    push = pushOld
+    
+    #---------------------------------------------------------------------------
+    # IEngineRelay methods
+    #---------------------------------------------------------------------------
     
-    def pushNew(self, **namespace):
-        dList = []
-        for k, v in namespace.iteritems():
-            d = self.pushPaging(k, v)
-            dList.append(d)
-        return gatherBoth(dList, 
-                          fireOnOneErrback=1,
-                          logErrors=0, 
-                          consumeErrors=1)
+    def get_relay_address(self):
+        if self._relayAddress is not None:
+            return defer.succeed(self._relayAddress)
+        # Other engines reach this one at the address the controller sees.
+        host = self.reference.broker.transport.getPeer().host
+        d = self.callRemote('get_relay_port')
+        def saveAddress(port):
+            self._relayAddress = (host, port)
+            return self._relayAddress
+        return d.addCallback(saveAddress)
+    
+    def expect_relayed(self, token):
+        return self.callRemote('expect_relayed', token)
+    
+    def relay(self, token, package, plan):
+        return PackageRelayer(self, token, package, plan).start()
+    
+    def push_relayed(self, token):
+        d = self.callRemote('push_relayed', token)
+        return d.addCallback(self.checkReturnForFailure)
+    
+    def discard_relayed(self, token):
+        return self.callRemote('discard_relayed', token)
+    
+    #---------------------------------------------------------------------------
+    # IEngineHeartbeat methods
+    #---------------------------------------------------------------------------
+    
+    def ping(self):
+        return self.callRemote('ping')
+    
+    #---------------------------------------------------------------------------
+    # IEngineInterruptible methods
+    #---------------------------------------------------------------------------
+    
+    def interrupt(self):
+        d = self.callRemote('interrupt')
+        return d.addCallback(self.checkReturnForFailure)
+    
+    def disconnect(self):
+        # Nobody needs to hear about a disconnection the controller asked for.
+        notifier = getattr(self, 'notifier', None)
+        if notifier is not None:
+            self.stopNotifying(notifier)
+        self.reference.broker.transport.loseConnection()
+        return defer.succeed(None)
+    
+    #---------------------------------------------------------------------------
+    # IEngineTasks methods
+    #---------------------------------------------------------------------------
     
-    def pushPaging(self, key, obj):
+    def run_tasks(self, tasks):
         try:
-            serial = newserialized.serialize(obj)
+            package = pickle.dumps(tasks, 2)
         except:
             return defer.fail(failure.Failure())
-        else:
-            return self.pushPagingSerialized(key, serial)
-    
-    def pushPagingSerialized(self, key, serial):
-        d = self.callRemote('getCollectorForKey', key)
+        package = checkMessageSize(package, 'tasks')
+        if isinstance(package, failure.Failure):
+            return defer.fail(package)
+        d = self.callRemote('run_tasks', package)
+        d.addCallback(self.syncProperties)
         d.addCallback(self.checkReturnForFailure)
-        d.addCallback(self._beginPaging, serial, key) 
-        return d
+        return d.addCallback(self._unpackageResults)
     
-    def _beginPaging(self, collector, serial, key):
-        #log.msg("Beginning to page" + repr(collector))
-        pager = SerializedPager(collector, serial, chunkSize=CHUNK_SIZE)
-        d = self.callRemote('finishPushPaging', key)
-        return d
-    
-    push = pushOld
+    def _unpackageResults(self, packages):
+        results = []
+        for package in packages:
+            r = unpackageFailure(package)
+            if not isinstance(r, failure.Failure):
+                r = pickle.loads(r)
+            results.append(r)
+        return results
     
     #---------------------------------------------------------------------------
     # pull
@@ -613,29 +1161,6 @@ class EngineFromReference(object):
         d.addCallback(pickle.loads)
         return d
     
-    # Paging version
-        
-    def pullPaging(self, key):
-        collector = SerializedCollector()
-        # This will fire if the object cannot be serialized on the other side
-        d = self.callRemote('pullPaging', key, collector)
-        d.addCallback(lambda _: collector.getDeferredToCollected())
-        d.addCallback(newserialized.unserialize)
-        return d
-    
-    def pullNew(self, *keys):
-        if len(keys) == 1:
-            return self.pullPaging(keys[0])
-        else:
-            pulledDeferreds = []
-            for k in keys:
-                pulledDeferreds.append(self.pullPaging(k))
-            d = gatherBoth(pulledDeferreds,
-                           fireOnOneErrback=1,
-                           logErrors=0, 
-                           consumeErrors=1)
-            return d
-    
     pull = pullOld
 
     #---------------------------------------------------------------------------
@@ -644,7 +1169,7 @@ class EngineFromReference(object):
     
     def push_function(self, namespace):
         try:
-            package = pickle.dumps(canDict(namespace), 2)
+            package = pickleNamespace(namespace, canDict)
         except:
             return defer.fail(failure.Failure())
         else:
@@ -742,11 +1267,17 @@ class EngineFromReference(object):
     # push/pull_serialized
     #---------------------------------------------------------------------------
         
-    def push_serializedOld(self, namespace):
-        """Older version of pushSerialize."""
-        #log.msg(repr(namespace))
+    def push_serialized(self, namespace):
+        """Push a dict of keys and Serialized objects.
+        
+        If the objects are larger than pbconfig.PAGING_THRESHOLD in total, 
+        they are paged to the engine instead of being sent in a single message.
+        """
+        size = sum([serializedSize(s) for s in namespace.values()])
+        if size > pbconfig.PAGING_THRESHOLD:
+            return self.push_serializedPaging(namespace)
         try:
-            package = pickle.dumps(namespace, 2)
+            package = pickleNamespace(namespace)
         except:
             return defer.fail(failure.Failure())
         else:
@@ -757,26 +1288,30 @@ class EngineFromReference(object):
                 d = self.callRemote('push_serialized', package)
                 return d.addCallback(self.checkReturnForFailure)
     
-    # The new paging version
+    def push_serializedPaging(self, namespace):
+        """Page a dict of keys and Serialized objects to the engine."""
+        d = self.callRemote('get_collector')
+        d.addCallback(self._pageToCollector, namespace)
+        return d.addCallback(self.checkReturnForFailure)
     
-    def push_serializedNew(self, **namespace):      
-        dList = []
-        for k, v in namespace.iteritems():
-            d = self.pushPagingSerialized(k, v)
-            dList.append(d)
-        return gatherBoth(dList,
-                          fireOnOneErrback=1,
-                          logErrors=0, 
-                          consumeErrors=1)
+    def _pageToCollector(self, collector, namespace):
+        d = pageSerialized(collector, namespace)
+        d.addCallback(lambda _: collector.callRemote('push_serialized'))
+        return d
     
     def pull_serialized(self, keys):
-        d = self.callRemote('pull_serialized', keys)
+        collector = SerializedCollector()
+        d = self.callRemote('pull_serialized', keys, collector)
         d.addCallback(self.checkReturnForFailure)
         d.addCallback(pickle.loads)
+        d.addCallback(self._collectPaged, collector)
         return d
     
-    push_serialized = push_serializedOld
- 
+    def _collectPaged(self, result, collector):
+        if isinstance(result, PagedSerialized):
+            return result.collect(collector)
+        return result
+    
     #---------------------------------------------------------------------------
     # Misc
     #---------------------------------------------------------------------------
@@ -0,0 +1,551 @@
+# encoding: utf-8
+# -*- test-case-name: ipython1.kernel.tests.test_engineprocess -*-
+"""An engine that runs the user's code in a worker process.
+
+An `EngineService` runs the user's code in the reactor's thread, so while a
+long command runs the engine can't answer anything, not even the heartbeat,
+and the only way to stop the command is to kill the engine.
+
+A `ProcessEngineService` keeps the user's namespace in a worker process
+instead.  The engine starts the worker with spawnProcess and sends it one
+request for each call on the shell, using the frames of `framedrpc` over
+the worker's stdin and stdout.  The reactor stays free while the worker
+computes, so pings and queue_status are answered at once.  The worker
+reads its requests in a thread of its own, which answers keys, 
+get_properties and has_properties while the user's code runs, so they
+don't wait for the command either (see `IEngineQueries`).
+`ProcessEngineService.interrupt` asks that thread to send SIGINT to the
+worker, which raises KeyboardInterrupt in the running code, and answers
+whether it did.  The namespace survives an
+interrupt, but not the death of the worker: the next call then starts a
+fresh one.  The properties live in the worker, where the user's code can
+change them, and the engine keeps a copy for the controller.
+
+The worker has no MPI, so ``mpi`` is None in its namespace.  To use these
+engines, start ipengine with --process.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import os, Queue, signal, struct, sys, threading
+
+from twisted.internet import defer, protocol, reactor
+from twisted.python import failure, log
+import zope.interface as zi
+
+from ipython1.core.interpreter import Interpreter
+from ipython1.kernel import error
+from ipython1.kernel.engineservice import EngineService, IEngineBase, \
+    IEngineTasks, IEngineHeartbeat, IEngineInterruptible, IEngineQueries, \
+    get_engine, hiddenKeys
+from ipython1.kernel.framedrpc import FramedMessageReceiver, packMessage, \
+    unpackMessage
+from ipython1.kernel.pickleutil import can, canDict, canSequence, uncan, \
+    uncanDict, uncanSequence
+
+#-------------------------------------------------------------------------------
+# The worker process
+#-------------------------------------------------------------------------------
+
+_prefix = struct.Struct('!I')
+
+def readMessage(f):
+    """Read the frames of a message from f, or return None at its end."""
+    head = f.read(4)
+    if len(head) < 4:
+        return None
+    frames = []
+    for i in range(_prefix.unpack(head)[0]):
+        length = _prefix.unpack(f.read(4))[0]
+        frames.append(f.read(length))
+    return frames
+
+def writeMessage(f, frames):
+    """Write a message made of a list of str or buffer frames to f."""
+    seq = [_prefix.pack(len(frames))]
+    for frame in frames:
+        seq.append(_prefix.pack(len(frame)))
+        seq.append(str(frame))
+    f.write(''.join(seq))
+    f.flush()
+
+
+class Worker(object):
+    """Answer the requests of a `ProcessEngineService` in the worker.
+
+    Every request is the name of one of the methods below and its
+    arguments.  The answer is ``('result', value, properties)`` or
+    ``('failure', ev, properties)``, where ev is the exception with its
+    formatted traceback.  The properties of the engine live here, where the
+    user's code can change them, and properties is a copy of them if they
+    changed during the request and None otherwise.
+
+    The requests are run one at a time by the main thread, except that the
+    `queries` are answered by the thread reading the requests while the
+    main thread runs the user's code, and ``interrupt`` always is.  Only
+    the `userCode` requests can be interrupted.
+    """
+
+    # Requests that only read the namespace or the properties
+    queries = ('keys', 'get_properties', 'has_properties')
+    # Requests that run the user's code, which interrupt can stop
+    userCode = ('execute', 'push', 'pull', 'push_function', 'pull_function')
+
+    def __init__(self):
+        self.shellClass = None
+        self.shell = None
+        self.id = None
+        self.properties = get_engine(None).properties
+        self.running = False
+        # Set while an interrupt waits to learn if it hit the user's code
+        self.interruptDone = None
+        self.interruptHit = False
+
+    def answer(self, methodName, frames, query=False):
+        try:
+            args = unpackMessage(frames)
+            if query or methodName not in self.userCode:
+                answer = ('result', getattr(self, methodName)(*args))
+            else:
+                self.running = True
+                try:
+                    answer = ('result', getattr(self, methodName)(*args))
+                finally:
+                    self.running = False
+                    self._interruptMissed()
+        except:
+            et, ev, tb = sys.exc_info()
+            if self.shell is not None:
+                et, ev, tb = self.shell.formatTraceback(et, ev, tb)
+            answer = ('failure', ev)
+        if not query and self.properties.modified:
+            self.properties.modified = False
+            answer += (dict(self.properties),)
+        else:
+            answer += (None,)
+        return self._pack(answer)
+
+    def answersAtOnce(self, methodName):
+        """Should the reading thread answer this request itself?"""
+        return methodName == 'interrupt' or (methodName in self.queries 
+            and self.running and self.shell is not None)
+
+    def _pack(self, answer):
+        try:
+            return packMessage(answer)
+        except:
+            # Send the pickling error if the result can't be pickled, and
+            # the exception with the repr of its args if it can't.
+            kind, value, properties = answer
+            ev = sys.exc_info()[1]
+            if kind == 'failure':
+                try:
+                    ev = value.__class__(*[repr(a) for a in value.args])
+                    ev.__dict__.update(value.__dict__)
+                    packMessage(ev)
+                except:
+                    ev = error.UnpickleableException(repr(value))
+            return packMessage(('failure', ev, properties))
+
+    def interrupt(self):
+        """Interrupt the user's code, return True if it was running.
+
+        This runs in the reading thread.  It sends SIGINT to the main thread
+        and waits until `interrupted` or the end of the request tells it 
+        whether the signal hit the request.
+        """
+        done = threading.Event()
+        self.interruptHit = False
+        # This is set before running is checked, so a request that ends 
+        # after the check always finds it and sets it.
+        self.interruptDone = done
+        if not self.running:
+            self.interruptDone = None
+            return False
+        os.kill(os.getpid(), signal.SIGINT)
+        done.wait()
+        return self.interruptHit
+
+    def interrupted(self, signum, frame):
+        """Raise KeyboardInterrupt, but only in the code of a request.
+
+        A signal that arrives between requests must not break the framing
+        of the messages to and from the engine.
+        """
+        done, self.interruptDone = self.interruptDone, None
+        if self.running and done is not None:
+            self.interruptHit = True
+            done.set()
+            raise KeyboardInterrupt
+        if done is not None:
+            done.set()
+
+    def _interruptMissed(self):
+        # The request ended before the signal got to it
+        done, self.interruptDone = self.interruptDone, None
+        if done is not None:
+            done.set()
+
+    # The requests
+
+    def start(self, shellClass, id):
+        self.shellClass = shellClass
+        self.setID(id)
+        self.reset()
+
+    def setID(self, id):
+        self.id = id
+        self.properties = get_engine(id).properties
+        if self.shell is not None:
+            self.shell.push({'id': id})
+
+    def reset(self):
+        self.shell = self.shellClass()
+        self.properties.clear()
+        self.shell.push({'mpi': None, 'id': self.id})
+
+    def execute(self, lines):
+        return self.shell.execute(lines)
+
+    def push(self, namespace):
+        self.shell.push(namespace)
+
+    def pull(self, keys):
+        return self.shell.pull(keys)
+
+    def push_function(self, namespace):
+        self.shell.push_function(uncanDict(namespace))
+
+    def pull_function(self, keys):
+        result = self.shell.pull_function(keys)
+        if isinstance(keys, str) or len(keys)==1:
+            return can(result)
+        return canSequence(result)
+
+    def getCommand(self, i):
+        return self.shell.getCommand(i)
+
+    def keys(self):
+        # keys() copies the names at once, the main thread may be adding some
+        return [k for k in self.shell.user_ns.keys() if k not in hiddenKeys]
+
+    def set_properties(self, properties):
+        self.properties.update(properties)
+
+    def get_properties(self, keys):
+        if keys is None:
+            keys = self.properties.keys()
+        return self.properties.subDict(*keys)
+
+    def del_properties(self, keys):
+        for key in keys:
+            del self.properties[key]
+
+    def has_properties(self, keys):
+        return [self.properties.has_key(key) for key in keys]
+
+    def clear_properties(self):
+        self.properties.clear()
+
+
+def serve():
+    """Answer the requests on stdin until it is closed.
+
+    This is the main loop of the worker process.  The requests come in on
+    stdin and the answers go out on stdout, so the user's code gets
+    /dev/null as its stdin and the worker's stderr as its stdout.  Each
+    request and answer starts with a frame holding the id of the request,
+    as queries can be answered before the request the main thread runs.
+    """
+    requests = os.fdopen(os.dup(0), 'rb')
+    answers = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    worker = Worker()
+    signal.signal(signal.SIGINT, worker.interrupted)
+    # Don't let the signal break a read or write of the messages.
+    signal.siginterrupt(signal.SIGINT, False)
+    writing = threading.Lock()
+    def send(requestID, frames):
+        writing.acquire()
+        try:
+            writeMessage(answers, [requestID] + frames)
+        finally:
+            writing.release()
+    pending = Queue.Queue()
+    def read():
+        while True:
+            frames = readMessage(requests)
+            if frames is None:
+                pending.put(None)
+                break
+            requestID, methodName = frames[0].split(' ', 1)
+            if worker.answersAtOnce(methodName):
+                send(requestID, worker.answer(methodName, frames[1:], True))
+            else:
+                pending.put((requestID, methodName, frames[1:]))
+    reader = threading.Thread(target=read)
+    reader.setDaemon(True)
+    reader.start()
+    while True:
+        request = pending.get()
+        if request is None:
+            break
+        requestID, methodName, frames = request
+        send(requestID, worker.answer(methodName, frames))
+
+#-------------------------------------------------------------------------------
+# The engine
+#-------------------------------------------------------------------------------
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """Pass the messages from the worker to its `ProcessEngineService`."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.messages = FramedMessageReceiver()
+        self.messages.messageReceived = self.messageReceived
+        self.ended = defer.Deferred()
+
+    def connectionMade(self):
+        self.messages.makeConnection(self.transport)
+
+    def outReceived(self, data):
+        self.messages.dataReceived(data)
+
+    def errReceived(self, data):
+        log.msg("Worker %r: %s" % (self.transport.pid, data.rstrip()))
+
+    def messageReceived(self, frames):
+        self.engine._answerReceived(self, frames)
+
+    def processEnded(self, reason):
+        self.engine._workerEnded(self, reason)
+        self.ended.callback(None)
+
+
+class WorkerShell(object):
+    """Stand in for the shell of a `ProcessEngineService`.
+
+    It has the methods of the Interpreter that `EngineService` calls, but
+    they run in the worker and return deferreds.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def execute(self, lines):
+        return self.engine._request('execute', lines)
+
+    def push(self, namespace):
+        return self.engine._request('push', namespace)
+
+    def pull(self, keys):
+        return self.engine._request('pull', keys)
+
+    def push_function(self, namespace):
+        return self.engine._request('push_function', canDict(dict(namespace)))
+
+    def pull_function(self, keys):
+        d = self.engine._request('pull_function', keys)
+        # As in enginepb, the functions get the globals of this module.
+        if isinstance(keys, str) or len(keys)==1:
+            return d.addCallback(uncan, globals())
+        return d.addCallback(uncanSequence, globals())
+
+    def getCommand(self, i=None):
+        return self.engine._request('getCommand', i)
+
+    def reset(self):
+        return self.engine._request('reset')
+
+    def keys(self):
+        return self.engine._request('keys')
+
+    def set_properties(self, properties):
+        return self.engine._request('set_properties', properties)
+
+    def get_properties(self, keys):
+        return self.engine._request('get_properties', keys)
+
+    def del_properties(self, keys):
+        return self.engine._request('del_properties', keys)
+
+    def has_properties(self, keys):
+        return self.engine._request('has_properties', keys)
+
+    def clear_properties(self):
+        return self.engine._request('clear_properties')
+
+
+class ProcessEngineService(EngineService):
+    """An EngineService that runs the user's code in a worker process.
+
+    See the module docstring.  The worker is started by startService and
+    stopped by stopService.
+    """
+
+    zi.implements(IEngineBase, IEngineTasks, IEngineHeartbeat,
+        IEngineInterruptible, IEngineQueries)
+
+    def __init__(self, shellClass=Interpreter, mpi=None):
+        self.shellClass = shellClass
+        self.shell = WorkerShell(self)
+        self.mpi = mpi
+        self.worker = None
+        self.requests = {}      # {request id: deferred to its answer}
+        self.lastRequestID = 0
+        self.id = None
+        if self.mpi is not None:
+            log.msg("MPI started with rank = %i and size = %i" %
+                (self.mpi.rank, self.mpi.size))
+            self.id = self.mpi.rank
+
+    def _setID(self, id):
+        self._id = id
+        self.properties = get_engine(id).properties
+        if self.worker is not None:
+            self._request('setID', id).addErrback(log.err)
+
+    id = property(EngineService._getID, _setID)
+
+    def executeAndRaise(self, msg, callable, *args, **kwargs):
+        """Call a method of self.shell, which may return a deferred."""
+        d = defer.maybeDeferred(callable, *args, **kwargs)
+        def addInfo(f):
+            ev = f.value
+            if not hasattr(ev, '_ipython_traceback_text'):
+                ev._ipython_traceback_text = f.getTraceback()
+            ev._ipython_engine_info = msg
+            return f
+        return d.addErrback(addInfo)
+
+    # The worker
+
+    def _startWorker(self):
+        args = [sys.executable, '-c',
+            'from ipython1.kernel.engineprocess import serve; serve()']
+        # The worker must be able to import what this process imported.
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p])
+        self.worker = WorkerProtocol(self)
+        reactor.spawnProcess(self.worker, sys.executable, args, env)
+        log.msg("Started worker %r" % self.worker.transport.pid)
+        return self._request('start', self.shellClass, self.id)
+
+    def _request(self, methodName, *args):
+        """Send a request to the worker, return a deferred to its answer."""
+        if self.worker is None:
+            self._startWorker().addErrback(log.err)
+        try:
+            frames = packMessage(args)
+        except:
+            return defer.fail()
+        self.lastRequestID += 1
+        d = self.requests[str(self.lastRequestID)] = defer.Deferred()
+        self.worker.messages.sendMessage(
+            ['%i %s' % (self.lastRequestID, methodName)] + frames)
+        return d
+
+    def _answerReceived(self, worker, frames):
+        d = self.requests.pop(frames[0])
+        try:
+            kind, value, properties = unpackMessage(frames[1:])
+        except:
+            d.errback()
+            return
+        if properties is not None:
+            # Mirror the worker's properties, which sets their modified flag
+            self.properties.clear()
+            self.properties.update(properties)
+        if kind == 'result':
+            d.callback(value)
+        else:
+            d.errback(failure.Failure(value, value.__class__, None))
+
+    def _workerEnded(self, worker, reason):
+        if worker is not self.worker:
+            return
+        log.msg("Worker %r ended: %s" % (worker.transport.pid,
+            reason.getErrorMessage()))
+        self.worker = None
+        requests, self.requests = self.requests, {}
+        for d in requests.values():
+            d.errback(failure.Failure(error.EngineWorkerDied(
+                "the worker process running the command died, its namespace "
+                "is lost")))
+
+    # Service methods
+
+    def startService(self):
+        """Start the worker with a seeded namespace."""
+        self._startWorker().addErrback(log.err)
+
+    def stopService(self):
+        """Stop the worker, return a deferred that fires once it has ended."""
+        EngineService.stopService(self)
+        worker, self.worker = self.worker, None
+        if worker is None:
+            return defer.succeed(None)
+        worker.transport.closeStdin()
+        return worker.ended
+
+    # The methods that can't use EngineService's.  See IEngineBase.
+
+    def reset(self):
+        msg = {'engineid':self.id,
+               'method':'reset',
+               'args':[]}
+        return self.executeAndRaise(msg, self.shell.reset)
+
+    def keys(self):
+        return self.shell.keys()
+
+    def set_properties(self, properties):
+        msg = {'engineid':self.id,
+               'method':'set_properties',
+               'args':[repr(properties.keys())]}
+        return self.executeAndRaise(msg, self.shell.set_properties, properties)
+
+    def get_properties(self, keys=None):
+        msg = {'engineid':self.id,
+               'method':'get_properties',
+               'args':[repr(keys)]}
+        return self.executeAndRaise(msg, self.shell.get_properties, keys)
+
+    def del_properties(self, keys):
+        msg = {'engineid':self.id,
+               'method':'del_properties',
+               'args':[repr(keys)]}
+        return self.executeAndRaise(msg, self.shell.del_properties, keys)
+
+    def has_properties(self, keys):
+        msg = {'engineid':self.id,
+               'method':'has_properties',
+               'args':[repr(keys)]}
+        return self.executeAndRaise(msg, self.shell.has_properties, keys)
+
+    def clear_properties(self):
+        msg = {'engineid':self.id,
+               'method':'clear_properties',
+               'args':[]}
+        return self.executeAndRaise(msg, self.shell.clear_properties)
+
+    def interrupt(self):
+        """Interrupt the user's code, see `Worker.interrupt`."""
+        if self.worker is None or not self.requests:
+            return defer.succeed(False)
+        return self._request('interrupt')
+
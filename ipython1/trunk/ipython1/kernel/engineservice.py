@@ -209,6 +209,128 @@ class IEngineQueued(IEngineBase):
         """Unregister an observer of pending Failures."""
     
 
+class IEngineRelay(zi.Interface):
+    """Methods for broadcasting a namespace along a tree of engines.
+    
+    Instead of the controller sending a pickled namespace to every engine,
+    the namespace is sent to one engine which forwards it to other engines,
+    which forward it further.  See `MultiEngine.push` with method='tree'.
+    
+    Engines only store relayed namespaces.  They are pushed into the user's 
+    namespace by `push_relayed`, which goes through the queue like `push`,
+    so the order of commands on each engine is preserved.
+    
+    All methods should return deferreds.
+    """
+    
+    def get_relay_address():
+        """Return the (host, port) that other engines can relay to."""
+    
+    def expect_relayed(token):
+        """Accept a namespace relayed under token from other engines.
+        
+        Namespaces relayed under any other token are refused.
+        """
+    
+    def relay(token, package, plan):
+        """Store a pickled namespace under token and forward it along plan.
+        
+        plan is a list of (id, host, port, subplan) tuples, one for each
+        engine to forward the package to.  The package travels in chunks
+        that each engine forwards as soon as it gets them.
+        
+        Returns a deferred to the list of ids of the engines that could not
+        be reached.
+        """
+    
+    def push_relayed(token):
+        """Push the namespace relayed under token into the user's namespace.
+        
+        If it has not arrived yet, this waits for it.
+        """
+    
+    def discard_relayed(token):
+        """Forget about the namespace relayed under token.
+        
+        A `push_relayed` still waiting for it fails.
+        """
+
+
+class IEngineTasks(zi.Interface):
+    """Methods for running a batch of tasks in a single call.
+    
+    The `TaskController` uses this to run many short tasks on an engine 
+    without a round trip for every step of every task.
+    
+    All methods should return deferreds.
+    """
+    
+    def run_tasks(tasks):
+        """Run a list of tasks one after the other.
+        
+        Each task is a dict with the keys expression, push, pull,
+        clear_before and clear_after, which have the same meaning as the
+        attributes of a `task.Task`.
+        
+        Returns a deferred to a list with an entry for each task.  This is
+        what pull returned for the names in the task's pull (None if pull
+        is None), or a Failure if the task failed.  A failing task does
+        not stop the tasks after it.
+        """
+
+
+class IEngineHeartbeat(zi.Interface):
+    """Methods the controller uses to check that an engine is responsive.
+    
+    These methods must not go through the engine's queue, so a ping is 
+    answered as soon as the engine is free to answer it, even if commands
+    are waiting.  See `ControllerService.beat`.
+    
+    All methods should return deferreds.
+    """
+    
+    def ping():
+        """Return a deferred that fires as soon as the engine answers."""
+    
+    def disconnect():
+        """Drop the connection to the engine, if there is one."""
+
+
+class IEngineInterruptible(zi.Interface):
+    """An engine that can stop the command it is running.
+    
+    Like the heartbeat, this must not go through the engine's queue, see
+    `engineprocess.ProcessEngineService`.
+    """
+    
+    def interrupt():
+        """Raise KeyboardInterrupt in the command the engine is running.
+        
+        Returns a deferred to True if a command was interrupted and to 
+        False if the engine was idle.
+        """
+
+
+class IEngineQueries(zi.Interface):
+    """An engine that answers queries while it runs a command.
+    
+    `QueuedEngine` sends these straight to such an engine when no other
+    command is waiting, instead of queueing them behind the running one.
+    A `engineprocess.ProcessEngineService` answers them at once, from the
+    namespace as it is while the command runs.  An engine behind PB that 
+    runs commands in its reactor answers them once the command is done.
+    """
+    
+    def keys():
+        """See `IEngineBase.keys`."""
+    
+    def get_properties(keys=None):
+        """See `IEngineProperties.get_properties`."""
+    
+    def has_properties(keys):
+        """See `IEngineProperties.has_properties`."""
+
+
 class IEngineThreaded(zi.Interface):
     """A place holder for threaded commands.  
     
@@ -248,11 +370,26 @@ class StrictDict(dict):
         >>> print e.properties[1]
         ... [0, 1]
         
+        The `modified` flag is set by every change.  Every change also sets
+        `version` to the new value of the class wide `clock`, so users can
+        tell when to recompute things that depend on the properties, and
+        whether any StrictDict has changed at all.
+        
     """
+    
+    clock = 0
+    # A class attribute, because unpickling sets items before __dict__.
+    version = 0
+    
     def __init__(self, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
         self.modified = True
     
+    def _touch(self):
+        self.modified = True
+        StrictDict.clock += 1
+        self.version = StrictDict.clock
+    
     def __getitem__(self, key):
         return copy.deepcopy(dict.__getitem__(self, key))
     
@@ -266,26 +403,26 @@ class StrictDict(dict):
         except:
             raise error.InvalidProperty(value)
         dict.__setitem__(self, key, newvalue)
-        self.modified = True
+        self._touch()
     
     def __delitem__(self, key):
         dict.__delitem__(self, key)
-        self.modified = True
+        self._touch()
     
     def update(self, dikt):
         for k,v in dikt.iteritems():
             self[k] = v
     
     def pop(self, key):
-        self.modified = True
+        self._touch()
         return dict.pop(self, key)
     
     def popitem(self):
-        self.modified = True
+        self._touch()
         return dict.popitem(self)
     
     def clear(self):
-        self.modified = True
+        self._touch()
         dict.clear(self)
     
     def subDict(self, *keys):
@@ -320,6 +457,10 @@ class EngineAPI(object):
 
 _apiDict = {}
 
+# The names in the user's namespace that keys() leaves out.
+hiddenKeys = ['__name__', '_ih', '_oh', '__builtins__', 'In', 'Out', '_',
+    '__', '___', '__IP', 'input', 'raw_input']
+
 def get_engine(id):
     """Get the Engine API object, whcih currently just provides the properties 
     object, by ID"""
@@ -337,7 +478,7 @@ def drop_engine(id):
 class EngineService(object, service.Service):
     """Adapt a IPython shell into a IEngine implementing Twisted Service."""
     
-    zi.implements(IEngineBase)
+    zi.implements(IEngineBase, IEngineTasks, IEngineHeartbeat)
     def __init__(self, shellClass=Interpreter, mpi=None):
         """Create an EngineService.
         
@@ -477,8 +618,7 @@ class EngineService(object, service.Service):
         
         remotes = []
         for k in self.shell.user_ns.iterkeys():
-            if k not in ['__name__', '_ih', '_oh', '__builtins__',
-                         'In', 'Out', '_', '__', '___', '__IP', 'input', 'raw_input']:
+            if k not in hiddenKeys:
                 remotes.append(k)
         return defer.succeed(remotes)
     
@@ -528,6 +668,11 @@ class EngineService(object, service.Service):
         ns = {}
         for k,v in sNamespace.iteritems():
             try:
+                v = newserialized.decompress(v)
+                decoded = v.getMetadata().get('decoded')
+                if decoded is not None:
+                    log.msg("Decoded pushed object %s (%s) in %f s" %
+                            (k, decoded['name'], decoded['decodeTime']))
                 unserialized = newserialized.IUnSerialized(v)
                 ns[k] = unserialized.getObject()
             except:
@@ -543,6 +688,7 @@ class EngineService(object, service.Service):
         if len(keys)==1:
             d = self.executeAndRaise(msg, self.shell.pull, keys)
             d.addCallback(newserialized.serialize)
+            d.addCallback(newserialized.maybeCompress)
             return d
         elif len(keys)>1:
             d = self.executeAndRaise(msg, self.shell.pull, keys)         
@@ -551,11 +697,45 @@ class EngineService(object, service.Service):
                 serials = []
                 for v in values:
                     try:
-                        serials.append(newserialized.serialize(v))
+                        serials.append(newserialized.maybeCompress(
+                            newserialized.serialize(v)))
                     except:
                         return defer.fail(failure.Failure())
                 return serials
             return packThemUp
+    
+    def ping(self):
+        return defer.succeed(None)
+    
+    def disconnect(self):
+        return defer.succeed(None)
+    
+    def run_tasks(self, tasks):
+        results = []
+        d = defer.succeed(None)
+        for t in tasks:
+            d.addCallback(lambda _, t=t: self._runTask(t))
+            d.addBoth(results.append)
+        return d.addCallback(lambda _: results)
+    
+    def _runTask(self, t):
+        if t['clear_before']:
+            d = self.reset()
+        else:
+            d = defer.succeed(None)
+        if t['push'] is not None:
+            d.addCallback(lambda _: self.push(t['push']))
+        d.addCallback(lambda _: self.execute(t['expression']))
+        if t['pull'] is not None:
+            d.addCallback(lambda _: self.pull(t['pull']))
+        else:
+            d.addCallback(lambda _: None)
+        if t['clear_after']:
+            def reseter(result):
+                self.reset()
+                return result
+            d.addBoth(reseter)
+        return d
 
 
 def queue(methodToQueue):
@@ -594,6 +774,14 @@ class QueuedEngine(object):
             "engine passed to QueuedEngine doesn't provide IEngineBase"
             
         self.engine = engine
+        if IEngineRelay.providedBy(engine):
+            zi.alsoProvides(self, IEngineRelay)
+        if IEngineTasks.providedBy(engine):
+            zi.alsoProvides(self, IEngineTasks)
+        if IEngineHeartbeat.providedBy(engine):
+            zi.alsoProvides(self, IEngineHeartbeat)
+        if IEngineInterruptible.providedBy(engine):
+            zi.alsoProvides(self, IEngineInterruptible)
         self.id = engine.id
         self.queued = []
         self.history = {}
@@ -730,10 +918,74 @@ class QueuedEngine(object):
         self.clear_queue()
         return self.submitCommand(Command('kill'))
     
-    @queue
+    def _query(self, name, *args, **kwargs):
+        """Run a query now if it would only wait for the running command."""
+        if IEngineQueries.providedBy(self.engine) and not self.queued:
+            return getattr(self.engine, name)(*args, **kwargs)
+        return self.submitCommand(Command(name, *args, **kwargs))
+    
     def keys(self):
+        return self._query('keys')
+    
+    #---------------------------------------------------------------------------
+    # IEngineRelay methods
+    #---------------------------------------------------------------------------
+    
+    # Only push_relayed is queued, the others just move data around and 
+    # don't touch the user's namespace.
+    
+    def get_relay_address(self):
+        return self.engine.get_relay_address()
+    
+    def expect_relayed(self, token):
+        return self.engine.expect_relayed(token)
+    
+    def relay(self, token, package, plan):
+        return self.engine.relay(token, package, plan)
+    
+    @queue
+    def push_relayed(self, token):
         pass
     
+    def discard_relayed(self, token):
+        return self.engine.discard_relayed(token)
+    
+    #---------------------------------------------------------------------------
+    # IEngineTasks methods
+    #---------------------------------------------------------------------------
+    
+    @queue
+    def run_tasks(self, tasks):
+        pass
+    
+    #---------------------------------------------------------------------------
+    # IEngineHeartbeat methods
+    #---------------------------------------------------------------------------
+    
+    # These bypass the queue, so a busy engine still answers pings.
+    
+    def ping(self):
+        return self.engine.ping()
+    
+    def disconnect(self):
+        return self.engine.disconnect()
+    
+    #---------------------------------------------------------------------------
+    # IEngineInterruptible methods
+    #---------------------------------------------------------------------------
+    
+    # This can be called on any engine.  Engines that can't be interrupted
+    # just say that they didn't interrupt anything.
+    
+    def interrupt(self):
+        cmd = self.currentCommand
+        if cmd is not None and not cmd.finished:
+            # From now on the heartbeat times out an engine that stays busy.
+            cmd.interrupted = True
+        if IEngineInterruptible.providedBy(self.engine):
+            return self.engine.interrupt()
+        return defer.succeed(False)
+    
     #---------------------------------------------------------------------------
     # IEngineSerialized methods
     #---------------------------------------------------------------------------
@@ -754,17 +1006,15 @@ class QueuedEngine(object):
     def set_properties(self, namespace):
         pass
         
-    @queue
     def get_properties(self, keys=None):
-        pass
+        return self._query('get_properties', keys)
     
     @queue
     def del_properties(self, keys):
         pass
     
-    @queue
     def has_properties(self, keys):
-        pass
+        return self._query('has_properties', keys)
     
     @queue
     def clear_properties(self):
@@ -793,6 +1043,22 @@ class QueuedEngine(object):
         dikt = {'queue':map(repr,self.queued), 'pending':pending}
         return defer.succeed(dikt)
         
+    def command_in_flight(self):
+        """Is a command running that hasn't been asked to interrupt?"""
+        cmd = self.currentCommand
+        return cmd is not None and not cmd.finished and not cmd.interrupted
+    
+    def abandon_commands(self, reason):
+        """Fail the running command and the queued ones without waiting.
+        
+        This is used when the engine stops answering.  If the running 
+        command does finish later, its result is dropped.
+        """
+        cmd = self.currentCommand
+        self.clear_queue(msg=str(reason))
+        if cmd is not None and not cmd.finished:
+            cmd.handleError(failure.Failure(reason))
+        
     def register_failure_observer(self, obs):
         self.failureObservers.append(obs)
     
@@ -821,6 +1087,7 @@ class Command(object):
         self.args = args
         self.kwargs = kwargs
         self.finished = False
+        self.interrupted = False
     
     def setDeferred(self, d):
         """Sets the deferred attribute of the Command."""  
@@ -841,12 +1108,15 @@ class Command(object):
     def handleResult(self, result):
         """When the result is ready, relay it to self.deferred."""
         
-        self.deferred.callback(result)
+        # The deferred has already fired if the command was abandoned.
+        if not self.deferred.called:
+            self.deferred.callback(result)
     
     def handleError(self, reason):
         """When an error has occured, relay it to self.deferred."""
         
-        self.deferred.errback(reason)
+        if not self.deferred.called:
+            self.deferred.errback(reason)
 
 class ThreadedEngineService(EngineService):
     
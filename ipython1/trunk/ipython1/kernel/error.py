@@ -38,6 +38,12 @@ class NotDefined(KernelError):
 class QueueCleared(KernelError):
     pass
 
+class EngineUnresponsive(KernelError):
+    pass
+
+class EngineWorkerDied(KernelError):
+    pass
+
 class IdInUse(KernelError):
     pass
 
@@ -0,0 +1,324 @@
+# encoding: utf-8
+# -*- test-case-name: ipython1.kernel.tests.test_framedrpc -*-
+"""A length prefixed binary RPC protocol.
+
+This is a lighter alternative to XML-RPC for the controller's client
+interfaces.  A message on the wire is a 4 byte frame count followed by
+that many frames, each a 4 byte length and the raw bytes of the frame.
+Python objects are turned into frames with `newserialized.serialize`, so
+the buffers of numpy arrays are sent as frames of their own rather than
+being pickled and base64 encoded.
+
+The first frame of a request is a pickle of ``(requestID, methodName)``
+and the others hold ``(args, kwargs)``.  The first frame of a response is
+a pickle of the requestID and the others hold the result, which is a
+cleaned `Failure` if the call failed.  The server answers each request as soon as
+it is done, so a client can send several requests without waiting for the
+earlier ones (pipelining) and responses can come back in any order.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import cPickle as pickle
+import struct
+
+from twisted.internet import defer, protocol, reactor
+from twisted.python import failure, log
+
+from ipython1.kernel import error
+from ipython1.kernel.newserialized import Serialized, serialize, unserialize
+
+#-------------------------------------------------------------------------------
+# Packing messages into frames
+#-------------------------------------------------------------------------------
+
+def packMessage(obj):
+    """Turn obj into a list of frames.
+
+    The first frame is a pickle of the type descriptor and metadata of
+    ``serialize(obj)``, the others are its data.  The data of a container
+    is the structure pickle followed by the buffer of each array.
+    """
+    serial = serialize(obj)
+    header = pickle.dumps((serial.getTypeDescriptor(), serial.getMetadata()), 2)
+    data = serial.getData()
+    if serial.getTypeDescriptor() == 'container':
+        return [header] + list(data)
+    else:
+        return [header, data]
+
+def unpackMessage(frames):
+    """Undo `packMessage`."""
+    typeDescriptor, metadata = pickle.loads(frames[0])
+    if typeDescriptor == 'container':
+        data = frames[1:]
+    else:
+        data = frames[1]
+    return unserialize(Serialized(data, typeDescriptor, metadata))
+
+#-------------------------------------------------------------------------------
+# The framing protocol
+#-------------------------------------------------------------------------------
+
+class FramedMessageReceiver(protocol.Protocol):
+    """Send and receive messages made of length prefixed frames.
+
+    Incoming data is only joined once a whole frame has arrived, so large
+    frames are not copied over and over as they trickle in.  Subclasses
+    override `messageReceived`.
+    """
+
+    # The largest frame that will be accepted.  The connection is dropped
+    # if a longer one is announced.
+    MAX_LENGTH = 1024*1024*1024
+
+    _prefix = struct.Struct('!I')
+
+    def connectionMade(self):
+        self._chunks = []
+        self._buffered = 0
+        self._state = 'count'
+        self._needed = 4
+        self._frames = []
+        self._nframes = 0
+
+    def sendMessage(self, frames):
+        """Send a message made of a list of str or buffer frames."""
+        seq = [self._prefix.pack(len(frames))]
+        for frame in frames:
+            if len(frame) > self.MAX_LENGTH:
+                raise error.MessageSizeError("frame of %i bytes exceeds the "
+                    "maximum of %i" % (len(frame), self.MAX_LENGTH))
+            seq.append(self._prefix.pack(len(frame)))
+            # The transport can only write str, so buffers get one copy here.
+            seq.append(str(frame))
+        self.transport.writeSequence(seq)
+
+    def dataReceived(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered < self._needed:
+            return
+        data = ''.join(self._chunks)
+        offset = 0
+        while len(data) - offset >= self._needed and self._state is not None:
+            needed = self._needed
+            self._consume(data[offset:offset+needed])
+            offset += needed
+        rest = data[offset:]
+        if rest:
+            self._chunks = [rest]
+        else:
+            self._chunks = []
+        self._buffered = len(rest)
+
+    def _consume(self, piece):
+        if self._state == 'count':
+            self._nframes = self._prefix.unpack(piece)[0]
+            self._frames = []
+            self._state, self._needed = 'length', 4
+            if self._nframes == 0:
+                self._messageDone()
+        elif self._state == 'length':
+            length = self._prefix.unpack(piece)[0]
+            if length > self.MAX_LENGTH:
+                log.msg("Frame of %i bytes is too long, dropping connection" % length)
+                self._state = None
+                self.transport.loseConnection()
+                return
+            self._state, self._needed = 'frame', length
+        else:
+            self._frames.append(piece)
+            self._state, self._needed = 'length', 4
+            if len(self._frames) == self._nframes:
+                self._messageDone()
+
+    def _messageDone(self):
+        frames = self._frames
+        self._frames = []
+        self._state, self._needed = 'count', 4
+        self.messageReceived(frames)
+
+    def messageReceived(self, frames):
+        raise NotImplementedError
+
+#-------------------------------------------------------------------------------
+# The server side
+#-------------------------------------------------------------------------------
+
+class FramedRPCServerProtocol(FramedMessageReceiver):
+    """Call the ``framed_`` methods of the factory's service for each request."""
+
+    def messageReceived(self, frames):
+        try:
+            requestID, methodName = pickle.loads(frames[0])
+        except:
+            log.msg("Could not unpack a request, dropping connection")
+            log.err()
+            self.transport.loseConnection()
+            return
+        try:
+            args, kwargs = unpackMessage(frames[1:])
+        except:
+            d = defer.fail()
+        else:
+            meth = getattr(self.factory.service, 'framed_' + str(methodName), None)
+            if meth is None:
+                d = defer.fail(AttributeError("no such method: %r" % methodName))
+            else:
+                d = defer.maybeDeferred(meth, *args, **kwargs)
+        d.addCallbacks(self._sendResponse, self._sendFailure, 
+            callbackArgs=(requestID,), errbackArgs=(requestID,))
+        # The result could not be serialized or was too big.
+        d.addErrback(self._sendFailure, requestID)
+        d.addErrback(log.err)
+
+    def _sendResponse(self, result, requestID):
+        # Writes after the client has gone away are dropped by the transport.
+        self.sendMessage([pickle.dumps(requestID, 2)] + packMessage(result))
+
+    def _sendFailure(self, f, requestID):
+        f.cleanFailure()
+        self._sendResponse(f, requestID)
+
+
+class FramedRPCServerFactory(protocol.ServerFactory):
+    """A factory for `FramedRPCServerProtocol`.
+
+    :Parameters:
+        service
+            The object whose ``framed_<name>`` methods are called for
+            requests for ``<name>``.
+    """
+
+    protocol = FramedRPCServerProtocol
+
+    def __init__(self, service):
+        self.service = service
+
+#-------------------------------------------------------------------------------
+# The client side
+#-------------------------------------------------------------------------------
+
+class FramedRPCClientProtocol(FramedMessageReceiver):
+    """Send requests and match the responses to them by request id."""
+
+    def connectionMade(self):
+        FramedMessageReceiver.connectionMade(self)
+        self._pending = {}
+        self._nextID = 0
+        self._closed = defer.Deferred()
+
+    def callRemote(self, methodName, *args, **kwargs):
+        requestID = self._nextID
+        self._nextID += 1
+        try:
+            frames = [pickle.dumps((requestID, methodName), 2)]
+            self.sendMessage(frames + packMessage((args, kwargs)))
+        except:
+            return defer.fail(failure.Failure())
+        d = self._pending[requestID] = defer.Deferred()
+        return d
+
+    def messageReceived(self, frames):
+        try:
+            requestID = pickle.loads(frames[0])
+            d = self._pending.pop(requestID)
+        except:
+            log.msg("Could not unpack a response, dropping connection")
+            log.err()
+            self.transport.loseConnection()
+            return
+        try:
+            result = unpackMessage(frames[1:])
+        except:
+            result = failure.Failure()
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def connectionLost(self, reason):
+        pending = self._pending
+        self._pending = {}
+        for d in pending.values():
+            d.errback(error.ConnectionError("Lost the connection to the "
+                "controller: %s" % reason.getErrorMessage()))
+        self._closed.callback(None)
+
+
+class FramedRPCProxy(object):
+    """Make framed RPC calls to a server at addr, connecting when needed.
+
+    Calls made while the connection is being set up are sent as soon as it
+    is, in the order they were made.  If the connection is lost, the
+    pending calls fail with `ConnectionError` and the next call reconnects.
+
+    :Parameters:
+        addr : tuple
+            The (ip, port) of the server.
+    """
+
+    def __init__(self, addr):
+        self.addr = addr
+        self._protocol = None
+        self._connecting = False
+        self._waiting = []
+
+    def _connect(self):
+        d = defer.Deferred()
+        self._waiting.append(d)
+        if not self._connecting:
+            self._connecting = True
+            cc = protocol.ClientCreator(reactor, FramedRPCClientProtocol)
+            cc.connectTCP(*self.addr).addCallbacks(self._connected, 
+                self._connectFailed)
+        return d
+
+    def _connected(self, p):
+        self._protocol = p
+        self._connecting = False
+        p._closed.addCallback(self._lost, p)
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(p)
+
+    def _connectFailed(self, f):
+        self._connecting = False
+        msg = "Error connecting to the server %s:%s: %s" % \
+            (self.addr + (f.getErrorMessage(),))
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(error.ConnectionError(msg))
+
+    def _lost(self, _, p):
+        if self._protocol is p:
+            self._protocol = None
+
+    def callRemote(self, methodName, *args, **kwargs):
+        if self._protocol is not None:
+            return self._protocol.callRemote(methodName, *args, **kwargs)
+        d = self._connect()
+        d.addCallback(lambda p: p.callRemote(methodName, *args, **kwargs))
+        return d
+
+    def disconnect(self):
+        """Close the connection, returning a deferred that fires once it is."""
+        p = self._protocol
+        if p is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        p._closed.addCallback(lambda _: d.callback(None))
+        p.transport.loseConnection()
+        return d
@@ -45,11 +45,18 @@ def serialize(obj):
     data = serial.getData()
     typeDescriptor = serial.getTypeDescriptor()
     md = serial.getMetadata()
+    if typeDescriptor == 'container' or \
+        (typeDescriptor == 'ndarray' and not isinstance(md['dtype'], str)):
+        # Multiple frames and record dtypes can't be put into a single body
+        # and headers, so pickle those objects
+        data = pickle.dumps(obj, 2)
+        typeDescriptor = 'pickle'
     headers = {'serial-type': typeDescriptor}
     if typeDescriptor == 'ndarray':
         # pass
         headers['dtype'] = md['dtype']
         headers['shape'] = str(md['shape'])
+        headers['order'] = md.get('order', 'C')
     headers = prefixHeaders(headers)
     # print headers
     return headers, data
@@ -64,6 +71,7 @@ def unserialize(headers, data):
     elif typeDescriptor == 'ndarray':
         md['dtype'] = h['dtype']
         md['shape'] = strToShape(h['shape'])
+        md['order'] = h.get('order', 'C')
     serial = newserialized.Serialized(data, typeDescriptor, md)
     return newserialized.unserialize(serial)
     
@@ -20,8 +20,6 @@ __docformat__ = "restructuredtext en"
 
 import types
 
-from IPython.genutils import flatten as genutil_flatten
-
 #-------------------------------------------------------------------------------
 # Figure out which array packages are present and their array types
 #-------------------------------------------------------------------------------
@@ -47,74 +45,251 @@ else:
     arrayModules.append({'module':numarray,
         'type':numarray.numarraycore.NumArray})
 
+def concatenate(listOfPartitions):
+    """Join a list of sequences into a sequence of the same type.
+
+    Arrays are joined with the concatenate function of their array package,
+    lists, tuples and strings are joined into a list, tuple or string.  If
+    the partitions are not sequences (scatter with flatten=True sends
+    single elements as scalars) the list itself is returned.
+    """
+    testObject = listOfPartitions[0]
+    # First see if we have a known array type
+    for m in arrayModules:
+        if isinstance(testObject, m['type']):
+            return m['module'].concatenate(listOfPartitions)
+    # Next try for Python sequence types.  This only joins the top level, so
+    # partitions of a list of lists are still lists of lists.
+    if isinstance(testObject, types.ListType):
+        result = []
+        for partition in listOfPartitions:
+            result.extend(partition)
+        return result
+    if isinstance(testObject, types.TupleType):
+        result = []
+        for partition in listOfPartitions:
+            result.extend(partition)
+        return tuple(result)
+    if isinstance(testObject, types.StringTypes):
+        return testObject[:0].join(listOfPartitions)
+    # If we have scalars, just return listOfPartitions
+    return listOfPartitions
+
+def _isSequence(obj):
+    if isinstance(obj, (types.ListType, types.TupleType, types.StringTypes)):
+        return True
+    for m in arrayModules:
+        if isinstance(obj, m['type']):
+            return True
+    return False
+
 class Map:
-    """A class for partitioning a sequence using a map."""
-            
+    """A class for partitioning a sequence using a map.
+    
+    The basic map splits a sequence into q contiguous blocks whose lengths
+    differ by at most one, the first len(seq)%q blocks getting the extra
+    element.  Partitions are slices of the sequence, so partitions of a
+    numpy array are views that share its data.
+    """
+    
+    def __init__(self):
+        self._bounds = {}
+    
+    def getBounds(self, n, q):
+        """Return a list of the (lo, hi) bounds of q partitions of n elements.
+        
+        The bounds are computed once for each (n, q) and cached, so that
+        calling `getPartition` for every p costs O(q) rather than O(q**2).
+        """
+        try:
+            return self._bounds[n, q]
+        except KeyError:
+            pass
+        remainder = n%q
+        basesize = n/q
+        bounds = []
+        lo = 0
+        for i in range(q):
+            if i < remainder:
+                hi = lo + basesize + 1
+            else:
+                hi = lo + basesize
+            bounds.append((lo, hi))
+            lo = hi
+        self._bounds[n, q] = bounds
+        return bounds
+    
     def getPartition(self, seq, p, q):
         """Returns the pth partition of q partitions of seq."""
         
         # Test for error conditions here
         if p<0 or p>=q:
-          print "No partition exists."
-          return
-          
-        remainder = len(seq)%q
-        basesize = len(seq)/q
-        hi = []
-        lo = []
-        for n in range(q):
-            if n < remainder:
-                lo.append(n * (basesize + 1))
-                hi.append(lo[-1] + basesize + 1)
-            else:
-                lo.append(n*basesize + remainder)
-                hi.append(lo[-1] + basesize)
-
-        
-        result = seq[lo[p]:hi[p]]
-        return result
-           
+            raise ValueError("No partition %r of %r partitions exists." % (p, q))
+        lo, hi = self.getBounds(len(seq), q)[p]
+        return seq[lo:hi]
+    
+    def getPartitions(self, seq, q):
+        """Return a list of all q partitions of seq."""
+        return [seq[lo:hi] for lo, hi in self.getBounds(len(seq), q)]
+    
     def joinPartitions(self, listOfPartitions):
+        """Invert `getPartitions`, joining partitions in partition order."""
         return self.concatenate(listOfPartitions)
-                    
+    
     def concatenate(self, listOfPartitions):
-        testObject = listOfPartitions[0]
-        # First see if we have a known array type
-        for m in arrayModules:
-            #print m
-            if isinstance(testObject, m['type']):
-                return m['module'].concatenate(listOfPartitions)
-        # Next try for Python sequence types
-        if isinstance(testObject, (types.ListType, types.TupleType)):
-            return genutil_flatten(listOfPartitions)
-        # If we have scalars, just return listOfPartitions
-        return listOfPartitions
+        return concatenate(listOfPartitions)
 
-class RoundRobinMap(Map):
-    """Partitions a sequence in a roun robin fashion.
+class BlockCyclicMap(Map):
+    """Deals out blocks of blockSize elements to the partitions in turn.
     
-    This currently does not work!
+    Partition p gets blocks p, p+q, p+2q, ... of the sequence, which spreads
+    work whose cost grows along the sequence more evenly than the basic
+    map.  The partitions are copies, not views, even for arrays.
     """
-
+    
+    def __init__(self, blockSize=1):
+        Map.__init__(self)
+        if blockSize < 1:
+            raise ValueError("blockSize must be at least 1: %r" % blockSize)
+        self.blockSize = blockSize
+    
+    def getBlocks(self, n, q):
+        """Return the (lo, hi) bounds of the blocks of each of q partitions."""
+        try:
+            return self._bounds[n, q]
+        except KeyError:
+            pass
+        bs = self.blockSize
+        blocks = [[] for i in range(q)]
+        for b, lo in enumerate(range(0, n, bs)):
+            blocks[b%q].append((lo, min(lo+bs, n)))
+        self._bounds[n, q] = blocks
+        return blocks
+    
     def getPartition(self, seq, p, q):
-        return seq[p:len(seq):q]
-        #result = []
-        #for i in range(p,len(seq),q):
-        #    result.append(seq[i])
-        #return result
+        if p<0 or p>=q:
+            raise ValueError("No partition %r of %r partitions exists." % (p, q))
+        return self._join(seq, self.getBlocks(len(seq), q)[p])
+    
+    def getPartitions(self, seq, q):
+        return [self._join(seq, blocks) for blocks in self.getBlocks(len(seq), q)]
+    
+    def _join(self, seq, blocks):
+        if not blocks:
+            return seq[0:0]
+        return self.concatenate([seq[lo:hi] for lo, hi in blocks])
+    
+    def joinPartitions(self, listOfPartitions):
+        if not _isSequence(listOfPartitions[0]):
+            return listOfPartitions
+        q = len(listOfPartitions)
+        n = sum([len(partition) for partition in listOfPartitions])
+        pieces = [None]*((n+self.blockSize-1)/self.blockSize)
+        for partition, blocks in zip(listOfPartitions, self.getBlocks(n, q)):
+            offset = 0
+            for lo, hi in blocks:
+                pieces[lo/self.blockSize] = partition[offset:offset+hi-lo]
+                offset += hi-lo
+        if not pieces:
+            return listOfPartitions[0]
+        return self.concatenate(pieces)
 
+class RoundRobinMap(BlockCyclicMap):
+    """Partitions a sequence in a round robin fashion.
+    
+    Partition p is seq[p::q], which for arrays is a (strided) view.
+    """
+    
+    def __init__(self):
+        BlockCyclicMap.__init__(self, 1)
+    
+    def getPartition(self, seq, p, q):
+        if p<0 or p>=q:
+            raise ValueError("No partition %r of %r partitions exists." % (p, q))
+        return seq[p::q]
+    
+    def getPartitions(self, seq, q):
+        return [seq[p::q] for p in range(q)]
+    
     def joinPartitions(self, listOfPartitions):
-        #lengths = [len(x) for x in listOfPartitions]
-        #maxPartitionLength = len(listOfPartitions[0])
-        #numberOfPartitions = len(listOfPartitions)
-        #concat = self.concatenate(listOfPartitions)
-        #totalLength = len(concat)
-        #result = []
-        #for i in range(maxPartitionLength):
-        #    result.append(concat[i:totalLength:maxPartitionLength])
-        return self.concatenate(listOfPartitions)
-        
-styles = {'basic':Map}
+        testObject = listOfPartitions[0]
+        if not _isSequence(testObject):
+            return listOfPartitions
+        q = len(listOfPartitions)
+        for m in arrayModules:
+            if isinstance(testObject, m['type']):
+                # concatenate gives an array of the right shape and type
+                result = m['module'].concatenate(listOfPartitions)
+                for p, partition in enumerate(listOfPartitions):
+                    result[p::q] = partition
+                return result
+        n = sum([len(partition) for partition in listOfPartitions])
+        result = [None]*n
+        for p, partition in enumerate(listOfPartitions):
+            result[p::q] = list(partition)
+        if isinstance(testObject, types.TupleType):
+            return tuple(result)
+        if isinstance(testObject, types.StringTypes):
+            return testObject[:0].join(result)
+        return result
 
+class WeightedMap(Map):
+    """Splits a sequence into contiguous blocks sized by a list of weights.
     
+    Partition p gets a share of the sequence proportional to weights[p], so
+    faster engines can be given more of the work.  The weights are in the
+    order of the targets being scattered to and must have one entry per
+    target.  Without weights this is the basic map.
+    """
+    
+    def __init__(self, weights=None):
+        Map.__init__(self)
+        if weights is not None:
+            weights = [float(w) for w in weights]
+            if not weights or min(weights) < 0 or sum(weights) <= 0:
+                raise ValueError("weights must be non-negative and not all "
+                    "zero: %r" % (weights,))
+        self.weights = weights
+    
+    def getBounds(self, n, q):
+        if self.weights is None:
+            return Map.getBounds(self, n, q)
+        if len(self.weights) != q:
+            raise ValueError("%i weights given for %i partitions" % 
+                (len(self.weights), q))
+        try:
+            return self._bounds[n, q]
+        except KeyError:
+            pass
+        # Largest remainder rounding of the ideal sizes.
+        total = sum(self.weights)
+        ideal = [n*w/total for w in self.weights]
+        sizes = [int(x) for x in ideal]
+        byRemainder = range(q)
+        byRemainder.sort(key=lambda i: sizes[i]-ideal[i])
+        for i in byRemainder[:n-sum(sizes)]:
+            sizes[i] += 1
+        bounds = []
+        lo = 0
+        for size in sizes:
+            bounds.append((lo, lo+size))
+            lo += size
+        self._bounds[n, q] = bounds
+        return bounds
+
+styles = {'basic':Map, 'roundrobin':RoundRobinMap,
+    'blockcyclic':BlockCyclicMap, 'weighted':WeightedMap}
+
+def getMap(style):
+    """Return a Map for style, which is a key of `styles` or a Map instance.
     
+    Styles that take arguments, like WeightedMap(weights) or 
+    BlockCyclicMap(blockSize), are passed to scatter and gather as
+    instances.
+    """
+    if isinstance(style, Map):
+        return style
+    try:
+        return styles[style]()
+    except (KeyError, TypeError):
+        raise ValueError("unknown scatter/gather style: %r" % (style,))
@@ -29,16 +29,21 @@ __docformat__ = "restructuredtext en"
 from new import instancemethod
 from types import FunctionType
 
+import cPickle as pickle
+import os
+
 from twisted.application import service
 from twisted.internet import defer, reactor
 from twisted.python import log, components, failure
-from zope.interface import Interface, implements, Attribute
+from zope.interface import Interface, implements, classImplements, Attribute
 
 from ipython1.tools import growl
 from ipython1.kernel.util import printer
 from ipython1.kernel.twistedutil import gatherBoth
 from ipython1.kernel import map as Map
-from ipython1.kernel import error
+from ipython1.kernel import error, newserialized
+from ipython1.kernel.pbutil import PickleOnceNamespace, serializationStats
+from ipython1.kernel.engineservice import IEngineRelay
 from ipython1.kernel.pendingdeferred import PendingDeferredManager, two_phase
 from ipython1.kernel.controllerservice import \
     ControllerAdapterBase, \
@@ -61,6 +66,7 @@ class IEngineMultiplexer(Interface):
     * targets = 10            # Engines are indexed by ints
     * targets = [0,1,2,3]     # A list of ints
     * targets = 'all'         # A string to indicate all targets
+    * targets = 'gpu-nodes'   # The name of a group, see `IMultiEngine.set_group`
     
     If targets is bad in any way, an InvalidEngineID will be raised.  This
     includes engines not being registered.
@@ -73,7 +79,7 @@ class IEngineMultiplexer(Interface):
     the overall action will fail immediately with that Failure.
     
     :Parameters:
-        targets : int, list of ints, or 'all'
+        targets : int, list of ints, 'all' or a group name
             Engine ids the action will apply to.
     
     :Returns: Deferred to a list of results for each engine.
@@ -100,7 +106,7 @@ class IEngineMultiplexer(Interface):
                 String of python code to be executed on targets.
         """
             
-    def push(namespace, targets='all'):
+    def push(namespace, targets='all', method='fanout'):
         """Push dict namespace into the user's namespace on targets.
         
         See the class docstring for information about targets and possible
@@ -109,6 +115,11 @@ class IEngineMultiplexer(Interface):
         :Parameters:
             namspace : dict
                 Dict of key value pairs to be put into the users namspace.
+            method : str
+                'fanout' sends the namespace from the controller to each
+                target.  'tree' sends it to one target and the targets 
+                forward it to each other along a binomial tree.  This 
+                falls back to 'fanout' if the engines can't relay.
         """
         
     def pull(keys, targets='all'):
@@ -181,6 +192,17 @@ class IEngineMultiplexer(Interface):
     def queue_status(targets='all'):
         """Get the status of the queue on the targets."""
     
+    def interrupt(targets='all'):
+        """Raise KeyboardInterrupt in the commands the targets are running.
+        
+        This doesn't wait for the queue of the targets.  Only engines that
+        run their commands in a worker process (see `engineprocess`) can be
+        interrupted.
+        
+        :Returns: A list of bools, True for each engine whose command was
+            interrupted.
+        """
+    
     def set_properties(properties, targets='all'):
         """set properties by key and value"""
     
@@ -208,6 +230,56 @@ class IMultiEngine(IEngineMultiplexer):
                 
         :Returns:  A Deferred to a list of registered engine ids.
         """
+    
+    def set_group(name, targets):
+        """Give a name to a group of engines.
+        
+        The name can then be used as the targets argument of any method,
+        which saves checking and sending a long list of ids every time.
+        Engines that unregister are dropped from the groups they are in.
+        Quarantined engines stay in them, but calls on the group leave
+        them out until they are readmitted.
+        
+        :Parameters:
+            name : str
+                The name of the group, anything but 'all'.  An existing
+                group with this name is replaced.
+            targets : int, list of ints, 'all' or a group name
+                The engines in the group.
+        
+        :Returns: A Deferred to the list of ids in the group.
+        """
+    
+    def del_group(name):
+        """Forget the group called name."""
+    
+    def get_groups():
+        """Return the groups of engines.
+        
+        :Returns: A Deferred to a dict of group names and lists of ids.
+        """
+    
+    def get_engine_stats():
+        """Return the heartbeat statistics of the engines.
+        
+        This includes the round trip times of pings to each engine and 
+        engines that have been quarantined for not answering them.  See
+        `ControllerService.get_liveness` for the format.
+        
+        :Returns: A Deferred to a list of dicts, one for each engine.
+        """
+    
+    def get_serialization_stats():
+        """Return how much pickling pushing to many engines has saved.
+        
+        A namespace pushed to many engines is pickled once and the pickle
+        is reused for the other engines.
+        
+        :Returns: A Deferred to a dict with the keys 'pickled' (the number
+            of namespaces pickled), 'reused' (the number of times a pickle
+            was reused) and 'timeSaved' (the time in seconds that pickling
+            them again would have taken).
+        """
 
 
 
@@ -215,6 +287,30 @@ class IMultiEngine(IEngineMultiplexer):
 # Implementation of the core MultiEngine classes
 #-------------------------------------------------------------------------------
 
+def binomialPlan(nodes):
+    """Build the plan to relay data from nodes[0] to nodes[1:].
+    
+    Node i forwards to nodes i+1, i+2, i+4, ... (as long as i is smaller than
+    the step), so the data reaches n nodes in log2(n) rounds.
+    
+    :Parameters:
+        nodes : list
+            A list of (id, host, port) tuples.
+    
+    :Returns: The plan for nodes[0], a list of (id, host, port, subplan) 
+        tuples.
+    """
+    children = [[] for n in nodes]
+    step = 1
+    while step < len(nodes):
+        for i in range(min(step, len(nodes)-step)):
+            children[i].append(i+step)
+        step *= 2
+    def plan(i):
+        return [nodes[c] + (plan(c),) for c in children[i]]
+    return plan(0)
+
+
 class MultiEngine(ControllerAdapterBase):
     """The representation of a ControllerService as a IMultiEngine.
     
@@ -226,8 +322,10 @@ class MultiEngine(ControllerAdapterBase):
     
     implements(IMultiEngine)
     
-    def __init(self, controller):
+    def __init__(self, controller):
         ControllerAdapterBase.__init__(self, controller)
+        self.groups = {} # {name:[engines]}
+        self.on_unregister_engine_do(self._dropFromGroups, True)
     
     #---------------------------------------------------------------------------
     # Helper methods
@@ -237,7 +335,7 @@ class MultiEngine(ControllerAdapterBase):
         """Parse the targets argument into a list of valid engine objects.
         
         :Parameters:
-            targets : int, list of ints or 'all'
+            targets : int, list of ints, 'all' or a group name
                 The targets argument to be parsed.
                 
         :Returns: List of engine objects.
@@ -246,18 +344,23 @@ class MultiEngine(ControllerAdapterBase):
             InvalidEngineID
                 If targets is not valid or if an engine is not registered.
         """
+        engines = self.engines
         if isinstance(targets, int):
-            if targets not in self.engines.keys():
+            if targets not in engines:
                 log.msg("Engine with id %i is not registered" % targets)
                 raise error.InvalidEngineID("Engine with id %i is not registered" % targets)
             else: 
-                return [self.engines[targets]]
+                return [engines[targets]]
         elif isinstance(targets, (list, tuple)):
-            for id in targets:
-                if id not in self.engines.keys():
-                    log.msg("Engine with id %r is not registered" % id)
-                    raise error.InvalidEngineID("Engine with id %r is not registered" % id)  
-            return map(self.engines.get, targets)
+            try:
+                return [engines[id] for id in targets]
+            except (KeyError, TypeError):
+                for id in targets:
+                    try:
+                        engines[id]
+                    except (KeyError, TypeError):
+                        log.msg("Engine with id %r is not registered" % (id,))
+                        raise error.InvalidEngineID("Engine with id %r is not registered" % (id,))
         elif targets == 'all':
             eList = self.engines.values()
             if len(eList) == 0:
@@ -266,8 +369,26 @@ class MultiEngine(ControllerAdapterBase):
                 raise error.NoEnginesRegistered(msg)
             else:
                 return eList
+        elif isinstance(targets, str) and targets in self.groups:
+            # Quarantined members are left out until they are readmitted
+            eList = [e for e in self.groups[targets] if engines.get(e.id) is e]
+            if len(eList) == 0:
+                raise error.NoEnginesRegistered("The engines in group %r "
+                    "have all unregistered or are quarantined" % targets)
+            return eList
         else:
-            raise error.InvalidEngineID("targets argument is not an int, list of ints or 'all': %r"%targets)
+            raise error.InvalidEngineID("targets argument is not an int, list of ints, 'all' or a group name: %r"%targets)
+    
+    def _isMember(self, e):
+        """Is e still registered, or quarantined, under its id?"""
+        quarantined = getattr(self.controller, 'quarantined', {})
+        return self.engines.get(e.id) is e or quarantined.get(e.id) is e
+    
+    def _dropFromGroups(self, id):
+        # A quarantined engine stays in its groups, so they are whole again
+        # when it is readmitted.
+        for name, eList in self.groups.items():
+            self.groups[name] = [e for e in eList if self._isMember(e)]
     
     def _performOnEngines(self, methodName, *args, **kwargs):
         """Calls a method on engines and returns deferred to list of results.
@@ -331,6 +452,35 @@ class MultiEngine(ControllerAdapterBase):
     def get_ids(self):
         return defer.succeed(self.engines.keys())
     
+    def set_group(self, name, targets):
+        if not isinstance(name, str) or name == 'all':
+            return defer.fail(ValueError("a group name must be a str other "
+                "than 'all': %r" % (name,)))
+        try:
+            eList = self.engineList(targets)
+        except (error.InvalidEngineID, error.NoEnginesRegistered):
+            return defer.fail(failure.Failure())
+        self.groups[name] = eList
+        return defer.succeed([e.id for e in eList])
+    
+    def del_group(self, name):
+        try:
+            del self.groups[name]
+        except KeyError:
+            return defer.fail(KeyError("no group named %r" % (name,)))
+        return defer.succeed(None)
+    
+    def get_groups(self):
+        groups = dict([(name, [e.id for e in eList if self._isMember(e)]) 
+            for name, eList in self.groups.iteritems()])
+        return defer.succeed(groups)
+    
+    def get_engine_stats(self):
+        return defer.succeed(self.get_liveness())
+    
+    def get_serialization_stats(self):
+        return defer.succeed(dict(serializationStats))
+    
     #---------------------------------------------------------------------------
     # IEngineMultiplexer methods
     #---------------------------------------------------------------------------
@@ -338,13 +488,94 @@ class MultiEngine(ControllerAdapterBase):
     def execute(self, lines, targets='all'):
         return self._performOnEnginesAndGatherBoth('execute', lines, targets=targets)
     
-    def push(self, ns, targets='all'):
-        return self._performOnEnginesAndGatherBoth('push', ns, targets=targets)
+    def push(self, ns, targets='all', method='fanout'):
+        if method == 'fanout':
+            # Engines that pickle the namespace reuse the first pickle.
+            ns = PickleOnceNamespace(ns)
+            return self._performOnEnginesAndGatherBoth('push', ns, targets=targets)
+        elif method == 'tree':
+            return self._pushTree(ns, targets)
+        else:
+            return defer.fail(ValueError("push method must be 'fanout' "
+                "or 'tree': %r" % method))
+    
+    def _pushTree(self, ns, targets):
+        """Push ns to targets along a binomial tree of engines.
+        
+        The namespace is pickled once and sent, in chunks, to the first 
+        target, which forwards it to the others.  Each engine then gets a 
+        queued ``push_relayed``, so pushes happen in order with other commands.
+        Any engines that the namespace can't be relayed to get it from the
+        controller directly, and if that fails too their ``push_relayed``
+        fails.
+        """
+        try:
+            engines = self.engineList(targets)
+        except (error.InvalidEngineID, error.NoEnginesRegistered):
+            return defer.fail(failure.Failure())
+        for e in engines:
+            if not IEngineRelay.providedBy(e):
+                log.msg("Engine %r can't relay, pushing to each engine" % e.id)
+                return self.push(ns, targets)
+        try:
+            package = pickle.dumps(ns, 2)
+        except:
+            return defer.fail(failure.Failure())
+        token = os.urandom(16).encode('hex')
+        log.msg("Performing push along a tree on %r" % targets)
+        # expect_relayed goes first, so it reaches each engine before 
+        # push_relayed does.
+        dRelay = gatherBoth([self._expectRelayed(e, token) for e in engines],
+                            fireOnOneErrback=1,
+                            consumeErrors=1,
+                            logErrors=0)
+        dList = []
+        for e in engines:
+            d = e.push_relayed(token)
+            d.addErrback(self._discardRelayed, e, token)
+            dList.append(d)
+        dRelay.addCallback(self._relayAlongTree, engines, token, package)
+        dRelay.addErrback(lambda f: [e.id for e in engines])
+        dRelay.addCallback(self._relayDirectly, engines, token, package)
+        # Errors from relaying show up in the results of push_relayed.
+        dRelay.addErrback(log.err)
+        d = gatherBoth(dList, 
+                       fireOnOneErrback=0,
+                       consumeErrors=1,
+                       logErrors=0)
+        d.addCallback(error.collect_exceptions, 'push')
+        return d
+    
+    def _expectRelayed(self, engine, token):
+        d = engine.expect_relayed(token)
+        d.addCallback(lambda _: engine.get_relay_address())
+        return d
+    
+    def _relayAlongTree(self, addresses, engines, token, package):
+        nodes = [(e.id, host, port) for e, (host, port) in zip(engines, addresses)]
+        plan = binomialPlan(nodes)
+        return engines[0].relay(token, package, plan)
+    
+    def _relayDirectly(self, failedIDs, engines, token, package):
+        dList = []
+        for e in engines:
+            if e.id in failedIDs:
+                log.msg("Relaying directly to engine %r" % e.id)
+                d = e.relay(token, package, [])
+                # Otherwise its queued push_relayed waits forever.
+                d.addErrback(self._discardRelayed, e, token)
+                dList.append(d)
+        return gatherBoth(dList, consumeErrors=1, logErrors=0)
+    
+    def _discardRelayed(self, reason, engine, token):
+        engine.discard_relayed(token).addErrback(lambda f: None)
+        return reason
         
     def pull(self, keys, targets='all'):
         return self._performOnEnginesAndGatherBoth('pull', keys, targets=targets)
     
     def push_function(self, ns, targets='all'):
+        ns = PickleOnceNamespace(ns)
         return self._performOnEnginesAndGatherBoth('push_function', ns, targets=targets)
         
     def pull_function(self, keys, targets='all'):
@@ -371,8 +602,12 @@ class MultiEngine(ControllerAdapterBase):
         return d
     
     def push_serialized(self, namespace, targets='all'):
+        # Compress once here rather than on each engine connection
+        namespace = dict([(k, newserialized.maybeCompress(v))
+                          for k, v in namespace.iteritems()])
         for k, v in namespace.iteritems():
-            log.msg("Pushed object %s is %f MB" % (k, v.getDataSize()))
+            self._logSize(v, "Pushed object %s" % k)
+        namespace = PickleOnceNamespace(namespace)
         d = self._performOnEnginesAndGatherBoth('push_serialized', namespace, targets=targets)      
         return d
         
@@ -394,14 +629,27 @@ class MultiEngine(ControllerAdapterBase):
     def _logSizes(self, listOfSerialized):
         if isinstance(listOfSerialized, (list, tuple)):
             for s in listOfSerialized:
-                log.msg("Pulled object is %f MB" % s.getDataSize())
+                self._logSize(s, "Pulled object")
         else:
-            log.msg("Pulled object is %f MB" % listOfSerialized.getDataSize())
+            self._logSize(listOfSerialized, "Pulled object")
         return listOfSerialized
     
+    def _logSize(self, serial, what):
+        """Log the size of a Serialized and how well it was compressed."""
+        codec = serial.getMetadata().get('codec')
+        if codec is None:
+            log.msg("%s is %f MB" % (what, serial.getDataSize()))
+        else:
+            log.msg("%s is %f MB (%f MB raw, %s in %f s)" % (what,
+                serial.getDataSize(), codec['rawSize']/10.0**6, 
+                codec['name'], codec['encodeTime']))
+    
     def clear_queue(self, targets='all'):
         return self._performOnEnginesAndGatherBoth('clear_queue', targets=targets)         
     
+    def interrupt(self, targets='all'):
+        return self._performOnEnginesAndGatherBoth('interrupt', targets=targets)
+    
     def queue_status(self, targets='all'):
         log.msg("Getting queue status on %r" % targets)
         try:
@@ -493,6 +741,82 @@ class MultiEngine(ControllerAdapterBase):
                            logErrors=0)
             d.addCallback(error.collect_exceptions, 'clear_properties')
             return d
+    
+    #---------------------------------------------------------------------------
+    # IMultiEngineCoordinator methods
+    #---------------------------------------------------------------------------
+    
+    def _orderedEngineList(self, targets):
+        """Like `engineList`, but 'all' gives the engines sorted by id.
+        
+        Scatter and gather match partitions to engines by position, so both
+        have to see the engines in the same order.
+        """
+        engines = self.engineList(targets)
+        if targets == 'all':
+            engines.sort(key=lambda e: e.id)
+        return engines
+    
+    def scatter(self, key, seq, style='basic', flatten=False, targets='all'):
+        """Partition seq in the controller and push a part to each target.
+        
+        The client sends the whole sequence once, rather than making a 
+        push for each engine.
+        """
+        log.msg("Scattering %r to %r" % (key, targets))
+        try:
+            engines = self._orderedEngineList(targets)
+            mapObject = Map.getMap(style)
+            partitions = mapObject.getPartitions(seq, len(engines))
+        except:
+            return defer.fail(failure.Failure())
+        dList = []
+        for e, partition in zip(engines, partitions):
+            if flatten and len(partition) == 1:
+                dList.append(e.push({key: partition[0]}))
+            else:
+                dList.append(e.push({key: partition}))
+        d = gatherBoth(dList, 
+                       fireOnOneErrback=0,
+                       consumeErrors=1,
+                       logErrors=0)
+        d.addCallback(error.collect_exceptions, 'scatter')
+        return d
+    
+    def gather(self, key, style='basic', targets='all'):
+        """Pull key from each target and join the parts in the controller."""
+        log.msg("Gathering %r from %r" % (key, targets))
+        try:
+            engines = self._orderedEngineList(targets)
+            mapObject = Map.getMap(style)
+        except:
+            return defer.fail(failure.Failure())
+        dList = [e.pull(key) for e in engines]
+        d = gatherBoth(dList, 
+                       fireOnOneErrback=0,
+                       consumeErrors=1,
+                       logErrors=0)
+        d.addCallback(error.collect_exceptions, 'gather')
+        d.addCallback(mapObject.joinPartitions)
+        return d
+    
+    def map(self, func, seq, style='basic', targets='all'):
+        if isinstance(func, FunctionType):
+            d = self.push_function(dict(_ipython_map_func=func), targets=targets)
+            sourceToRun = \
+                '_ipython_map_seq_result = map(_ipython_map_func, _ipython_map_seq)'
+        elif isinstance(func, str):
+            d = defer.succeed(None)
+            sourceToRun = \
+                '_ipython_map_seq_result = map(%s, _ipython_map_seq)' % func
+        else:
+            return defer.fail(TypeError("func must be a function or str"))
+        d.addCallback(lambda _: self.scatter('_ipython_map_seq', seq, style, 
+            targets=targets))
+        d.addCallback(lambda _: self.execute(sourceToRun, targets=targets))
+        d.addCallback(lambda _: self.gather('_ipython_map_seq_result', style, 
+            targets=targets))
+        return d
 
 
 components.registerAdapter(MultiEngine,
@@ -528,6 +852,20 @@ class ISynchronousMultiEngine(ISynchronousEngineMultiplexer):
     
     def clear_pending_deferreds():
         """"""
+    
+    def batch(calls):
+        """Make a list of calls in non-blocking mode, in order.
+        
+        This lets a client send many calls in a single request.
+        
+        :Parameters:
+            calls : list
+                A list of (methodName, args, kwargs) tuples.  The kwargs
+                must not include block.
+        
+        :Returns: A deferred to a list with the deferredID of each call, or
+            a Failure for calls that could not be made.
+        """
 
 
 #-------------------------------------------------------------------------------
@@ -557,8 +895,8 @@ class SynchronousMultiEngine(PendingDeferredManager):
         return d
     
     @two_phase
-    def push(self, namespace, targets='all'):
-        return self.multiengine.push(namespace, targets)
+    def push(self, namespace, targets='all', method='fanout'):
+        return self.multiengine.push(namespace, targets, method)
     
     @two_phase
     def pull(self, keys, targets='all'):
@@ -606,6 +944,10 @@ class SynchronousMultiEngine(PendingDeferredManager):
     def queue_status(self, targets='all'):
         return self.multiengine.queue_status(targets)
     
+    @two_phase
+    def interrupt(self, targets='all'):
+        return self.multiengine.interrupt(targets)
+    
     @two_phase
     def set_properties(self, properties, targets='all'):
         return self.multiengine.set_properties(properties, targets)
@@ -626,6 +968,48 @@ class SynchronousMultiEngine(PendingDeferredManager):
     def clear_properties(self, targets='all'):
         return self.multiengine.clear_properties(targets)
     
+    #---------------------------------------------------------------------------
+    # IMultiEngineCoordinator methods
+    #---------------------------------------------------------------------------
+    
+    @two_phase
+    def scatter(self, key, seq, style='basic', flatten=False, targets='all'):
+        return self.multiengine.scatter(key, seq, style, flatten, targets)
+    
+    @two_phase
+    def gather(self, key, style='basic', targets='all'):
+        return self.multiengine.gather(key, style, targets)
+    
+    @two_phase
+    def map(self, func, seq, style='basic', targets='all'):
+        return self.multiengine.map(func, seq, style, targets)
+    
+    #---------------------------------------------------------------------------
+    # Batches of calls
+    #---------------------------------------------------------------------------
+    
+    # The methods that can be called through `batch`.
+    batchMethods = ('execute', 'push', 'pull', 'push_serialized', 
+        'pull_serialized', 'get_result', 'reset', 'keys', 'clear_queue',
+        'queue_status', 'set_properties', 'get_properties', 'has_properties',
+        'del_properties', 'clear_properties', 'scatter', 'gather')
+    
+    def batch(self, calls):
+        dList = []
+        for methodName, args, kwargs in calls:
+            if methodName not in self.batchMethods:
+                dList.append(defer.fail(ValueError("%r can't be called in a "
+                    "batch" % methodName)))
+                continue
+            kwargs = dict(kwargs)
+            kwargs['block'] = False
+            dList.append(defer.maybeDeferred(getattr(self, methodName), 
+                *args, **kwargs))
+        return gatherBoth(dList, 
+                          fireOnOneErrback=0,
+                          consumeErrors=1,
+                          logErrors=0)
+    
     #---------------------------------------------------------------------------
     # IMultiEngine methods
     #---------------------------------------------------------------------------
@@ -636,6 +1020,21 @@ class SynchronousMultiEngine(PendingDeferredManager):
         Never use the two phase block/non-block stuff for this.
         """
         return self.multiengine.get_ids()
+    
+    def set_group(self, name, targets):
+        return self.multiengine.set_group(name, targets)
+    
+    def del_group(self, name):
+        return self.multiengine.del_group(name)
+    
+    def get_groups(self):
+        return self.multiengine.get_groups()
+    
+    def get_engine_stats(self):
+        return self.multiengine.get_engine_stats()
+    
+    def get_serialization_stats(self):
+        return self.multiengine.get_serialization_stats()
 
 
 components.registerAdapter(SynchronousMultiEngine, IMultiEngine, ISynchronousMultiEngine)
@@ -660,9 +1059,11 @@ class IMultiEngineCoordinator(Interface):
                 The variable name to call the scattered sequence.
             seq : list, tuple, array
                 The sequence to scatter.  The type should be preserved.
-            style : string
-                A specification of how the sequence is partitioned.  Currently 
-                only 'basic' is implemented.
+            style : string or Map
+                A specification of how the sequence is partitioned: 'basic'
+                (contiguous blocks), 'roundrobin', 'blockcyclic' or 
+                'weighted', or an instance of a `ipython1.kernel.map.Map`
+                class such as ``map.WeightedMap(weights)``.
             flatten : boolean
                 Should single element sequences be converted to scalars.
         """
@@ -673,9 +1074,9 @@ class IMultiEngineCoordinator(Interface):
         :Parameters:
             key : string
                 The name of a sequence on the targets to gather.
-            style : string
-                A specification of how the sequence is partitioned.  Currently 
-                only 'basic' is implemented.                
+            style : string or Map
+                A specification of how the sequence was partitioned.  This
+                must be the style that was used to scatter it.
         """
     
     def map(func, seq, style='basic', targets='all'):
@@ -696,8 +1097,8 @@ class IMultiEngineCoordinator(Interface):
                 callable defined on the engines.
             seq : list, tuple or numpy array
                 The local sequence to be scattered.
-            style : str
-                Only 'basic' is supported for now.
+            style : str or Map
+                How seq is partitioned, see `scatter`.
                 
         :Returns: A list of len(seq) with functionSource called on each element
         of seq.
@@ -715,6 +1116,12 @@ class ISynchronousMultiEngineCoordinator(IMultiEngineCoordinator):
     pass
 
 
+# The coordinator methods of MultiEngine and SynchronousMultiEngine run
+# in the controller.
+classImplements(MultiEngine, IMultiEngineCoordinator)
+classImplements(SynchronousMultiEngine, ISynchronousMultiEngineCoordinator)
+
+
 #-------------------------------------------------------------------------------
 # IMultiEngineExtras
 #-------------------------------------------------------------------------------
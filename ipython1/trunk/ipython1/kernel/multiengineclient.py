@@ -98,6 +98,8 @@ class PendingResult(object):
         """Create a PendingResult with a result_id and a client instance.
         
         The client should implement `_getPendingResult(result_id, block)`.
+        The result_id of a call made in a `Batch` is None until the batch
+        has been sent.
         """
         self.client = client
         self.result_id = result_id
@@ -129,6 +131,9 @@ class PendingResult(object):
                 raise self.result[0], self.result[1], self.result[2]
             else:
                 return self.result
+        if self.result_id is None:
+            raise error.ClientError("The batch this result is part of has "
+                "not been sent")
         try:
             result = self.client.get_pending_deferred(self.result_id, block)
         except error.ResultNotCompleted:
@@ -336,6 +341,77 @@ class InteractiveMultiEngineClient(object):
         return ParallelFunction(func, self, targets, block)
 
 
+#-------------------------------------------------------------------------------
+# Batches of calls
+#-------------------------------------------------------------------------------
+
+class Batch(object):
+    """Collect the calls made on a blocking client and send them at once.
+    
+    Use this through the `batch` method of a blocking client, as a context
+    manager::
+    
+        with mec.batch():
+            r1 = mec.execute('a = 10')
+            r2 = mec.pull('a')
+        print r2.r
+    
+    Inside the with block every call returns a `PendingResult` right away
+    and does nothing else.  When the block ends, all the calls are sent to 
+    the controller in a single request, where they are run in order.  If
+    the block raises an exception the calls are dropped.
+    """
+    
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+        self.pendingResults = []
+    
+    def __enter__(self):
+        if self.client._batch is not None:
+            raise error.ClientError("Batches can't be nested")
+        self.client._batch = self
+        return self
+    
+    def __exit__(self, excType, excValue, tb):
+        self.client._batch = None
+        if excType is None:
+            self.send()
+        return False
+    
+    def add(self, methodName, args, kwargs):
+        """Record a call and return a `PendingResult` for it.
+        
+        Methods that the controller can't run in a batch (those not in
+        `SynchronousMultiEngine.batchMethods`) raise a `ClientError` here,
+        rather than failing when the batch is sent.
+        """
+        if methodName not in me.SynchronousMultiEngine.batchMethods:
+            raise error.ClientError("%r can't be called in a batch" %
+                                    methodName)
+        kwargs = dict(kwargs)
+        kwargs.pop('block', None)
+        self.calls.append((methodName, args, kwargs))
+        pr = PendingResult(self.client, None)
+        self.pendingResults.append(pr)
+        return pr
+    
+    def send(self):
+        """Send the calls and give each `PendingResult` its result_id."""
+        calls, self.calls = self.calls, []
+        pendingResults, self.pendingResults = self.pendingResults, []
+        if not calls:
+            return
+        results = blockingCallFromThread(self.client.smultiengine.batch, calls)
+        for pr, r in zip(pendingResults, results):
+            if isinstance(r, Failure):
+                pr.result = (r.type, r.value, None)
+                pr.called = True
+                pr.raised = True
+            else:
+                pr.result_id = r
+
+
 #-------------------------------------------------------------------------------
 # IFullTwoPhaseMultiEngine -> IFullBlockingMultiEngineClient adaptor
 #-------------------------------------------------------------------------------
@@ -353,6 +429,7 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
         self.smultiengine = smultiengine
         self.block = True
         self.targets = 'all'
+        self._batch = None
     
     def _findBlock(self, block=None):
         if block is None:
@@ -378,6 +455,8 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
         block = kwargs.get('block', None)
         if block is None:
             raise error.MissingBlockArgument("'block' keyword argument is missing")
+        if self._batch is not None:
+            return self._batch.add(function.__name__, args, kwargs)
         result = blockingCallFromThread(function, *args, **kwargs)
         if not block:
             result = PendingResult(self, result)
@@ -424,12 +503,33 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
         r = blockingCallFromThread(self.smultiengine.clear_pending_deferreds)
         return r
     
+    def batch(self):
+        """Return a `Batch` that sends the calls made inside it at once.
+        
+        This is used as a context manager::
+        
+            with mec.batch():
+                results = [mec.execute('a = %i' % i) for i in range(100)]
+            
+        Calls made in the with block return `PendingResult` objects
+        whatever the block argument is.  They are sent to the controller
+        in a single request when the block ends, which saves a round trip
+        for each call.  Calls that take functions, like `push_function` and
+        `map`, and calls like `kill` and `interrupt` can't be batched, and
+        raise a `ClientError` right away.
+        """
+        return Batch(self)
+    
     #---------------------------------------------------------------------------
     # IEngineMultiplexer related methods
     #---------------------------------------------------------------------------
     
     def execute(self, lines, targets=None, block=None):
         targets, block = self._findTargetsAndBlock(targets, block)
+        if self._batch is not None:
+            result = self._batch.add('execute', (lines,), dict(targets=targets))
+            result.add_callback(wrapResultList)
+            return result
         result = blockingCallFromThread(self.smultiengine.execute, lines,
             targets=targets, block=block)
         if block:
@@ -439,10 +539,10 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
             result.add_callback(wrapResultList)
         return result
     
-    def push(self, namespace, targets=None, block=None):
+    def push(self, namespace, targets=None, block=None, method='fanout'):
         targets, block = self._findTargetsAndBlock(targets, block)
         return self._blockFromThread(self.smultiengine.push, namespace,
-            targets=targets, block=block)
+            targets=targets, block=block, method=method)
     
     def pull(self, keys, targets=None, block=None):
         targets, block = self._findTargetsAndBlock(targets, block)
@@ -466,6 +566,10 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
     
     def get_result(self, i=None, targets=None, block=None):
         targets, block = self._findTargetsAndBlock(targets, block)
+        if self._batch is not None:
+            result = self._batch.add('get_result', (i,), dict(targets=targets))
+            result.add_callback(wrapResultList)
+            return result
         result = blockingCallFromThread(self.smultiengine.get_result, i, targets=targets, block=block)
         if block:
             result = ResultList(result)
@@ -494,6 +598,10 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
         targets, block = self._findTargetsAndBlock(targets, block)
         return self._blockFromThread(self.smultiengine.queue_status, targets=targets, block=block)
     
+    def interrupt(self, targets=None, block=None):
+        targets, block = self._findTargetsAndBlock(targets, block)
+        return self._blockFromThread(self.smultiengine.interrupt, targets=targets, block=block)
+    
     def set_properties(self, properties, targets=None, block=None):
         targets, block = self._findTargetsAndBlock(targets, block)
         return self._blockFromThread(self.smultiengine.set_properties, properties, targets=targets, block=block)
@@ -521,6 +629,28 @@ class FullBlockingMultiEngineClient(InteractiveMultiEngineClient):
     def get_ids(self):
         result = blockingCallFromThread(self.smultiengine.get_ids)
         return result
+    
+    def set_group(self, name, targets=None):
+        targets = self._findTargets(targets)
+        result = blockingCallFromThread(self.smultiengine.set_group, name, 
+            targets)
+        return result
+    
+    def del_group(self, name):
+        result = blockingCallFromThread(self.smultiengine.del_group, name)
+        return result
+    
+    def get_groups(self):
+        result = blockingCallFromThread(self.smultiengine.get_groups)
+        return result
+    
+    def get_engine_stats(self):
+        result = blockingCallFromThread(self.smultiengine.get_engine_stats)
+        return result
+    
+    def get_serialization_stats(self):
+        result = blockingCallFromThread(self.smultiengine.get_serialization_stats)
+        return result
         
     #---------------------------------------------------------------------------
     # IMultiEngineCoordinator
@@ -0,0 +1,435 @@
+# encoding: utf-8
+# -*- test-case-name: ipython1.kernel.tests.test_multiengineframed -*-
+"""A binary framed interface for an `ISynchronousMultiEngine`.
+
+This works like `multienginexmlrpc`, but over the length prefixed protocol
+of `framedrpc`.  Arguments and results are not base64 encoded or parsed
+out of XML, and numpy arrays travel as raw buffers.  Requests from one
+client are pipelined over a single connection.
+
+The controller listens for framed clients on port 10106 (and for framed
+task clients on port 10115).  To use it, set the client's 
+MultiEngineImplementation to
+``ipython1.kernel.multiengineframed.FramedFullSynchronousMultiEngineClient``
+and connectToMultiEngineControllerOn to that port in the kernel config.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from types import FunctionType
+
+from zope.interface import Interface, implements
+from twisted.internet import defer
+from twisted.python import components, failure, log
+
+from ipython1.kernel.framedrpc import FramedRPCServerFactory, FramedRPCProxy
+from ipython1.kernel.multiengine import (IMultiEngine,
+    IFullSynchronousMultiEngine,
+    ISynchronousMultiEngine)
+from ipython1.kernel.pickleutil import (can, canDict,
+    canSequence, uncan, uncanDict, uncanSequence)
+
+#-------------------------------------------------------------------------------
+# The Controller side of things
+#-------------------------------------------------------------------------------
+
+class IFramedSynchronousMultiEngine(Interface):
+    """Binary framed interface to `ISynchronousMultiEngine`.
+
+    Each ``framed_<name>`` method takes the arguments of the
+    `ISynchronousMultiEngine` method <name>.  Functions are sent canned.
+    """
+    pass
+
+
+class FramedSynchronousMultiEngineFromMultiEngine(object):
+    """Adapt `IMultiEngine` -> `ISynchronousMultiEngine` -> `IFramedSynchronousMultiEngine`.
+    """
+
+    implements(IFramedSynchronousMultiEngine)
+
+    def __init__(self, multiengine):
+        log.msg("Adapting: %r"%multiengine)
+        self.smultiengine = ISynchronousMultiEngine(multiengine)
+        self._deferredIDCallbacks = {}
+
+    #---------------------------------------------------------------------------
+    # Things related to PendingDeferredManager
+    #---------------------------------------------------------------------------
+
+    def framed_get_pending_deferred(self, deferredID, block):
+        d = self.smultiengine.get_pending_deferred(deferredID, block)
+        try:
+            callback = self._deferredIDCallbacks.pop(deferredID)
+        except KeyError:
+            callback = None
+        if callback is not None:
+            d.addCallback(callback[0], *callback[1], **callback[2])
+        return d
+
+    def framed_clear_pending_deferreds(self):
+        return defer.maybeDeferred(self.smultiengine.clear_pending_deferreds)
+
+    def framed_batch(self, calls):
+        return self.smultiengine.batch(calls)
+
+    def _addDeferredIDCallback(self, did, callback, *args, **kwargs):
+        self._deferredIDCallbacks[did] = (callback, args, kwargs)
+        return did
+
+    #---------------------------------------------------------------------------
+    # IEngineMultiplexer related methods
+    #---------------------------------------------------------------------------
+
+    def framed_execute(self, lines, targets, block):
+        return self.smultiengine.execute(lines, targets=targets, block=block)
+
+    def framed_push(self, namespace, targets, block, method='fanout'):
+        return self.smultiengine.push(namespace, targets=targets, block=block,
+            method=method)
+
+    def framed_pull(self, keys, targets, block):
+        return self.smultiengine.pull(keys, targets=targets, block=block)
+
+    def framed_push_function(self, namespace, targets, block):
+        namespace = uncanDict(namespace)
+        return self.smultiengine.push_function(namespace, targets=targets,
+            block=block)
+
+    def framed_pull_function(self, keys, targets, block):
+        def can_functions(r, keys):
+            if len(keys)==1 or isinstance(keys, str):
+                result = canSequence(r)
+            elif len(keys)>1:
+                result = [canSequence(s) for s in r]
+            return result
+        d = self.smultiengine.pull_function(keys, targets=targets, block=block)
+        if block:
+            d.addCallback(can_functions, keys)
+        else:
+            d.addCallback(lambda did: self._addDeferredIDCallback(did, can_functions, keys))
+        return d
+
+    def framed_push_serialized(self, namespace, targets, block):
+        return self.smultiengine.push_serialized(namespace, targets=targets,
+            block=block)
+
+    def framed_pull_serialized(self, keys, targets, block):
+        return self.smultiengine.pull_serialized(keys, targets=targets,
+            block=block)
+
+    def framed_get_result(self, i, targets, block):
+        return self.smultiengine.get_result(i, targets=targets, block=block)
+
+    def framed_reset(self, targets, block):
+        return self.smultiengine.reset(targets=targets, block=block)
+
+    def framed_keys(self, targets, block):
+        return self.smultiengine.keys(targets=targets, block=block)
+
+    def framed_kill(self, controller, targets, block):
+        return self.smultiengine.kill(controller, targets=targets, block=block)
+
+    def framed_clear_queue(self, targets, block):
+        return self.smultiengine.clear_queue(targets=targets, block=block)
+
+    def framed_queue_status(self, targets, block):
+        return self.smultiengine.queue_status(targets=targets, block=block)
+
+    def framed_interrupt(self, targets, block):
+        return self.smultiengine.interrupt(targets=targets, block=block)
+
+    def framed_set_properties(self, properties, targets, block):
+        return self.smultiengine.set_properties(properties, targets=targets,
+            block=block)
+
+    def framed_get_properties(self, keys, targets, block):
+        return self.smultiengine.get_properties(keys, targets=targets,
+            block=block)
+
+    def framed_has_properties(self, keys, targets, block):
+        return self.smultiengine.has_properties(keys, targets=targets,
+            block=block)
+
+    def framed_del_properties(self, keys, targets, block):
+        return self.smultiengine.del_properties(keys, targets=targets,
+            block=block)
+
+    def framed_clear_properties(self, targets, block):
+        return self.smultiengine.clear_properties(targets=targets, block=block)
+
+    #---------------------------------------------------------------------------
+    # ISynchronousMultiEngineCoordinator related methods
+    #---------------------------------------------------------------------------
+
+    def framed_scatter(self, key, seq, style, flatten, targets, block):
+        return self.smultiengine.scatter(key, seq, style, flatten,
+            targets=targets, block=block)
+
+    def framed_gather(self, key, style, targets, block):
+        return self.smultiengine.gather(key, style, targets=targets, block=block)
+
+    def framed_map(self, func, seq, style, targets, block):
+        return self.smultiengine.map(uncan(func), seq, style, targets=targets,
+            block=block)
+
+    #---------------------------------------------------------------------------
+    # IMultiEngine related methods
+    #---------------------------------------------------------------------------
+
+    def framed_get_ids(self):
+        return self.smultiengine.get_ids()
+
+    def framed_set_group(self, name, targets):
+        return self.smultiengine.set_group(name, targets)
+
+    def framed_del_group(self, name):
+        return self.smultiengine.del_group(name)
+
+    def framed_get_groups(self):
+        return self.smultiengine.get_groups()
+
+    def framed_get_engine_stats(self):
+        return self.smultiengine.get_engine_stats()
+
+    def framed_get_serialization_stats(self):
+        return self.smultiengine.get_serialization_stats()
+
+
+components.registerAdapter(FramedSynchronousMultiEngineFromMultiEngine,
+            IMultiEngine, IFramedSynchronousMultiEngine)
+
+
+class IFramedMultiEngineFactory(Interface):
+    pass
+
+
+def FramedServerFactoryFromMultiEngine(multiengine):
+    """Adapt a MultiEngine to a `FramedRPCServerFactory`."""
+    return FramedRPCServerFactory(IFramedSynchronousMultiEngine(multiengine))
+
+
+components.registerAdapter(FramedServerFactoryFromMultiEngine,
+            IMultiEngine, IFramedMultiEngineFactory)
+
+
+#-------------------------------------------------------------------------------
+# The Client side of things
+#-------------------------------------------------------------------------------
+
+class IFramedFullSynchronousMultiEngineClient(Interface):
+    pass
+
+
+class FramedFullSynchronousMultiEngineClient(object):
+    """A drop-in replacement for `XMLRPCFullSynchronousMultiEngineClient`.
+
+    Calls are pipelined over one connection to the controller, which is
+    made on the first call and remade if it is lost.
+    """
+
+    implements(IFullSynchronousMultiEngine, IFramedFullSynchronousMultiEngineClient)
+
+    def __init__(self, addr):
+        """Create a client that will connect to addr.
+
+        :Parameters:
+            addr : tuple
+                The (ip, port) of the IMultiEngine adapted controller.
+        """
+        self.addr = addr
+        self._proxy = FramedRPCProxy(addr)
+        self._deferredIDCallbacks = {}
+
+    #---------------------------------------------------------------------------
+    # Non interface methods
+    #---------------------------------------------------------------------------
+
+    def disconnect(self):
+        """Close the connection to the controller."""
+        return self._proxy.disconnect()
+
+    #---------------------------------------------------------------------------
+    # Things related to PendingDeferredManager
+    #---------------------------------------------------------------------------
+
+    def get_pending_deferred(self, deferredID, block=True):
+        d = self._proxy.callRemote('get_pending_deferred', deferredID, block)
+        try:
+            callback = self._deferredIDCallbacks.pop(deferredID)
+        except KeyError:
+            callback = None
+        if callback is not None:
+            d.addCallback(callback[0], *callback[1], **callback[2])
+        return d
+
+    def clear_pending_deferreds(self):
+        return self._proxy.callRemote('clear_pending_deferreds')
+
+    def batch(self, calls):
+        return self._proxy.callRemote('batch', calls)
+
+    def _addDeferredIDCallback(self, did, callback, *args, **kwargs):
+        self._deferredIDCallbacks[did] = (callback, args, kwargs)
+        return did
+
+    #---------------------------------------------------------------------------
+    # IEngineMultiplexer related methods
+    #---------------------------------------------------------------------------
+
+    def execute(self, lines, targets='all', block=True):
+        return self._proxy.callRemote('execute', lines, targets, block)
+
+    def push(self, namespace, targets='all', block=True, method='fanout'):
+        return self._proxy.callRemote('push', namespace, targets, block, method)
+
+    def pull(self, keys, targets='all', block=True):
+        return self._proxy.callRemote('pull', keys, targets, block)
+
+    def push_function(self, namespace, targets='all', block=True):
+        cannedNamespace = canDict(namespace)
+        return self._proxy.callRemote('push_function', cannedNamespace,
+            targets, block)
+
+    def pull_function(self, keys, targets='all', block=True):
+        def uncan_functions(r, keys):
+            if len(keys)==1 or isinstance(keys, str):
+                return uncanSequence(r)
+            elif len(keys)>1:
+                return [uncanSequence(s) for s in r]
+        d = self._proxy.callRemote('pull_function', keys, targets, block)
+        if block:
+            d.addCallback(uncan_functions, keys)
+        else:
+            d.addCallback(lambda did: self._addDeferredIDCallback(did, uncan_functions, keys))
+        return d
+
+    def push_serialized(self, namespace, targets='all', block=True):
+        return self._proxy.callRemote('push_serialized', namespace, targets,
+            block)
+
+    def pull_serialized(self, keys, targets='all', block=True):
+        return self._proxy.callRemote('pull_serialized', keys, targets, block)
+
+    def get_result(self, i=None, targets='all', block=True):
+        return self._proxy.callRemote('get_result', i, targets, block)
+
+    def reset(self, targets='all', block=True):
+        return self._proxy.callRemote('reset', targets, block)
+
+    def keys(self, targets='all', block=True):
+        return self._proxy.callRemote('keys', targets, block)
+
+    def kill(self, controller=False, targets='all', block=True):
+        return self._proxy.callRemote('kill', controller, targets, block)
+
+    def clear_queue(self, targets='all', block=True):
+        return self._proxy.callRemote('clear_queue', targets, block)
+
+    def queue_status(self, targets='all', block=True):
+        return self._proxy.callRemote('queue_status', targets, block)
+
+    def interrupt(self, targets='all', block=True):
+        return self._proxy.callRemote('interrupt', targets, block)
+
+    def set_properties(self, properties, targets='all', block=True):
+        return self._proxy.callRemote('set_properties', properties, targets,
+            block)
+
+    def get_properties(self, keys=None, targets='all', block=True):
+        return self._proxy.callRemote('get_properties', keys, targets, block)
+
+    def has_properties(self, keys, targets='all', block=True):
+        return self._proxy.callRemote('has_properties', keys, targets, block)
+
+    def del_properties(self, keys, targets='all', block=True):
+        return self._proxy.callRemote('del_properties', keys, targets, block)
+
+    def clear_properties(self, targets='all', block=True):
+        return self._proxy.callRemote('clear_properties', targets, block)
+
+    #---------------------------------------------------------------------------
+    # IMultiEngine related methods
+    #---------------------------------------------------------------------------
+
+    def get_ids(self):
+        return self._proxy.callRemote('get_ids')
+
+    def set_group(self, name, targets):
+        return self._proxy.callRemote('set_group', name, targets)
+
+    def del_group(self, name):
+        return self._proxy.callRemote('del_group', name)
+
+    def get_groups(self):
+        return self._proxy.callRemote('get_groups')
+
+    def get_engine_stats(self):
+        return self._proxy.callRemote('get_engine_stats')
+
+    def get_serialization_stats(self):
+        return self._proxy.callRemote('get_serialization_stats')
+
+    #---------------------------------------------------------------------------
+    # ISynchronousMultiEngineCoordinator related methods
+    #---------------------------------------------------------------------------
+
+    def scatter(self, key, seq, style='basic', flatten=False, targets='all', block=True):
+        return self._proxy.callRemote('scatter', key, seq, style, flatten,
+            targets, block)
+
+    def gather(self, key, style='basic', targets='all', block=True):
+        return self._proxy.callRemote('gather', key, style, targets, block)
+
+    def map(self, func, seq, style='basic', targets='all', block=True):
+        if not isinstance(func, (FunctionType, str)):
+            return defer.fail(TypeError("func must be a function or str"))
+        return self._proxy.callRemote('map', can(func), seq, style, targets,
+            block)
+
+    #---------------------------------------------------------------------------
+    # ISynchronousMultiEngineExtras related methods
+    #---------------------------------------------------------------------------
+
+    def _transformPullResult(self, pushResult, multitargets, lenKeys):
+        if not multitargets:
+            result = pushResult[0]
+        elif lenKeys > 1:
+            result = zip(*pushResult)
+        elif lenKeys is 1:
+            result = list(pushResult)
+        return result
+
+    def zip_pull(self, keys, targets='all', block=True):
+        multitargets = not isinstance(targets, int) and len(targets) > 1
+        lenKeys = len(keys)
+        d = self.pull(keys, targets=targets, block=block)
+        if block:
+            d.addCallback(self._transformPullResult, multitargets, lenKeys)
+        else:
+            d.addCallback(lambda did: self._addDeferredIDCallback(did, self._transformPullResult, multitargets, lenKeys))
+        return d
+
+    def run(self, fname, targets='all', block=True):
+        fileobj = open(fname,'r')
+        source = fileobj.read()
+        fileobj.close()
+        # if the compilation blows, we get a local error right away
+        try:
+            code = compile(source,fname,'exec')
+        except:
+            return defer.fail(failure.Failure())
+        # Now run the code
+        d = self.execute(source, targets=targets, block=block)
+        return d
@@ -27,21 +27,18 @@ from types import FunctionType
 from zope.interface import Interface, implements
 from twisted.internet import defer
 from twisted.python import components, failure, log
-from twisted.web import xmlrpc as webxmlrpc
 from ipython1.external.twisted.web2 import xmlrpc, server, channel
 
 from ipython1.kernel import error 
 from ipython1.kernel.util import printer
-from ipython1.kernel import map as Map
-from ipython1.kernel.twistedutil import gatherBoth
 from ipython1.kernel.multiengine import (MultiEngine,
     IMultiEngine,
     IFullSynchronousMultiEngine,
     ISynchronousMultiEngine)
 from ipython1.kernel.multiengineclient import wrapResultList
-from ipython1.kernel.pendingdeferred import PendingDeferredManager
 from ipython1.kernel.pickleutil import (can, canDict,
     canSequence, uncan, uncanDict, uncanSequence)
+from ipython1.kernel.xmlrpcutil import Proxy
 
 # Needed to access the true globals from __main__.__dict__ 
 import __main__
@@ -90,6 +87,11 @@ class IXMLRPCSynchronousMultiEngine(Interface):
     * xmlrpc_queue_status
     * xmlrpc_clear_queue
     * xmlrpc_get_ids
+    * xmlrpc_set_group
+    * xmlrpc_del_group
+    * xmlrpc_get_groups
+    * xmlrpc_get_engine_stats
+    * xmlrpc_get_serialization_stats
     
     These methods should always return actual results as they don't need to
     touch the actual engines and can be completed instantly.
@@ -147,6 +149,16 @@ class XMLRPCSynchronousMultiEngineFromMultiEngine(xmlrpc.XMLRPC):
     def _addDeferredIDCallback(self, did, callback, *args, **kwargs):
         self._deferredIDCallbacks[did] = (callback, args, kwargs)
         return did
+    
+    @packageResult
+    def xmlrpc_batch(self, request, binaryCalls):
+        try:
+            calls = pickle.loads(binaryCalls.data)
+        except:
+            d = defer.fail(failure.Failure())
+        else:
+            d = self.smultiengine.batch(calls)
+        return d
         
     #---------------------------------------------------------------------------
     # IEngineMultiplexer related methods
@@ -157,13 +169,14 @@ class XMLRPCSynchronousMultiEngineFromMultiEngine(xmlrpc.XMLRPC):
         return self.smultiengine.execute(lines, targets=targets, block=block)
     
     @packageResult    
-    def xmlrpc_push(self, request, binaryNS, targets, block):
+    def xmlrpc_push(self, request, binaryNS, targets, block, method='fanout'):
         try:
             namespace = pickle.loads(binaryNS.data)
         except:
             d = defer.fail(failure.Failure())
         else:
-            d = self.smultiengine.push(namespace, targets=targets, block=block)
+            d = self.smultiengine.push(namespace, targets=targets, block=block,
+                method=method)
         return d
     
     @packageResult
@@ -241,6 +254,10 @@ class XMLRPCSynchronousMultiEngineFromMultiEngine(xmlrpc.XMLRPC):
     def xmlrpc_queue_status(self, request, targets, block):
         return self.smultiengine.queue_status(targets=targets, block=block)
     
+    @packageResult
+    def xmlrpc_interrupt(self, request, targets, block):
+        return self.smultiengine.interrupt(targets=targets, block=block)
+    
     @packageResult
     def xmlrpc_set_properties(self, request, binaryNS, targets, block):
         try:
@@ -269,6 +286,45 @@ class XMLRPCSynchronousMultiEngineFromMultiEngine(xmlrpc.XMLRPC):
     def xmlrpc_clear_properties(self, request, targets, block):
         return self.smultiengine.clear_properties(targets=targets, block=block)
     
+    #---------------------------------------------------------------------------
+    # ISynchronousMultiEngineCoordinator related methods
+    #---------------------------------------------------------------------------
+    
+    # The sequence is partitioned and joined here, in the controller, so
+    # that scatter, gather and map take a single request from the client.
+    
+    @packageResult
+    def xmlrpc_scatter(self, request, key, binaryPackage, flatten, targets, block):
+        try:
+            seq, style = pickle.loads(binaryPackage.data)
+        except:
+            d = defer.fail(failure.Failure())
+        else:
+            d = self.smultiengine.scatter(key, seq, style, flatten, 
+                targets=targets, block=block)
+        return d
+    
+    @packageResult
+    def xmlrpc_gather(self, request, key, binaryStyle, targets, block):
+        try:
+            style = pickle.loads(binaryStyle.data)
+        except:
+            d = defer.fail(failure.Failure())
+        else:
+            d = self.smultiengine.gather(key, style, targets=targets, block=block)
+        return d
+    
+    @packageResult
+    def xmlrpc_map(self, request, binaryPackage, targets, block):
+        try:
+            func, seq, style = pickle.loads(binaryPackage.data)
+        except:
+            d = defer.fail(failure.Failure())
+        else:
+            d = self.smultiengine.map(uncan(func), seq, style, 
+                targets=targets, block=block)
+        return d
+    
     #---------------------------------------------------------------------------
     # IMultiEngine related methods
     #---------------------------------------------------------------------------
@@ -279,6 +335,34 @@ class XMLRPCSynchronousMultiEngineFromMultiEngine(xmlrpc.XMLRPC):
         This method always blocks.
         """
         return self.smultiengine.get_ids()
+    
+    @packageResult
+    def xmlrpc_set_group(self, request, name, targets):
+        return self.smultiengine.set_group(name, targets)
+    
+    @packageResult
+    def xmlrpc_del_group(self, request, name):
+        return self.smultiengine.del_group(name)
+    
+    @packageResult
+    def xmlrpc_get_groups(self, request):
+        return self.smultiengine.get_groups()
+    
+    @packageResult
+    def xmlrpc_get_engine_stats(self, request):
+        """Get the heartbeat statistics of the engines.
+        
+        This method always blocks.
+        """
+        return self.smultiengine.get_engine_stats()
+    
+    @packageResult
+    def xmlrpc_get_serialization_stats(self, request):
+        """Get how much pickling pushes to many engines have saved.
+        
+        This method always blocks.
+        """
+        return self.smultiengine.get_serialization_stats()
 
 
 # The __init__ method of `XMLRPCMultiEngineFromMultiEngine` first adapts the
@@ -330,12 +414,8 @@ class XMLRPCFullSynchronousMultiEngineClient(object):
         """
         self.addr = addr
         self.url = 'http://%s:%s/' % self.addr
-        self._proxy = webxmlrpc.Proxy(self.url)
+        self._proxy = Proxy(self.url)
         self._deferredIDCallbacks = {}
-        # This class manages some pending deferreds through this instance.  This
-        # is required for methods like gather/scatter as it enables us to
-        # create our own pending deferreds for composite operations.
-        self.pdm = PendingDeferredManager()
     
     #---------------------------------------------------------------------------
     # Non interface methods
@@ -344,36 +424,35 @@ class XMLRPCFullSynchronousMultiEngineClient(object):
     def unpackage(self, r):
         return pickle.loads(r.data)
     
+    def disconnect(self):
+        """Close the connections kept open to the controller."""
+        return self._proxy.close()
+    
     #---------------------------------------------------------------------------
     # Things related to PendingDeferredManager
     #---------------------------------------------------------------------------
     
     def get_pending_deferred(self, deferredID, block=True):
-        
-        # Because we are managing some pending deferreds locally (through
-        # self.pdm) and some remotely (on the controller), we first try the 
-        # local one and then the remote one.
-        if self.pdm.quick_has_id(deferredID):
-            d = self.pdm.get_pending_deferred(deferredID, block)
-            return d
-        else:
-            d = self._proxy.callRemote('get_pending_deferred', deferredID, block)
-            d.addCallback(self.unpackage)
-            try:
-                callback = self._deferredIDCallbacks.pop(deferredID)
-            except KeyError:
-                callback = None
-            if callback is not None:
-                d.addCallback(callback[0], *callback[1], **callback[2])
-            return d
+        d = self._proxy.callRemote('get_pending_deferred', deferredID, block)
+        d.addCallback(self.unpackage)
+        try:
+            callback = self._deferredIDCallbacks.pop(deferredID)
+        except KeyError:
+            callback = None
+        if callback is not None:
+            d.addCallback(callback[0], *callback[1], **callback[2])
+        return d
     
     def clear_pending_deferreds(self):
-        
-        # This clear both the local (self.pdm) and remote pending deferreds
-        self.pdm.clear_pending_deferreds()
-        d2 = self._proxy.callRemote('clear_pending_deferreds')
-        d2.addCallback(self.unpackage)
-        return d2
+        d = self._proxy.callRemote('clear_pending_deferreds')
+        d.addCallback(self.unpackage)
+        return d
+    
+    def batch(self, calls):
+        binCalls = xmlrpc.Binary(pickle.dumps(calls, 2))
+        d = self._proxy.callRemote('batch', binCalls)
+        d.addCallback(self.unpackage)
+        return d
     
     def _addDeferredIDCallback(self, did, callback, *args, **kwargs):
         self._deferredIDCallbacks[did] = (callback, args, kwargs)
@@ -388,9 +467,9 @@ class XMLRPCFullSynchronousMultiEngineClient(object):
         d.addCallback(self.unpackage)
         return d
     
-    def push(self, namespace, targets='all', block=True):
+    def push(self, namespace, targets='all', block=True, method='fanout'):
         binPackage = xmlrpc.Binary(pickle.dumps(namespace, 2))
-        d =  self._proxy.callRemote('push', binPackage, targets, block)
+        d =  self._proxy.callRemote('push', binPackage, targets, block, method)
         d.addCallback(self.unpackage)
         return d
     
@@ -464,6 +543,11 @@ class XMLRPCFullSynchronousMultiEngineClient(object):
         d.addCallback(self.unpackage)
         return d
     
+    def interrupt(self, targets='all', block=True):
+        d = self._proxy.callRemote('interrupt', targets, block)
+        d.addCallback(self.unpackage)
+        return d
+    
     def set_properties(self, properties, targets='all', block=True):
         binPackage = xmlrpc.Binary(pickle.dumps(properties, 2))
         d = self._proxy.callRemote('set_properties', binPackage, targets, block)
@@ -500,175 +584,56 @@ class XMLRPCFullSynchronousMultiEngineClient(object):
         d = self._proxy.callRemote('get_ids')
         return d
     
+    def set_group(self, name, targets):
+        d = self._proxy.callRemote('set_group', name, targets)
+        d.addCallback(self.unpackage)
+        return d
+    
+    def del_group(self, name):
+        d = self._proxy.callRemote('del_group', name)
+        d.addCallback(self.unpackage)
+        return d
+    
+    def get_groups(self):
+        d = self._proxy.callRemote('get_groups')
+        d.addCallback(self.unpackage)
+        return d
+    
+    def get_engine_stats(self):
+        d = self._proxy.callRemote('get_engine_stats')
+        d.addCallback(self.unpackage)
+        return d
+    
+    def get_serialization_stats(self):
+        d = self._proxy.callRemote('get_serialization_stats')
+        d.addCallback(self.unpackage)
+        return d
+    
     #---------------------------------------------------------------------------
     # ISynchronousMultiEngineCoordinator related methods
     #---------------------------------------------------------------------------
 
-    def _process_targets(self, targets):
-        def create_targets(ids):
-            if isinstance(targets, int):
-                engines = [targets]
-            elif targets=='all':
-                engines = ids
-            elif isinstance(targets, (list, tuple)):
-                engines = targets
-            for t in engines:
-                if not t in ids:
-                    raise error.InvalidEngineID("engine with id %r does not exist"%t)
-            return engines
-        
-        d = self.get_ids()
-        d.addCallback(create_targets)
-        return d
-    
     def scatter(self, key, seq, style='basic', flatten=False, targets='all', block=True):
-        
-        # Note: scatter and gather handle pending deferreds locally through self.pdm.
-        # This enables us to collect a bunch fo deferred ids and make a secondary 
-        # deferred id that corresponds to the entire group.  This logic is extremely
-        # difficult to get right though.
-        def do_scatter(engines):
-            nEngines = len(engines)
-            mapClass = Map.styles[style]
-            mapObject = mapClass()
-            d_list = []
-            # Loop through and push to each engine in non-blocking mode.
-            # This returns a set of deferreds to deferred_ids
-            for index, engineid in enumerate(engines):
-                partition = mapObject.getPartition(seq, index, nEngines)
-                if flatten and len(partition) == 1:
-                    d = self.push({key: partition[0]}, targets=engineid, block=False)
-                else:
-                    d = self.push({key: partition}, targets=engineid, block=False)
-                d_list.append(d)
-            # Collect the deferred to deferred_ids
-            d = gatherBoth(d_list,
-                           fireOnOneErrback=0,
-                           consumeErrors=1,
-                           logErrors=0)
-            # Now d has a list of deferred_ids or Failures coming
-            d.addCallback(error.collect_exceptions, 'scatter')
-            def process_did_list(did_list):
-                """Turn a list of deferred_ids into a final result or failure."""
-                new_d_list = [self.get_pending_deferred(did, True) for did in did_list]
-                final_d = gatherBoth(new_d_list,
-                                     fireOnOneErrback=0,
-                                     consumeErrors=1,
-                                     logErrors=0)
-                final_d.addCallback(error.collect_exceptions, 'scatter')
-                final_d.addCallback(lambda lop: [i[0] for i in lop])
-                return final_d
-            # Now, depending on block, we need to handle the list deferred_ids
-            # coming down the pipe diferently.
-            if block:
-                # If we are blocking register a callback that will transform the
-                # list of deferred_ids into the final result.
-                d.addCallback(process_did_list)
-                return d
-            else:
-                # Here we are going to use a _local_ PendingDeferredManager.
-                deferred_id = self.pdm.get_deferred_id()
-                # This is the deferred we will return to the user that will fire
-                # with the local deferred_id AFTER we have received the list of 
-                # primary deferred_ids
-                d_to_return = defer.Deferred()
-                def do_it(did_list):
-                    """Produce a deferred to the final result, but first fire the
-                    deferred we will return to the user that has the local
-                    deferred id."""
-                    d_to_return.callback(deferred_id)
-                    return process_did_list(did_list)
-                d.addCallback(do_it)
-                # Now save the deferred to the final result
-                self.pdm.save_pending_deferred(d, deferred_id)
-                return d_to_return
-
-        d = self._process_targets(targets)
-        d.addCallback(do_scatter)
+        binPackage = xmlrpc.Binary(pickle.dumps((seq, style), 2))
+        d = self._proxy.callRemote('scatter', key, binPackage, flatten, 
+            targets, block)
+        d.addCallback(self.unpackage)
         return d
-
+    
     def gather(self, key, style='basic', targets='all', block=True):
-        
-        # Note: scatter and gather handle pending deferreds locally through self.pdm.
-        # This enables us to collect a bunch fo deferred ids and make a secondary 
-        # deferred id that corresponds to the entire group.  This logic is extremely
-        # difficult to get right though.
-        def do_gather(engines):
-            nEngines = len(engines)
-            mapClass = Map.styles[style]
-            mapObject = mapClass()
-            d_list = []
-            # Loop through and push to each engine in non-blocking mode.
-            # This returns a set of deferreds to deferred_ids
-            for index, engineid in enumerate(engines):
-                d = self.pull(key, targets=engineid, block=False)
-                d_list.append(d)
-            # Collect the deferred to deferred_ids
-            d = gatherBoth(d_list,
-                           fireOnOneErrback=0,
-                           consumeErrors=1,
-                           logErrors=0)
-            # Now d has a list of deferred_ids or Failures coming
-            d.addCallback(error.collect_exceptions, 'scatter')
-            def process_did_list(did_list):
-                """Turn a list of deferred_ids into a final result or failure."""
-                new_d_list = [self.get_pending_deferred(did, True) for did in did_list]
-                final_d = gatherBoth(new_d_list,
-                                     fireOnOneErrback=0,
-                                     consumeErrors=1,
-                                     logErrors=0)
-                final_d.addCallback(error.collect_exceptions, 'gather')
-                final_d.addCallback(lambda lop: [i[0] for i in lop])
-                final_d.addCallback(mapObject.joinPartitions)
-                return final_d
-            # Now, depending on block, we need to handle the list deferred_ids
-            # coming down the pipe diferently.
-            if block:
-                # If we are blocking register a callback that will transform the
-                # list of deferred_ids into the final result.
-                d.addCallback(process_did_list)
-                return d
-            else:
-                # Here we are going to use a _local_ PendingDeferredManager.
-                deferred_id = self.pdm.get_deferred_id()
-                # This is the deferred we will return to the user that will fire
-                # with the local deferred_id AFTER we have received the list of 
-                # primary deferred_ids
-                d_to_return = defer.Deferred()
-                def do_it(did_list):
-                    """Produce a deferred to the final result, but first fire the
-                    deferred we will return to the user that has the local
-                    deferred id."""
-                    d_to_return.callback(deferred_id)
-                    return process_did_list(did_list)
-                d.addCallback(do_it)
-                # Now save the deferred to the final result
-                self.pdm.save_pending_deferred(d, deferred_id)
-                return d_to_return
-
-        d = self._process_targets(targets)
-        d.addCallback(do_gather)
+        binStyle = xmlrpc.Binary(pickle.dumps(style, 2))
+        d = self._proxy.callRemote('gather', key, binStyle, targets, block)
+        d.addCallback(self.unpackage)
         return d
-
+    
     def map(self, func, seq, style='basic', targets='all', block=True):
-        d_list = []
-        if isinstance(func, FunctionType):
-            d = self.push_function(dict(_ipython_map_func=func), targets=targets, block=False)
-            d.addCallback(lambda did: self.get_pending_deferred(did, True))
-            sourceToRun = '_ipython_map_seq_result = map(_ipython_map_func, _ipython_map_seq)'
-        elif isinstance(func, str):
-            d = defer.succeed(None)
-            sourceToRun = \
-                '_ipython_map_seq_result = map(%s, _ipython_map_seq)' % func
-        else:
-            raise TypeError("func must be a function or str")
-        
-        d.addCallback(lambda _: self.scatter('_ipython_map_seq', seq, style, targets=targets))
-        d.addCallback(lambda _: self.execute(sourceToRun, targets=targets, block=False))
-        d.addCallback(lambda did: self.get_pending_deferred(did, True))
-        d.addCallback(lambda _: self.gather('_ipython_map_seq_result', style, targets=targets, block=block))
+        if not isinstance(func, (FunctionType, str)):
+            return defer.fail(TypeError("func must be a function or str"))
+        binPackage = xmlrpc.Binary(pickle.dumps((can(func), seq, style), 2))
+        d = self._proxy.callRemote('map', binPackage, targets, block)
+        d.addCallback(self.unpackage)
         return d
-
+    
     #---------------------------------------------------------------------------
     # ISynchronousMultiEngineExtras related methods
     #---------------------------------------------------------------------------
@@ -13,6 +13,8 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 import cPickle as pickle
+import time, zlib
+from cStringIO import StringIO
 
 from zope.interface import Interface, implements
 from twisted.python import components
@@ -24,6 +26,294 @@ except ImportError:
 
 from ipython1.kernel.error import SerializationError
 
+#-------------------------------------------------------------------------------
+# Compression configuration
+#-------------------------------------------------------------------------------
+
+# Whether pushed and pulled Serialized objects are compressed with
+# `maybeCompress`.  Compressing costs CPU time on both ends, so only turn it
+# on when the network is the bottleneck.  ipcontroller and ipengine set these
+# from the 'compression' section of their kernel config, see 
+# `configureCompression`.
+COMPRESSION = False
+# Serialized objects smaller than this (in bytes) are never compressed.
+COMPRESSION_THRESHOLD = 1024*1024
+# Compressed data is only used if it is smaller than this fraction of the 
+# raw data.  Otherwise the raw data is sent.
+COMPRESSION_MAX_RATIO = 0.9
+# The default codec, must be a key of `codecs`.
+COMPRESSION_CODEC = 'zlib'
+# The zlib compression level.  Level 1 is the fastest.
+ZLIB_LEVEL = 1
+
+#-------------------------------------------------------------------------------
+# Helpers for sending arrays as raw buffers
+#-------------------------------------------------------------------------------
+
+def _contiguousArray(a):
+    """Return a contiguous version of array a and its memory order.
+    
+    C and Fortran contiguous arrays are returned as is, so their memory is
+    never copied.  Only arrays that are truly non-contiguous (slices with
+    strides, for instance) are copied into a new C ordered array.
+    
+    :Returns: A tuple of (array, order), where order is 'C' or 'F'.
+    """
+    if a.flags.c_contiguous:
+        return a, 'C'
+    elif a.flags.f_contiguous:
+        return a, 'F'
+    else:
+        return numpy.ascontiguousarray(a), 'C'
+
+def _arrayBuffer(a):
+    """Return the memory of the contiguous array a as a buffer without copying."""
+    if a.size == 0:
+        return ''
+    else:
+        return numpy.getbuffer(a)
+
+def _arrayMetadata(a, order):
+    return {'shape':a.shape,
+            'dtype':_dtypeToMetadata(a.dtype),
+            'order':order}
+
+def _isBufferable(obj):
+    """Can obj be sent as a raw buffer rather than being pickled?
+    
+    Arrays of Python objects only hold pointers, so they have to go through
+    pickle.  So do subclasses of ndarray (masked arrays, matrices), as the
+    buffer would lose their type and extra attributes.
+    """
+    return globals().has_key('numpy') and type(obj) is numpy.ndarray \
+        and not obj.dtype.hasobject
+
+def _containsArrays(obj, seen=None):
+    """Walk dicts, lists and tuples and see if they hold any bufferable array.
+    
+    seen holds the ids of the containers already walked, so containers that
+    hold themselves are only walked once.
+    """
+    if isinstance(obj, dict):
+        items = obj.itervalues()
+    elif isinstance(obj, (list, tuple)):
+        items = obj
+    else:
+        return False
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return False
+    seen.add(id(obj))
+    for item in items:
+        if _isBufferable(item) or _containsArrays(item, seen):
+            return True
+    return False
+
+def _dtypeToMetadata(dtype):
+    """Build a picklable description of dtype.
+    
+    Record/structured dtypes are sent as the dtype itself, as dtype.str only
+    gives their size (like '|V12') and dtype.descr turns padding and 
+    explicit offsets into extra anonymous fields.
+    """
+    if dtype.fields is not None:
+        return dtype
+    else:
+        return dtype.str
+
+def _arrayFromBuffer(data, metadata, copy=True):
+    """Build an ndarray from a buffer and the metadata of an 'ndarray' Serialized.
+    
+    By default the data is copied once, so the array never shares memory
+    with whatever the data came from (the buffer of the array that was
+    serialized, for instance).  With copy=False, which is only for data 
+    nothing else uses (the frames of a SerializedCollector, for instance), 
+    the array is a view of data if data is writable.  Read-only data (like 
+    a str that came off the wire) is always copied so the user gets a
+    writable array.
+    """
+    dtype = numpy.dtype(metadata['dtype'])
+    shape = metadata['shape']
+    order = metadata.get('order', 'C')
+    if len(data) == 0:
+        # numpy.frombuffer can't handle empty buffers
+        return numpy.empty(shape, dtype=dtype, order=order)
+    result = numpy.frombuffer(data, dtype=dtype)
+    if copy or not result.flags.writeable:
+        result = result.copy()
+    return result.reshape(shape, order=order)
+
+
+#-------------------------------------------------------------------------------
+# Codecs for compressing the data of Serialized objects
+#-------------------------------------------------------------------------------
+
+def _shuffle(data, itemsize):
+    """Group byte i of every item of data together.
+    
+    For numeric arrays this puts the (mostly constant) high order bytes next 
+    to each other, which helps compressors a lot.
+    """
+    a = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, itemsize)
+    return numpy.getbuffer(a.T.copy())
+
+def _unshuffle(data, itemsize):
+    a = numpy.frombuffer(data, dtype=numpy.uint8).reshape(itemsize, -1)
+    return numpy.getbuffer(a.T.copy())
+
+def _zlibEncode(data):
+    return zlib.compress(data, ZLIB_LEVEL)
+
+def _zlibDecode(data):
+    return zlib.decompress(data)
+
+# A dict of codec name: (encode, decode) functions.  Both functions take
+# and return a buffer.
+codecs = {'zlib': (_zlibEncode, _zlibDecode)}
+
+def _frameItemsizes(serial):
+    """Get the item size to shuffle each frame of serial by (0 for no shuffle)."""
+    def itemsize(md):
+        dtype = numpy.dtype(md['dtype'])
+        if dtype.kind in 'biufc' and dtype.itemsize > 1 and \
+            reduce(lambda x, y: x*y, md['shape'], 1) > 0:
+            return dtype.itemsize
+        return 0
+    typeDescriptor = serial.getTypeDescriptor()
+    if typeDescriptor == 'ndarray':
+        return [itemsize(serial.getMetadata())]
+    elif typeDescriptor == 'container':
+        return [0] + [itemsize(md) for md in serial.getMetadata()['arrays']]
+    else:
+        return [0]
+
+def compress(serial, codec=None, threshold=None):
+    """Compress the data of a Serialized object if it is worth it.
+    
+    Objects smaller than threshold bytes (`COMPRESSION_THRESHOLD` by default)
+    and objects that don't compress well are returned unchanged.  Otherwise a
+    new Serialized is returned whose metadata has a 'codec' dict recording
+    the codec name, the shuffle used for each frame, the raw size in bytes and
+    the time spent encoding.  `UnSerializeIt` uses this to decode the data 
+    transparently.
+    
+    The numeric array buffers of 'ndarray' and 'container' objects are
+    byte shuffled before they are compressed.
+    """
+    if codec is None:
+        codec = COMPRESSION_CODEC
+    if threshold is None:
+        threshold = COMPRESSION_THRESHOLD
+    md = serial.getMetadata()
+    if md.has_key('codec'):
+        return serial
+    rawSize = serial.getDataSize(1)
+    if rawSize < threshold or rawSize == 0:
+        return serial
+    try:
+        encode = codecs[codec][0]
+    except KeyError:
+        raise SerializationError("Unknown codec: %r" % codec)
+    typeDescriptor = serial.getTypeDescriptor()
+    if typeDescriptor == 'container':
+        frames = serial.getData()
+    else:
+        frames = [serial.getData()]
+    if globals().has_key('numpy'):
+        itemsizes = _frameItemsizes(serial)
+    else:
+        itemsizes = [0]*len(frames)
+    start = time.time()
+    encoded = []
+    for frame, itemsize in zip(frames, itemsizes):
+        if itemsize:
+            frame = _shuffle(frame, itemsize)
+        encoded.append(encode(frame))
+    encodeTime = time.time() - start
+    if sum([len(frame) for frame in encoded]) >= rawSize*COMPRESSION_MAX_RATIO:
+        return serial
+    md = dict(md)
+    md.pop('decoded', None)
+    md['codec'] = {'name':codec,
+                   'shuffle':itemsizes,
+                   'rawSize':rawSize,
+                   'encodeTime':encodeTime}
+    if typeDescriptor != 'container':
+        encoded = encoded[0]
+    return Serialized(encoded, typeDescriptor, md)
+
+def configureCompression(config):
+    """Set the compression globals from a config section.
+    
+    config is a dict like the 'compression' sections of the controller and
+    engine config, with the keys 'enabled', 'threshold' and 'codec'.
+    """
+    global COMPRESSION, COMPRESSION_THRESHOLD, COMPRESSION_CODEC
+    if config['codec'] not in codecs:
+        raise SerializationError("Unknown codec: %r" % config['codec'])
+    COMPRESSION = bool(config['enabled'])
+    COMPRESSION_THRESHOLD = int(config['threshold'])
+    COMPRESSION_CODEC = config['codec']
+
+def maybeCompress(serial):
+    """Compress serial with `compress` if `COMPRESSION` is on."""
+    if COMPRESSION:
+        return compress(serial)
+    else:
+        return serial
+
+def decompress(serial):
+    """Undo `compress`, returning a Serialized object with the raw data.
+    
+    The codec dict of serial, with the time spent decoding added as
+    'decodeTime', is kept under the 'decoded' key of the new metadata.
+    """
+    md = dict(serial.getMetadata())
+    codecInfo = md.pop('codec', None)
+    if codecInfo is None:
+        return serial
+    try:
+        decode = codecs[codecInfo['name']][1]
+    except KeyError:
+        raise SerializationError("Unknown codec: %r" % codecInfo['name'])
+    typeDescriptor = serial.getTypeDescriptor()
+    if typeDescriptor == 'container':
+        frames = serial.getData()
+    else:
+        frames = [serial.getData()]
+    start = time.time()
+    decoded = []
+    for frame, itemsize in zip(frames, codecInfo['shuffle']):
+        frame = decode(frame)
+        if itemsize:
+            frame = _unshuffle(frame, itemsize)
+        decoded.append(frame)
+    md['decoded'] = dict(codecInfo, decodeTime=time.time() - start)
+    if typeDescriptor != 'container':
+        decoded = decoded[0]
+    # The decoded frames are new, so the arrays can be built on top of them
+    return Serialized(decoded, typeDescriptor, md, owned=True)
+
+
+#-------------------------------------------------------------------------------
+# Serialization interfaces and classes
+#-------------------------------------------------------------------------------
+
+def _picklableState(serial):
+    """Return the __dict__ of serial with its buffer frames turned into str.
+    
+    The data of arrays is held as buffers, which can't be pickled.
+    """
+    state = serial.__dict__.copy()
+    data = state['data']
+    if isinstance(data, list):
+        state['data'] = [str(frame) for frame in data]
+    else:
+        state['data'] = str(data)
+    return state
+
+
 class ISerialized(Interface):
     
     def getData():
@@ -45,13 +335,24 @@ class IUnSerialized(Interface):
         """"""
         
 class Serialized(object):
+    """A Serialized object built from its data.
+    
+    If owned is True nothing but this object uses the data, so arrays can
+    be built on top of it when it is unserialized, without a copy.
+    """
     
     implements(ISerialized)
     
-    def __init__(self, data, typeDescriptor, metadata={}):
+    def __init__(self, data, typeDescriptor, metadata={}, owned=False):
         self.data = data
         self.typeDescriptor = typeDescriptor
         self.metadata = metadata
+        self.owned = owned
+    
+    def __getstate__(self):
+        state = _picklableState(self)
+        state['owned'] = False
+        return state
         
     def getData(self):
         return self.data
@@ -84,17 +385,10 @@ class SerializeIt(object):
     def __init__(self, unSerialized):
         self.data = None
         self.obj = unSerialized.getObject()
-        if globals().has_key('numpy'):
-            if isinstance(self.obj, numpy.ndarray):
-                if len(self.obj) == 0:         # length 0 arrays can't be reconstructed
-                    raise SerializationError("You cannot send a length 0 array")
-                self.obj = numpy.ascontiguousarray(self.obj, dtype=None)
-                self.typeDescriptor = 'ndarray'
-                self.metadata = {'shape':self.obj.shape,
-                                 'dtype':self.obj.dtype.str}
-            else:
-                self.typeDescriptor = 'pickle'
-                self.metadata = {}
+        if _isBufferable(self.obj):
+            self.obj, order = _contiguousArray(self.obj)
+            self.typeDescriptor = 'ndarray'
+            self.metadata = _arrayMetadata(self.obj, order)
         else:
             self.typeDescriptor = 'pickle'
             self.metadata = {}
@@ -102,12 +396,15 @@ class SerializeIt(object):
     
     def _generateData(self):
         if self.typeDescriptor == 'ndarray':
-            self.data = numpy.getbuffer(self.obj)
+            self.data = _arrayBuffer(self.obj)
         elif self.typeDescriptor == 'pickle':
             self.data = pickle.dumps(self.obj, 2)
         else:
             raise SerializationError("Really wierd serialization error.")
         del self.obj
+    
+    def __getstate__(self):
+        return _picklableState(self)
         
     def getData(self):
         return self.data
@@ -122,6 +419,96 @@ class SerializeIt(object):
         return self.metadata
 
 
+class IUnSerializedContainer(IUnSerialized):
+    """An unserialized dict, list or tuple that holds arrays.
+    
+    Adapting one of these to `ISerialized` gives a Serialized object whose
+    data is a list of frames instead of a single string.
+    """
+    pass
+
+
+class UnSerializedContainer(UnSerialized):
+    
+    implements(IUnSerializedContainer)
+
+
+class SerializeContainer(object):
+    """Serialize a container of arrays as a pickle plus raw array buffers.
+    
+    The container is pickled with every bufferable array replaced by a
+    persistent reference to a frame.  The data is then the list of frames::
+    
+        [structure pickle, buffer of array 0, buffer of array 1, ...]
+        
+    The arrays' buffers are not copied and their shape/dtype/order go into 
+    ``metadata['arrays']``.  Only the small structural pickle goes through 
+    pickle itself.
+    """
+    
+    implements(ISerialized)
+    
+    def __init__(self, unSerialized):
+        self.typeDescriptor = 'container'
+        arrays = []
+        arrayIndex = {}
+        def persistent_id(obj):
+            if _isBufferable(obj):
+                # The same array can be in the container more than once
+                index = arrayIndex.get(id(obj))
+                if index is None:
+                    index = arrayIndex[id(obj)] = len(arrays)
+                    arrays.append(obj)
+                return index
+            return None
+        f = StringIO()
+        p = pickle.Pickler(f, 2)
+        p.persistent_id = persistent_id
+        p.dump(unSerialized.getObject())
+        self.data = [f.getvalue()]
+        self.metadata = {'arrays':[]}
+        for a in arrays:
+            a, order = _contiguousArray(a)
+            self.metadata['arrays'].append(_arrayMetadata(a, order))
+            self.data.append(_arrayBuffer(a))
+    
+    def __getstate__(self):
+        return _picklableState(self)
+    
+    def getData(self):
+        return self.data
+    
+    def getDataSize(self, units=10.0**6):
+        return sum([len(frame) for frame in self.data])/units
+    
+    def getTypeDescriptor(self):
+        return self.typeDescriptor
+    
+    def getMetadata(self):
+        return self.metadata
+
+
+def _unserializeContainer(frames, metadata, copy=True):
+    arrayMetadata = metadata['arrays']
+    arrays = {}
+    def persistent_load(index):
+        # Keep arrays that are in the container more than once shared
+        if not arrays.has_key(index):
+            arrays[index] = _arrayFromBuffer(frames[index+1], 
+                arrayMetadata[index], copy)
+        return arrays[index]
+    u = pickle.Unpickler(StringIO(frames[0]))
+    u.persistent_load = persistent_load
+    return u.load()
+
+
+def _loads(data):
+    """Unpickle data, which may be a str or a buffer."""
+    if isinstance(data, str):
+        return pickle.loads(data)
+    return pickle.load(StringIO(data))
+
+
 class UnSerializeIt(UnSerialized):
     
     implements(IUnSerialized)
@@ -130,20 +517,22 @@ class UnSerializeIt(UnSerialized):
         self.serialized = serialized
         
     def getObject(self):
-        typeDescriptor = self.serialized.getTypeDescriptor()
+        serialized = decompress(self.serialized)
+        typeDescriptor = serialized.getTypeDescriptor()
+        copy = not getattr(serialized, 'owned', False)
         if globals().has_key('numpy'):
             if typeDescriptor == 'ndarray':
-                result = numpy.frombuffer(self.serialized.getData(), dtype = self.serialized.metadata['dtype'])
-                result.shape = self.serialized.metadata['shape']
-                # This is a hack to make the array writable.  We are working with
-                # the numpy folks to address this issue.
-                result = result.copy()
+                result = _arrayFromBuffer(serialized.getData(),
+                                          serialized.getMetadata(), copy)
+            elif typeDescriptor == 'container':
+                result = _unserializeContainer(serialized.getData(),
+                                               serialized.getMetadata(), copy)
             elif typeDescriptor == 'pickle':
-                result = pickle.loads(self.serialized.getData())
+                result = _loads(serialized.getData())
             else:
                 raise SerializationError("Really wierd serialization error.")
         elif typeDescriptor == 'pickle':
-            result = pickle.loads(self.serialized.getData())
+            result = _loads(serialized.getData())
         else:
             raise SerializationError("Really wierd serialization error.")
         return result
@@ -151,9 +540,15 @@ class UnSerializeIt(UnSerialized):
 components.registerAdapter(UnSerializeIt, ISerialized, IUnSerialized)
 
 components.registerAdapter(SerializeIt, IUnSerialized, ISerialized)
+
+components.registerAdapter(SerializeContainer, IUnSerializedContainer, ISerialized)
     
 def serialize(obj):
-    return ISerialized(UnSerialized(obj))
+    """Serialize obj, sending the arrays of dicts/lists/tuples out of band."""
+    if _containsArrays(obj):
+        return ISerialized(UnSerializedContainer(obj))
+    else:
+        return ISerialized(UnSerialized(obj))
     
 def unserialize(serialized):
     return IUnSerialized(serialized).getObject()
@@ -32,3 +32,11 @@ banana.SIZE_LIMIT = 10*1024*1024       # 10 MB
     
 # This sets the size of chunks used when paging is used.    
 CHUNK_SIZE = 64*1024
+
+# Serialized objects larger than this (in bytes) are paged in chunks of
+# CHUNK_SIZE by push_serialized and pull_serialized instead of being sent in
+# a single message.  This must be smaller than banana.SIZE_LIMIT.
+PAGING_THRESHOLD = 1024*1024
+
+# The maximum number of chunks that are sent but not yet acknowledged.
+PAGING_WINDOW = 8
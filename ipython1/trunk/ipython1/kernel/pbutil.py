@@ -16,6 +16,7 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 import cPickle as pickle
+import time
 
 from twisted.python.failure import Failure
 from twisted.python import failure
@@ -90,4 +91,65 @@ SIZE_LIMIT  (kB): %d
             % (info, len(m)/1024, pbconfig.banana.SIZE_LIMIT/1024)
         return Failure(PBMessageSizeError(s))
     else:
-        return m
\ No newline at end of file
+        return m
+
+
+#-------------------------------------------------------------------------------
+# Pickling a namespace once for many engines
+#-------------------------------------------------------------------------------
+
+# Counters for the pickling that was avoided by PickleOnceNamespace.
+# 'pickled' is the number of namespaces pickled, 'reused' the number of times
+# a pickle was reused and 'timeSaved' the time in seconds that pickling them
+# again would have taken.  Clients read them with 
+# IMultiEngine.get_serialization_stats.
+serializationStats = {'pickled':0, 'reused':0, 'timeSaved':0.0}
+
+def resetSerializationStats():
+    serializationStats.update(pickled=0, reused=0, timeSaved=0.0)
+
+
+class PickleOnceNamespace(dict):
+    """A namespace dict that remembers its pickled form.
+    
+    When the same namespace is pushed to many engines, wrapping it in this
+    lets `pickleNamespace` pickle it once and reuse the result for all of
+    the engines.  It is a dict so engines that don't pickle can use it as is.
+    """
+    
+    def __init__(self, namespace):
+        dict.__init__(self, namespace)
+        self._packages = {}
+    
+    def package(self, transform=None):
+        """Return the namespace pickled after applying transform to a copy."""
+        if self._packages.has_key(transform):
+            package, elapsed = self._packages[transform]
+            serializationStats['reused'] += 1
+            serializationStats['timeSaved'] += elapsed
+            return package
+        start = time.time()
+        namespace = dict(self)
+        if transform is not None:
+            namespace = transform(namespace)
+        package = pickle.dumps(namespace, 2)
+        self._packages[transform] = (package, time.time()-start)
+        serializationStats['pickled'] += 1
+        return package
+
+
+def pickleNamespace(namespace, transform=None):
+    """Pickle namespace, reusing the pickle of a PickleOnceNamespace.
+    
+    :Parameters:
+        namespace : dict
+            The namespace to pickle.
+        transform : callable
+            Applied to the namespace before pickling, for example canDict.
+            It may modify a plain dict in place.
+    """
+    if isinstance(namespace, PickleOnceNamespace):
+        return namespace.package(transform)
+    if transform is not None:
+        namespace = transform(namespace)
+    return pickle.dumps(namespace, 2)
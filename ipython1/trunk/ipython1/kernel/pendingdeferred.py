@@ -21,6 +21,9 @@ __docformat__ = "restructuredtext en"
 # Imports
 #-------------------------------------------------------------------------------
 
+import time
+from collections import deque
+
 from twisted.application import service
 from twisted.internet import defer, reactor
 from twisted.python import log, components, failure
@@ -39,14 +42,26 @@ class PendingDeferredManager(object):
     calls `save_pending_deferred` passing that id and the deferred to
     be tracked.  To later retrieve it, the user calls
     `get_pending_deferred` passing the id.
+    
+    Results that are never retrieved would be kept forever.  To prevent
+    this, set `maxResults` to the most unclaimed results to keep, or
+    `resultTTL` to the number of seconds to keep them.  The oldest results
+    are then deleted, and the number deleted for each reason is counted in 
+    `evicted`.
     """
     
+    maxResults = None   # the most unclaimed results to keep, None for no limit
+    resultTTL = None    # the time in seconds to keep unclaimed results
+    
     def __init__(self):
         """Manage pending deferreds."""
 
         self.results = {} # Populated when results are ready
-        self.deferred_ids = [] # List of deferred ids I am managing
+        self.deferred_ids = set() # Set of deferred ids I am managing
         self.deferreds_to_callback = {} # dict of lists of deferreds to callback
+        self.finished = deque() # (deferred_id, time) in the order results came
+        self.evicted = {'maxResults':0, 'resultTTL':0}
+        self.clock = time.time
         
     def get_deferred_id(self):
         return guid.generate()
@@ -57,22 +72,47 @@ class PendingDeferredManager(object):
     def _save_result(self, result, deferred_id):
         if self.quick_has_id(deferred_id):
             self.results[deferred_id] = result
+            self.finished.append((deferred_id, self.clock()))
             self._trigger_callbacks(deferred_id)
+            self._evict()
     
     def _trigger_callbacks(self, deferred_id):
-        # Go through and call the waiting callbacks
-        result = self.results.get(deferred_id)
-        if result is not None:  # Only trigger if there is a result
-            try:
-                d = self.deferreds_to_callback.pop(deferred_id)
-            except KeyError:
-                d = None
-            if d is not None:
-                if isinstance(result, failure.Failure):
-                    d.errback(result)
-                else:
-                    d.callback(result)
-                self.delete_pending_deferred(deferred_id)
+        # Call the waiting callback, if there is one
+        try:
+            d = self.deferreds_to_callback.pop(deferred_id)
+        except KeyError:
+            return
+        result = self.results[deferred_id]
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+        self.delete_pending_deferred(deferred_id)
+    
+    def _evict(self):
+        """Delete the oldest unclaimed results beyond the limits."""
+        finished = self.finished
+        now = self.clock()
+        while finished:
+            deferred_id, finishedAt = finished[0]
+            if deferred_id not in self.results:
+                # Already claimed or deleted
+                finished.popleft()
+                continue
+            if self.maxResults is not None and \
+                    len(self.results) > self.maxResults:
+                reason = 'maxResults'
+            elif self.resultTTL is not None and \
+                    now - finishedAt > self.resultTTL:
+                reason = 'resultTTL'
+            else:
+                break
+            finished.popleft()
+            self.evicted[reason] += 1
+            self.delete_pending_deferred(deferred_id)
+        if len(finished) > 2*len(self.results) + 16:
+            self.finished = deque([(did, t) for did, t in finished
+                if did in self.results])
                    
     def save_pending_deferred(self, d, deferred_id=None):
         """Save the result of a deferred for later retrieval.
@@ -84,16 +124,11 @@ class PendingDeferredManager(object):
         """
         if deferred_id is None:
             deferred_id = self.get_deferred_id()
-        self.deferred_ids.append(deferred_id)
+        self.deferred_ids.add(deferred_id)
         d.addBoth(self._save_result, deferred_id)
+        self._evict()
         return deferred_id
     
-    def _protected_del(self, key, container):
-        try:
-            del container[key]
-        except Exception:
-            pass
-    
     def delete_pending_deferred(self, deferred_id):
         """Remove a deferred I am tracking and add a null Errback.
         
@@ -103,21 +138,20 @@ class PendingDeferredManager(object):
         """
         if self.quick_has_id(deferred_id):
             # First go through a errback any deferreds that are still waiting
-            d = self.deferreds_to_callback.get(deferred_id)
+            d = self.deferreds_to_callback.pop(deferred_id, None)
             if d is not None:
                 d.errback(failure.Failure(error.AbortedPendingDeferredError("pending deferred has been deleted: %r"%deferred_id)))
             # Now delete all references to this deferred_id
-            ind = self.deferred_ids.index(deferred_id)
-            self._protected_del(ind, self.deferred_ids)
-            self._protected_del(deferred_id, self.deferreds_to_callback)
-            self._protected_del(deferred_id, self.results)            
+            self.deferred_ids.discard(deferred_id)
+            self.results.pop(deferred_id, None)
         else:
             raise error.InvalidDeferredID('invalid deferred_id: %r' % deferred_id)
     
     def clear_pending_deferreds(self):
         """Remove all the deferreds I am tracking."""
-        for did in self.deferred_ids:
+        for did in list(self.deferred_ids):
             self.delete_pending_deferred(did)
+        self.finished.clear()
         
     def _delete_and_pass_through(self, r, deferred_id):
         self.delete_pending_deferred(deferred_id)
@@ -125,9 +159,9 @@ class PendingDeferredManager(object):
         
     def get_pending_deferred(self, deferred_id, block):
         if not self.quick_has_id(deferred_id) or self.deferreds_to_callback.get(deferred_id) is not None:
-            return defer.fail(failure.Failure(error.InvalidDeferredID('invalid deferred_id: %r' + deferred_id)))
-        result = self.results.get(deferred_id)
-        if result is not None:
+            return defer.fail(failure.Failure(error.InvalidDeferredID('invalid deferred_id: %r' % deferred_id)))
+        if deferred_id in self.results:
+            result = self.results[deferred_id]
             self.delete_pending_deferred(deferred_id)
             if isinstance(result, failure.Failure):
                 return defer.fail(result)
@@ -169,6 +203,8 @@ def two_phase(wrapped_method):
             deferred_id=pdm.save_pending_deferred(d)
             return defer.succeed(deferred_id)
     
+    wrapper_two_phase.__name__ = wrapped_method.__name__
+    wrapper_two_phase.__doc__ = wrapped_method.__doc__
     return wrapper_two_phase
                 
                 
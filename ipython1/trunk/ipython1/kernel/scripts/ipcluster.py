@@ -25,6 +25,12 @@ contain.
 Notes
 -----
 
+The engines are all started at once as soon as the controller listens for
+them, and %prog then waits until the controller says that all of them have
+registered.  If that doesn't happen within the timeout (-t), it reports the
+engines that exited or never registered and exits with an error instead of
+announcing a cluster that isn't there.
+
 WARNING: this code is still UNFINISHED and EXPERIMENTAL!  It is incomplete,
 some listed options are not really implemented, and all of its interfaces are
 subject to change.
@@ -82,12 +88,13 @@ __docformat__ = "restructuredtext en"
 #---------------------------------------------------------------------------
 
 import os
+import select
 import signal
 import sys
 import time
 
 from optparse import OptionParser
-from subprocess import Popen,call
+from subprocess import Popen,PIPE,call
 
 #---------------------------------------------------------------------------
 # IPython imports
@@ -131,6 +138,9 @@ def parse_args():
     newopt('-f','--cluster-file',dest='clusterfile',
            help='file describing a remote cluster')
 
+    newopt("-t", "--timeout", type="float", dest="timeout", default=60.0,
+           help="seconds to wait for all the engines to register")
+
     return parser.parse_args()
 
 def numAlive(controller,engines):
@@ -177,6 +187,84 @@ def startMsg(control_host,control_port=10105):
     print
 
     
+def readStatus(controller, deadline):
+    """Return the words of the next status line written by the controller.
+
+    The controller is started with --ready-engines, so it writes a line when
+    it is listening, when engines register and unregister and when enough
+    of them have registered (see ipcontroller.announceReadiness).  None is
+    returned if the deadline passes or the controller exits first.
+    """
+    fd = controller.stdout.fileno()
+    left = deadline - time.time()
+    if left <= 0 or not select.select([fd],[],[],left)[0]:
+        return None
+    line = controller.stdout.readline()
+    if not line:
+        return None
+    return line.split()
+
+def waitForController(controller, deadline):
+    """Wait until the controller listens for engines, return True if it does."""
+    while True:
+        words = readStatus(controller, deadline)
+        if words is None:
+            return False
+        if words == ['listening']:
+            return True
+
+def waitForEngines(controller, engines, deadline):
+    """Wait until the controller says that all the engines have registered.
+
+    Engines do not retry a failed connection, so this also gives up as soon
+    as the controller or any of the engine processes exits.
+
+    :Returns: (ready, ids), where ids is the set of registered engine ids.
+    """
+    ids = set()
+    while True:
+        words = readStatus(controller, min(deadline, time.time()+0.5))
+        if words is not None:
+            if words[0] == 'registered':
+                ids.add(int(words[1]))
+            elif words[0] == 'unregistered':
+                ids.discard(int(words[1]))
+            elif words[0] == 'ready':
+                return True, ids
+        elif time.time() >= deadline or controller.poll() is not None or \
+                 [e for e in engines if e.poll() is not None]:
+            return False, ids
+
+def registeredPids(controller, ids):
+    """Map the pids of the registered engines of a local controller to ids.
+
+    This reads the engine info log the controller writes as engines
+    register, see ControllerService._logEngineInfoToFile.
+    """
+    fname = os.path.join(cutils.get_ipython_dir(),'log',
+                         'ipcontroller-%s-engine-info.log' % controller.pid)
+    pids = {}
+    try:
+        lines = open(fname).readlines()
+    except IOError:
+        return pids
+    for line in lines:
+        words = line.split()
+        if len(words) == 6 and int(words[2]) in ids:
+            pids[int(words[5])] = int(words[2])
+    return pids
+
+def failureMsg(controller, listening, n, ids):
+    """Print why the cluster did not become ready."""
+    print
+    print '*'*75
+    if not listening:
+        print 'ERROR: the controller never started listening for engines.'
+    elif controller.poll() is not None:
+        print 'ERROR: the controller exited with code %s.' % controller.returncode
+    else:
+        print 'ERROR: only %d of %d engines registered.' % (len(ids), n)
+
 def clusterLocal(opt,arg):
     """Start a cluster on the local machine."""
     
@@ -190,39 +278,64 @@ def clusterLocal(opt,arg):
         ensureDir(logdir_base)
         logfile = pjoin(logdir_base,'ipcluster-')
 
+    startTime = time.time()
+    deadline = startTime + opt.timeout
     print 'Starting controller:',
-    controller = Popen(['ipcontroller','--logfile',logfile])
+    controller = Popen(['ipcontroller','--logfile',logfile,
+                        '--ready-engines',str(opt.n)], stdout=PIPE)
     print 'Controller PID:',controller.pid
 
-    print 'Starting engines:   ',
-    time.sleep(3)
-
     englogfile = '%s%s-' % (logfile,controller.pid)
-    mpi = opt.mpi
-    if mpi: # start with mpi - killing the engines with sigterm will not work if you do this
-        engines = [Popen(['mpirun', '-np', str(opt.n), 'ipengine', '--mpi', mpi, '--logfile',englogfile])]
-    else: # do what we would normally do
-        engines = [ Popen(['ipengine','--logfile',englogfile])
-                    for i in range(opt.n) ]
-    eids = [e.pid for e in engines]
-    print 'Engines PIDs:  ',eids
-    print 'Log files: %s*' % englogfile
+    engines = []
+    ready, ids = False, set()
+    listening = waitForController(controller, deadline)
+    if listening:
+        print 'Starting engines:   ',
+        mpi = opt.mpi
+        if mpi: # start with mpi - killing the engines with sigterm will not work if you do this
+            engines = [Popen(['mpirun', '-np', str(opt.n), 'ipengine', '--mpi', mpi, '--logfile',englogfile])]
+        else: # do what we would normally do
+            engines = [ Popen(['ipengine','--logfile',englogfile])
+                        for i in range(opt.n) ]
+        eids = [e.pid for e in engines]
+        print 'Engines PIDs:  ',eids
+        print 'Log files: %s*' % englogfile
+        ready, ids = waitForEngines(controller, engines, deadline)
+
+    if not ready:
+        failureMsg(controller, listening, opt.n, ids)
+        if not opt.mpi:
+            pids = registeredPids(controller, ids)
+            for e in engines:
+                if e.poll() is not None:
+                    print 'Engine pid %d exited with code %d, see %s%d.log' % \
+                          (e.pid, e.returncode, englogfile, e.pid)
+                elif e.pid not in pids:
+                    print 'Engine pid %d did not register, see %s%d.log' % \
+                          (e.pid, englogfile, e.pid)
+        print 'Controller log: %s%d.log' % (logfile, controller.pid)
+        print '*'*75
+        print
+    else:
+        print 'All %d engines registered in %.1f seconds.' % \
+              (opt.n, time.time()-startTime)
     
-    proc_ids = eids + [controller.pid]
+    proc_ids = [e.pid for e in engines] + [controller.pid]
     procs = engines + [controller]
 
     grpid = os.getpgrp()
     try:
-        startMsg('127.0.0.1')
-        print 'You can also hit Ctrl-C to stop it, or use from the cmd line:'
-        print
-        print 'kill -INT',grpid
-        print
-        try:
-            while True:
-                time.sleep(5)
-        except:
-            pass
+        if ready:
+            startMsg('127.0.0.1')
+            print 'You can also hit Ctrl-C to stop it, or use from the cmd line:'
+            print
+            print 'kill -INT',grpid
+            print
+            try:
+                while True:
+                    time.sleep(5)
+            except:
+                pass
     finally:
         print 'Stopping cluster.  Cleaning up...'
         cleanup(stop,controller,engines)
@@ -252,6 +365,9 @@ def clusterLocal(opt,arg):
             print
             print 'Zombie summary:',' '.join(map(str,zombies))
 
+    if not ready:
+        sys.exit(1)
+
 def clusterRemote(opt,arg):
     """Start a remote cluster over SSH"""
 
@@ -276,35 +392,57 @@ def clusterRemote(opt,arg):
     # Append this script's PID to the logfile name always
     logfile = '%s-%s' % (logfile,os.getpid())
     
-    print 'Starting controller:'
-    # Controller data:
-    xsys = os.system
-
-    contHost = contConfig['host']
-    contLog = '%s-con-%s-' % (logfile,contHost)
-    cmd = "ssh %s '%s' 'ipcontroller --logfile %s' &" % \
-          (contHost,sshx,contLog)
-    #print 'cmd:<%s>' % cmd  # dbg
-    xsys(cmd)
-    time.sleep(2)
-
-    print 'Starting engines:   '
+    startTime = time.time()
+    deadline = startTime + opt.timeout
+    # ssh must not read from our terminal, and every ssh process is kept so
+    # that we can tell which engines failed to start.
+    devnull = open(os.devnull)
+    numEngines = 0
     for engineHost,engineData in engConfig.iteritems():
         if isinstance(engineData,int):
-            numEngines = engineData
+            numEngines += engineData
         else:
             raise NotImplementedError('port configuration not finished for engines')
 
-        print 'Sarting %d engines on %s' % (numEngines,engineHost)
-        engLog = '%s-eng-%s-' % (logfile,engineHost)
-        for i in range(numEngines):
-            cmd = "ssh %s '%s' 'ipengine --controller-ip %s --logfile %s' &" % \
-                      (engineHost,sshx,contHost,engLog)
+    print 'Starting controller:'
+    # Controller data:
+    contHost = contConfig['host']
+    contLog = '%s-con-%s-' % (logfile,contHost)
+    cmd = ['ssh',contHost,sshx,'ipcontroller --logfile %s --ready-engines %d' %
+           (contLog,numEngines)]
+    #print 'cmd:<%s>' % cmd  # dbg
+    controller = Popen(cmd,stdin=devnull,stdout=PIPE)
+
+    engines = []
+    ready, ids = False, set()
+    listening = waitForController(controller, deadline)
+    if listening:
+        print 'Starting engines:   '
+        for engineHost,numEngines in engConfig.iteritems():
+            print 'Starting %d engines on %s' % (numEngines,engineHost)
+            engLog = '%s-eng-%s-' % (logfile,engineHost)
+            cmd = ['ssh',engineHost,sshx,
+                   'ipengine --controller-ip %s --logfile %s' % (contHost,engLog)]
             #print 'cmd:<%s>' % cmd  # dbg
-            xsys(cmd)
-        # Wait after each host a little bit
-        time.sleep(1)
-            
+            engines.extend([(engineHost,Popen(cmd,stdin=devnull))
+                            for i in range(numEngines)])
+        ready, ids = waitForEngines(controller, [e for h,e in engines],
+                                    deadline)
+
+    if not ready:
+        failureMsg(controller, listening, len(engines), ids)
+        for engineHost,e in engines:
+            if e.poll() is not None:
+                print 'ssh to %s for an engine exited with code %d' % \
+                      (engineHost, e.returncode)
+        print 'See the logs on the hosts: %s*' % logfile
+        print 'Processes that did start are left running.'
+        print '*'*75
+        print
+        sys.exit(1)
+
+    print 'All %d engines registered in %.1f seconds.' % \
+          (len(engines), time.time()-startTime)
     startMsg(contConfig['host'])
         
 def main():
@@ -25,13 +25,45 @@ from twisted.python import log
 # from ipython1.tools import growl
 # growl.start("IPython1 Controller")
 
-from ipython1.kernel import controllerservice
+from ipython1.kernel import controllerservice, newserialized
 from ipython1.kernel.multiengine import IMultiEngine
 from ipython1.kernel.task import ITaskController
 
 from ipython1.kernel.config import configManager as kernelConfigManager
 
-def main(logfile):
+def announceReadiness(cs, n):
+    """Write the progress of the engine registrations to stdout.
+    
+    This is how ipcluster knows when the controller is listening and when
+    n engines have registered.  The lines are::
+    
+        listening
+        registered <id>
+        unregistered <id>
+        ready <number of engines>
+    
+    They go to the real stdout, as twisted's log takes over sys.stdout.
+    Nothing more is written after the ready line, so ipcluster can stop
+    reading without the controller ever blocking on a full pipe.
+    """
+    out = sys.__stdout__
+    def say(*words):
+        out.write(' '.join([str(w) for w in words]) + '\n')
+        out.flush()
+    def registered(id):
+        say('registered', id)
+    def unregistered(id):
+        say('unregistered', id)
+    def ready():
+        cs.on_register_engine_do_not(registered)
+        cs.on_unregister_engine_do_not(unregistered)
+        say('ready', len(cs.engines))
+    cs.on_register_engine_do(registered, True)
+    cs.on_unregister_engine_do(unregistered, True)
+    cs.on_n_engines_registered_do(n, ready)
+    reactor.callWhenRunning(say, 'listening')
+
+def main(logfile, readyEngines=None):
     co = kernelConfigManager.get_config_obj()
     if logfile:
         logfile = logfile + str(os.getpid()) + '.log'
@@ -51,8 +83,16 @@ def main(logfile):
         except:
             log.msg("Error running controllerImportStatement: %s" % cis)
     
+    comp = co['controller']['compression']
+    newserialized.configureCompression(dict(enabled=comp.as_bool('enabled'),
+        threshold=comp.as_int('threshold'), codec=comp['codec']))
+    
     # Create and configure the core ControllerService
-    cs = controllerservice.ControllerService()
+    hb = co['controller']['heartbeat']
+    cs = controllerservice.ControllerService(
+        heartbeatPeriod=hb.as_float('period'),
+        heartbeatTimeout=hb.as_float('timeout'),
+        heartbeatAction=hb['action'])
     
     # Start listening for engines
     efac = kernelConfigManager._import(co['controller']['engineServerProtocolInterface'])(cs)
@@ -72,8 +112,12 @@ def main(logfile):
                 factory=fac,
                 interface=ni['ip'])
                     
+    if readyEngines:
+        announceReadiness(cs, readyEngines)
+    
     # Start the controller service and set things running
     cs.startService()
+    reactor.addSystemEventTrigger('before', 'shutdown', cs.stopService)
     reactor.run()
 
 def start():
@@ -95,8 +139,19 @@ def start():
     parser.add_option("--remote-cont-ip", type="string", dest="rcip",
         help="the TCP ip address the controller will listen on for Remote Controller client connections")
 
+    parser.add_option("--heartbeat-period", type="float", dest="hbperiod",
+        help="ping the engines this often in seconds (0 for never)")
+    parser.add_option("--heartbeat-timeout", type="float", dest="hbtimeout",
+        help="quarantine engines that don't answer a ping for this many seconds")
+    parser.add_option("--compression", action="store_true", dest="compression",
+        help="compress large objects pushed with push_serialized")
+    parser.add_option("--compression-threshold", type="int", dest="compthreshold",
+        help="only compress objects of at least this many bytes")
+
     parser.add_option("-l", "--logfile", type="string", dest="logfile",
         help="log file name (default is stdout)")
+    parser.add_option("--ready-engines", type="int", dest="readyengines",
+        help="report engine registrations on stdout until this many engines have registered (used by ipcluster)")
     
     # Configuration files and profiles
     # parser.add_option("-p", "--profile", type="string", dest="profile",
@@ -132,8 +187,17 @@ def start():
     if options.taskport is not None:
         co['controller']['controllerInterfaces']['task']['networkInterfaces'][di]['port'] = options.taskport
 
+    if options.hbperiod is not None:
+        co['controller']['heartbeat']['period'] = options.hbperiod
+    if options.hbtimeout is not None:
+        co['controller']['heartbeat']['timeout'] = options.hbtimeout
+    if options.compression:
+        co['controller']['compression']['enabled'] = True
+    if options.compthreshold is not None:
+        co['controller']['compression']['threshold'] = options.compthreshold
+
     kernelConfigManager.update_config_obj(co)
-    main(options.logfile)
+    main(options.logfile, options.readyengines)
     
     
 if __name__ == "__main__":
@@ -23,6 +23,8 @@ from twisted.internet import reactor
 from twisted.python import log
 
 from ipython1.kernel.engineservice import EngineService
+from ipython1.kernel.engineprocess import ProcessEngineService
+from ipython1.kernel import newserialized
 
 from ipython1.kernel.config import configManager as kernelConfigManager
 from ipython1.core.config import configManager as coreConfigManager
@@ -39,7 +41,7 @@ from ipython1.core.config import configManager as coreConfigManager
 #     except ImportError:
 #         mpi = None
 
-def main(n, logfile):
+def main(n, logfile, process=False):
     kco = kernelConfigManager.get_config_obj()
     cco = coreConfigManager.get_config_obj()
     
@@ -63,9 +65,17 @@ def main(n, logfile):
         openLogFile = sys.stdout
     log.startLogging(openLogFile)
     
+    comp = kco['engine']['compression']
+    newserialized.configureCompression(dict(enabled=comp.as_bool('enabled'),
+        threshold=comp.as_int('threshold'), codec=comp['codec']))
+    
     for i in range(n):
         shellClass = coreConfigManager._import(cco['shell']['shellClass'])
-        service = EngineService(shellClass, mpi=mpi)
+        if process:
+            # The worker process has no MPI
+            service = ProcessEngineService(shellClass)
+        else:
+            service = EngineService(shellClass, mpi=mpi)
         fac = kernelConfigManager._import(kco['engine']['engineClientProtocolInterface'])(service)
         reactor.connectTCP(
             host=kco['engine']['connectToControllerOn']['ip'], 
@@ -88,6 +98,7 @@ def start(n=1):
     parser.set_defaults(rcfile='')
     parser.set_defaults(ipythondir='')
     parser.set_defaults(logfile='')
+    parser.set_defaults(process=False)
 
     parser.add_option("--controller-port", type="int", dest="controllerport",
         help="the TCP port the controller is listening on")
@@ -99,6 +110,12 @@ def start(n=1):
         help="the number of engines to start in this process")
     parser.add_option("-l", "--logfile", type="string", dest="logfile",
         help="log file name (default is stdout)")
+    parser.add_option("--process", action="store_true", dest="process",
+        help="run the user's code in a worker process that can be interrupted")
+    parser.add_option("--compression", action="store_true", dest="compression",
+        help="compress large objects pulled with pull_serialized")
+    parser.add_option("--compression-threshold", type="int", dest="compthreshold",
+        help="only compress objects of at least this many bytes")
     
     # Configuration files and profiles
     # parser.add_option("-p", "--profile", type="string", dest="profile",
@@ -126,8 +143,12 @@ def start(n=1):
         kco['engine']['connectToControllerOn']['port'] = options.controllerport
     if options.mpi is not None:
         kco['mpi']['default'] = options.mpi
+    if options.compression:
+        kco['engine']['compression']['enabled'] = True
+    if options.compthreshold is not None:
+        kco['engine']['compression']['threshold'] = options.compthreshold
         
-    main(options.n, options.logfile)
+    main(options.n, options.logfile, options.process)
     
 if __name__ == "__main__":
     start()
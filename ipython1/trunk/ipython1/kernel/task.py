@@ -15,11 +15,15 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 # Imports
 #-------------------------------------------------------------------------------
-import copy
+import copy, heapq, shelve, time
+import cPickle as pickle
+from bisect import bisect_right
+from collections import deque
 from types import FunctionType as function
 
 import zope.interface as zi, string
 from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall
 from twisted.python import components, log, failure
 
 from ipython1.kernel import engineservice as es, error
@@ -78,7 +82,12 @@ class Task(object):
             not.
             Default=None - run on any worker
         options : dict
-            Any other keyword options for more elaborate uses of tasks
+            Any other keyword options for more elaborate uses of tasks, such
+            as the `priority` and `deadline` used by the `PriorityScheduler`
+            or `speculative`.  If speculative is True, the `TaskController`
+            may run a copy of the task on an idle worker when it is taking
+            much longer than usual, and use whichever result comes first.
+            Only use it for tasks that can safely run more than once.
     
     Examples
     --------
@@ -235,6 +244,33 @@ class IWorker(zi.Interface):
         
         :Returns: `Deferred` to a `TaskResult` object.
         """
+    
+    def run_batch(tasks):
+        """Run a list of tasks in worker's namespace, one after the other.
+        
+        This is optional.  The `TaskController` only batches tasks for
+        workers that have it.
+        
+        :Parameters:
+            tasks : a list of `Task` objects
+        
+        :Returns: `Deferred` to a list of `TaskResult` objects.
+        """
+    
+    def interrupt():
+        """Interrupt the task the worker is running.
+        
+        This is optional.  The `TaskController` uses it to stop the copies
+        of a speculative task that lost.
+        
+        :Returns: `Deferred` to True if a task was interrupted.
+        """
+
+
+def taskDict(task):
+    """Return the parts of a task that the engine needs to run it."""
+    return dict(expression=task.expression, push=task.push, pull=task.pull,
+        clear_before=task.clear_before, clear_after=task.clear_after)
 
 
 class WorkerFromQueuedEngine(object):
@@ -282,6 +318,43 @@ class WorkerFromQueuedEngine(object):
         
         return d.addBoth(self._zipResults, task.pull)
     
+    def run_batch(self, tasks):
+        """Run a list of tasks in worker's namespace.
+        
+        If the engine provides `IEngineTasks` the tasks are run in a single
+        call, otherwise they are run one after the other.
+        
+        :Parameters:
+            tasks : a list of `Task` objects
+        
+        :Returns: `Deferred` to a list of `TaskResult` objects.
+        """
+        if not es.IEngineTasks.providedBy(self.queuedEngine):
+            results = []
+            d = defer.succeed(None)
+            for task in tasks:
+                d.addCallback(lambda _, task=task: self.run(task))
+                d.addCallback(results.append)
+            return d.addCallback(lambda _: results)
+        d = self.queuedEngine.run_tasks(map(taskDict, tasks))
+        d.addCallback(lambda results: [self._zipResults(r, task.pull) 
+            for r, task in zip(results, tasks)])
+        # If the whole batch failed, so did every task in it
+        d.addErrback(lambda f: [self._zipResults(f, task.pull) 
+            for task in tasks])
+        return d
+    
+    def interrupt(self):
+        """Interrupt the task the worker is running.
+        
+        Engines that don't provide `IEngineInterruptible` are left alone.
+        
+        :Returns: `Deferred` to True if a task was interrupted.
+        """
+        if es.IEngineInterruptible.providedBy(self.queuedEngine):
+            return self.queuedEngine.interrupt()
+        return defer.succeed(False)
+    
     def _zipResults(self, result, names):
         """Callback for construting the TaskResult object."""
         if isinstance(result, failure.Failure):
@@ -368,7 +441,6 @@ class IScheduler(zi.Interface):
 
 class FIFOScheduler(object):
     """A basic First-In-First-Out (Queue) Scheduler.
-    This is the default Scheduler for the TaskController.
     See the docstrings for IScheduler for interface details.
     """
     
@@ -452,6 +524,470 @@ class LIFOScheduler(FIFOScheduler):
         # self.workers.reverse()
     
 
+class _TaskEntry(object):
+    """A queued task in an IndexedScheduler."""
+    
+    __slots__ = ('seq', 'task', 'removed', 'checkedAt')
+    
+    def __init__(self, seq, task):
+        self.seq = seq
+        self.task = task
+        self.removed = False
+        # The event up to which depend has failed on all idle workers.
+        self.checkedAt = -1
+
+
+class IndexedScheduler(object):
+    """A First-In-First-Out Scheduler for large numbers of tasks and workers.
+    This is the default Scheduler for the TaskController.
+    
+    Tasks are scheduled in the same order as by the `FIFOScheduler`: each
+    time, the first queued task that can run on an idle worker.  A task
+    without a dependency goes to the worker that has been idle longest, as
+    there.  A task with a dependency goes to the idle worker it can run on
+    that was added, or last had its properties changed, longest ago.  This
+    is not always the one that has been idle longest, because a worker whose
+    properties change while it is idle goes to the back.
+    
+    Tasks and workers are kept in deques and indexed by id, so adding and 
+    popping them is O(1).  Tasks without a dependency are kept apart from 
+    tasks with one, so they are scheduled without looking at any 
+    dependencies.
+    
+    The results of `Task.depend` are cached.  Every time a worker is added
+    or the version of its properties (see `StrictDict`) changes, an event
+    counter is incremented.  A task that can't run on any of the idle
+    workers remembers the event at which that was checked, so depend is 
+    only called again for workers that were added or changed after that.
+    Workers whose properties have no version are checked every time.
+    
+    See the docstrings for IScheduler for interface details.
+    """
+    
+    zi.implements(IScheduler)
+    
+    def __init__(self):
+        self._seq = 0
+        self._entries = {}      # {taskid:_TaskEntry}
+        self._free = deque()    # entries without a dependency
+        self._dependent = []    # entries with a dependency
+        self._dependentStart = 0
+        self._dependentRemoved = 0
+        # Every live entry in self._dependent before _scanned[1] failed
+        # on all idle workers as of event _scanned[0].
+        self._scanned = (-1, 0)
+        self._workers = {}      # {workerid:(worker, token)}
+        self._workerOrder = deque()  # (workerid, token) in FIFO order
+        self._workerToken = 0
+        # The idle workers ordered by the event at which they were added or
+        # last changed, for finding the ones changed since a task was checked.
+        self._event = 0
+        self._events = []
+        self._changed = []
+        self._changedAt = {}    # {workerid:event}
+        self._versions = {}     # {workerid:properties version}
+        self._unversioned = 0   # number of idle workers without a version
+        self._clock = None      # StrictDict.clock when workers were checked
+    
+    def _ntasks(self):
+        return len(self._entries)
+    
+    def _nworkers(self):
+        return len(self._workers)
+    
+    ntasks = property(_ntasks, lambda self, _:None)
+    nworkers = property(_nworkers, lambda self, _:None)
+    
+    def _taskids(self):
+        entries = self._entries.values()
+        entries.sort(key=lambda e: e.seq)
+        return [e.task.taskid for e in entries]
+    
+    def _workerids(self):
+        return [id for id, token in self._workerOrder 
+            if self._workers.get(id, (None, None))[1] == token]
+    
+    taskids = property(_taskids, lambda self,_:None)
+    workerids = property(_workerids, lambda self,_:None)
+    
+    #---------------------------------------------------------------------------
+    # Tasks
+    #---------------------------------------------------------------------------
+    
+    def add_task(self, task, **flags):
+        entry = _TaskEntry(self._seq, task)
+        self._seq += 1
+        self._entries[task.taskid] = entry
+        if task.depend is None:
+            self._free.append(entry)
+        else:
+            self._dependent.append(entry)
+    
+    def _freeHead(self):
+        while self._free and self._free[0].removed:
+            self._free.popleft()
+        if self._free:
+            return self._free[0]
+    
+    def _dependentHead(self):
+        for i in xrange(self._dependentStart, len(self._dependent)):
+            if not self._dependent[i].removed:
+                self._dependentStart = i
+                return self._dependent[i]
+        self._dependentStart = len(self._dependent)
+    
+    def pop_task(self, id=None):
+        if id is None:
+            free = self._freeHead()
+            dependent = self._dependentHead()
+            if free is None and dependent is None:
+                raise IndexError("pop from an empty scheduler")
+            if free is None or (dependent is not None and 
+                dependent.seq < free.seq):
+                entry = dependent
+            else:
+                entry = free
+            id = entry.task.taskid
+        try:
+            entry = self._entries.pop(id)
+        except KeyError:
+            raise IndexError("No task #%i"%id)
+        entry.removed = True
+        if entry.task.depend is not None:
+            self._dependentRemoved += 1
+            if self._dependentRemoved > len(self._dependent)/2:
+                self._compactDependent()
+        return entry.task
+    
+    def _compactDependent(self):
+        self._dependent = [e for e in self._dependent if not e.removed]
+        self._dependentStart = 0
+        self._dependentRemoved = 0
+        self._scanned = (-1, 0)
+    
+    #---------------------------------------------------------------------------
+    # Workers
+    #---------------------------------------------------------------------------
+    
+    def add_worker(self, worker, **flags):
+        id = worker.workerid
+        self._workerToken += 1
+        self._workers[id] = (worker, self._workerToken)
+        self._workerOrder.append((id, self._workerToken))
+        version = self._propertiesVersion(worker)
+        if version is None:
+            self._unversioned += 1
+        self._versions[id] = version
+        self._markChanged(id)
+        if len(self._workerOrder) > 2*len(self._workers) + 16:
+            self._workerOrder = deque([(i, t) for i, t in self._workerOrder 
+                if self._workers.get(i, (None, None))[1] == t])
+    
+    def pop_worker(self, id=None):
+        if id is None:
+            while self._workerOrder:
+                id, token = self._workerOrder.popleft()
+                if self._workers.get(id, (None, None))[1] == token:
+                    break
+            else:
+                raise IndexError("pop from an empty scheduler")
+        try:
+            worker, token = self._workers.pop(id)
+        except KeyError:
+            raise IndexError("No worker #%i"%id)
+        self._unmarkChanged(id)
+        if self._versions.pop(id) is None:
+            self._unversioned -= 1
+        return worker
+    
+    def _markChanged(self, id):
+        self._unmarkChanged(id)
+        self._event += 1
+        self._changedAt[id] = self._event
+        self._events.append(self._event)
+        self._changed.append(id)
+    
+    def _unmarkChanged(self, id):
+        event = self._changedAt.pop(id, None)
+        if event is not None:
+            i = bisect_right(self._events, event) - 1
+            del self._events[i]
+            del self._changed[i]
+    
+    def _propertiesVersion(self, worker):
+        try:
+            return worker.properties.version
+        except AttributeError:
+            return None
+    
+    def _checkWorkers(self):
+        """Mark idle workers whose properties have changed."""
+        if self._clock == es.StrictDict.clock and not self._unversioned:
+            return
+        self._clock = es.StrictDict.clock
+        for id, (worker, token) in self._workers.items():
+            version = self._propertiesVersion(worker)
+            if version is None or version != self._versions[id]:
+                self._versions[id] = version
+                self._markChanged(id)
+    
+    #---------------------------------------------------------------------------
+    # Scheduling
+    #---------------------------------------------------------------------------
+    
+    def _depends(self, task, worker):
+        try:# do not allow exceptions to break this
+            return task.depend(worker.properties)
+        except:
+            return False
+    
+    def _scheduleDependent(self, limit):
+        """Find the first task with a dependency that can run on a worker.
+        
+        Only tasks queued before the task with seq limit are considered.
+        """
+        events = self._events
+        latest = events[-1]
+        scannedEvent, scannedUpTo = self._scanned
+        if scannedEvent == self._event:
+            start = max(scannedUpTo, self._dependentStart)
+        else:
+            start = self._dependentStart
+        dependent = self._dependent
+        i = len(dependent)
+        for i in xrange(start, len(dependent)):
+            entry = dependent[i]
+            if entry.removed or entry.checkedAt >= latest:
+                continue
+            if limit is not None and entry.seq > limit:
+                break
+            for id in self._changed[bisect_right(events, entry.checkedAt):]:
+                worker = self._workers[id][0]
+                if self._depends(entry.task, worker):
+                    self._scanned = (self._event, i)
+                    return worker, entry
+            entry.checkedAt = self._event
+        else:
+            i = len(dependent)
+        self._scanned = (self._event, i)
+        return None, None
+    
+    def schedule(self):
+        if not self._workers or not self._entries:
+            return None, None
+        free = self._freeHead()
+        dependent = self._dependentHead()
+        worker, entry = None, None
+        if dependent is not None and (free is None or dependent.seq < free.seq):
+            self._checkWorkers()
+            if free is None:
+                worker, entry = self._scheduleDependent(None)
+            else:
+                worker, entry = self._scheduleDependent(free.seq)
+        if entry is None:
+            if free is None:
+                return None, None
+            entry = free
+            worker = self.pop_worker()
+        else:
+            self.pop_worker(worker.workerid)
+        return worker, self.pop_task(entry.task.taskid)
+
+
+class _PriorityEntry(_TaskEntry):
+    """A queued task in a PriorityScheduler."""
+    
+    __slots__ = ('priority', 'key', 'due', 'band')
+
+
+class PriorityScheduler(IndexedScheduler):
+    """A Scheduler that honours the priority and deadline of tasks.
+    
+    The priority and deadline are given as options to the `Task`::
+    
+        Task('quickLook()', priority=10, deadline=30)
+    
+    Tasks with a higher priority are scheduled first, and tasks with the
+    same priority in FIFO order.  The default priority is 0.  To prevent
+    starvation, the priority of a queued task grows by `aging` for every
+    second it waits.  Because all tasks age at the same rate, two queued
+    tasks never change places, so tasks are kept in a heap keyed by 
+    ``aging*queuedTime - priority`` and adding or scheduling a task is 
+    O(log n).
+    
+    The deadline is the number of seconds after queuing by which the task
+    should be started.  Once a task is within `deadlineWindow` seconds of
+    its deadline it is due, and due tasks are scheduled earliest deadline
+    first, ahead of all other tasks.
+    
+    Tasks with a dependency that can't run on any idle worker are set aside
+    and only checked again against workers that are added or changed, as
+    in the `IndexedScheduler`.  The queue is reported by priority band,
+    with the bands defined by `priorityBands`.
+    
+    To use this scheduler in the controller, set the `SchedulerClass` of
+    `TaskController` to it, for example in the controllerImportStatement
+    of the configuration.
+    
+    See the docstrings for IScheduler for interface details.
+    """
+    
+    aging = 1.0/60          # priority gained per second in the queue
+    deadlineWindow = 60.0   # seconds before the deadline a task is due
+    # (lowest priority, name) of each band, from the highest band down
+    priorityBands = ((10, 'high'), (0, 'normal'), (None, 'low'))
+    
+    def __init__(self, clock=time.time):
+        IndexedScheduler.__init__(self)
+        self.clock = clock
+        self._heap = []         # (key, seq, entry) of the runnable entries
+        self._deadlines = []    # (due, seq, entry) of entries with deadlines
+        self._blocked = []      # entries that failed on all idle workers
+        self._blockedAt = -1    # the event at which they were last checked
+        self._ndependent = 0
+        # The number of queued tasks in each band
+        self._bandCounts = dict([(name, 0) for low, name in self.priorityBands])
+    
+    def _band(self, priority):
+        for low, name in self.priorityBands:
+            if low is None or priority >= low:
+                return name
+    
+    def countsByBand(self):
+        """Return a dict of the number of queued tasks in each priority band."""
+        return dict(self._bandCounts)
+    
+    def taskidsByBand(self):
+        """Return a dict of the queued taskids in each priority band."""
+        result = dict([(name, []) for low, name in self.priorityBands])
+        entries = self._entries.values()
+        entries.sort(key=lambda e: e.seq)
+        for entry in entries:
+            result[entry.band].append(entry.task.taskid)
+        return result
+    
+    #---------------------------------------------------------------------------
+    # Tasks
+    #---------------------------------------------------------------------------
+    
+    def add_task(self, task, **flags):
+        now = self.clock()
+        entry = _PriorityEntry(self._seq, task)
+        self._seq += 1
+        entry.priority = task.options.get('priority', 0)
+        entry.key = self.aging*now - entry.priority
+        entry.band = self._band(entry.priority)
+        self._bandCounts[entry.band] += 1
+        heapq.heappush(self._heap, (entry.key, entry.seq, entry))
+        deadline = task.options.get('deadline')
+        if deadline is None:
+            entry.due = None
+        else:
+            entry.due = now + deadline
+            heapq.heappush(self._deadlines, (entry.due, entry.seq, entry))
+        self._entries[task.taskid] = entry
+        if task.depend is not None:
+            self._ndependent += 1
+    
+    def _top(self, heap):
+        while heap and heap[0][2].removed:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0][2]
+    
+    def _due(self):
+        entry = self._top(self._deadlines)
+        if entry is not None and entry.due - self.deadlineWindow <= self.clock():
+            return entry
+    
+    def pop_task(self, id=None):
+        if id is None:
+            entry = self._due() or self._top(self._heap)
+            if entry is None:
+                for entry in self._blocked:
+                    if not entry.removed:
+                        break
+                else:
+                    raise IndexError("pop from an empty scheduler")
+            id = entry.task.taskid
+        try:
+            entry = self._entries.pop(id)
+        except KeyError:
+            raise IndexError("No task #%i"%id)
+        entry.removed = True
+        self._bandCounts[entry.band] -= 1
+        if entry.task.depend is not None:
+            self._ndependent -= 1
+        if len(self._heap) + len(self._deadlines) > 4*len(self._entries) + 64:
+            self._compact()
+        return entry.task
+    
+    def _compact(self):
+        """Drop the removed entries from the heaps."""
+        self._heap = [item for item in self._heap if not item[2].removed]
+        heapq.heapify(self._heap)
+        self._deadlines = [item for item in self._deadlines 
+            if not item[2].removed]
+        heapq.heapify(self._deadlines)
+        self._blocked = [e for e in self._blocked if not e.removed]
+    
+    #---------------------------------------------------------------------------
+    # Scheduling
+    #---------------------------------------------------------------------------
+    
+    def _takeWorker(self, entry):
+        """Pop an idle worker that can run entry, or return None."""
+        if entry.task.depend is None:
+            return self.pop_worker()
+        events = self._events
+        for id in self._changed[bisect_right(events, entry.checkedAt):]:
+            if self._depends(entry.task, self._workers[id][0]):
+                return self.pop_worker(id)
+        entry.checkedAt = self._event
+    
+    def _unblock(self):
+        """Requeue blocked tasks that can run on an added or changed worker."""
+        if not self._blocked or self._blockedAt == self._event:
+            return
+        self._blockedAt = self._event
+        events = self._events
+        blocked = []
+        for entry in self._blocked:
+            if entry.removed:
+                continue
+            for id in self._changed[bisect_right(events, entry.checkedAt):]:
+                if self._depends(entry.task, self._workers[id][0]):
+                    heapq.heappush(self._heap, (entry.key, entry.seq, entry))
+                    break
+            else:
+                entry.checkedAt = self._event
+                blocked.append(entry)
+        self._blocked = blocked
+    
+    def schedule(self):
+        if not self._workers or not self._entries:
+            return None, None
+        if self._ndependent:
+            self._checkWorkers()
+            self._unblock()
+        entry = self._due()
+        if entry is not None:
+            worker = self._takeWorker(entry)
+            if worker is not None:
+                return worker, self.pop_task(entry.task.taskid)
+        heap = self._heap
+        entry = self._top(heap)
+        while entry is not None:
+            worker = self._takeWorker(entry)
+            if worker is not None:
+                heapq.heappop(heap)
+                return worker, self.pop_task(entry.task.taskid)
+            heapq.heappop(heap)
+            self._blocked.append(entry)
+            entry = self._top(heap)
+        return None, None
+
+
 class ITaskController(cs.IControllerBase):
     """The Task based interface to a `ControllerService` object
     
@@ -513,35 +1049,242 @@ class ITaskController(cs.IControllerBase):
         """Get a dictionary with the current state of the task queue.
         
         If verbose is True, then return lists of taskids, otherwise, 
-        return the number of tasks with each status.
+        return the number of tasks with each status.  If the scheduler
+        groups tasks into priority bands, the scheduled tasks of each band
+        are given in a dict under the key 'bands'.
         """
     
 
+class ResultStore(object):
+    """The results of finished tasks, with an optional retention policy.
+    
+    Results are kept in memory in least recently used order.  When there
+    are more than `maxEntries` results, when their pickled size adds up to
+    more than `maxBytes`, or when a result has not been stored or fetched
+    for `ttl` seconds, the least recently used results are evicted.  With
+    the default of None for all three, results are kept forever.
+    
+    If `spill` is the path of a file, evicted results are written to a
+    shelve there and are still found by lookups, otherwise they are
+    discarded.  The file is created anew.
+    
+    The number of succeeded and failed results that can still be looked 
+    up is kept in running counters, and the number of discarded results in
+    `discarded`.
+    """
+    
+    def __init__(self, maxEntries=None, maxBytes=None, ttl=None, spill=None,
+            clock=time.time):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.clock = clock
+        self._results = {}      # {taskid:(result, size, token, lastUsed)}
+        self._order = deque()   # (taskid, token) least recently used first
+        self._token = 0
+        self.nbytes = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.discarded = 0
+        if spill is None:
+            self._spill = None
+        else:
+            self._spill = shelve.open(spill, 'n', protocol=2)
+    
+    def _status(self, result):
+        if isinstance(result, failure.Failure) or \
+                not hasattr(result, 'failure'):
+            return None     # aborted tasks are neither
+        elif result.failure is None:
+            return 'succeeded'
+        else:
+            return 'failed'
+    
+    def _count(self, result, n):
+        status = self._status(result)
+        if status is not None:
+            setattr(self, status, getattr(self, status) + n)
+    
+    def _sizeOf(self, result):
+        if self.maxBytes is None:
+            return 0
+        try:
+            return len(self._pickle(result))
+        except:
+            return 0
+    
+    def _pickle(self, result):
+        if isinstance(result, failure.Failure):
+            result.cleanFailure()
+        elif isinstance(getattr(result, 'failure', None), failure.Failure):
+            result.failure.cleanFailure()
+        return pickle.dumps(result, 2)
+    
+    def __len__(self):
+        n = len(self._results)
+        if self._spill is not None:
+            n += len(self._spill)
+        return n
+    
+    def __contains__(self, taskid):
+        return taskid in self._results or \
+            (self._spill is not None and self._spill.has_key(str(taskid)))
+    
+    has_key = __contains__
+    
+    def __getitem__(self, taskid):
+        try:
+            result, size, token, lastUsed = self._results[taskid]
+        except KeyError:
+            if self._spill is None:
+                raise
+            return pickle.loads(self._spill[str(taskid)])
+        self._touch(taskid, result, size)
+        return result
+    
+    def __setitem__(self, taskid, result):
+        if taskid in self:
+            self._remove(taskid)
+        self._count(result, 1)
+        size = self._sizeOf(result)
+        self.nbytes += size
+        self._touch(taskid, result, size)
+    
+    def _touch(self, taskid, result, size):
+        self._token += 1
+        self._results[taskid] = (result, size, self._token, self.clock())
+        self._order.append((taskid, self._token))
+        self.evict()
+    
+    def _remove(self, taskid):
+        try:
+            result, size, token, lastUsed = self._results.pop(taskid)
+        except KeyError:
+            result = pickle.loads(self._spill.pop(str(taskid)))
+        else:
+            self.nbytes -= size
+        self._count(result, -1)
+        return result
+    
+    def _over(self, now, lastUsed):
+        return (self.maxEntries is not None and 
+                len(self._results) > self.maxEntries) or \
+            (self.maxBytes is not None and self.nbytes > self.maxBytes) or \
+            (self.ttl is not None and now - lastUsed > self.ttl)
+    
+    def evict(self):
+        """Evict results until the retention policy is met."""
+        now = self.clock()
+        order = self._order
+        while order:
+            taskid, token = order[0]
+            entry = self._results.get(taskid)
+            if entry is None or entry[2] != token:
+                order.popleft()
+                continue
+            if not self._over(now, entry[3]):
+                break
+            order.popleft()
+            result = self._results.pop(taskid)[0]
+            self.nbytes -= entry[1]
+            self._spillResult(taskid, result)
+        if len(order) > 2*len(self._results) + 16:
+            self._order = deque([(i, t) for i, t in order 
+                if self._results.get(i, (None, None, None))[2] == t])
+    
+    def _spillResult(self, taskid, result):
+        if self._spill is not None:
+            try:
+                self._spill[str(taskid)] = self._pickle(result)
+            except:
+                log.msg("Could not spill the result of task %i" % taskid)
+            else:
+                return
+        self._count(result, -1)
+        self.discarded += 1
+    
+    def taskids(self, status):
+        """Return the taskids of the 'succeeded' or 'failed' results."""
+        ids = [id for id, entry in self._results.iteritems() 
+            if self._status(entry[0]) == status]
+        if self._spill is not None:
+            ids.extend([int(id) for id, package in self._spill.iteritems()
+                if self._status(pickle.loads(package)) == status])
+        return ids
+    
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
 class TaskController(cs.ControllerAdapterBase):
     """The Task based interface to a Controller object.
     
     If you want to use a different scheduler, just subclass this and set
     the `SchedulerClass` member to the *class* of your chosen scheduler.
+    
+    When `maxBatchSize` is more than 1, a worker that becomes free while
+    no other worker is idle is given a batch of tasks, which the engine
+    runs in a single call.  This saves a number of round trips for every
+    task, which matters for tasks of a few milliseconds.  The batch size
+    adapts to the measured duration of tasks, so that a batch takes about
+    `batchTime` seconds, and batches never take more than a fair share of
+    the queued tasks.  The results of the tasks in a batch are handled one
+    by one, with the usual retries and recovery tasks.
+    
+    The results of finished tasks are kept in a `ResultStore`, created with
+    the keyword arguments in `resultRetention`.  By default all results are
+    kept in memory.  With a ttl, expired results are evicted every ttl/2 
+    seconds even if no results are stored or fetched.  The store is closed
+    when the controller is stopped.
+    
+    Tasks created with ``speculative=True`` that run alone on a worker are
+    watched for stragglers.  When one has been running for more than 
+    `speculationFactor` times the average task duration (and at least 
+    `speculationMinimum` seconds) and a worker that can run it is idle, a
+    copy of it is started on that worker, up to `maxCopies` copies in all.
+    The first copy to succeed gives the task's result.  The other copies
+    are interrupted if their engines provide `IEngineInterruptible`;
+    otherwise they are left to finish, keeping their workers busy, and
+    their results are dropped.  A copy that fails only fails the task if it
+    is the last one running.
     """
     
     zi.implements(ITaskController)
-    SchedulerClass = FIFOScheduler
+    SchedulerClass = IndexedScheduler
     
     timeout = 30
+    maxBatchSize = 1 # the most tasks to run in one call, 1 for no batching
+    batchTime = 0.5 # the time in seconds a batch should take
+    resultRetention = {} # maxEntries, maxBytes, ttl and spill for results
+    speculationFactor = 3.0 # a speculative task straggles after this many
+                            # times the average task duration
+    speculationMinimum = 1.0 # and after at least this many seconds
+    maxCopies = 2 # the most copies of a speculative task to run at once
     
     def __init__(self, controller):
         self.controller = controller
         self.controller.on_register_engine_do(self.registerWorker, True)
         self.controller.on_unregister_engine_do(self.unregisterWorker, True)
+        self.controller.on_stop_service_do(self.stopService)
         self.taskid = 0
         self.failurePenalty = 1 # the time in seconds to penalize
                                 # a worker for failing a task
-        self.pendingTasks = {} # dict of {workerid:(taskid, task)}
+        self.pendingTasks = {} # dict of {workerid:[tasks]}
         self.deferredResults = {} # dict of {taskid:deferred}
-        self.finishedResults = {} # dict of {taskid:actualResult}
+        self.finishedResults = ResultStore(**self.resultRetention)
+        self.purgeLater = None # looping call evicting expired results
+        if self.finishedResults.ttl is not None:
+            self.purgeLater = LoopingCall(self.finishedResults.evict)
+            self.purgeLater.start(self.finishedResults.ttl/2.0, now=False)
         self.workers = {} # dict of {workerid:worker}
         self.abortPending = [] # dict of {taskid:abortDeferred}
         self.idleLater = None # delayed call object for timeout
+        self.speculative = {} # {taskid:[task, started, [workerids]]}
+        self.speculateLater = None # delayed call object for stragglers
+        self.interruptedCopies = set() # set of (taskid, workerid)
+        self.taskDuration = None # moving average of the time per task
         self.scheduler = self.SchedulerClass()
         
         for id in self.controller.engines.keys():
@@ -549,6 +1292,17 @@ class TaskController(cs.ControllerAdapterBase):
                 self.workers[id].workerid = id
                 self.schedule.add_worker(self.workers[id])
     
+    def stopService(self):
+        """Called when the controller is stopped."""
+        for later in (self.idleLater, self.speculateLater):
+            if later is not None and later.active():
+                later.cancel()
+        self.idleLater = None
+        self.speculateLater = None
+        if self.purgeLater is not None and self.purgeLater.running:
+            self.purgeLater.stop()
+        self.finishedResults.close()
+    
     def registerWorker(self, id):
         """Called by controller.register_engine."""
         if self.workers.get(id):
@@ -568,9 +1322,23 @@ class TaskController(cs.ControllerAdapterBase):
             except IndexError:
                 pass
             self.workers.pop(id)
+        # If the worker still has tasks, the controller gave up on it before
+        # they failed (the heartbeat timed out).  They didn't fail, so they 
+        # are run again elsewhere without using up their retries.
+        tasks = self.pendingTasks.pop(id, [])
+        for task in tasks:
+            if self._dropCopy(task.taskid, id):
+                continue
+            if task.taskid in self.abortPending:
+                self._doAbort(task.taskid)
+            else:
+                log.msg("Requeuing task %i from worker %i" % (task.taskid, id))
+                self.scheduler.add_task(task)
+        if tasks:
+            self.distributeTasks()
     
     def _pendingTaskIDs(self):
-        return [t.taskid for t in self.pendingTasks.values()]
+        return [t.taskid for tasks in self.pendingTasks.values() for t in tasks]
     
     #---------------------------------------------------------------------------
     # Interface methods
@@ -602,7 +1370,7 @@ class TaskController(cs.ControllerAdapterBase):
             else:
                 return defer.succeed(None)
         else:
-            return defer.fail(IndexError("task ID not registered: %r" % taskid))
+            return defer.fail(IndexError("task ID not registered or result discarded: %r" % taskid))
     
     def abort(self, taskid):
         """Remove a task from the queue if it has not been run already."""
@@ -611,7 +1379,7 @@ class TaskController(cs.ControllerAdapterBase):
         try:
             self.scheduler.pop_task(taskid)
         except IndexError, e:
-            if taskid in self.finishedResults.keys():
+            if taskid in self.finishedResults:
                 d = defer.fail(IndexError("Task Already Completed"))
             elif taskid in self.abortPending:
                 d = defer.fail(IndexError("Task Already Aborted"))
@@ -638,23 +1406,22 @@ class TaskController(cs.ControllerAdapterBase):
         return defer.succeed(self.distributeTasks())
     
     def queue_status(self, verbose=False):
-        pending = self._pendingTaskIDs()
-        failed = []
-        succeeded = []
-        for k,v in self.finishedResults.iteritems():
-            if not isinstance(v, failure.Failure):
-                if hasattr(v,'failure'):
-                    if v.failure is None:
-                        succeeded.append(k)
-                    else:
-                        failed.append(k)
-        scheduled = self.scheduler.taskids
         if verbose:
-            result = dict(pending=pending, failed=failed, 
-                succeeded=succeeded, scheduled=scheduled)
+            results = self.finishedResults
+            result = dict(pending=self._pendingTaskIDs(), 
+                failed=results.taskids('failed'),
+                succeeded=results.taskids('succeeded'),
+                scheduled=self.scheduler.taskids)
         else:
-            result = dict(pending=len(pending),failed=len(failed),
-                succeeded=len(succeeded),scheduled=len(scheduled))
+            pending = sum([len(t) for t in self.pendingTasks.itervalues()])
+            result = dict(pending=pending, failed=self.finishedResults.failed,
+                succeeded=self.finishedResults.succeeded,
+                scheduled=self.scheduler.ntasks)
+        if hasattr(self.scheduler, 'taskidsByBand'):
+            if verbose:
+                result['bands'] = self.scheduler.taskidsByBand()
+            else:
+                result['bands'] = self.scheduler.countsByBand()
         return defer.succeed(result)
     
     #---------------------------------------------------------------------------
@@ -685,21 +1452,69 @@ class TaskController(cs.ControllerAdapterBase):
                 self.idleLater = None
             else:
                 self.checkIdle()
+            self.checkStragglers()
             return False
         # else something to do:
         while worker and task:
             # get worker and task
+            tasks = self._batchFor(worker, task)
             # add to pending
-            self.pendingTasks[worker.workerid] = task
+            self.pendingTasks[worker.workerid] = tasks
             # run/link callbacks
-            d = worker.run(task)
-            log.msg("Running task %i on worker %i" %(task.taskid, worker.workerid))
-            d.addBoth(self.taskCompleted, task.taskid, worker.workerid)
+            if len(tasks) == 1:
+                if task.options.get('speculative'):
+                    self._startCopy(task, worker.workerid)
+                d = worker.run(task)
+                log.msg("Running task %i on worker %i" %(task.taskid, worker.workerid))
+                d.addBoth(self.taskCompleted, task.taskid, worker.workerid,
+                    time.time())
+            else:
+                taskids = [t.taskid for t in tasks]
+                d = worker.run_batch(tasks)
+                log.msg("Running tasks %r on worker %i" %(taskids, worker.workerid))
+                d.addBoth(self.batchCompleted, taskids, worker.workerid,
+                    time.time())
             worker, task = self.scheduler.schedule()
         # check for idle timeout:
         self.checkIdle()
+        self.checkStragglers()
         return True
     
+    def batchSize(self):
+        """Return the number of tasks to give a worker at once."""
+        if self.maxBatchSize <= 1 or not self.taskDuration:
+            return 1
+        size = int(self.batchTime/self.taskDuration)
+        return max(1, min(size, self.maxBatchSize))
+    
+    def _batchFor(self, worker, task):
+        """Return task and the tasks to run with it on worker."""
+        size = self.batchSize()
+        if size == 1 or self.scheduler.nworkers or \
+                not hasattr(worker, 'run_batch'):
+            return [task]
+        # Leave a fair share of the tasks for the busy workers
+        size = min(size, self.scheduler.ntasks/len(self.workers) + 1)
+        # worker is the only one the scheduler can pick, so it hands out 
+        # the next tasks that can run on it, in its usual order.
+        tasks = [task]
+        while len(tasks) < size:
+            self.scheduler.add_worker(worker)
+            w, t = self.scheduler.schedule()
+            if t is None:
+                self.scheduler.pop_worker(worker.workerid)
+                break
+            tasks.append(t)
+        return tasks
+    
+    def _timeTasks(self, started, ntasks):
+        """Update the moving average of the time per task."""
+        duration = (time.time() - started)/ntasks
+        if self.taskDuration is None:
+            self.taskDuration = duration
+        else:
+            self.taskDuration = 0.8*self.taskDuration + 0.2*duration
+    
     def checkIdle(self):
         if self.idleLater and not self.idleLater.called:
             self.idleLater.cancel()
@@ -713,6 +1528,9 @@ class TaskController(cs.ControllerAdapterBase):
         if not self.distributeTasks():
             while self.scheduler.ntasks:
                 t = self.scheduler.pop_task()
+                if t.taskid in self.speculative:
+                    # Only a copy, the task is still running elsewhere.
+                    continue
                 msg = "task %i failed to execute due to unmet dependencies"%t.taskid
                 msg += " for %i seconds"%self.timeout
                 log.msg("Task aborted by timeout: %i" % t.taskid)
@@ -721,56 +1539,193 @@ class TaskController(cs.ControllerAdapterBase):
         self.idleLater = None
                 
     
-    def taskCompleted(self, result, taskid, workerid):
+    def taskCompleted(self, result, taskid, workerid, started=None):
         """This is the err/callback for a completed task."""
-        try:
-            task = self.pendingTasks.pop(workerid)
-        except:
-            # this should not happen
-            log.msg("Tried to pop bad pending task %i from worker %i"%(taskid, workerid))
-            log.msg("Result: %r"%result)
-            log.msg("Pending tasks: %s"%self.pendingTasks)
+        self.batchCompleted([result], [taskid], workerid, started)
+    
+    def batchCompleted(self, results, taskids, workerid, started=None):
+        """This is the err/callback for a completed batch of tasks."""
+        tasks = self.pendingTasks.get(workerid)
+        if tasks is None or [t.taskid for t in tasks] != taskids:
+            # The worker was unregistered and these tasks were requeued.
+            log.msg("Ignoring results of requeued tasks %r from worker %i" % 
+                (taskids, workerid))
             return
+        del self.pendingTasks[workerid]
+        
+        if started is not None:
+            self._timeTasks(started, len(tasks))
+        
+        failed = False
+        for task, taskid, result in zip(tasks, taskids, results):
+            if self._handleResult(task, taskid, result, workerid):
+                failed = True
+        
+        if failed:
+            # wait a second before readmitting a worker that failed
+            # it may have died, and not yet been unregistered
+            reactor.callLater(self.failurePenalty, self.readmitWorker, workerid)
+        else:
+            self.readmitWorker(workerid)
+    
+    def _handleResult(self, task, taskid, result, workerid):
+        """Finish, retry or recover a task, returning True if it failed."""
+        failed = result.failure is not None and \
+            isinstance(result.failure, failure.Failure)
+        
+        if taskid not in self.deferredResults:
+            log.msg("Dropping the result of task %i from worker %i, another "
+                "copy finished first" % (taskid, workerid))
+            if (taskid, workerid) in self.interruptedCopies:
+                # It failed because we interrupted it, the worker is fine
+                self.interruptedCopies.remove((taskid, workerid))
+                return False
+            return failed
+        if taskid in self.speculative:
+            if not failed:
+                self._finishCopies(taskid, workerid)
+            elif self._dropCopy(taskid, workerid):
+                log.msg("A copy of task %i failed on worker %i, waiting for "
+                    "the others" % (taskid, workerid))
+                return failed
         
         # Check if aborted while pending
-        aborted = False
         if taskid in self.abortPending:
             self._doAbort(taskid)
-            aborted = True
-        
-        if not aborted:
-            if result.failure is not None and isinstance(result.failure, failure.Failure): # we failed
-                log.msg("Task %i failed on worker %i"% (taskid, workerid))
-                if task.retries > 0: # resubmit
-                    task.retries -= 1
-                    self.scheduler.add_task(task)
-                    s = "Resubmitting task %i, %i retries remaining" %(taskid, task.retries)
-                    log.msg(s)
-                    self.distributeTasks()
-                elif isinstance(task.recovery_task, Task) and \
-                                    task.recovery_task.retries > -1:
-                    # retries = -1 is to prevent infinite recovery_task loop
-                    task.retries = -1 
-                    task.recovery_task.taskid = taskid
-                    task = task.recovery_task
-                    self.scheduler.add_task(task)
-                    s = "Recovering task %i, %i retries remaining" %(taskid, task.retries)
-                    log.msg(s)
-                    self.distributeTasks()
-                else: # done trying
-                    self._finishTask(taskid, result)
-                # wait a second before readmitting a worker that failed
-                # it may have died, and not yet been unregistered
-                reactor.callLater(self.failurePenalty, self.readmitWorker, workerid)
-            else: # we succeeded
-                log.msg("Task completed: %i"% taskid)
+        elif failed:
+            log.msg("Task %i failed on worker %i"% (taskid, workerid))
+            if task.retries > 0: # resubmit
+                task.retries -= 1
+                self.scheduler.add_task(task)
+                s = "Resubmitting task %i, %i retries remaining" %(taskid, task.retries)
+                log.msg(s)
+                self.distributeTasks()
+            elif isinstance(task.recovery_task, Task) and \
+                                task.recovery_task.retries > -1:
+                # retries = -1 is to prevent infinite recovery_task loop
+                task.retries = -1 
+                task.recovery_task.taskid = taskid
+                task = task.recovery_task
+                self.scheduler.add_task(task)
+                s = "Recovering task %i, %i retries remaining" %(taskid, task.retries)
+                log.msg(s)
+                self.distributeTasks()
+            else: # done trying
                 self._finishTask(taskid, result)
-                self.readmitWorker(workerid)
-        else:# we aborted the task
-            if result.failure is not None and isinstance(result.failure, failure.Failure): # it failed, penalize worker
-                reactor.callLater(self.failurePenalty, self.readmitWorker, workerid)
+        else: # we succeeded
+            log.msg("Task completed: %i"% taskid)
+            self._finishTask(taskid, result)
+        return failed
+    
+    #---------------------------------------------------------------------------
+    # Speculative tasks
+    #---------------------------------------------------------------------------
+    
+    def _startCopy(self, task, workerid):
+        entry = self.speculative.get(task.taskid)
+        if entry is None:
+            self.speculative[task.taskid] = [task, time.time(), [workerid]]
+        else:
+            log.msg("Running a copy of task %i on worker %i" % 
+                (task.taskid, workerid))
+            entry[2].append(workerid)
+    
+    def _dropCopy(self, taskid, workerid):
+        """Forget the copy of taskid on workerid.
+        
+        Returns True if other copies of the task are still running.
+        """
+        entry = self.speculative.get(taskid)
+        if entry is None:
+            return False
+        if workerid in entry[2]:
+            entry[2].remove(workerid)
+        if entry[2]:
+            return True
+        del self.speculative[taskid]
+        self._unscheduleCopy(taskid)
+        return False
+    
+    def _finishCopies(self, taskid, workerid):
+        """Stop tracking taskid, whose copy on workerid succeeded."""
+        task, started, workerids = self.speculative.pop(taskid)
+        others = [w for w in workerids if w != workerid]
+        if others:
+            log.msg("Task %i finished on worker %i, dropping the copies on "
+                "workers %r" % (taskid, workerid, others))
+        self._unscheduleCopy(taskid)
+        for w in others:
+            self._interruptCopy(taskid, w)
+    
+    def _interruptCopy(self, taskid, workerid):
+        """Interrupt the losing copy of taskid on workerid, if we can."""
+        worker = self.workers.get(workerid)
+        if worker is None or not hasattr(worker, 'interrupt'):
+            return
+        self.interruptedCopies.add((taskid, workerid))
+        def interrupted(result):
+            if result:
+                log.msg("Interrupted the copy of task %i on worker %i" %
+                    (taskid, workerid))
             else:
-                self.readmitWorker(workerid)
+                self.interruptedCopies.discard((taskid, workerid))
+        d = worker.interrupt()
+        d.addCallback(interrupted)
+        d.addErrback(lambda f: 
+            self.interruptedCopies.discard((taskid, workerid)))
+    
+    def _unscheduleCopy(self, taskid):
+        # A copy may still be waiting for a worker.
+        try:
+            self.scheduler.pop_task(taskid)
+        except IndexError:
+            pass
+    
+    def stragglerTime(self):
+        """Return how long a speculative task runs before it is copied."""
+        if self.taskDuration is None:
+            return None
+        return max(self.speculationMinimum, 
+            self.speculationFactor*self.taskDuration)
+    
+    def checkStragglers(self):
+        """Start copies of straggling speculative tasks on idle workers."""
+        if self.speculateLater and self.speculateLater.active():
+            self.speculateLater.cancel()
+        self.speculateLater = None
+        limit = self.stragglerTime()
+        if not self.speculative or limit is None or self.scheduler.ntasks:
+            return
+        idle = [self.workers[id] for id in self.scheduler.workerids
+            if id in self.workers]
+        if not idle:
+            return
+        now = time.time()
+        nextCheck = None
+        copied = False
+        for taskid, (task, started, workerids) in self.speculative.items():
+            if len(workerids) >= self.maxCopies:
+                continue
+            if started + limit > now:
+                if nextCheck is None or started + limit < nextCheck:
+                    nextCheck = started + limit
+                continue
+            for w in idle:
+                try:
+                    cando = task.depend is None or task.depend(w.properties)
+                except:
+                    cando = False
+                if cando:
+                    log.msg("Task %i has been running for %.1f seconds, "
+                        "copying it" % (taskid, now - started))
+                    self.scheduler.add_task(task)
+                    copied = True
+                    break
+        if copied:
+            self.distributeTasks()
+        elif nextCheck is not None:
+            self.speculateLater = reactor.callLater(nextCheck - now, 
+                self.checkStragglers)
     
     def readmitWorker(self, workerid):
         """Readmit a worker to the scheduler.  
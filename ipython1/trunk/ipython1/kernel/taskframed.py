@@ -0,0 +1,142 @@
+# encoding: utf-8
+# -*- test-case-name: ipython1.kernel.tests.test_taskframed -*-
+"""A binary framed interface to the `TaskController`.
+
+This is the task controller counterpart of `multiengineframed`, using the
+length prefixed protocol of `framedrpc` instead of XML-RPC.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from zope.interface import Interface, implements
+from twisted.python import components
+
+from ipython1.kernel import task as Task
+from ipython1.kernel.framedrpc import FramedRPCServerFactory, FramedRPCProxy
+
+#-------------------------------------------------------------------------------
+# The Controller side of things
+#-------------------------------------------------------------------------------
+
+class IFramedTaskController(Interface):
+    """Binary framed interface to the task controller.
+
+    See the documentation of ITaskController for documentation about the 
+    methods.  Tasks are sent canned.
+    """
+    pass
+
+
+class FramedTaskControllerFromTaskController(object):
+    
+    implements(IFramedTaskController)
+    
+    def __init__(self, taskController):
+        self.taskController = taskController
+    
+    #---------------------------------------------------------------------------
+    # ITaskController related methods
+    #---------------------------------------------------------------------------
+    
+    def framed_run(self, task):
+        return self.taskController.run(Task.uncanTask(task))
+    
+    def framed_abort(self, taskid):
+        return self.taskController.abort(taskid)
+    
+    def framed_get_task_result(self, taskid, block=False):
+        return self.taskController.get_task_result(taskid, block)
+    
+    def framed_barrier(self, taskids):
+        return self.taskController.barrier(taskids)
+    
+    def framed_spin(self):
+        return self.taskController.spin()
+    
+    def framed_queue_status(self, verbose):
+        return self.taskController.queue_status(verbose)
+
+
+components.registerAdapter(FramedTaskControllerFromTaskController,
+            Task.TaskController, IFramedTaskController)
+
+
+class IFramedTaskControllerFactory(Interface):
+    pass
+
+
+def FramedServerFactoryFromTaskController(taskController):
+    """Adapt a TaskController to a `FramedRPCServerFactory`."""
+    return FramedRPCServerFactory(IFramedTaskController(taskController))
+
+
+components.registerAdapter(FramedServerFactoryFromTaskController,
+            Task.TaskController, IFramedTaskControllerFactory)
+
+
+#-------------------------------------------------------------------------------
+# The Client side of things
+#-------------------------------------------------------------------------------
+
+class IFramedTaskClient(Interface):
+    pass
+
+
+class FramedTaskClient(object):
+    """A drop-in replacement for `XMLRPCTaskClient`.
+    
+    See `XMLRPCTaskClient` for the documentation of the methods.
+        
+    :Parameters:
+        addr : (ip, port)
+            The ip (str) and port (int) tuple of the `TaskController`.  
+    """
+    implements(Task.ITaskController, IFramedTaskClient)
+    
+    def __init__(self, addr):
+        self.addr = addr
+        self._proxy = FramedRPCProxy(addr)
+    
+    #---------------------------------------------------------------------------
+    # Non interface methods
+    #---------------------------------------------------------------------------
+    
+    def disconnect(self):
+        """Close the connection to the controller."""
+        return self._proxy.disconnect()
+    
+    #---------------------------------------------------------------------------
+    # ITaskController related methods
+    #---------------------------------------------------------------------------
+    
+    def run(self, task):
+        assert isinstance(task, Task.Task), "task must be a Task object!"
+        ctask = Task.canTask(task) # handles arbitrary function in .depend
+                                # as well as arbitrary recovery_task chains
+        return self._proxy.callRemote('run', ctask)
+    
+    def get_task_result(self, taskid, block=False):
+        return self._proxy.callRemote('get_task_result', taskid, block)
+    
+    def abort(self, taskid):
+        return self._proxy.callRemote('abort', taskid)
+    
+    def barrier(self, taskids):
+        return self._proxy.callRemote('barrier', taskids)
+    
+    def spin(self):
+        return self._proxy.callRemote('spin')
+    
+    def queue_status(self, verbose=False):
+        return self._proxy.callRemote('queue_status', verbose)
@@ -26,13 +26,12 @@ import xmlrpclib, copy
 from zope.interface import Interface, implements
 from twisted.internet import defer
 from twisted.python import components, failure
-from twisted.web import xmlrpc as webxmlrpc
 
 from ipython1.external.twisted.web2 import xmlrpc, server, channel
 
 from ipython1.kernel import error, task as Task, taskclient
 from ipython1.kernel.pickleutil import can, uncan
-from ipython1.kernel.xmlrpcutil import Transport
+from ipython1.kernel.xmlrpcutil import Transport, Proxy
 
 #-------------------------------------------------------------------------------
 # The Controller side of things
@@ -175,7 +174,7 @@ class XMLRPCTaskClient(object):
     def __init__(self, addr):
         self.addr = addr
         self.url = 'http://%s:%s/' % self.addr
-        self._proxy = webxmlrpc.Proxy(self.url)
+        self._proxy = Proxy(self.url)
     
     #---------------------------------------------------------------------------
     # Non interface methods
@@ -183,6 +182,10 @@ class XMLRPCTaskClient(object):
         
     def unpackage(self, r):
         return pickle.loads(r.data)
+    
+    def disconnect(self):
+        """Close the connections kept open to the controller."""
+        return self._proxy.close()
       
     #---------------------------------------------------------------------------
     # ITaskController related methods
@@ -98,4 +98,41 @@ class IControllerCoreTestCase(object):
         self.unregisterCallableCalled = 'asdf'
         
     def testBadUnregister(self):
-        self.assertRaises(AssertionError, self.controller.unregister_engine, 'foo')
\ No newline at end of file
+        self.assertRaises(AssertionError, self.controller.unregister_engine, 'foo')
+
+
+class WedgedEngineService(es.EngineService):
+    """An engine whose pings and commands can be made to hang.
+    
+    While wedged, pings and executes return deferreds that only fire when 
+    `unwedge` is called, like those to an engine stuck in C code.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        es.EngineService.__init__(self, *args, **kwargs)
+        self.wedged = False
+        self.waiting = []
+        self.disconnected = False
+    
+    def _wait(self, f, *args):
+        if not self.wedged:
+            return f(*args)
+        d = defer.Deferred()
+        self.waiting.append((d, f, args))
+        return d
+    
+    def ping(self):
+        return self._wait(es.EngineService.ping, self)
+    
+    def execute(self, lines):
+        return self._wait(es.EngineService.execute, self, lines)
+    
+    def disconnect(self):
+        self.disconnected = True
+        return defer.succeed(None)
+    
+    def unwedge(self):
+        self.wedged = False
+        waiting, self.waiting = self.waiting, []
+        for d, f, args in waiting:
+            f(*args).chainDeferred(d)
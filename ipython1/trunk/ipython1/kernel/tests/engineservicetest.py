@@ -243,6 +243,16 @@ class IEngineSerializedTestCase(object):
             d = self.assertDeferredEquals(value,o,d)
         return d
 
+    def testPushPullCompressedSerialized(self):
+        obj = {'a':range(1000), 'b':'asdf'*1000}
+        serial = newserialized.compress(newserialized.serialize(obj),
+                                        threshold=0)
+        d = self.engine.push_serialized(dict(key=serial))
+        d.addCallback(lambda _: self.engine.pull_serialized('key'))
+        d.addCallback(lambda serial: newserialized.IUnSerialized(serial).getObject())
+        d.addCallback(lambda value: self.assertEquals(value, obj))
+        return d
+
     def testPullSerializedFailures(self):
         d = self.engine.pull_serialized('a')
         d.addErrback(lambda f: self.assertRaises(NameError, f.raiseException))
@@ -287,6 +297,37 @@ class IEngineQueuedTestCase(object):
         d = self.assertDeferredEquals(result, True)
         return d
 
+class IEngineTasksTestCase(object):
+    """Test an IEngineTasks implementer."""
+    
+    def testIEngineTasksInterface(self):
+        """Does self.engine claim to implement IEngineTasks?"""
+        self.assert_(es.IEngineTasks.providedBy(self.engine))
+    
+    def testRunTasks(self):
+        def task(expression, push=None, pull=None, clear_before=False, 
+            clear_after=False):
+            return dict(expression=expression, push=push, pull=pull,
+                clear_before=clear_before, clear_after=clear_after)
+        tasks = [task('a=5', pull=['a']),
+            task('1/0', pull=['a']),
+            task('c=a+b', push=dict(b=2), pull=['b', 'c'], clear_after=True),
+            task('d=1', pull=['a'], clear_before=True),
+            task('e=1')]
+        d = self.engine.execute('a=0')
+        d.addCallback(lambda _: self.engine.run_tasks(tasks))
+        def check(results):
+            self.assertEquals(len(results), 5)
+            self.assertEquals(results[0], 5)
+            self.assertRaises(ZeroDivisionError, results[1].raiseException)
+            self.assertEquals(tuple(results[2]), (2, 7))
+            self.assertRaises(NameError, results[3].raiseException)
+            self.assertEquals(results[4], None)
+        d.addCallback(check)
+        d.addCallback(lambda _: self.engine.pull('e'))
+        return self.assertDeferredEquals(d, 1)
+
+
 class IEnginePropertiesTestCase(object):
     """Test an IEngineProperties implementor."""
     
@@ -15,10 +15,12 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from ipython1.kernel import engineservice as es
 from ipython1.kernel import multiengine as me
 from ipython1.kernel import newserialized
+from ipython1.kernel.map import BlockCyclicMap, WeightedMap
 from ipython1.kernel.error import NotDefined
 from ipython1.testutils import util
 from ipython1.kernel import newserialized
@@ -231,6 +233,19 @@ class IMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda r: self.assert_(r==[[None,None]]))
         return d
     
+    def testPushTree(self):
+        self.addEngine(4)
+        d = self.multiengine.push(dict(a=10, b=range(5)), method='tree')
+        d.addCallback(lambda _: self.multiengine.pull(('a','b')))
+        d.addCallback(lambda r: self.assertEquals(r, 4*[[10,range(5)]]))
+        d.addCallback(lambda _: self.multiengine.push(dict(a=5), targets=[1,3], 
+            method='tree'))
+        d.addCallback(lambda _: self.multiengine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, [10,5,10,5]))
+        d.addCallback(lambda _: self.multiengine.push(dict(a=5), method='bogus'))
+        d.addErrback(lambda f: self.assertRaises(ValueError, f.raiseException))
+        return d
+    
     def testPushPullSerialized(self):
         self.addEngine(1)
         objs = [10,"hi there",1.2342354,{"p":(1,2)}]        
@@ -362,6 +377,44 @@ class IMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda r: self.assertEquals(r, [0,1,2,3]))
         return d
     
+    def testGroups(self):
+        self.addEngine(4)
+        d = self.multiengine.set_group('even', [0, 2])
+        d.addCallback(lambda r: self.assertEquals(r, [0, 2]))
+        d.addCallback(lambda _: self.multiengine.execute('a = 1', targets='even'))
+        d.addCallback(lambda _: self.multiengine.pull('a', targets='even'))
+        d.addCallback(lambda r: self.assertEquals(r, [1, 1]))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {'even':[0, 2]}))
+        d.addCallback(lambda _: self.controller.unregister_engine(2))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {'even':[0]}))
+        d.addCallback(lambda _: self.multiengine.set_group('all', 0))
+        d.addErrback(lambda f: self.assertRaises(ValueError, f.raiseException))
+        d.addCallback(lambda _: self.multiengine.set_group('bad', 10))
+        d.addErrback(lambda f: self.assertRaises(InvalidEngineID, f.raiseException))
+        d.addCallback(lambda _: self.multiengine.del_group('even'))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {}))
+        d.addCallback(lambda _: self.multiengine.execute('a = 1', targets='even'))
+        d.addErrback(lambda f: self.assertRaises(InvalidEngineID, f.raiseException))
+        return d
+    
+    def testGetEngineStats(self):
+        self.addEngine(2)
+        d = self.multiengine.get_engine_stats()
+        d.addCallback(lambda r: self.assertEquals([(s['id'], s['state'], 
+            s['pings']) for s in r], [(0, 'alive', 0), (1, 'alive', 0)]))
+        return d
+    
+    def testGetSerializationStats(self):
+        self.addEngine(2)
+        d = self.multiengine.push(dict(a=1))
+        d.addCallback(lambda _: self.multiengine.get_serialization_stats())
+        d.addCallback(lambda r: self.assertEquals(sorted(r.keys()), 
+            ['pickled', 'reused', 'timeSaved']))
+        return d
+    
     def testClearQueue(self):
         self.addEngine(4)
         d = self.multiengine.clear_queue()
@@ -374,6 +427,12 @@ class IMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda r: self.assert_(isinstance(r[0],tuple)))
         return d
     
+    def testInterruptIdle(self):
+        self.addEngine(4)
+        d = self.multiengine.interrupt()
+        d.addCallback(lambda r: self.assertEquals(r,4*[False]))
+        return d
+    
     def testGetSetProperties(self):
         self.addEngine(4)
         dikt = dict(a=5, b='asdf', c=True, d=None, e=range(5))
@@ -592,6 +651,15 @@ class ISynchronousMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda did: self.multiengine.get_pending_deferred(did, True))
         d.addCallback(lambda r: self.assert_(isinstance(r[0],tuple)))
         return d
+    
+    def testInterruptIdle(self):
+        self.addEngine(4)
+        d = self.multiengine.interrupt()
+        d.addCallback(lambda r: self.assertEquals(r,4*[False]))
+        d.addCallback(lambda r: self.multiengine.interrupt(targets=0, block=False))
+        d.addCallback(lambda did: self.multiengine.get_pending_deferred(did, True))
+        d.addCallback(lambda r: self.assertEquals(r,[False]))
+        return d
         
     def testGetIDs(self):
         self.addEngine(1)
@@ -602,6 +670,44 @@ class ISynchronousMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda r: self.assertEquals(r, [0,1,2,3]))
         return d
     
+    def testGroups(self):
+        self.addEngine(4)
+        d = self.multiengine.set_group('even', [0, 2])
+        d.addCallback(lambda r: self.assertEquals(r, [0, 2]))
+        d.addCallback(lambda _: self.multiengine.execute('a = 1', targets='even'))
+        d.addCallback(lambda _: self.multiengine.pull('a', targets='even'))
+        d.addCallback(lambda r: self.assertEquals(r, [1, 1]))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {'even':[0, 2]}))
+        d.addCallback(lambda _: self.controller.unregister_engine(2))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {'even':[0]}))
+        d.addCallback(lambda _: self.multiengine.set_group('all', 0))
+        d.addErrback(lambda f: self.assertRaises(ValueError, f.raiseException))
+        d.addCallback(lambda _: self.multiengine.set_group('bad', 10))
+        d.addErrback(lambda f: self.assertRaises(InvalidEngineID, f.raiseException))
+        d.addCallback(lambda _: self.multiengine.del_group('even'))
+        d.addCallback(lambda _: self.multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {}))
+        d.addCallback(lambda _: self.multiengine.execute('a = 1', targets='even'))
+        d.addErrback(lambda f: self.assertRaises(InvalidEngineID, f.raiseException))
+        return d
+    
+    def testGetEngineStats(self):
+        self.addEngine(2)
+        d = self.multiengine.get_engine_stats()
+        d.addCallback(lambda r: self.assertEquals([(s['id'], s['state'], 
+            s['pings']) for s in r], [(0, 'alive', 0), (1, 'alive', 0)]))
+        return d
+    
+    def testGetSerializationStats(self):
+        self.addEngine(2)
+        d = self.multiengine.push(dict(a=1))
+        d.addCallback(lambda _: self.multiengine.get_serialization_stats())
+        d.addCallback(lambda r: self.assertEquals(sorted(r.keys()), 
+            ['pickled', 'reused', 'timeSaved']))
+        return d
+    
     def testGetSetProperties(self):
         self.addEngine(4)
         dikt = dict(a=5, b='asdf', c=True, d=None, e=range(5))
@@ -683,7 +789,23 @@ class ISynchronousMultiEngineTestCase(IMultiEngineBaseTestCase):
         d.addCallback(lambda _: self.multiengine.get_pending_deferred(did_list[2],True))
         d.addErrback(lambda f: self.assertRaises(InvalidDeferredID, f.raiseException))
         return d
-    
+
+    def testBatch(self):
+        self.addEngine(4)
+        calls = [('execute', ('a=5',), {}),
+            ('push', (dict(b=10),), {'targets':0}),
+            ('pull', (('a','b'),), {'targets':0}),
+            ('zip_pull', (('a','b'),), {})]
+        d = self.multiengine.batch(calls)
+        def checkDids(r):
+            self.assertEquals(len(r), 4)
+            self.assert_(isinstance(r[3], Failure))
+            self.assertRaises(ValueError, r[3].raiseException)
+            return self.multiengine.get_pending_deferred(r[2], True)
+        d.addCallback(checkDids)
+        d.addCallback(lambda r: self.assertEquals(r, [[5, 10]]))
+        return d
+
 #-------------------------------------------------------------------------------
 # Coordinator test cases
 #-------------------------------------------------------------------------------
@@ -699,6 +821,19 @@ class IMultiEngineCoordinatorTestCase(object):
         d.addErrback(lambda f: self.assertRaises(NameError, _raise_it, f))
         return d
     
+    def testScatterGatherStyles(self):
+        self.addEngine(4)
+        data = range(19)
+        def check(style):
+            d = self.multiengine.scatter('a', data, style=style)
+            d.addCallback(lambda r: self.multiengine.gather('a', style=style))
+            d.addCallback(lambda r: self.assertEquals(r, data))
+            return d
+        d = check('roundrobin')
+        d.addCallback(lambda _: check(BlockCyclicMap(3)))
+        d.addCallback(lambda _: check(WeightedMap([1,2,3,4])))
+        return d
+    
     def testScatterGatherNumpy(self):
         try:
             import numpy
@@ -23,9 +23,13 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 from twisted.application.service import IService
-from ipython1.kernel.controllerservice import ControllerService
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from ipython1.kernel.controllerservice import ControllerService, EngineIDs
+from ipython1.kernel import engineservice as es, error
+from ipython1.kernel import multiengine as me
 from ipython1.kernel.tests import multienginetest as met
-from controllertest import IControllerCoreTestCase
+from controllertest import IControllerCoreTestCase, WedgedEngineService
 from ipython1.testutils.util import DeferredTestCase
 
 class BasicControllerServiceTest(DeferredTestCase,
@@ -37,3 +41,185 @@ class BasicControllerServiceTest(DeferredTestCase,
     
     def tearDown(self):
         self.controller.stopService()
+
+
+class HeartbeatTestCase(DeferredTestCase):
+    
+    def setUp(self):
+        self.clock = task.Clock()
+        self.controller = ControllerService(heartbeatPeriod=1.0, 
+            heartbeatTimeout=3.0, clock=self.clock)
+        self.controller.startService()
+        self.unregistered = []
+        self.registered = []
+        self.controller.on_unregister_engine_do(self.unregistered.append, True)
+        self.controller.on_register_engine_do(self.registered.append, True)
+        self.engine = WedgedEngineService()
+        self.qe = es.QueuedEngine(self.engine)
+        self.id = self.controller.register_engine(self.qe)['id']
+        del self.registered[:]
+    
+    def tearDown(self):
+        self.controller.stopService()
+    
+    def beat(self, n):
+        for i in range(n):
+            self.clock.advance(1.0)
+    
+    def testLatencyStats(self):
+        self.engine.wedged = True
+        self.beat(1)
+        self.clock.advance(0.5)
+        self.engine.unwedge()
+        stats = self.controller.get_liveness()
+        self.assertEquals(len(stats), 1)
+        self.assertEquals(stats[0]['id'], self.id)
+        self.assertEquals(stats[0]['state'], 'alive')
+        self.assertEquals(stats[0]['pings'], 1)
+        self.assertEquals(stats[0]['latency'], 0.5)
+        self.assertEquals(stats[0]['maxLatency'], 0.5)
+        self.beat(1)
+        stats = self.controller.get_liveness()
+        self.assertEquals(stats[0]['pings'], 2)
+        self.assertEquals(stats[0]['latency'], 0.0)
+        self.assertEquals(stats[0]['averageLatency'], 0.4)
+        self.assertEquals(stats[0]['maxLatency'], 0.5)
+    
+    def testLongCommand(self):
+        """Is an engine running a long command left alone?"""
+        self.engine.wedged = True
+        d = self.qe.execute('a = 1')
+        self.beat(10)
+        self.assert_(self.id in self.controller.engines)
+        self.assertEquals(self.unregistered, [])
+        self.assertEquals(self.controller.get_liveness()[0]['state'], 'busy')
+        self.engine.unwedge()
+        self.assertEquals(self.controller.get_liveness()[0]['state'], 'alive')
+        self.beat(10)
+        self.assert_(self.id in self.controller.engines)
+        return d
+    
+    def testIdleQuarantine(self):
+        """Is an idle engine that stops answering quarantined?"""
+        self.engine.wedged = True
+        self.beat(5)
+        self.assert_(self.id in self.controller.quarantined)
+        self.assertEquals(self.unregistered, [self.id])
+    
+    def testQuarantine(self):
+        """Is a busy engine that doesn't answer after an interrupt 
+        quarantined?"""
+        self.engine.wedged = True
+        d = self.qe.execute('a = 1')
+        d2 = self.qe.execute('b = 1')
+        self.beat(5)
+        self.assert_(self.id in self.controller.engines)
+        self.qe.interrupt()
+        self.beat(3)
+        self.assertEquals(self.controller.get_liveness()[0]['state'], 'late')
+        self.assert_(self.id in self.controller.engines)
+        self.beat(2)
+        self.failIf(self.id in self.controller.engines)
+        self.assert_(self.id in self.controller.quarantined)
+        self.assertEquals(self.unregistered, [self.id])
+        self.assertEquals(self.controller.get_liveness()[0]['state'], 'quarantined')
+        # The id isn't given to a new engine while it is quarantined
+        newID = self.controller.register_engine(
+            es.QueuedEngine(es.EngineService()))['id']
+        self.assertNotEquals(newID, self.id)
+        self.assertEquals(self.registered, [newID])
+        self.engine.unwedge()
+        self.assert_(self.id in self.controller.engines)
+        self.assertEquals(self.registered, [newID, self.id])
+        self.assertEquals(self.controller.get_liveness()[0]['state'], 'alive')
+        d.addErrback(lambda f: self.assertRaises(error.EngineUnresponsive, 
+            f.raiseException))
+        d2.addErrback(lambda f: self.assertRaises(error.QueueCleared, 
+            f.raiseException))
+        return defer.DeferredList([d, d2], fireOnOneErrback=1)
+    
+    def testQuarantinedStaysInGroups(self):
+        """Is a quarantined engine put back in its groups when readmitted?"""
+        multiengine = me.MultiEngine(self.controller)
+        otherID = self.controller.register_engine(
+            es.QueuedEngine(es.EngineService()))['id']
+        multiengine.set_group('g', [self.id, otherID])
+        self.engine.wedged = True
+        self.beat(5)
+        self.assert_(self.id in self.controller.quarantined)
+        self.assertEquals([e.id for e in multiengine.engineList('g')], 
+            [otherID])
+        self.engine.unwedge()
+        self.assertEquals([e.id for e in multiengine.engineList('g')], 
+            [self.id, otherID])
+        d = multiengine.get_groups()
+        d.addCallback(lambda r: self.assertEquals(r, {'g':[self.id, otherID]}))
+        # Unregistering it for good drops it from the group
+        d.addCallback(lambda _: self.controller.unregister_engine(self.id))
+        d.addCallback(lambda _: multiengine.get_groups())
+        d.addCallback(lambda r: self.assertEquals(r, {'g':[otherID]}))
+        return d
+    
+    def testUnregister(self):
+        self.controller.heartbeatAction = 'unregister'
+        self.engine.wedged = True
+        self.beat(5)
+        self.failIf(self.id in self.controller.engines)
+        self.failIf(self.id in self.controller.quarantined)
+        self.assertEquals(self.controller.get_liveness(), [])
+        self.assertEquals(self.unregistered, [self.id])
+        self.assert_(self.engine.disconnected)
+        # A late answer doesn't bring it back
+        self.engine.unwedge()
+        self.failIf(self.id in self.controller.engines)
+    
+    def testUnregisterQuarantined(self):
+        self.engine.wedged = True
+        self.beat(5)
+        self.controller.unregister_engine(self.id)
+        self.assertEquals(self.controller.quarantined, {})
+        self.assertEquals(self.unregistered, [self.id])
+        self.assert_(self.id in self.controller.availableIDs)
+
+
+class EngineIDsTestCase(unittest.TestCase):
+    
+    def testLowestFirst(self):
+        ids = EngineIDs()
+        self.assertEquals([ids.take() for i in range(5)], range(5))
+        ids.release(3)
+        ids.release(1)
+        self.assert_(1 in ids)
+        self.failIf(2 in ids)
+        self.assertEquals([ids.take() for i in range(3)], [1, 3, 5])
+    
+    def testTakeRequested(self):
+        ids = EngineIDs()
+        self.assertEquals(ids.take(10), 10)
+        self.failIf(10 in ids)
+        self.assertEquals(ids.take(10), 0)
+        self.assertEquals([ids.take() for i in range(10)], range(1, 10) + [11])
+        ids.release(10)
+        ids.release(4)
+        self.assertEquals(ids.take(4), 4)
+        self.assertEquals(ids.take(), 10)
+        self.assertEquals(ids.take(), 12)
+    
+    def testMaxID(self):
+        ids = EngineIDs(2)
+        self.assertEquals(ids.take(5), 0)
+        self.assertEquals([ids.take(), ids.take()], [1, 2])
+        self.assertRaises(IndexError, ids.take)
+        ids.release(1)
+        self.assertEquals(ids.take(), 1)
+    
+    def testManyEngines(self):
+        controller = ControllerService()
+        engine = es.EngineService()
+        for i in range(1000):
+            controller.register_engine(es.QueuedEngine(engine))
+        self.assertEquals(sorted(controller.engines.keys()), range(1000))
+        controller.unregister_engine(500)
+        regDict = controller.register_engine(es.QueuedEngine(engine))
+        self.assertEquals(regDict['id'], 500)
+        controller.stopService()
@@ -16,32 +16,38 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 
+import cPickle as pickle
+
 from twisted.python import components
 from twisted.internet import reactor, defer
-from twisted.spread import pb
+from twisted.spread import pb, banana
 from twisted.internet.base import DelayedCall
 DelayedCall.debug = True
 
 import zope.interface as zi
 
-from ipython1.kernel import pbconfig
-from ipython1.kernel.error import PBMessageSizeError
+from ipython1.kernel import pbconfig, pbutil, enginepb, newserialized
+from ipython1.kernel.error import PBMessageSizeError, ProtocolError
 from ipython1.kernel import engineservice as es
 from ipython1.testutils.util import DeferredTestCase
-from ipython1.kernel.controllerservice import IControllerBase
+from ipython1.kernel.controllerservice import IControllerBase, ControllerService
+from ipython1.kernel import multiengine as me
 from ipython1.kernel.enginepb import \
     PBRemoteEngineRootFromService, \
-    PBEngineClientFactory
+    PBEngineClientFactory, \
+    SerializedCollector
     
 from ipython1.kernel.tests.engineservicetest import \
     IEngineCoreTestCase, \
     IEngineSerializedTestCase, \
-    IEngineQueuedTestCase
+    IEngineQueuedTestCase, \
+    IEngineTasksTestCase
 
 class EnginePBTest(DeferredTestCase, 
                    IEngineCoreTestCase, 
                    IEngineSerializedTestCase,
-                   IEngineQueuedTestCase
+                   IEngineQueuedTestCase,
+                   IEngineTasksTestCase
                    ):
         
     zi.implements(IControllerBase)
@@ -106,6 +112,10 @@ class EnginePBTest(DeferredTestCase,
     # Specific tests
     #---------------------------------------------------------------------------
 
+    def testInterruptNotInterruptible(self):
+        d = self.engine.interrupt()
+        return self.assertDeferredEquals(d, False)
+
     def testMessageSizeLimit(self):
         sizeLimit = 64*1024
         savedLimit = pbconfig.banana.SIZE_LIMIT
@@ -127,4 +137,238 @@ class EnginePBTest(DeferredTestCase,
         d.addErrback(lambda f: self.assertRaises(PBMessageSizeError, f.raiseException))
 
         pbconfig.banana.SIZE_LIMIT = savedLimit
-        return d
\ No newline at end of file
+        return d
+    
+    def testPushPullSerializedPaging(self):
+        saved = (pbconfig.PAGING_THRESHOLD, pbconfig.CHUNK_SIZE, 
+            pbconfig.PAGING_WINDOW)
+        pbconfig.PAGING_THRESHOLD = 100
+        pbconfig.CHUNK_SIZE = 64
+        pbconfig.PAGING_WINDOW = 2
+        def restore(result):
+            (pbconfig.PAGING_THRESHOLD, pbconfig.CHUNK_SIZE,
+                pbconfig.PAGING_WINDOW) = saved
+            return result
+        objs = [1000*'x', range(500), {'a':'b'*1000}]
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            objs.append(numpy.arange(1000.0).reshape(10,100))
+            objs.append(dict(a=numpy.arange(50), b=range(100)))
+        d = defer.succeed(None)
+        for o in objs:
+            d.addCallback(lambda _, o=o: self.engine.push_serialized(
+                dict(key=newserialized.serialize(o))))
+            d.addCallback(lambda _: self.engine.pull_serialized('key'))
+            d.addCallback(newserialized.unserialize)
+            d.addCallback(lambda r, o=o: self.assertEquals(repr(r), repr(o)))
+        d.addCallback(lambda _: self.engine.execute("b=300*'y'"))
+        d.addCallback(lambda _: self.engine.pull_serialized(['key', 'b']))
+        d.addCallback(lambda r: [newserialized.unserialize(s) for s in r])
+        d.addCallback(lambda r: self.assertEquals(r[1], 300*'y'))
+        d.addBoth(restore)
+        return d
+    
+    def testPushPullSerializedArrays(self):
+        try:
+            import numpy
+        except ImportError:
+            return
+        # Small enough to go in a single message, not paged
+        objs = [numpy.arange(10.0), dict(a=numpy.arange(5), b=[numpy.ones(3)])]
+        d = defer.succeed(None)
+        for o in objs:
+            d.addCallback(lambda _, o=o: self.engine.push_serialized(
+                dict(key=newserialized.serialize(o))))
+            d.addCallback(lambda _: self.engine.pull_serialized('key'))
+            d.addCallback(newserialized.unserialize)
+            d.addCallback(lambda r, o=o: self.assertEquals(repr(r), repr(o)))
+        return d
+    
+    def testSerializedCollector(self):
+        """Are chunks written into the right place in the frames?"""
+        serial = newserialized.serialize(range(1000))
+        collector = SerializedCollector()
+        header = enginepb.pickle.dumps((serial.getTypeDescriptor(),
+            serial.getMetadata(), [len(serial.getData())]), 2)
+        collector.remote_beginSerialized('a', header)
+        data = serial.getData()
+        offsets = range(0, len(data), 100)
+        offsets.reverse()
+        for offset in offsets:
+            collector.remote_gotChunk('a', 0, offset, data[offset:offset+100])
+        collector.remote_endSerialized('a')
+        result = newserialized.unserialize(collector.getSerialized('a'))
+        self.assertEquals(result, range(1000))
+    
+    def testSerializedCollectorWithoutNumpy(self):
+        """Are out of order chunks assembled right without numpy?"""
+        numpy = enginepb.numpy
+        enginepb.numpy = None
+        try:
+            self.testSerializedCollector()
+        finally:
+            enginepb.numpy = numpy
+
+
+class EngineRelayTest(DeferredTestCase):
+    """Test pushing along a tree of engines connected over PB.
+    
+    The fanout pushes that pickle the namespace once for all the engines
+    are tested here too, as they need the same engines.
+    """
+    
+    nEngines = 5
+    
+    def setUp(self):
+        self.controller = ControllerService()
+        self.controller.startService()
+        self.multiengine = me.IMultiEngine(self.controller)
+        root = PBRemoteEngineRootFromService(self.controller)
+        self.server = reactor.listenTCP(10202, pb.PBServerFactory(root))
+        self.factories = []
+        self.clients = []
+        for i in range(self.nEngines):
+            engineService = es.EngineService()
+            engineService.startService()
+            ef = PBEngineClientFactory(engineService)
+            self.factories.append(ef)
+            self.clients.append(reactor.connectTCP('127.0.0.1', 10202, ef))
+        d = defer.Deferred()
+        self.controller.on_n_engines_registered_do(self.nEngines, 
+            reactor.callLater, 0.1, d.callback, None)
+        return d
+    
+    def tearDown(self):
+        l = []
+        for ef in self.factories:
+            d = ef.engineReference.relay.close()
+            if d is not None:
+                l.append(d)
+        for c in self.clients:
+            c.disconnect()
+        d = self.server.stopListening()
+        if d is not None:
+            l.append(d)
+        self.controller.stopService()
+        return defer.DeferredList(l)
+    
+    def testPushTree(self):
+        for e in self.controller.engines.values():
+            self.assert_(es.IEngineRelay.providedBy(e))
+        ns = dict(a=range(100), b='asdf')
+        d = self.multiengine.push(ns, method='tree')
+        d.addCallback(lambda r: self.assertEquals(r, self.nEngines*[None]))
+        d.addCallback(lambda _: self.multiengine.pull(('a', 'b')))
+        d.addCallback(lambda r: self.assertEquals(r, 
+            self.nEngines*[[range(100), 'asdf']]))
+        return d
+    
+    def testPushTreeOrdering(self):
+        """Is a relayed push queued after earlier commands?"""
+        self.multiengine.execute('a = 1')
+        d = self.multiengine.push(dict(a=2), targets=[0,2,4], method='tree')
+        d.addCallback(lambda _: self.multiengine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, [2,1,2,1,2]))
+        return d
+    
+    def testPushTreeFallback(self):
+        """Do engines that can't be relayed to get the data directly?"""
+        engine = self.controller.engines[1].engine
+        engine._relayAddress = ('127.0.0.1', 1)
+        d = self.multiengine.push(dict(a=3), method='tree')
+        d.addCallback(lambda _: self.multiengine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, self.nEngines*[3]))
+        return d
+    
+    def testPushTreeLarge(self):
+        """Can namespaces larger than banana.SIZE_LIMIT be relayed?"""
+        sizeLimit = banana.SIZE_LIMIT
+        banana.SIZE_LIMIT = 2*pbconfig.CHUNK_SIZE
+        def restore(r):
+            banana.SIZE_LIMIT = sizeLimit
+            return r
+        d = self.multiengine.push(dict(a='x'*5*pbconfig.CHUNK_SIZE), 
+            method='tree')
+        d.addCallback(lambda _: self.multiengine.execute('n = len(a)'))
+        d.addCallback(lambda _: self.multiengine.pull('n'))
+        d.addBoth(restore)
+        d.addCallback(lambda r: self.assertEquals(r, 
+            self.nEngines*[5*pbconfig.CHUNK_SIZE]))
+        return d
+    
+    def testPushTreeRelayFails(self):
+        """Does a failed relay fail the push instead of wedging the queue?"""
+        engine = self.controller.engines[1].engine
+        engine._relayAddress = ('127.0.0.1', 1)
+        engine.relay = lambda token, package, plan: defer.fail(
+            ProtocolError('no relay'))
+        d = self.multiengine.push(dict(a=4), method='tree')
+        d.addCallbacks(lambda _: self.fail('push should fail'), lambda f: None)
+        d.addCallback(lambda _: self.multiengine.execute('b = 5'))
+        d.addCallback(lambda _: self.multiengine.pull('b'))
+        d.addCallback(lambda r: self.assertEquals(r, self.nEngines*[5]))
+        return d
+    
+    def testRelayUnexpectedToken(self):
+        """Are only expected tokens accepted, on the controller's interface?"""
+        relay = self.factories[0].engineReference.relay
+        self.assertEquals(relay.interface, '127.0.0.1')
+        d = relay.remote_begin_relay('bogus', [])
+        d.addCallbacks(lambda _: self.fail('relay should fail'), 
+            lambda f: self.assertRaises(ProtocolError, f.raiseException))
+        return d
+    
+    def testRelayForwardsChunks(self):
+        """Are chunks forwarded before the whole namespace has arrived?"""
+        relays = [ef.engineReference.relay for ef in self.factories[:2]]
+        for relay in relays:
+            relay.expect('token')
+        plan = [(1, '127.0.0.1', relays[1].listen(), [])]
+        relays[0].remote_begin_relay('token', plan)
+        d = relays[0].remote_relay_chunk('token', 'abc')
+        d.addCallback(lambda _: self.assertEquals(
+            relays[1].relaying['token'][0], ['abc']))
+        d.addCallback(lambda _: relays[0].remote_end_relay('token'))
+        d.addCallback(lambda failedIDs: self.assertEquals(failedIDs, []))
+        d.addCallback(lambda _: relays[1].receive('token'))
+        d.addCallback(lambda chunks: self.assertEquals(chunks, ['abc']))
+        return d
+    
+    def testLoadChunks(self):
+        """Can packages be unpickled from their chunks without joining them?"""
+        ns = dict(a=range(100), b='x\ny'*100, c=None)
+        for protocol in (0, 2):
+            package = pickle.dumps(ns, protocol)
+            for size in (1, 7, len(package)):
+                chunks = [package[i:i+size] 
+                    for i in range(0, len(package), size)]
+                self.assertEquals(enginepb.loadChunks(chunks), ns)
+    
+    def testPushPicklesOnce(self):
+        pbutil.resetSerializationStats()
+        d = self.multiengine.push(dict(a=range(1000)))
+        d.addCallback(lambda _: self.assertEquals(pbutil.serializationStats['pickled'], 1))
+        d.addCallback(lambda _: self.assertEquals(pbutil.serializationStats['reused'], 
+            self.nEngines-1))
+        d.addCallback(lambda _: self.multiengine.get_serialization_stats())
+        d.addCallback(lambda r: self.assertEquals((r['pickled'], r['reused']),
+            (1, self.nEngines-1)))
+        d.addCallback(lambda _: self.multiengine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, self.nEngines*[range(1000)]))
+        return d
+    
+    def testPushFunctionPicklesOnce(self):
+        def f(x):
+            return 2*x
+        ns = dict(f=f)
+        pbutil.resetSerializationStats()
+        d = self.multiengine.push_function(ns)
+        d.addCallback(lambda _: self.assertEquals(pbutil.serializationStats['pickled'], 1))
+        d.addCallback(lambda _: self.assertEquals(ns['f'], f))
+        d.addCallback(lambda _: self.multiengine.execute('b = f(10)'))
+        d.addCallback(lambda _: self.multiengine.pull('b'))
+        d.addCallback(lambda r: self.assertEquals(r, self.nEngines*[20]))
+        return d
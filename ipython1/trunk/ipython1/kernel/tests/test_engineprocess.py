@@ -0,0 +1,196 @@
+# encoding: utf-8
+"""This file contains unittests for the kernel.engineprocess.py module."""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import os, tempfile
+
+from twisted.internet import defer, reactor, task
+
+from ipython1.kernel import engineservice as es
+from ipython1.kernel import error
+from ipython1.kernel.engineprocess import ProcessEngineService
+from ipython1.testutils.util import DeferredTestCase
+from ipython1.kernel.tests.engineservicetest import \
+    IEngineCoreTestCase, \
+    IEngineSerializedTestCase, \
+    IEngineQueuedTestCase, \
+    IEnginePropertiesTestCase, \
+    IEngineTasksTestCase
+
+
+class ProcessEngineServiceTest(DeferredTestCase,
+                               IEngineCoreTestCase,
+                               IEngineSerializedTestCase,
+                               IEnginePropertiesTestCase,
+                               IEngineTasksTestCase):
+
+    def setUp(self):
+        self.engine = ProcessEngineService()
+        self.engine.startService()
+
+    def tearDown(self):
+        return self.engine.stopService()
+
+    def testPropertiesFromWorker(self):
+        d = self.engine.execute("from ipython1.kernel.engineservice import get_engine\n"
+            "get_engine(id).properties['a'] = 5")
+        d.addCallback(lambda _: self.assertEquals(self.engine.properties['a'], 5))
+        d.addCallback(lambda _: self.engine.reset())
+        d.addCallback(lambda _: self.assertEquals(self.engine.properties, {}))
+        return d
+
+class QueuedProcessEngineServiceTest(DeferredTestCase,
+                                     IEngineCoreTestCase,
+                                     IEngineSerializedTestCase,
+                                     IEnginePropertiesTestCase,
+                                     IEngineQueuedTestCase,
+                                     IEngineTasksTestCase):
+
+    def setUp(self):
+        self.rawEngine = ProcessEngineService()
+        self.rawEngine.startService()
+        self.engine = es.IEngineQueued(self.rawEngine)
+
+    def tearDown(self):
+        return self.rawEngine.stopService()
+
+class InterruptTestCase(DeferredTestCase):
+
+    def setUp(self):
+        self.rawEngine = ProcessEngineService()
+        self.rawEngine.startService()
+        self.engine = es.IEngineQueued(self.rawEngine)
+        fd, self.started = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.started)
+
+    def tearDown(self):
+        if os.path.exists(self.started):
+            os.remove(self.started)
+        return self.rawEngine.stopService()
+
+    def runForever(self):
+        """Execute a command that never ends, once it is running."""
+        lines = "open(%r, 'w').close()\nwhile True: pass" % self.started
+        return self.engine.execute(lines)
+
+    def whenStarted(self):
+        """Return a deferred that fires when runForever's loop runs."""
+        d = defer.Deferred()
+        def check():
+            if os.path.exists(self.started):
+                d.callback(None)
+            else:
+                reactor.callLater(0.05, check)
+        check()
+        return d
+
+    def testInterfaces(self):
+        self.assert_(es.IEngineInterruptible.providedBy(self.rawEngine))
+        self.assert_(es.IEngineInterruptible.providedBy(self.engine))
+
+    def testInterrupt(self):
+        d = self.engine.execute('a = 5')
+        running = self.runForever()
+        result = []
+        running.addErrback(lambda f: result.append(f.type))
+        d.addCallback(lambda _: self.whenStarted())
+        # The engine answers while the command runs.
+        d.addCallback(lambda _: self.engine.queue_status())
+        d.addCallback(lambda s: self.assert_(s['pending'].startswith('execute')))
+        d.addCallback(lambda _: self.engine.ping())
+        d.addCallback(lambda _: self.engine.interrupt())
+        d.addCallback(lambda r: self.assertEquals(r, True))
+        d.addCallback(lambda _: running)
+        d.addCallback(lambda _: self.assertEquals(result, [KeyboardInterrupt]))
+        # The namespace is still there.
+        d.addCallback(lambda _: self.engine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, 5))
+        return d
+
+    def testQueriesWhileRunning(self):
+        """Are keys and properties answered while a command runs?"""
+        d = self.engine.execute('a = 5')
+        self.engine.set_properties(dict(b=1))
+        running = self.runForever()
+        running.addErrback(lambda f: None)
+        d.addCallback(lambda _: self.whenStarted())
+        d.addCallback(lambda _: self.engine.keys())
+        d.addCallback(lambda r: self.assert_('a' in r))
+        d.addCallback(lambda _: self.engine.get_properties())
+        d.addCallback(lambda r: self.assertEquals(r, dict(b=1)))
+        d.addCallback(lambda _: self.engine.has_properties(['b', 'c']))
+        d.addCallback(lambda r: self.assertEquals(r, [True, False]))
+        d.addCallback(lambda _: self.engine.interrupt())
+        d.addCallback(lambda _: running)
+        return d
+    
+    def testInterruptResult(self):
+        """Is interrupt True exactly when it stopped the user's code?"""
+        results = []
+        def once(delay):
+            running = self.engine.execute('import time; time.sleep(0.02)')
+            stopped = []
+            running.addErrback(lambda f: stopped.append(
+                f.check(KeyboardInterrupt) is not None))
+            d = task.deferLater(reactor, delay, self.engine.interrupt)
+            d.addCallback(lambda r: running.addCallback(lambda _: 
+                results.append((r, stopped == [True]))))
+            return d
+        # Wait for the worker to start
+        d = self.engine.execute('a = 1')
+        for i in range(10):
+            d.addCallback(lambda _, delay=i*0.005: once(delay))
+        d.addCallback(lambda _: self.assertEquals([r for r, s in results], 
+            [s for r, s in results]))
+        return d
+    
+    def testInterruptStopsCommand(self):
+        d = self.engine.execute('a = 1')
+        lines = "open(%r, 'w').close()\nwhile True: pass\na = 2" % self.started
+        running = self.engine.execute(lines)
+        running.addErrback(lambda f: None)
+        d.addCallback(lambda _: self.whenStarted())
+        d.addCallback(lambda _: self.engine.interrupt())
+        d.addCallback(lambda _: running)
+        d.addCallback(lambda _: self.engine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, 1))
+        return d
+
+    def testInterruptIdle(self):
+        d = self.engine.execute('a = 5')
+        d.addCallback(lambda _: self.engine.interrupt())
+        d.addCallback(lambda r: self.assertEquals(r, False))
+        d.addCallback(lambda _: self.engine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, 5))
+        return d
+
+    def testNotInterruptible(self):
+        engine = es.IEngineQueued(es.EngineService())
+        self.assert_(not es.IEngineInterruptible.providedBy(engine))
+        d = engine.interrupt()
+        return self.assertDeferredEquals(d, False)
+
+    def testWorkerDies(self):
+        d = self.engine.execute('a = 5')
+        d.addCallback(lambda _: self.engine.execute('import os; os._exit(1)'))
+        d = self.assertDeferredRaises(d, error.EngineWorkerDied)
+        # A new worker is started with a fresh namespace.
+        d.addCallback(lambda _: self.engine.keys())
+        d.addCallback(lambda r: self.assert_('a' not in r and 'id' in r))
+        d.addCallback(lambda _: self.engine.execute('a = 10'))
+        d.addCallback(lambda _: self.engine.pull('a'))
+        d.addCallback(lambda r: self.assertEquals(r, 10))
+        return d
@@ -31,13 +31,15 @@ from ipython1.kernel.tests.engineservicetest import \
     IEngineCoreTestCase, \
     IEngineSerializedTestCase, \
     IEngineQueuedTestCase, \
-    IEnginePropertiesTestCase
+    IEnginePropertiesTestCase, \
+    IEngineTasksTestCase
     
 
 class BasicEngineServiceTest(DeferredTestCase,
                              IEngineCoreTestCase, 
                              IEngineSerializedTestCase,
-                             IEnginePropertiesTestCase):
+                             IEnginePropertiesTestCase,
+                             IEngineTasksTestCase):
     
     def setUp(self):
         self.engine = es.EngineService()
@@ -50,7 +52,8 @@ class QueuedEngineServiceTest(DeferredTestCase,
                               IEngineCoreTestCase, 
                               IEngineSerializedTestCase,
                               IEnginePropertiesTestCase,
-                              IEngineQueuedTestCase):
+                              IEngineQueuedTestCase,
+                              IEngineTasksTestCase):
                               
     def setUp(self):
         self.rawEngine = es.EngineService()
@@ -0,0 +1,175 @@
+# encoding: utf-8
+"""This file contains unittests for the framedrpc.py module.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from ipython1.kernel import error
+from ipython1.kernel.framedrpc import (packMessage, unpackMessage,
+    FramedMessageReceiver, FramedRPCServerFactory, FramedRPCProxy)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class FakeTransport(object):
+    
+    def __init__(self):
+        self.data = []
+        self.disconnecting = False
+    
+    def writeSequence(self, seq):
+        self.data.extend(seq)
+    
+    def loseConnection(self):
+        self.disconnecting = True
+
+
+class Receiver(FramedMessageReceiver):
+    
+    def __init__(self):
+        self.messages = []
+    
+    def messageReceived(self, frames):
+        self.messages.append(frames)
+
+
+class FramingTestCase(unittest.TestCase):
+    
+    def wire(self, messages):
+        p = Receiver()
+        p.transport = FakeTransport()
+        p.connectionMade()
+        for frames in messages:
+            p.sendMessage(frames)
+        return ''.join(p.transport.data)
+    
+    def testChunks(self):
+        messages = [['a', '', 'bc'], [], ['x'*100000], ['done']]
+        data = self.wire(messages)
+        for chunkSize in [1, 3, 7, 1000, len(data)]:
+            p = Receiver()
+            p.connectionMade()
+            for i in range(0, len(data), chunkSize):
+                p.dataReceived(data[i:i+chunkSize])
+            self.assertEquals(p.messages, messages)
+    
+    def testMaxLength(self):
+        p = Receiver()
+        p.transport = FakeTransport()
+        p.connectionMade()
+        p.MAX_LENGTH = 10
+        self.assertRaises(error.MessageSizeError, p.sendMessage, ['x'*11])
+        p.dataReceived(self.wire([['x'*11]]))
+        self.assert_(p.transport.disconnecting)
+        self.assertEquals(p.messages, [])
+    
+    def testPackMessage(self):
+        obj = (1, 'a', {'b':[None, 2.0]})
+        self.assertEquals(unpackMessage(packMessage(obj)), obj)
+        if numpy is None:
+            return
+        a = numpy.arange(1000)
+        frames = packMessage(([a], {}))
+        # The array's buffer is a frame of its own
+        self.assertEquals(len(frames), 3)
+        self.assertEquals(len(frames[2]), a.nbytes)
+        args, kwargs = unpackMessage([str(f) for f in frames])
+        self.assert_((args[0] == a).all())
+
+
+class Service(object):
+    
+    def __init__(self):
+        self.waiting = {}
+    
+    def framed_echo(self, *args, **kwargs):
+        return (args, kwargs)
+    
+    def framed_wait(self, key):
+        d = self.waiting[key] = defer.Deferred()
+        return d
+    
+    def framed_release(self, key, value):
+        self.waiting.pop(key).callback(value)
+    
+    def framed_fail(self):
+        raise ValueError('failed')
+    
+    def framed_unpicklable(self):
+        return lambda: None
+
+
+class FramedRPCTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.service = Service()
+        self.server = reactor.listenTCP(0, FramedRPCServerFactory(self.service))
+        self.proxy = FramedRPCProxy(('localhost', self.server.getHost().port))
+    
+    def tearDown(self):
+        d = self.proxy.disconnect()
+        d.addCallback(lambda _: self.server.stopListening())
+        return d
+    
+    def testEcho(self):
+        d = self.proxy.callRemote('echo', 1, [2], a=None)
+        d.addCallback(lambda r: self.assertEquals(r, ((1, [2]), {'a':None})))
+        return d
+    
+    def testPipelining(self):
+        # The second call is answered before the first one
+        done = []
+        d1 = self.proxy.callRemote('wait', 'a')
+        d1.addCallback(lambda r: done.append(r) or r)
+        d2 = self.proxy.callRemote('echo', 'b')
+        d2.addCallback(lambda r: self.assertEquals(done, []))
+        d2.addCallback(lambda _: self.proxy.callRemote('release', 'a', 10))
+        d = defer.gatherResults([d1, d2])
+        d.addCallback(lambda r: self.assertEquals(r[0], 10))
+        return d
+    
+    def testFailures(self):
+        d = self.proxy.callRemote('fail')
+        d.addErrback(lambda f: self.assertRaises(ValueError, f.raiseException))
+        d.addCallback(lambda _: self.proxy.callRemote('nosuchmethod'))
+        d.addErrback(lambda f: self.assertRaises(AttributeError, f.raiseException))
+        d.addCallback(lambda _: self.proxy.callRemote('unpicklable'))
+        d.addCallbacks(lambda r: self.fail('unpicklable result was returned'),
+            lambda f: None)
+        d.addCallback(lambda _: self.proxy.callRemote('echo', 1))
+        d.addCallback(lambda r: self.assertEquals(r, ((1,), {})))
+        return d
+    
+    def testReconnect(self):
+        d = self.proxy.callRemote('echo', 1)
+        d.addCallback(lambda _: self.proxy.disconnect())
+        d.addCallback(lambda _: self.proxy.callRemote('echo', 2))
+        d.addCallback(lambda r: self.assertEquals(r, ((2,), {})))
+        return d
+    
+    def testConnectionError(self):
+        proxy = FramedRPCProxy(('localhost', 1))
+        d = proxy.callRemote('echo', 1)
+        d.addErrback(lambda f: self.assertRaises(error.ConnectionError, 
+            f.raiseException))
+        return d
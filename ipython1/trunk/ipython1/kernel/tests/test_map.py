@@ -0,0 +1,106 @@
+# encoding: utf-8
+"""This file contains unittests for the map.py module.
+"""
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from twisted.trial import unittest
+
+from ipython1.kernel import map as Map
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class MapTestCase(unittest.TestCase):
+    
+    def styles(self):
+        return [Map.Map(), Map.RoundRobinMap(), Map.BlockCyclicMap(3),
+            Map.WeightedMap(), Map.WeightedMap([1,0,2,5])]
+    
+    def roundTrip(self, seq, q=4):
+        for m in self.styles():
+            partitions = m.getPartitions(seq, q)
+            self.assertEquals(len(partitions), q)
+            self.assertEquals(partitions, 
+                [m.getPartition(seq, p, q) for p in range(q)])
+            self.assertEquals(sum([len(p) for p in partitions]), len(seq))
+            result = m.joinPartitions(partitions)
+            self.assertEquals(type(result), type(seq))
+            self.assertEquals(result, seq)
+    
+    def testLists(self):
+        for n in [0, 1, 3, 4, 17, 100]:
+            self.roundTrip(range(n))
+    
+    def testTuplesAndStrings(self):
+        self.roundTrip(tuple(range(17)))
+        self.roundTrip('abcdefghijklmnopq')
+    
+    def testNestedLists(self):
+        seq = [[i, i+1] for i in range(10)]
+        self.roundTrip(seq)
+        self.assertEquals(Map.Map().joinPartitions([[[0,1]], [[1,2]]]),
+            [[0,1], [1,2]])
+    
+    def testBasic(self):
+        m = Map.Map()
+        self.assertEquals(m.getPartitions(range(10), 4),
+            [[0,1,2], [3,4,5], [6,7], [8,9]])
+        self.assertRaises(ValueError, m.getPartition, range(10), 4, 4)
+        self.assertEquals(m.joinPartitions([1,2,3]), [1,2,3])
+    
+    def testRoundRobin(self):
+        m = Map.RoundRobinMap()
+        self.assertEquals(m.getPartitions(range(10), 4),
+            [[0,4,8], [1,5,9], [2,6], [3,7]])
+    
+    def testBlockCyclic(self):
+        m = Map.BlockCyclicMap(2)
+        self.assertEquals(m.getPartitions(range(11), 3),
+            [[0,1,6,7], [2,3,8,9], [4,5,10]])
+        self.assertRaises(ValueError, Map.BlockCyclicMap, 0)
+    
+    def testWeighted(self):
+        m = Map.WeightedMap([1,3])
+        self.assertEquals(m.getPartitions(range(8), 2), [[0,1], [2,3,4,5,6,7]])
+        self.assertEquals([len(p) for p in 
+            Map.WeightedMap([1,1,1]).getPartitions(range(10), 3)], [4,3,3])
+        self.assertRaises(ValueError, m.getPartitions, range(8), 3)
+        self.assertRaises(ValueError, Map.WeightedMap, [0,0])
+    
+    def testGetMap(self):
+        self.assert_(isinstance(Map.getMap('roundrobin'), Map.RoundRobinMap))
+        m = Map.WeightedMap([1,2])
+        self.assert_(Map.getMap(m) is m)
+        self.assertRaises(ValueError, Map.getMap, 'nosuchstyle')
+    
+    def testNumpy(self):
+        if numpy is None:
+            return
+        a = numpy.arange(30).reshape(15,2)
+        for m in self.styles():
+            partitions = m.getPartitions(a, 4)
+            result = m.joinPartitions(partitions)
+            self.assertEquals(result.shape, a.shape)
+            self.assert_((result == a).all())
+        # The basic and round robin partitions are views of the array
+        for m in [Map.Map(), Map.RoundRobinMap(), Map.WeightedMap([1,2,3,4])]:
+            for p in m.getPartitions(a, 4):
+                self.assert_(p.base is a or p.base is a.base)
@@ -20,10 +20,12 @@ from ipython1.testutils.util import DeferredTestCase
 from ipython1.kernel.controllerservice import ControllerService
 from ipython1.kernel import multiengine as me
 from ipython1.kernel.tests.multienginetest import (IMultiEngineTestCase,
-    ISynchronousMultiEngineTestCase)
+    ISynchronousMultiEngineTestCase, IMultiEngineCoordinatorTestCase,
+    ISynchronousMultiEngineCoordinatorTestCase)
     
     
-class BasicMultiEngineTestCase(DeferredTestCase, IMultiEngineTestCase):
+class BasicMultiEngineTestCase(DeferredTestCase, IMultiEngineTestCase,
+    IMultiEngineCoordinatorTestCase):
     
     def setUp(self):
         self.controller = ControllerService()
@@ -37,7 +39,8 @@ class BasicMultiEngineTestCase(DeferredTestCase, IMultiEngineTestCase):
             e.stopService()
 
 
-class SynchronousMultiEngineTestCase(DeferredTestCase, ISynchronousMultiEngineTestCase):
+class SynchronousMultiEngineTestCase(DeferredTestCase, 
+    ISynchronousMultiEngineTestCase, ISynchronousMultiEngineCoordinatorTestCase):
     
     def setUp(self):
         self.controller = ControllerService()
@@ -50,3 +53,23 @@ class SynchronousMultiEngineTestCase(DeferredTestCase, ISynchronousMultiEngineTe
         for e in self.engines:
             e.stopService()
 
+
+class BinomialPlanTestCase(DeferredTestCase):
+    
+    def testBinomialPlan(self):
+        for n in range(1, 40):
+            nodes = [(i, 'host%i' % i, i) for i in range(n)]
+            plan = me.binomialPlan(nodes)
+            ids = []
+            def walk(plan, depth):
+                maxDepth = depth
+                for id, host, port, subplan in plan:
+                    self.assertEquals((host, port), ('host%i' % id, id))
+                    ids.append(id)
+                    maxDepth = max(maxDepth, walk(subplan, depth+1))
+                return maxDepth
+            depth = walk(plan, 0)
+            ids.sort()
+            self.assertEquals(ids, range(1, n))
+            # Every node is reached in at most ceil(log2(n)) hops
+            self.assert_(2**depth < 2*n)
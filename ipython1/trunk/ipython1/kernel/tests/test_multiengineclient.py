@@ -0,0 +1,79 @@
+# encoding: utf-8
+"""This file contains unittests for the multiengineclient.py module.
+"""
+from __future__ import with_statement
+__docformat__ = "restructuredtext en"
+#-------------------------------------------------------------------------------
+#       Copyright (C) 2005  Fernando Perez <fperez@colorado.edu>
+#                           Brian E Granger <ellisonbg@gmail.com>
+#                           Benjamin Ragan-Kelley <benjaminrk@gmail.com>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from twisted.internet import threads
+from ipython1.testutils.util import DeferredTestCase
+from ipython1.kernel.controllerservice import ControllerService
+from ipython1.kernel import multiengine as me
+from ipython1.kernel import error
+from ipython1.kernel.multiengineclient import (FullBlockingMultiEngineClient,
+    PendingResult)
+from ipython1.kernel.tests.multienginetest import IMultiEngineBaseTestCase
+
+
+class BatchTestCase(DeferredTestCase, IMultiEngineBaseTestCase):
+
+    def setUp(self):
+        self.controller = ControllerService()
+        self.controller.startService()
+        self.multiengine = me.ISynchronousMultiEngine(me.IMultiEngine(self.controller))
+        self.mec = FullBlockingMultiEngineClient(self.multiengine)
+        self.engines = []
+
+    def tearDown(self):
+        self.controller.stopService()
+        for e in self.engines:
+            e.stopService()
+
+    def testBatch(self):
+        self.addEngine(2)
+        def useBatch():
+            mec = self.mec
+            with mec.batch():
+                r1 = mec.execute('a = 10')
+                r2 = mec.push(dict(b=5), targets=0)
+                r3 = mec.pull(('a', 'b'), targets=0, block=True)
+                self.assertRaises(error.ClientError, r3.get_result)
+                # Calls that can't be batched fail right away
+                self.assertRaises(error.ClientError, mec.push_function, 
+                    dict(f=len))
+                self.assertRaises(error.ClientError, mec.map, len, ['a'])
+                self.assertRaises(error.ClientError, mec.kill)
+                self.assertRaises(error.ClientError, mec.interrupt)
+            self.assert_(isinstance(r1, PendingResult))
+            self.assertEquals(len(r1.r), 2)
+            self.assertEquals(r2.r, [None])
+            self.assertEquals(r3.r, [[10, 5]])
+            self.assertEquals(mec.pull('a'), [10, 10])
+        return threads.deferToThread(useBatch)
+
+    def testBatchNotSentOnError(self):
+        self.addEngine(1)
+        def useBatch():
+            mec = self.mec
+            mec.execute('a = 1')
+            try:
+                with mec.batch():
+                    mec.execute('a = 10')
+                    raise KeyError('a')
+            except KeyError:
+                pass
+            self.assertEquals(mec.pull('a'), [1])
+            with mec.batch():
+                self.assertRaises(error.ClientError, mec.batch().__enter__)
+        return threads.deferToThread(useBatch)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from twisted.internet import defer, reactor
+from ipython1.testutils.util import DeferredTestCase
+from ipython1.kernel.controllerservice import ControllerService
+from ipython1.kernel.multiengine import IMultiEngine
+from ipython1.kernel.tests.multienginetest import IFullSynchronousMultiEngineTestCase
+
+from ipython1.kernel.multiengineframed import IFramedMultiEngineFactory
+from ipython1.kernel.multiengineframed import FramedFullSynchronousMultiEngineClient
+
+class FullSynchronousMultiEngineTestCase(DeferredTestCase, IFullSynchronousMultiEngineTestCase):
+    
+    def setUp(self):
+        self.controller = ControllerService()
+        self.controller.startService()
+        self.imultiengine = IMultiEngine(self.controller)
+        self.imultiengine_factory = IFramedMultiEngineFactory(self.imultiengine)
+        self.server = reactor.listenTCP(0, self.imultiengine_factory)
+        self.multiengine = FramedFullSynchronousMultiEngineClient(('localhost',
+            self.server.getHost().port))
+        self.engines = []
+    
+    def tearDown(self):
+        d = self.multiengine.disconnect()
+        d.addCallback(lambda _: self.server.stopListening())
+        self.controller.stopService()
+        for e in self.engines:
+            e.stopService()
+        return d
+    
+    def testPipelining(self):
+        self.addEngine(2)
+        dList = [self.multiengine.execute('a = %i' % i) for i in range(20)]
+        dList.append(self.multiengine.pull('a'))
+        d = defer.gatherResults(dList)
+        d.addCallback(lambda r: self.assertEquals(r[-1], [19, 19]))
+        return d
+    
+    def testPushPullArrays(self):
+        try:
+            import numpy
+        except ImportError:
+            return
+        self.addEngine(2)
+        a = numpy.arange(100000, dtype='float64').reshape(1000, 100)
+        d = self.multiengine.push(dict(a=a, b=[a, 'b']))
+        d.addCallback(lambda _: self.multiengine.pull(('a', 'b')))
+        def check(r):
+            for a2, b2 in r:
+                self.assert_((a2 == a).all())
+                self.assert_((b2[0] == a).all())
+                self.assertEquals(b2[1], 'b')
+        d.addCallback(check)
+        return d
@@ -30,6 +30,7 @@ class FullSynchronousMultiEngineTestCase(DeferredTestCase, IFullSynchronousMulti
         self.imultiengine_factory = IXMLRPCMultiEngineFactory(self.imultiengine)
         self.servers.append(reactor.listenTCP(10105, self.imultiengine_factory))
         self.multiengine = XMLRPCFullSynchronousMultiEngineClient(('localhost',10105))
+        self.clients.append(self.multiengine)
         self.engines = []
     
     def tearDown(self):
@@ -42,8 +43,7 @@ class FullSynchronousMultiEngineTestCase(DeferredTestCase, IFullSynchronousMulti
             except:
                 pass
         for c in self.clients:
-            c.disconnect()
-            del c
+            l.append(c.disconnect())
         dl = defer.DeferredList(l)
         self.controller.stopService()
         for e in self.engines:
@@ -19,13 +19,19 @@ import zope.interface as zi
 from twisted.trial import unittest
 from ipython1.testutils.util import DeferredTestCase
 
+from ipython1.kernel import newserialized
 from ipython1.kernel.newserialized import \
     ISerialized, \
     IUnSerialized, \
     Serialized, \
     UnSerialized, \
     SerializeIt, \
-    UnSerializeIt
+    UnSerializeIt, \
+    serialize, \
+    unserialize, \
+    compress, \
+    maybeCompress, \
+    decompress
     
 #-------------------------------------------------------------------------------
 # Tests
@@ -94,6 +100,246 @@ class SerializedTestCase(unittest.TestCase):
             self.assert_(numpy.getbuffer(a) == numpy.getbuffer(final))
             self.assert_(a.dtype.str == final.dtype.str)
             self.assert_(a.shape == final.shape)
-            
-            
-    
\ No newline at end of file
+    
+    def _roundTrip(self, obj):
+        ser = ISerialized(UnSerialized(obj))
+        s = Serialized(ser.getData(), ser.getTypeDescriptor(), ser.getMetadata())
+        return ser, IUnSerialized(s).getObject()
+    
+    def testNDArrayEdgeCases(self):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            # Fortran ordered arrays are sent without a copy
+            a = numpy.asfortranarray(numpy.arange(12.0).reshape(3,4))
+            ser, final = self._roundTrip(a)
+            self.assert_(ser.getTypeDescriptor() == 'ndarray')
+            self.assert_(ser.getMetadata()['order'] == 'F')
+            self.assert_((a == final).all())
+            self.assert_(final.flags.f_contiguous)
+            # Non-contiguous arrays
+            a = numpy.arange(20).reshape(4,5)[::2,1:4]
+            ser, final = self._roundTrip(a)
+            self.assert_(ser.getTypeDescriptor() == 'ndarray')
+            self.assert_((a == final).all())
+            # Length 0 and 0-d arrays
+            for a in [numpy.array([]), numpy.zeros((3,0)), numpy.array(5.0)]:
+                ser, final = self._roundTrip(a)
+                self.assert_(ser.getTypeDescriptor() == 'ndarray')
+                self.assert_(a.shape == final.shape)
+                self.assert_(a.dtype == final.dtype)
+            # Record arrays
+            a = numpy.zeros(4, dtype=[('x','<i4'),('y','<f8',(2,))])
+            a['x'] = range(4)
+            ser, final = self._roundTrip(a)
+            self.assert_(ser.getTypeDescriptor() == 'ndarray')
+            self.assert_(a.dtype == final.dtype)
+            self.assert_((a == final).all())
+            # Record arrays with padding
+            for dtype in [numpy.dtype([('x','u1'),('y','<f8')], align=True),
+                numpy.dtype({'names':['x','y'], 'formats':['<i4','<i2'], 
+                             'offsets':[4,12], 'itemsize':16})]:
+                a = numpy.zeros(3, dtype=dtype)
+                a['x'] = range(3)
+                a['y'] = 2.0
+                ser, final = self._roundTrip(a)
+                self.assert_(ser.getTypeDescriptor() == 'ndarray')
+                self.assert_(final.dtype == dtype)
+                self.assert_(final.dtype.names == ('x', 'y'))
+                self.assert_((a == final).all())
+                ser = serialize({'a':a, 'b':numpy.arange(3)})
+                self.assert_(ser.getTypeDescriptor() == 'container')
+                final = unserialize(ser)
+                self.assert_(final['a'].dtype == dtype)
+                self.assert_((a == final['a']).all())
+            # Object arrays must be pickled
+            a = numpy.array([{'a':1}, 'b', None], dtype=object)
+            ser, final = self._roundTrip(a)
+            self.assert_(ser.getTypeDescriptor() == 'pickle')
+            self.assert_(list(a) == list(final))
+    
+    def testNDArrayZeroCopy(self):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            a = numpy.linspace(0.0, 1.0, 100)
+            ser = ISerialized(UnSerialized(a))
+            # A writable buffer owned by the Serialized is wrapped without a copy
+            buff = bytearray(str(ser.getData()))
+            final = IUnSerialized(Serialized(buff, 'ndarray', ser.getMetadata(),
+                owned=True)).getObject()
+            final[0] = 10.0
+            self.assert_(buff[:8] == numpy.getbuffer(final)[:8])
+            # Other buffers are copied, so the result never shares memory
+            # with the original array
+            final = unserialize(serialize(a))
+            final[0] = 10.0
+            self.assert_(a[0] == 0.0)
+            # A str is read-only, so it is copied to give a writable array
+            final = IUnSerialized(Serialized(str(ser.getData()), 'ndarray', 
+                ser.getMetadata(), owned=True)).getObject()
+            self.assert_(final.flags.writeable)
+            final[0] = 10.0
+    
+    def testPickleArraySerialized(self):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            import cPickle as pickle
+            a = numpy.arange(10.0)
+            for obj in [a, {'a':a, 'b':[a, 'c']}]:
+                for protocol in [0, 2]:
+                    ser = pickle.loads(pickle.dumps(serialize(obj), protocol))
+                    final = unserialize(ser)
+                    if isinstance(obj, dict):
+                        self.assert_((final['a'] == a).all())
+                        self.assert_(final['b'][0] is final['a'])
+                    else:
+                        self.assert_((final == a).all())
+    
+    def testCyclicContainer(self):
+        l = [1]
+        l.append(l)
+        final = unserialize(serialize(l))
+        self.assert_(final[1] is final)
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            l.append(numpy.arange(3))
+            ser = serialize(l)
+            self.assert_(ser.getTypeDescriptor() == 'container')
+            final = unserialize(ser)
+            self.assert_(final[1] is final)
+            self.assert_((final[2] == numpy.arange(3)).all())
+    
+    def testContainerSerialized(self):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            a = numpy.arange(10.0)
+            b = numpy.asfortranarray(numpy.ones((3,4), dtype='int32'))
+            obj = {'a':a, 'b':[b, (a, 'c')], 'd':10, 'e':numpy.array([None])}
+            ser = serialize(obj)
+            self.assert_(ser.getTypeDescriptor() == 'container')
+            frames = ser.getData()
+            # One frame for the structure and one for each distinct array
+            self.assert_(len(frames) == 3)
+            self.assert_(frames[1] == numpy.getbuffer(a))
+            self.assert_(ser.getDataSize(1) == sum([len(f) for f in frames]))
+            s = Serialized([str(f) for f in frames], ser.getTypeDescriptor(), 
+                ser.getMetadata())
+            final = unserialize(s)
+            self.assert_((final['a'] == a).all())
+            self.assert_((final['b'][0] == b).all())
+            self.assert_(final['b'][0].dtype == b.dtype)
+            self.assert_(final['b'][1][0] is final['a'])
+            self.assert_(final['b'][1][1] == 'c')
+            self.assert_(final['d'] == 10)
+            self.assert_(final['e'][0] is None)
+            # Containers without arrays are still pickled
+            self.assert_(serialize({'a':range(10)}).getTypeDescriptor() == 'pickle')
+    
+    def testArraySubclasses(self):
+        """Do masked arrays and matrices keep their type, alone or in a 
+        container?"""
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            m = numpy.ma.array([1,2,3], mask=[0,1,0])
+            x = numpy.matrix([[1.0, 2.0], [3.0, 4.0]])
+            obj = {'m':m, 'x':x, 'a':numpy.arange(3)}
+            ser = serialize(obj)
+            self.assert_(ser.getTypeDescriptor() == 'container')
+            self.assert_(len(ser.getData()) == 2)
+            final = unserialize(ser)
+            self.assert_(isinstance(final['m'], numpy.ma.MaskedArray))
+            self.assert_((numpy.ma.getmaskarray(final['m']) == 
+                [False, True, False]).all())
+            self.assert_((final['m'].compressed() == [1, 3]).all())
+            self.assert_(type(final['x']) is numpy.matrix)
+            self.assert_((final['x'] == x).all())
+            self.assert_((final['a'] == numpy.arange(3)).all())
+            for a in [m, x]:
+                ser = serialize(a)
+                self.assert_(ser.getTypeDescriptor() == 'pickle')
+                self.assert_(type(unserialize(ser)) is type(a))
+    
+    def testCompression(self):
+        obj = {'a':range(1000), 'b':'asdf'*1000}
+        ser = serialize(obj)
+        # Small objects are not compressed
+        self.assert_(compress(ser) is ser)
+        cser = compress(ser, threshold=0)
+        codec = cser.getMetadata()['codec']
+        self.assert_(codec['name'] == 'zlib')
+        self.assert_(codec['rawSize'] == len(ser.getData()))
+        self.assert_(cser.getDataSize() < ser.getDataSize())
+        dser = decompress(cser)
+        self.assert_(dser.getData() == ser.getData())
+        self.assert_(dser.getMetadata()['decoded']['decodeTime'] >= 0.0)
+        self.assert_(unserialize(cser) == obj)
+        # Compressing the decoded object again gives the same result
+        self.assert_(compress(dser, threshold=0).getData() == cser.getData())
+    
+    def testMaybeCompress(self):
+        ser = serialize('asdf'*(newserialized.COMPRESSION_THRESHOLD/2))
+        # Compression is off by default
+        self.assert_(maybeCompress(ser) is ser)
+        newserialized.COMPRESSION = True
+        try:
+            cser = maybeCompress(ser)
+        finally:
+            newserialized.COMPRESSION = False
+        self.assert_(cser.getMetadata().has_key('codec'))
+        self.assert_(unserialize(cser) == unserialize(ser))
+    
+    def testConfigureCompression(self):
+        from ipython1.kernel.config import compressionConfig
+        ser = serialize('asdf'*1000)
+        try:
+            newserialized.configureCompression(dict(compressionConfig, 
+                enabled=True, threshold=1000))
+            self.assert_(maybeCompress(ser).getMetadata().has_key('codec'))
+            self.assertRaises(newserialized.SerializationError, 
+                newserialized.configureCompression, 
+                dict(compressionConfig, codec='bogus'))
+        finally:
+            newserialized.configureCompression(compressionConfig)
+        self.assert_(maybeCompress(ser) is ser)
+        self.assertEquals(newserialized.COMPRESSION_THRESHOLD, 1024*1024)
+        
+    def testNDArrayCompression(self):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            a = numpy.zeros(10000)
+            a[::10] = numpy.linspace(0.0, 1.0, 1000)
+            for obj in [a, {'a':a, 'b':[a[:10].copy(), 'c']}]:
+                ser = serialize(obj)
+                cser = compress(ser, threshold=0)
+                self.assert_(cser.getMetadata().has_key('codec'))
+                self.assert_(cser.getDataSize() < ser.getDataSize()/5)
+                final = unserialize(cser)
+                if isinstance(obj, dict):
+                    self.assert_((final['a'] == a).all())
+                    self.assert_(final['b'][1] == 'c')
+                else:
+                    self.assert_((final == a).all())
+                    final[0] = 1.0
+            # Data that doesn't compress is left alone
+            ser = serialize(numpy.random.randint(0, 256, 8000).astype(numpy.uint8))
+            self.assert_(compress(ser, threshold=0) is ser)
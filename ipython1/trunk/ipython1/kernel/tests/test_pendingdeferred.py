@@ -202,6 +202,63 @@ class PendingDeferredManagerTest(DeferredTestCase):
         d2.callback('bar')
         d3 = self.pdm.get_pending_deferred(did,False)
         d3.addCallback(lambda r: self.assertEquals(r,'bar'))
+    
+    def test_clear_pending_deferreds(self):
+        dList = [defer.Deferred() for i in range(10)]
+        dids = [self.pdm.save_pending_deferred(d) for d in dList]
+        waiting = self.pdm.get_pending_deferred(dids[0], True)
+        dList[1].callback('foo')
+        self.pdm.clear_pending_deferreds()
+        for did in dids:
+            self.assert_(not self.pdm.quick_has_id(did))
+        self.assertEquals(self.pdm.results, {})
+        waiting.addErrback(lambda f: self.assertRaises(
+            error.AbortedPendingDeferredError, f.raiseException))
+        return waiting
+    
+    def test_none_result(self):
+        d = defer.Deferred()
+        did = self.pdm.save_pending_deferred(d)
+        d.callback(None)
+        d2 = self.pdm.get_pending_deferred(did,False)
+        d2.addCallback(lambda r: self.assertEquals(r,None))
+        return d2
+    
+    def test_max_results(self):
+        self.pdm.maxResults = 3
+        dids = [self.pdm.save_pending_deferred(defer.succeed(i)) 
+            for i in range(5)]
+        self.assertEquals(self.pdm.evicted['maxResults'], 2)
+        for did in dids[:2]:
+            self.assert_(not self.pdm.quick_has_id(did))
+        # Claimed results and pending deferreds don't count
+        d = self.pdm.get_pending_deferred(dids[2],False)
+        d.addCallback(lambda r: self.assertEquals(r, 2))
+        pending = self.pdm.save_pending_deferred(defer.Deferred())
+        self.pdm.save_pending_deferred(defer.succeed(5))
+        self.assertEquals(self.pdm.evicted['maxResults'], 2)
+        self.assert_(self.pdm.quick_has_id(pending))
+        self.assertEquals(sorted(self.pdm.results.values()), [3, 4, 5])
+        return d
+    
+    def test_result_ttl(self):
+        now = [0.0]
+        self.pdm.clock = lambda: now[0]
+        self.pdm.resultTTL = 10
+        old = self.pdm.save_pending_deferred(defer.succeed('old'))
+        now[0] = 5
+        new = self.pdm.save_pending_deferred(defer.succeed('new'))
+        now[0] = 12
+        self.pdm.save_pending_deferred(defer.Deferred())
+        self.assert_(not self.pdm.quick_has_id(old))
+        self.assert_(self.pdm.quick_has_id(new))
+        self.assertEquals(self.pdm.evicted, {'maxResults':0, 'resultTTL':1})
+    
+    def test_finished_bounded(self):
+        for i in range(1000):
+            did = self.pdm.save_pending_deferred(defer.succeed(i))
+            self.pdm.get_pending_deferred(did, False)
+        self.assert_(len(self.pdm.finished) < 100)
 
 #-------------------------------------------------------------------------------
 # Regular Unittests
@@ -17,14 +17,21 @@ __docformat__ = "restructuredtext en"
 #-------------------------------------------------------------------------------
 
 import time
+import cPickle as pickle
+import random
 
-from twisted.internet import defer
+import zope.interface as zi
+
+from twisted.internet import defer, reactor
+from twisted.internet.task import Clock
+from twisted.python import failure
 from twisted.trial import unittest
 
 from ipython1.kernel import task, controllerservice as cs, engineservice as es
 from ipython1.kernel.multiengine import IMultiEngine
 from ipython1.testutils.util import DeferredTestCase
 from ipython1.kernel.tests.tasktest import ITaskControllerTestCase
+from ipython1.kernel.tests.controllertest import WedgedEngineService
 
 #-------------------------------------------------------------------------------
 # Tests
@@ -46,3 +53,548 @@ class BasicTaskControllerTestCase(DeferredTestCase, ITaskControllerTestCase):
             e.stopService()
 
 
+class BatchTaskControllerTestCase(BasicTaskControllerTestCase):
+    
+    def setUp(self):
+        BasicTaskControllerTestCase.setUp(self)
+        self.tc.maxBatchSize = 8
+        self.tc.taskDuration = 0.001
+    
+    def _recordBatches(self, worker):
+        batches = []
+        runBatch = worker.run_batch
+        def recorder(tasks):
+            batches.append([t.taskid for t in tasks])
+            return runBatch(tasks)
+        worker.run_batch = recorder
+        return batches
+    
+    def testBatchSize(self):
+        self.tc.taskDuration = None
+        self.assertEquals(self.tc.batchSize(), 1)
+        self.tc.taskDuration = 0.1
+        self.assertEquals(self.tc.batchSize(), 5)
+        self.tc.taskDuration = 0.001
+        self.assertEquals(self.tc.batchSize(), 8)
+        self.tc.maxBatchSize = 1
+        self.assertEquals(self.tc.batchSize(), 1)
+        self.tc.taskDuration = None
+        self.tc._timeTasks(time.time() - 1.0, 10)
+        self.assert_(0.09 < self.tc.taskDuration < 0.2)
+    
+    def testBatches(self):
+        self.addEngine(1)
+        batches = self._recordBatches(self.tc.workers[0])
+        # Queue the tasks while the worker is away
+        d = self.multiengine.execute('i=0', targets=0)
+        self.tc.scheduler.pop_worker(0)
+        taskids = []
+        for i in range(12):
+            if i == 3:
+                t = task.Task("i += 1\nassert i > 1", pull='i', retries=1)
+            elif i == 5:
+                t = task.Task("1/0", recovery_task=task.Task('r=5', pull='r'))
+            elif i == 7:
+                t = task.Task("1/0")
+            else:
+                t = task.Task("x=%i" % i, pull='x')
+            self.tc.run(t).addCallback(taskids.append)
+        d.addCallback(lambda _: self.tc.readmitWorker(0))
+        d.addCallback(lambda _: self.tc.barrier(taskids))
+        d.addCallback(lambda _: defer.gatherResults(
+            [self.tc.get_task_result(i) for i in taskids]))
+        def check(results):
+            for i, tr in enumerate(results):
+                if i == 3:
+                    self.assertEquals(tr.ns.i, 2)
+                elif i == 5:
+                    self.assertEquals(tr.ns.r, 5)
+                elif i == 7:
+                    self.assertRaises(ZeroDivisionError, tr.raiseException)
+                else:
+                    self.assertEquals(tr.ns.x, i)
+            self.assertEquals(batches[0], range(8))
+            self.assert_(len(batches) > 1)
+        return d.addCallback(check)
+
+
+class FakeWorker(object):
+    
+    def __init__(self, workerid, **properties):
+        self.workerid = workerid
+        self.properties = es.StrictDict(properties)
+
+
+class IndexedSchedulerTestCase(unittest.TestCase):
+    
+    def _scheduler(self):
+        return task.IndexedScheduler()
+    
+    def _simulate(self, scheduler, seed):
+        """Run a random workload and return the (workerid, taskid) pairs."""
+        rand = random.Random(seed)
+        def depend(props):
+            return props['kind'] == 1
+        workers = [FakeWorker(i, kind=i%3) for i in range(8)]
+        for w in workers:
+            scheduler.add_worker(w)
+        busy = []
+        pairs = []
+        taskid = 0
+        for step in range(300):
+            for i in range(rand.randint(0, 3)):
+                if rand.random() < 0.3:
+                    t = task.Task('a', depend=depend)
+                else:
+                    t = task.Task('a')
+                t.taskid = taskid
+                taskid += 1
+                scheduler.add_task(t)
+            if rand.random() < 0.1 and scheduler.ntasks:
+                scheduler.pop_task(rand.choice(scheduler.taskids))
+            worker, t = scheduler.schedule()
+            while worker is not None:
+                pairs.append((worker.workerid, t.taskid))
+                busy.append(worker)
+                worker, t = scheduler.schedule()
+            rand.shuffle(busy)
+            for i in range(rand.randint(0, len(busy))):
+                scheduler.add_worker(busy.pop())
+        self.assertEquals(scheduler.ntasks, len(scheduler.taskids))
+        return pairs
+    
+    def testSameOrderAsFIFO(self):
+        for seed in range(5):
+            self.assertEquals(self._simulate(self._scheduler(), seed),
+                self._simulate(task.FIFOScheduler(), seed))
+    
+    def testChangedWorkerGoesBack(self):
+        """A worker whose properties change while idle is picked last."""
+        s = self._scheduler()
+        workers = [FakeWorker(i, kind='cpu') for i in range(3)]
+        for w in workers:
+            s.add_worker(w)
+        workers[0].properties['kind'] = 'gpu'
+        workers[0].properties['kind'] = 'cpu'
+        t = task.Task('a', depend=lambda p: p['kind'] == 'cpu')
+        t.taskid = 0
+        s.add_task(t)
+        worker, t = s.schedule()
+        self.assertEquals(worker.workerid, 1)
+    
+    def testDependCache(self):
+        calls = []
+        def depend(props):
+            calls.append(props['kind'])
+            return props['kind'] == 'gpu'
+        s = self._scheduler()
+        for i in range(3):
+            s.add_worker(FakeWorker(i, kind='cpu'))
+        for i in range(10):
+            t = task.Task('a', depend=depend)
+            t.taskid = i
+            s.add_task(t)
+        self.assertEquals(s.schedule(), (None, None))
+        self.assertEquals(len(calls), 30)
+        # Nothing has changed, so depend is not called again
+        self.assertEquals(s.schedule(), (None, None))
+        self.assertEquals(len(calls), 30)
+        # A new worker is only checked once for each task
+        s.add_worker(FakeWorker(3, kind='cpu'))
+        self.assertEquals(s.schedule(), (None, None))
+        self.assertEquals(len(calls), 40)
+        # Changing the properties of a worker makes it be checked again
+        w = s.pop_worker(1)
+        w.properties['kind'] = 'gpu'
+        s.add_worker(w)
+        worker, t = s.schedule()
+        self.assertEquals((worker.workerid, t.taskid), (1, 0))
+        self.assertEquals(s.ntasks, 9)
+        self.assertEquals(s.nworkers, 3)
+        self.assertEquals(s.workerids, [0, 2, 3])
+    
+    def testPop(self):
+        s = self._scheduler()
+        self.assertRaises(IndexError, s.pop_task)
+        self.assertRaises(IndexError, s.pop_worker)
+        for i in range(5):
+            t = task.Task('a', depend=(i%2 and (lambda p: True) or None))
+            t.taskid = i
+            s.add_task(t)
+        self.assertEquals(s.pop_task(3).taskid, 3)
+        self.assertRaises(IndexError, s.pop_task, 3)
+        self.assertEquals([s.pop_task().taskid for i in range(4)], [0, 1, 2, 4])
+        self.assertRaises(IndexError, s.pop_task)
+
+
+class PrioritySchedulerTestCase(IndexedSchedulerTestCase):
+    
+    def setUp(self):
+        self.now = 1000.0
+    
+    def _scheduler(self):
+        return task.PriorityScheduler(clock=lambda: self.now)
+    
+    def _add(self, s, taskid, **options):
+        t = task.Task('a', **options)
+        t.taskid = taskid
+        s.add_task(t)
+    
+    def _order(self, s):
+        order = []
+        worker, t = s.schedule()
+        while worker is not None:
+            order.append(t.taskid)
+            s.add_worker(worker)
+            worker, t = s.schedule()
+        return order
+    
+    def testPriority(self):
+        s = self._scheduler()
+        for i, p in enumerate([0, 5, -1, 5, 20]):
+            self._add(s, i, priority=p)
+        s.add_worker(FakeWorker(0))
+        self.assertEquals(self._order(s), [4, 1, 3, 0, 2])
+    
+    def testAging(self):
+        s = self._scheduler()
+        s.aging = 1.0
+        self._add(s, 0, priority=0)
+        self.now += 5
+        self._add(s, 1, priority=4)
+        self._add(s, 2, priority=6)
+        s.add_worker(FakeWorker(0))
+        # Task 0 has waited 5 seconds longer, which beats priority 4
+        self.assertEquals(self._order(s), [2, 0, 1])
+    
+    def testDeadline(self):
+        s = self._scheduler()
+        s.deadlineWindow = 10
+        self._add(s, 0, priority=5)
+        self._add(s, 1, deadline=100)
+        self._add(s, 2, deadline=20)
+        self._add(s, 3, deadline=5)
+        s.add_worker(FakeWorker(0))
+        worker, t = s.schedule()
+        self.assertEquals(t.taskid, 3)
+        s.add_worker(worker)
+        worker, t = s.schedule()
+        self.assertEquals(t.taskid, 0)
+        s.add_worker(worker)
+        self.now += 15
+        self.assertEquals(self._order(s), [2, 1])
+    
+    def testDependency(self):
+        def depend(props):
+            return props['kind'] == 'gpu'
+        s = self._scheduler()
+        s.add_worker(FakeWorker(0, kind='cpu'))
+        self._add(s, 0, priority=10, depend=depend)
+        self._add(s, 1)
+        worker, t = s.schedule()
+        self.assertEquals((worker.workerid, t.taskid), (0, 1))
+        self.assertEquals(s.schedule(), (None, None))
+        s.add_worker(worker)
+        self.assertEquals(s.schedule(), (None, None))
+        s.add_worker(FakeWorker(1, kind='gpu'))
+        worker, t = s.schedule()
+        self.assertEquals((worker.workerid, t.taskid), (1, 0))
+    
+    def testBands(self):
+        s = self._scheduler()
+        for i, p in enumerate([0, 10, -3, 4, 11]):
+            self._add(s, i, priority=p)
+        self.assertEquals(s.taskidsByBand(), 
+            {'high':[1, 4], 'normal':[0, 3], 'low':[2]})
+        s.pop_task(3)
+        self.assertEquals(s.taskidsByBand(), 
+            {'high':[1, 4], 'normal':[0], 'low':[2]})
+        self.assertEquals(s.countsByBand(), {'high':2, 'normal':1, 'low':1})
+        self.assertEquals([s.pop_task().taskid for i in range(4)], 
+            [4, 1, 0, 2])
+        self.assertEquals(s.countsByBand(), {'high':0, 'normal':0, 'low':0})
+
+
+class PriorityTaskControllerTestCase(unittest.TestCase):
+    
+    def testQueueStatusBands(self):
+        controller = cs.ControllerService()
+        tc = task.TaskController(controller)
+        tc.scheduler = task.PriorityScheduler()
+        tc.run(task.Task('a', priority=20))
+        tc.run(task.Task('a'))
+        tc.run(task.Task('a'))
+        d = tc.queue_status()
+        d.addCallback(lambda r: self.assertEquals(r['bands'], 
+            {'high':1, 'normal':2, 'low':0}))
+        d.addCallback(lambda _: tc.queue_status(True))
+        d.addCallback(lambda r: self.assertEquals(r['bands'], 
+            {'high':[0], 'normal':[1, 2], 'low':[]}))
+        if tc.idleLater is not None:
+            tc.idleLater.cancel()
+        return d
+
+
+class HeartbeatTaskControllerTestCase(unittest.TestCase):
+    
+    def testRequeueFromWedgedEngine(self):
+        clock = Clock()
+        controller = cs.ControllerService(heartbeatPeriod=1.0, 
+            heartbeatTimeout=3.0, clock=clock)
+        controller.startService()
+        tc = task.TaskController(controller)
+        wedged = WedgedEngineService()
+        qe = es.QueuedEngine(wedged)
+        controller.register_engine(qe)
+        wedged.wedged = True
+        t = task.Task('a = 5', pull='a', retries=0)
+        d = tc.run(t)
+        d.addCallback(lambda _: self.assertEquals(tc.pendingTasks.keys(), [0]))
+        def wedge(_):
+            # The running task keeps the engine from timing out until the
+            # engine is interrupted.
+            for i in range(5):
+                clock.advance(1.0)
+            self.assertEquals(tc.pendingTasks.keys(), [0])
+            qe.interrupt()
+            for i in range(5):
+                clock.advance(1.0)
+            self.assertEquals(tc.pendingTasks, {})
+            self.assertEquals(tc.scheduler.ntasks, 1)
+            controller.register_engine(es.QueuedEngine(es.EngineService()))
+            return tc.get_task_result(t.taskid, block=True)
+        d.addCallback(wedge)
+        def check(result):
+            self.assertEquals(result.failure, None)
+            self.assertEquals(result.ns.a, 5)
+            self.assertEquals(result.engineid, 1)
+            controller.stopService()
+        d.addCallback(check)
+        return d
+
+
+class InterruptibleWedgedEngineService(WedgedEngineService):
+    """A wedged engine whose hanging commands can be interrupted."""
+    
+    zi.implements(es.IEngineInterruptible)
+    
+    def interrupt(self):
+        waiting, self.waiting = self.waiting, []
+        for d, f, args in waiting:
+            d.errback(failure.Failure(KeyboardInterrupt()))
+        return defer.succeed(bool(waiting))
+
+
+class SpeculativeTaskControllerTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.controller = cs.ControllerService()
+        self.controller.startService()
+        self.tc = task.TaskController(self.controller)
+        self.tc.taskDuration = 0.01
+        self.tc.speculationMinimum = 0.0
+        self.engines = [WedgedEngineService(), WedgedEngineService()]
+        for e in self.engines:
+            self.controller.register_engine(es.QueuedEngine(e))
+    
+    def tearDown(self):
+        for later in (self.tc.idleLater, self.tc.speculateLater):
+            if later is not None and later.active():
+                later.cancel()
+        self.controller.stopService()
+    
+    def testCopyWins(self):
+        self.engines[0].wedged = True
+        t = task.Task('a = 5', pull='a', speculative=True)
+        d = self.tc.run(t)
+        d.addCallback(lambda taskid: self.tc.get_task_result(taskid, block=True))
+        def check(result):
+            self.assertEquals(result.ns.a, 5)
+            self.assertEquals(result.engineid, 1)
+            self.assertEquals(self.tc.speculative, {})
+            self.assertEquals(self.tc.pendingTasks.keys(), [0])
+            self.engines[0].unwedge()
+            self.assertEquals(self.tc.pendingTasks, {})
+            self.assert_(0 in self.tc.scheduler.workerids)
+            self.assertEquals(self.tc.finishedResults[t.taskid].engineid, 1)
+        d.addCallback(check)
+        return d
+    
+    def testLoserInterrupted(self):
+        self.controller.unregister_engine(0)
+        engine = InterruptibleWedgedEngineService()
+        self.controller.register_engine(es.QueuedEngine(engine))
+        engine.wedged = True
+        t = task.Task('a = 5', pull='a', speculative=True)
+        d = self.tc.run(t)
+        d.addCallback(lambda taskid: self.tc.get_task_result(taskid, block=True))
+        def check(result):
+            self.assertEquals(result.ns.a, 5)
+            self.assertEquals(result.engineid, 1)
+            # The original was interrupted and its worker readmitted
+            self.assertEquals(engine.waiting, [])
+            self.assertEquals(self.tc.pendingTasks, {})
+            self.assertEquals(self.tc.interruptedCopies, set())
+            self.assert_(0 in self.tc.scheduler.workerids)
+            self.assertEquals(self.tc.finishedResults[t.taskid].engineid, 1)
+        d.addCallback(check)
+        return d
+    
+    def testOriginalWins(self):
+        for e in self.engines:
+            e.wedged = True
+        t = task.Task('a = 5', pull='a', speculative=True)
+        d = self.tc.run(t)
+        def waitForCopy(taskid):
+            d = defer.Deferred()
+            def check():
+                if len(self.tc.pendingTasks) == 2:
+                    d.callback(taskid)
+                else:
+                    reactor.callLater(0.01, check)
+            check()
+            return d
+        d.addCallback(waitForCopy)
+        def unwedge(taskid):
+            self.engines[0].unwedge()
+            return self.tc.get_task_result(taskid, block=True)
+        d.addCallback(unwedge)
+        def check(result):
+            self.assertEquals(result.engineid, 0)
+            self.engines[1].unwedge()
+            self.assertEquals(self.tc.pendingTasks, {})
+            self.assertEquals(self.tc.finishedResults[t.taskid].engineid, 0)
+        d.addCallback(check)
+        return d
+    
+    def testNotSpeculative(self):
+        self.engines[0].wedged = True
+        d = self.tc.run(task.Task('a = 5', pull='a'))
+        d.addCallback(lambda _: self.assertEquals(self.tc.speculative, {}))
+        d.addCallback(lambda _: self.assertEquals(self.tc.speculateLater, None))
+        d.addCallback(lambda _: self.engines[0].unwedge())
+        return d
+
+
+class RetentionTaskController(task.TaskController):
+    resultRetention = {'ttl':0.05}
+
+
+class RetentionTaskControllerTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.controller = cs.ControllerService()
+        self.controller.startService()
+        self.tc = RetentionTaskController(self.controller)
+        self.controller.register_engine(es.QueuedEngine(es.EngineService()))
+    
+    def tearDown(self):
+        self.controller.stopService()
+    
+    def testPurgeExpired(self):
+        d = self.tc.run(task.Task('a = 5', pull='a'))
+        d.addCallback(lambda taskid: self.tc.get_task_result(taskid, block=True))
+        d.addCallback(lambda _: self.assertEquals(len(self.tc.finishedResults), 1))
+        def wait(_):
+            d = defer.Deferred()
+            reactor.callLater(0.2, d.callback, None)
+            return d
+        d.addCallback(wait)
+        # Nothing was stored or fetched, the periodic purge evicted it
+        d.addCallback(lambda _: self.assertEquals(len(self.tc.finishedResults), 0))
+        return d
+    
+    def testStopCloses(self):
+        self.tc.finishedResults = task.ResultStore(spill=self.mktemp())
+        self.controller.stopService()
+        self.failIf(self.tc.purgeLater.running)
+        self.assertEquals(self.tc.finishedResults._spill, None)
+
+
+class ResultStoreTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.now = 0.0
+    
+    def _store(self, **kwargs):
+        return task.ResultStore(clock=lambda: self.now, **kwargs)
+    
+    def _result(self, i, ok=True):
+        if ok:
+            return task.TaskResult({'a':i}, 0)
+        else:
+            return task.TaskResult(failure.Failure(ValueError(i)), 0)
+    
+    def testUnbounded(self):
+        s = self._store()
+        for i in range(10):
+            s[i] = self._result(i, i%3)
+        self.assertEquals(len(s), 10)
+        self.assertEquals((s.succeeded, s.failed, s.discarded), (6, 4, 0))
+        self.assertEquals(s[4]['a'], 4)
+        self.assertEquals(s.taskids('failed'), [0, 3, 6, 9])
+    
+    def testMaxEntriesLRU(self):
+        s = self._store(maxEntries=3)
+        for i in range(3):
+            s[i] = self._result(i)
+        s[0]
+        s[3] = self._result(3)
+        self.failIf(1 in s)
+        self.assert_(0 in s and 2 in s and 3 in s)
+        self.assertRaises(KeyError, s.__getitem__, 1)
+        self.assertEquals((s.succeeded, s.discarded), (3, 1))
+    
+    def testMaxBytes(self):
+        size = len(pickle.dumps(self._result(0), 2))
+        s = self._store(maxBytes=int(2.5*size))
+        for i in range(5):
+            s[i] = self._result(i)
+        self.assertEquals(len(s), 2)
+        self.assert_(s.nbytes <= 2.5*size)
+    
+    def testTTL(self):
+        s = self._store(ttl=10)
+        s[0] = self._result(0)
+        self.now = 5
+        s[1] = self._result(1)
+        self.now = 12
+        s[2] = self._result(2)
+        self.failIf(0 in s)
+        self.assert_(1 in s)
+        self.now = 18
+        s[1]
+        self.now = 23
+        s[3] = self._result(3)
+        self.assert_(1 in s)
+        self.failIf(2 in s)
+    
+    def testSpill(self):
+        s = self._store(maxEntries=2, spill=self.mktemp())
+        for i in range(6):
+            s[i] = self._result(i, i != 4)
+        self.assertEquals(len(s), 6)
+        self.assertEquals(s[0]['a'], 0)
+        self.assertRaises(ValueError, s[4].raiseException)
+        self.assertEquals((s.succeeded, s.failed, s.discarded), (5, 1, 0))
+        self.assertEquals(sorted(s.taskids('succeeded')), [0, 1, 2, 3, 5])
+        s[0] = self._result(10)
+        self.assertEquals(s[0]['a'], 10)
+        self.assertEquals(len(s), 6)
+        s.close()
+    
+    def testTaskController(self):
+        controller = cs.ControllerService()
+        tc = task.TaskController(controller)
+        tc.finishedResults = self._store(maxEntries=2)
+        for i in range(4):
+            tc.deferredResults[i] = []
+            tc._finishTask(i, self._result(i, i != 1))
+        d = tc.queue_status()
+        d.addCallback(lambda r: self.assertEquals((r['succeeded'], r['failed']), 
+            (2, 0)))
+        d.addCallback(lambda _: tc.get_task_result(3))
+        d.addCallback(lambda tr: self.assertEquals(tr['a'], 3))
+        d.addCallback(lambda _: tc.get_task_result(1))
+        d.addErrback(lambda f: f.trap(IndexError))
+        return d
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# encoding: utf-8
+__docformat__ = "restructuredtext en"
+
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from twisted.internet import defer, reactor
+
+from ipython1.kernel import task, controllerservice as cs
+import ipython1.kernel.multiengine as me
+from ipython1.testutils.util import DeferredTestCase
+from ipython1.kernel import taskframed
+from ipython1.kernel import multiengineframed as meframed
+from ipython1.kernel.tests.tasktest import ITaskControllerTestCase
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class TaskTest(DeferredTestCase, ITaskControllerTestCase):
+    
+    def setUp(self):
+        self.servers = []
+        self.clients = []
+        self.engines = []
+        
+        self.controller = cs.ControllerService()
+        self.controller.startService()
+        
+        self.imultiengine = me.IMultiEngine(self.controller)
+        self.imultiengine_factory = meframed.IFramedMultiEngineFactory(self.imultiengine)
+        self.servers.append(reactor.listenTCP(0, self.imultiengine_factory))
+        self.multiengine = meframed.FramedFullSynchronousMultiEngineClient(
+            ('localhost', self.servers[-1].getHost().port))
+        self.clients.append(self.multiengine)
+        
+        self.itc = task.ITaskController(self.controller)
+        self.itc.failurePenalty = 0
+        self.itc_factory = taskframed.IFramedTaskControllerFactory(self.itc)
+        self.servers.append(reactor.listenTCP(0, self.itc_factory))
+        self.tc = taskframed.FramedTaskClient(('localhost', 
+            self.servers[-1].getHost().port))
+        self.clients.append(self.tc)
+    
+    def tearDown(self):
+        d = defer.DeferredList([c.disconnect() for c in self.clients])
+        d.addCallback(lambda _: defer.DeferredList(
+            [defer.maybeDeferred(s.stopListening) for s in self.servers]))
+        self.controller.stopService()
+        for e in self.engines:
+            e.stopService()
+        return d
@@ -38,12 +38,14 @@ class TaskTest(DeferredTestCase, ITaskControllerTestCase):
         self.imultiengine_factory = mexmlrpc.IXMLRPCMultiEngineFactory(self.imultiengine)
         self.servers.append(reactor.listenTCP(10105, self.imultiengine_factory))
         self.multiengine = mexmlrpc.XMLRPCFullSynchronousMultiEngineClient(('localhost',10105))
+        self.clients.append(self.multiengine)
         
         self.itc = task.ITaskController(self.controller)
         self.itc.failurePenalty = 0
         self.itc_factory = taskxmlrpc.IXMLRPCTaskControllerFactory(self.itc)
         self.servers.append(reactor.listenTCP(10113, self.itc_factory))
         self.tc = taskxmlrpc.XMLRPCTaskClient(('localhost',10113))
+        self.clients.append(self.tc)
     
     def tearDown(self):
         l = []
@@ -55,8 +57,7 @@ class TaskTest(DeferredTestCase, ITaskControllerTestCase):
             except:
                 pass
         for c in self.clients:
-            c.disconnect()
-            del c
+            l.append(c.disconnect())
         dl = defer.DeferredList(l)
         self.controller.stopService()
         for e in self.engines:
@@ -26,8 +26,15 @@ import xmlrpclib
 
 # import re, string, time, operator
 import string
+from cStringIO import StringIO
 from types import *
 
+from twisted.internet import defer, protocol, reactor
+from twisted.web.client import (Agent, HTTPConnectionPool, FileBodyProducer,
+    ResponseDone)
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+
 from ipython1.kernel import error
 # from ipython1.external.twisted.web2 import server, channel
 # from ipython1.external.twisted.web2 import http, resource
@@ -235,3 +242,85 @@ class Transport(xmlrpclib.Transport):
         p.close()
 
         return u.close()
+
+
+#-------------------------------------------------------------------------------
+# An asynchronous XML-RPC proxy with persistent connections
+#-------------------------------------------------------------------------------
+
+class _BodyReceiver(protocol.Protocol):
+    """Collect the body of a response and fire a deferred with it."""
+    
+    def __init__(self, finished):
+        self.finished = finished
+        self.data = []
+    
+    def dataReceived(self, data):
+        self.data.append(data)
+    
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(''.join(self.data))
+        else:
+            self.finished.errback(reason)
+
+
+class Proxy(object):
+    """An XML-RPC proxy that keeps its HTTP connections open between calls.
+    
+    This can be used in place of `twisted.web.xmlrpc.Proxy`, which opens a
+    new TCP connection for every call.  Here HTTP/1.1 keep-alive
+    connections are kept in a pool and reused, so a series of small calls
+    doesn't pay for connection setup each time.  Calls that are made while
+    all the pooled connections are busy open new ones.
+    
+    :Parameters:
+        url : str
+            The URL of the XML-RPC server.
+        allowNone : boolean
+            Allow None to be marshalled (an XML-RPC extension).
+    """
+    
+    # The number of idle connections kept open to the server.
+    maxPersistentPerHost = 4
+    user_agent = "ipython1 xmlrpc client (xmlrpclib.py/%s)" % xmlrpclib.__version__
+    
+    def __init__(self, url, allowNone=False):
+        self.url = url
+        self.allowNone = allowNone
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.maxPersistentPerHost
+        self.agent = Agent(reactor, pool=self.pool)
+    
+    def callRemote(self, method, *args):
+        try:
+            body = xmlrpclib.dumps(args, method, allow_none=self.allowNone)
+        except:
+            return defer.fail()
+        headers = Headers({'Content-Type': ['text/xml'],
+                           'User-Agent': [self.user_agent]})
+        d = self.agent.request('POST', self.url, headers, 
+            FileBodyProducer(StringIO(body)))
+        d.addCallback(self._readResponse)
+        return d
+    
+    def _readResponse(self, response):
+        # The body is always read, so the connection can go back to the pool
+        finished = defer.Deferred()
+        response.deliverBody(_BodyReceiver(finished))
+        if response.code != 200:
+            def badStatus(_):
+                raise error.ProtocolError("%s returned %s %s" % 
+                    (self.url, response.code, response.phrase))
+            finished.addCallback(badStatus)
+        else:
+            finished.addCallback(self._parseResponse)
+        return finished
+    
+    def _parseResponse(self, body):
+        # Raises a xmlrpclib.Fault if the server sent one
+        return xmlrpclib.loads(body)[0][0]
+    
+    def close(self):
+        """Close the pooled connections, returning a deferred."""
+        return self.pool.closeCachedConnections()